@@ -5,7 +5,7 @@ import { Grid, List, Star, Play } from "lucide-react";
 import { Button } from "@/components/ui/button";
 import { Card, CardContent } from "@/components/ui/card";
 import { PodcastList, EpisodeList, Category } from "@/types";
-import { searchAPI, categoriesAPI, episodesAPI } from "@/lib/api";
+import { homeAPI } from "@/lib/api";
 import Link from "next/link";
 
 export default function DiscoverPage() {
@@ -24,23 +24,23 @@ export default function DiscoverPage() {
 
   const loadData = async () => {
     try {
-      const [trendingRes, episodesRes, categoriesRes] = await Promise.all([
-        searchAPI.getTrending(),
-        episodesAPI.getRecent(),
-        categoriesAPI.getAll(),
+      const home = await homeAPI.get([
+        "trending",
+        "recent_episodes",
+        "categories",
       ]);
 
-      if (Array.isArray(trendingRes)) {
-        setTrendingPodcasts(trendingRes);
-        setFeaturedPodcasts(trendingRes.slice(0, 6));
+      if (Array.isArray(home.trending)) {
+        setTrendingPodcasts(home.trending);
+        setFeaturedPodcasts(home.trending.slice(0, 6));
       }
 
-      if (Array.isArray(episodesRes)) {
-        setRecentEpisodes(episodesRes);
+      if (Array.isArray(home.recent_episodes)) {
+        setRecentEpisodes(home.recent_episodes);
       }
 
-      if (Array.isArray(categoriesRes)) {
-        setCategories(categoriesRes);
+      if (Array.isArray(home.categories)) {
+        setCategories(home.categories);
       }
 
       setError(null);
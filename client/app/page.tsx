@@ -15,7 +15,7 @@ import { Button } from "@/components/ui/button";
 import { Card, CardContent } from "@/components/ui/card";
 import EpisodeCard from "@/components/EpisodeCard";
 import { PodcastList, EpisodeList, Category } from "@/types";
-import { searchAPI, categoriesAPI, episodesAPI } from "@/lib/api";
+import { homeAPI } from "@/lib/api";
 
 export default function HomePage() {
   const [trendingPodcasts, setTrendingPodcasts] = useState<PodcastList[]>([]);
@@ -30,23 +30,22 @@ export default function HomePage() {
 
   const loadData = async () => {
     try {
-      const [trendingResponse, episodesResponse, categoriesResponse] =
-        await Promise.all([
-          searchAPI.getTrending(),
-          episodesAPI.getRecent(),
-          categoriesAPI.getAll(),
-        ]);
+      const home = await homeAPI.get([
+        "trending",
+        "recent_episodes",
+        "categories",
+      ]);
 
-      if (Array.isArray(trendingResponse)) {
-        setTrendingPodcasts(trendingResponse);
+      if (Array.isArray(home.trending)) {
+        setTrendingPodcasts(home.trending);
       }
 
-      if (Array.isArray(episodesResponse)) {
-        setRecentEpisodes(episodesResponse);
+      if (Array.isArray(home.recent_episodes)) {
+        setRecentEpisodes(home.recent_episodes);
       }
 
-      if (Array.isArray(categoriesResponse)) {
-        setCategories(categoriesResponse);
+      if (Array.isArray(home.categories)) {
+        setCategories(home.categories);
       }
 
       setError(null);
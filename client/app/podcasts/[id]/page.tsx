@@ -58,6 +58,13 @@ export default function PodcastDetailPage() {
         setIsSubscribed(false);
         return;
       }
+      if (!podcast) {
+        return;
+      }
+      if (podcast.is_subscribed !== undefined) {
+        setIsSubscribed(podcast.is_subscribed);
+        return;
+      }
 
       try {
         const subscriptions = await subscriptionsAPI.getAll();
@@ -72,7 +79,7 @@ export default function PodcastDetailPage() {
     };
 
     checkSubscriptionStatus();
-  }, [isAuthenticated, podcastId]);
+  }, [isAuthenticated, podcastId, podcast?.is_subscribed]);
 
   const loadPodcastData = async () => {
     try {
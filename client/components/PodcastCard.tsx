@@ -35,6 +35,10 @@ export default function PodcastCard({
         setIsSubscribed(false);
         return;
       }
+      if (podcast.is_subscribed !== undefined) {
+        setIsSubscribed(podcast.is_subscribed);
+        return;
+      }
 
       try {
         setLoading(true);
@@ -52,7 +56,7 @@ export default function PodcastCard({
     };
 
     checkSubscriptionStatus();
-  }, [isAuthenticated, podcast.id]);
+  }, [isAuthenticated, podcast.id, podcast.is_subscribed]);
 
   const handleSubscribe = async (e: React.MouseEvent) => {
     e.preventDefault();
@@ -7,13 +7,21 @@ import {
   Podcast,
   PodcastList,
   Episode,
+  EpisodeChapters,
   EpisodeList,
   Playlist,
   PlaylistCreate,
   Subscription,
+  OPMLImportResult,
   SearchResult,
+  Suggestion,
+  HomeData,
+  HomeSection,
+  SyncData,
+  UserStats,
   ApiResponse,
   FilterState,
+  Facets,
 } from "@/types";
 
 // Create axios instance
@@ -172,18 +180,28 @@ export const categoriesAPI = {
 };
 
 // Podcasts API
+function filterParams(filters?: FilterState) {
+  const params = new URLSearchParams();
+  if (filters?.category)
+    params.append("category", filters.category.toString());
+  if (filters?.creator) params.append("creator", filters.creator.toString());
+  if (filters?.search) params.append("search", filters.search);
+  return params;
+}
+
 export const podcastsAPI = {
   getAll: async (filters?: FilterState): Promise<PodcastList[]> => {
-    const params = new URLSearchParams();
-    if (filters?.category)
-      params.append("category", filters.category.toString());
-    if (filters?.creator) params.append("creator", filters.creator.toString());
-    if (filters?.search) params.append("search", filters.search);
-
+    const params = filterParams(filters);
     const response = await api.get(`/podcasts/?${params.toString()}`);
     return response.data;
   },
 
+  getFacets: async (filters?: FilterState): Promise<Facets> => {
+    const params = filterParams(filters);
+    const response = await api.get(`/podcasts/facets/?${params.toString()}`);
+    return response.data;
+  },
+
   getById: async (id: number): Promise<Podcast> => {
     const response = await api.get(`/podcasts/${id}/`);
     return response.data;
@@ -233,6 +251,13 @@ export const episodesAPI = {
     const response = await api.get(`/episodes/?podcast=${podcastId}`);
     return response.data;
   },
+
+  getChapters: async (id: number): Promise<EpisodeChapters> => {
+    const response = await api.get(`/episodes/${id}/chapters/`, {
+      headers: { Accept: "application/json" },
+    });
+    return response.data;
+  },
 };
 
 // Playlists API
@@ -294,6 +319,20 @@ export const subscriptionsAPI = {
     const response = await api.get("/subscriptions/");
     return response.data;
   },
+
+  exportOPML: async (): Promise<Blob> => {
+    const response = await api.get("/subscriptions/opml/", { responseType: "blob" });
+    return response.data;
+  },
+
+  importOPML: async (file: File): Promise<OPMLImportResult> => {
+    const formData = new FormData();
+    formData.append("file", file);
+    const response = await api.post("/subscriptions/opml/", formData, {
+      headers: { "Content-Type": "multipart/form-data" },
+    });
+    return response.data;
+  },
 };
 
 // Search API
@@ -303,6 +342,13 @@ export const searchAPI = {
     return response.data;
   },
 
+  suggest: async (query: string, limit = 8): Promise<Suggestion[]> => {
+    const response = await api.get("/search/suggest/", {
+      params: { q: query, limit },
+    });
+    return response.data.results;
+  },
+
   getTrending: async (): Promise<PodcastList[]> => {
     const response = await api.get("/trending/");
     return response.data;
@@ -311,14 +357,30 @@ export const searchAPI = {
 
 // User Stats API
 export const statsAPI = {
-  getUserStats: async (): Promise<{
-    podcasts_created: number;
-    playlists_created: number;
-    subscriptions: number;
-  }> => {
+  getUserStats: async (): Promise<UserStats> => {
     const response = await api.get("/stats/");
     return response.data;
   },
 };
 
+// Home API: several page sections in one request
+export const homeAPI = {
+  get: async (sections?: HomeSection[]): Promise<HomeData> => {
+    const response = await api.get("/home/", {
+      params: sections ? { sections: sections.join(",") } : undefined,
+    });
+    return response.data;
+  },
+};
+
+// Sync API: what changed in the library since the last token
+export const syncAPI = {
+  sync: async (token?: string | null): Promise<SyncData> => {
+    const response = await api.get("/sync/", {
+      params: token ? { token } : undefined,
+    });
+    return response.data;
+  },
+};
+
 export default api;
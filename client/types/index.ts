@@ -40,12 +40,13 @@ export type Podcast = {
   title: string;
   description: string;
   cover_image?: string;
+  feed_url?: string;
   category: number;
   category_name: string;
   creator: number;
   creator_name: string;
   created_at: string;
-};
+} & PodcastViewerFlags;
 
 export type PodcastList = {
   id: number;
@@ -54,6 +55,16 @@ export type PodcastList = {
   creator_name: string;
   category_name: string;
   created_at: string;
+} & PodcastViewerFlags;
+
+// Only present when signed in
+export type PodcastViewerFlags = {
+  is_subscribed?: boolean;
+};
+
+export type EpisodeViewerFlags = {
+  playlist_ids?: number[];
+  resume_at?: number | null;
 };
 
 // Episode types
@@ -65,7 +76,24 @@ export type Episode = {
   podcast: number;
   podcast_title: string;
   duration: number;
+  // Null until the server has measured the audio, and for silence
+  loudness_lufs: number | null;
+  true_peak_dbtp: number | null;
+  // Playback gain that normalises the episode; apply it with a GainNode
+  gain_db: number | null;
   created_at: string;
+} & EpisodeViewerFlags;
+
+// Boundaries detected in the audio; GET without Accept gives Podcasting 2.0 chapters JSON instead
+export type EpisodeChapters = {
+  episode: number;
+  seconds: number;
+  analyzed_at: string;
+  chapters: {
+    start: number;
+    end: number;
+    kind: "start" | "silence" | "change" | "silence+change";
+  }[];
 };
 
 export type EpisodeList = {
@@ -74,7 +102,7 @@ export type EpisodeList = {
   podcast_title: string;
   duration: number;
   created_at: string;
-};
+} & EpisodeViewerFlags;
 
 // Playlist types
 export type Playlist = {
@@ -100,10 +128,81 @@ export type Subscription = {
   created_at: string;
 };
 
+export type OPMLImportStatus =
+  | "subscribed"
+  | "already_subscribed"
+  | "duplicate"
+  | "not_found";
+
+export type OPMLImportResult = Record<OPMLImportStatus, number> & {
+  results: {
+    title: string;
+    xml_url: string;
+    podcast: number | null;
+    status: OPMLImportStatus;
+  }[];
+};
+
 // Search types
 export type SearchResult = {
   podcasts: PodcastList[];
   episodes: EpisodeList[];
+  // With ?facets=true
+  facets?: Facets;
+};
+
+export type Suggestion = {
+  type: "podcast" | "episode" | "category" | "creator";
+  id: number;
+  text: string;
+};
+
+// Home/discover page sections, fetched in one call
+export type UserStats = {
+  podcasts_created: number;
+  playlists_created: number;
+  subscriptions: number;
+};
+
+export type HomeSection =
+  | "trending"
+  | "recent_episodes"
+  | "categories"
+  | "subscriptions"
+  | "stats";
+
+export type HomeData = {
+  trending?: PodcastList[] | null;
+  recent_episodes?: EpisodeList[] | null;
+  categories?: Category[] | null;
+  subscriptions?: Subscription[] | null;
+  stats?: UserStats | null;
+  // Sections served stale ("stale") or left empty ("timeout", "error")
+  degraded: Partial<Record<HomeSection, "stale" | "timeout" | "error">>;
+};
+
+// Delta sync (/sync/): apply upserts and deletes by id, keep `token` for next time
+export type SyncSection<T, K = number> = { upserted: T[]; deleted: K[] };
+
+export type SyncData = {
+  token: string;
+  // The whole library follows; drop what was stored before
+  reset: boolean;
+  // More changes are waiting; sync again with the new token right away
+  more: boolean;
+  // deleted: podcast ids no longer subscribed to
+  subscriptions: SyncSection<Pick<Subscription, "id" | "podcast" | "podcast_title" | "created_at">>;
+  playlists: SyncSection<{ id: number; name: string; created_at: string }>;
+  // [playlist id, episode id] pairs
+  playlist_episodes: { added: [number, number][]; removed: [number, number][] };
+  episodes: SyncSection<{
+    id: number;
+    podcast: number;
+    podcast_title: string;
+    title: string;
+    duration: number;
+    created_at: string;
+  }>;
 };
 
 // API Response types - simplified without pagination
@@ -126,3 +225,10 @@ export type FilterState = {
   search?: string;
   creator?: number;
 };
+
+// Podcast counts per category and creator; each ignores its own filter
+export type Facets = {
+  total: number;
+  categories: { id: number; name: string; count: number }[];
+  creators: { id: number; username: string; count: number }[];
+};
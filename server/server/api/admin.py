@@ -1,6 +1,73 @@
+from django.conf import settings
 from django.contrib import admin
+from django.core.paginator import Paginator
+from django.db import connections
+from django.utils.functional import cached_property
 from unfold.admin import ModelAdmin
-from .models import Category, Podcast, Episode, Playlist, Subscription
+from unfold.contrib.filters.admin import AutocompleteSelectFilter, RangeDateFilter
+from .deletion import schedule_purge
+from .jobs import retry
+from .models import Category, Podcast, Episode, Job, Playlist, Subscription
+
+
+class EstimatedCountPaginator(Paginator):
+    """
+    Paginator that trusts the planner's row estimate for unfiltered big tables.
+
+    An exact ``COUNT(*)`` scans the whole table on PostgreSQL; ``pg_class.reltuples``
+    is kept up to date by autovacuum and is close enough for page links.
+    """
+
+    @staticmethod
+    def unfiltered(queryset):
+        """No filters beyond the default manager's own, like hiding rows marked for deletion"""
+        return queryset.query.where == queryset.model._default_manager.get_queryset().query.where
+
+    @cached_property
+    def count(self):
+        queryset = self.object_list
+        connection = connections[queryset.db]
+        if connection.vendor == 'postgresql' and self.unfiltered(queryset):
+            with connection.cursor() as cursor:
+                cursor.execute(
+                    'SELECT reltuples::bigint FROM pg_class WHERE oid = %s::regclass',
+                    [queryset.model._meta.db_table],
+                )
+                row = cursor.fetchone()
+            if row and row[0] >= settings.ADMIN_ESTIMATED_COUNT_THRESHOLD:
+                return row[0]
+        return super().count
+
+
+class LargeTableAdmin(ModelAdmin):
+    """Changelist defaults for tables too big for exact counts and full option lists"""
+
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
+    list_filter_submit = True
+    list_per_page = 50
+
+
+class DeferredDeletionAdmin(LargeTableAdmin):
+    """
+    Deleting only flags the rows; a background purge removes them in batches.
+
+    The confirmation page lists the selected objects instead of walking the
+    whole cascade, which for a big show means every episode and subscription.
+    """
+
+    def get_deleted_objects(self, objs, request):
+        objs = list(objs)
+        model_count = {self.model._meta.verbose_name_plural: len(objs)}
+        return [str(obj) for obj in objs], model_count, set(), []
+
+    def delete_model(self, request, obj):
+        obj.mark_deleted()
+        schedule_purge()
+
+    def delete_queryset(self, request, queryset):
+        queryset.mark_deleted()
+        schedule_purge()
 
 
 @admin.register(Category)
@@ -10,23 +77,26 @@ class CategoryAdmin(ModelAdmin):
 
 
 @admin.register(Podcast)
-class PodcastAdmin(ModelAdmin):
+class PodcastAdmin(DeferredDeletionAdmin):
     list_display = ['title', 'creator', 'category', 'created_at']
-    list_filter = ['category', 'created_at']
-    search_fields = ['title', 'description', 'creator__username']
-    
+    list_filter = [('category', AutocompleteSelectFilter), ('created_at', RangeDateFilter)]
+    list_select_related = ['creator', 'category']
+    # Trigram-indexed on PostgreSQL, see migration 0005
+    search_fields = ['title', 'creator__username']
+    autocomplete_fields = ['category']
+
     compressed_fields = True
     warn_unsaved_form = True
-    
+
     fieldsets = (
         ("Basic Information", {
             "fields": ("title", "description", "category"),
         }),
         ("Media", {
-            "fields": ("cover_image",),
+            "fields": ("cover_image", "feed_url"),
         }),
     )
-    
+
     def save_model(self, request, obj, form, change):
         if not change:
             obj.creator = request.user
@@ -34,14 +104,16 @@ class PodcastAdmin(ModelAdmin):
 
 
 @admin.register(Episode)
-class EpisodeAdmin(ModelAdmin):
+class EpisodeAdmin(DeferredDeletionAdmin):
     list_display = ['title', 'podcast', 'duration', 'created_at']
-    list_filter = ['podcast', 'created_at']
-    search_fields = ['title', 'description', 'podcast__title']
-    
+    list_filter = [('podcast', AutocompleteSelectFilter), ('created_at', RangeDateFilter)]
+    list_select_related = ['podcast']
+    search_fields = ['title', 'podcast__title']
+    autocomplete_fields = ['podcast']
+
     compressed_fields = True
     warn_unsaved_form = True
-    
+
     fieldsets = (
         ("Episode Details", {
             "fields": ("title", "description", "podcast"),
@@ -49,25 +121,46 @@ class EpisodeAdmin(ModelAdmin):
         ("Media & Duration", {
             "fields": ("audio_file", "duration"),
         }),
+        ("Loudness", {
+            "fields": ("loudness_lufs", "true_peak_dbtp", "gain_db", "loudness_measured_at"),
+        }),
     )
+    readonly_fields = ["loudness_lufs", "true_peak_dbtp", "gain_db", "loudness_measured_at"]
 
 
 @admin.register(Playlist)
-class PlaylistAdmin(ModelAdmin):
+class PlaylistAdmin(LargeTableAdmin):
     list_display = ['name', 'user', 'created_at']
-    list_filter = ['created_at']
+    list_filter = [('created_at', RangeDateFilter)]
+    list_select_related = ['user']
     search_fields = ['name', 'user__username']
-    filter_horizontal = ['episodes']
-    
+    # Episodes are picked through the autocomplete endpoint instead of one <option> per episode
+    autocomplete_fields = ['user', 'episodes']
+
     compressed_fields = True
     warn_unsaved_form = True
 
 
 @admin.register(Subscription)
-class SubscriptionAdmin(ModelAdmin):
+class SubscriptionAdmin(LargeTableAdmin):
     list_display = ['user', 'podcast', 'created_at']
-    list_filter = ['created_at']
+    list_filter = [('podcast', AutocompleteSelectFilter), ('created_at', RangeDateFilter)]
+    list_select_related = ['user', 'podcast']
     search_fields = ['user__username', 'podcast__title']
-    
+    autocomplete_fields = ['user', 'podcast']
+
     compressed_fields = True
     warn_unsaved_form = True
+
+
+@admin.register(Job)
+class JobAdmin(ModelAdmin):
+    list_display = ['task', 'status', 'priority', 'attempts', 'run_at', 'locked_by']
+    list_filter = ['status', ('run_at', RangeDateFilter)]
+    search_fields = ['task']
+    readonly_fields = ['attempts', 'locked_by', 'locked_at', 'last_error', 'created_at']
+    actions = ['retry_jobs']
+
+    @admin.action(description="Retry selected jobs now")
+    def retry_jobs(self, request, queryset):
+        self.message_user(request, f"Queued {retry(queryset)} jobs again.")
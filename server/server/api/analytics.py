@@ -0,0 +1,246 @@
+"""
+Hourly and daily analytics rollups per episode and per podcast.
+
+Plays, subscribes, unsubscribes and playlist adds are appended to
+``AnalyticsEvent``. ``roll_up`` folds the events past a watermark into the
+rollup tables a batch at a time, entirely in the database: counters are
+grouped over the batch's id range and added to the stored rows with
+``INSERT ... SELECT ... ON CONFLICT DO UPDATE``, then unique listeners are
+recounted for the buckets the batch played in. Each batch commits its
+upserts together with the new watermark, so an interrupted run redoes at
+most the batch in flight and never counts an event twice. The dashboard
+only reads the rollup tables.
+"""
+from collections import Counter
+from datetime import timedelta, timezone as dt_timezone
+
+from django.conf import settings
+from django.db import connection, transaction
+from django.db.models import Count, Max, Min, Q, Sum, Value
+from django.db.models.functions import Coalesce, Trunc
+from django.utils import timezone
+
+from .models import AnalyticsEvent, Episode, EpisodeRollup, PodcastRollup, Rollup, RollupWatermark
+
+WATERMARK = 'analytics'
+SPANS = {Rollup.HOUR: timedelta(hours=1), Rollup.DAY: timedelta(days=1)}
+COUNTERS = ['plays', 'completions', 'listened_seconds', 'playlist_adds']
+PODCAST_COUNTERS = COUNTERS + ['subscribes', 'unsubscribes']
+# rollup model, unique constraint upserts conflict on, owner column, counters summed
+ROLLUPS = [
+    (EpisodeRollup, 'episode_rollup_key', 'episode_id', COUNTERS),
+    (PodcastRollup, 'podcast_rollup_key', 'podcast_id', PODCAST_COUNTERS),
+]
+
+
+def bucket_start(moment, period):
+    moment = moment.astimezone(dt_timezone.utc).replace(minute=0, second=0, microsecond=0)
+    return moment.replace(hour=0) if period == Rollup.DAY else moment
+
+
+def window_start(period, days, now=None):
+    """First bucket of the last ``days`` days, counting the current bucket in"""
+    return bucket_start((now or timezone.now()) - timedelta(days=days), period) + SPANS[period]
+
+
+# Recording
+
+def record_play(episode, user, seconds):
+    """Log a play of ``episode``; it counts as listened through past ``COMPLETION_RATIO`` of its duration"""
+    duration = episode.duration * 60
+    seconds = min(seconds, duration) if duration else seconds
+    AnalyticsEvent.objects.create(
+        kind=AnalyticsEvent.PLAY, podcast_id=episode.podcast_id, episode=episode,
+        user=user if user.is_authenticated else None, seconds=seconds,
+        completed=bool(duration) and seconds >= duration * settings.API_ANALYTICS['COMPLETION_RATIO'],
+    )
+
+
+def record(kind, podcast_id, user, episode_id=None):
+    AnalyticsEvent.objects.create(kind=kind, podcast_id=podcast_id, episode_id=episode_id, user=user)
+
+
+# Rolling up
+
+def batch_range(position, batch_size, now):
+    """Last event id of the next batch, or None if nothing past ``position`` has settled"""
+    end = AnalyticsEvent.objects.filter(pk__gt=position).aggregate(last=Max('pk'))['last']
+    if end is None:
+        return None
+    end = min(end, position + batch_size)
+    # Ids are handed out before commit; recent events may still have lower-numbered ones in flight
+    horizon = now - timedelta(seconds=settings.API_ANALYTICS['SETTLE_SECONDS'])
+    unsettled = AnalyticsEvent.objects.filter(pk__gt=position, pk__lte=end, created_at__gte=horizon)
+    first = unsettled.aggregate(first=Min('pk'))['first']
+    if first is not None:
+        end = first - 1
+    return end if end > position else None
+
+
+def bucketed(events, field, period):
+    """``events`` grouped by ``field`` and bucket, shaped like rollup rows"""
+    keys = ['episode_id', 'podcast_id'] if field == 'episode_id' else ['podcast_id']
+    return events.values(
+        *keys, bucket=Trunc('created_at', period, tzinfo=dt_timezone.utc), period=Value(period),
+    ).order_by()
+
+
+def counters(events, field, period):
+    played = Q(kind=AnalyticsEvent.PLAY)
+    rows = bucketed(events, field, period).annotate(
+        plays=Count('pk', filter=played),
+        completions=Count('pk', filter=played & Q(completed=True)),
+        listened_seconds=Coalesce(Sum('seconds', filter=played), 0),
+        playlist_adds=Count('pk', filter=Q(kind=AnalyticsEvent.PLAYLIST_ADD)),
+        # Set by the listener pass, a placeholder for rows inserted here
+        listeners=Value(0),
+    )
+    if field == 'episode_id':
+        return rows.filter(episode__isnull=False)
+    return rows.annotate(
+        subscribes=Count('pk', filter=Q(kind=AnalyticsEvent.SUBSCRIBE)),
+        unsubscribes=Count('pk', filter=Q(kind=AnalyticsEvent.UNSUBSCRIBE)),
+    )
+
+
+def listeners(events, field, period, end):
+    """Distinct listeners of every bucket ``events`` played in, over all events up to ``end``"""
+    span = events.filter(kind=AnalyticsEvent.PLAY).aggregate(first=Min('created_at'), last=Max('created_at'))
+    if span['first'] is None:
+        return None
+    played = AnalyticsEvent.objects.filter(
+        kind=AnalyticsEvent.PLAY, pk__lte=end,
+        created_at__gte=bucket_start(span['first'], period),
+        created_at__lt=bucket_start(span['last'], period) + SPANS[period],
+        **{f'{field}__in': events.filter(kind=AnalyticsEvent.PLAY).values(field)},
+    )
+    zeros = {name: Value(0) for name in PODCAST_COUNTERS if field == 'podcast_id' or name in COUNTERS}
+    return bucketed(played, field, period).annotate(**zeros, listeners=Count('user', distinct=True))
+
+
+def upsert(model, constraint, rows, add=(), replace=()):
+    """
+    ``INSERT ... SELECT`` the rows of a values() queryset into ``model``.
+
+    Rows already stored, by the unique constraint of ``model`` named
+    ``constraint``, get the ``add`` columns added to them and the ``replace``
+    columns overwritten. Returns the number of rows written.
+    """
+    if rows is None:
+        return 0
+    quote = connection.ops.quote_name
+    table = quote(model._meta.db_table)
+    columns = ', '.join(quote(name) for name in [*rows.query.values_select, *rows.query.annotation_select])
+    fields = next(unique.fields for unique in model._meta.constraints if unique.name == constraint)
+    key = ', '.join(quote(model._meta.get_field(name).column) for name in fields)
+    assignments = ', '.join(
+        [f'{quote(name)} = {table}.{quote(name)} + excluded.{quote(name)}' for name in add]
+        + [f'{quote(name)} = excluded.{quote(name)}' for name in replace]
+    )
+    sql, params = rows.query.sql_with_params()
+    with connection.cursor() as cursor:
+        # WHERE true: SQLite can't otherwise tell ON CONFLICT apart from a join constraint
+        cursor.execute(
+            f'INSERT INTO {table} ({columns}) SELECT {columns} FROM ({sql}) batch WHERE true '
+            f'ON CONFLICT ({key}) DO UPDATE SET {assignments}',
+            params,
+        )
+        return cursor.rowcount
+
+
+def roll_up(batch_size=None, now=None):
+    """Fold one batch of settled events into the rollups; ``(events, rows written)``, or None when caught up"""
+    batch_size = batch_size or settings.API_ANALYTICS['BATCH_SIZE']
+    with transaction.atomic():
+        # The lock keeps two jobs from folding in the same batch
+        RollupWatermark.objects.get_or_create(name=WATERMARK)
+        watermark = RollupWatermark.objects.select_for_update().get(name=WATERMARK)
+        end = batch_range(watermark.position, batch_size, now or timezone.now())
+        if end is None:
+            return None
+
+        events = AnalyticsEvent.objects.filter(pk__gt=watermark.position, pk__lte=end)
+        written = 0
+        for period in SPANS:
+            for model, key, field, added in ROLLUPS:
+                written += upsert(model, key, counters(events, field, period), add=added)
+                upsert(model, key, listeners(events, field, period, end), replace=['listeners'])
+        processed = events.count()
+        watermark.position = end
+        watermark.save()
+    return processed, written
+
+
+def catch_up(batch_size=None, now=None, log=None):
+    """Run ``roll_up`` until every settled event is folded in"""
+    totals = Counter()
+    while (result := roll_up(batch_size, now)) is not None:
+        processed, written = result
+        totals.update(events=processed, rows=written)
+        if log:
+            log(f'{processed} events, {written} rollup rows')
+    return totals
+
+
+# Reading
+
+def rate(completions, plays):
+    return round(completions / plays, 4) if plays else None
+
+
+def summarize(row):
+    summary = {name: row[name] or 0 for name in ('plays', 'completions', 'listened_seconds', 'playlist_adds')}
+    summary['listen_through_rate'] = rate(summary['completions'], summary['plays'])
+    if 'subscribes' in row:
+        summary['subscribers_gained'] = row['subscribes'] or 0
+        summary['subscribers_lost'] = row['unsubscribes'] or 0
+        summary['net_subscribers'] = summary['subscribers_gained'] - summary['subscribers_lost']
+    return summary
+
+
+def dashboard(podcasts, period, since, top=10):
+    """
+    Creator stats over ``podcasts`` (``{id: title}``) from ``since``, read from the rollup tables only.
+
+    Listener counts are unique per podcast and bucket; summed over several
+    podcasts, someone who listened to two of them counts twice.
+    """
+    sums = {name: Sum(name) for name in PODCAST_COUNTERS + ['listeners']}
+    rollups = PodcastRollup.objects.filter(podcast_id__in=list(podcasts), period=period, bucket__gte=since)
+
+    series = [
+        {'bucket': row.pop('bucket'), 'listeners': row['listeners'] or 0, **summarize(row)}
+        for row in rollups.values('bucket').annotate(**sums).order_by('bucket')
+    ]
+    per_podcast = {
+        row.pop('podcast_id'): summarize(row)
+        for row in rollups.values('podcast_id').annotate(**sums).order_by()
+    }
+
+    episodes = list(
+        EpisodeRollup.objects.filter(podcast_id__in=list(podcasts), period=period, bucket__gte=since)
+        .values('episode_id', 'podcast_id').annotate(**{name: Sum(name) for name in COUNTERS})
+        .order_by('-plays', 'episode_id')[:top]
+    )
+    titles = dict(Episode.all_objects.filter(pk__in=[row['episode_id'] for row in episodes]).values_list('pk', 'title'))
+
+    totals = summarize({name: sum(row[name] for row in per_podcast.values()) for name in COUNTERS} | {
+        'subscribes': sum(row['subscribers_gained'] for row in per_podcast.values()),
+        'unsubscribes': sum(row['subscribers_lost'] for row in per_podcast.values()),
+    })
+    watermark = RollupWatermark.objects.filter(name=WATERMARK).values_list('updated_at', flat=True).first()
+    return {
+        'period': period,
+        'since': since,
+        'updated_at': watermark,
+        'totals': totals,
+        'series': series,
+        'podcasts': [
+            {'id': pk, 'title': title, **per_podcast.get(pk, summarize(dict.fromkeys(PODCAST_COUNTERS)))}
+            for pk, title in podcasts.items()
+        ],
+        'top_episodes': [
+            {'id': row['episode_id'], 'podcast': row['podcast_id'], 'title': titles.get(row['episode_id']), **summarize(row)}
+            for row in episodes
+        ],
+    }
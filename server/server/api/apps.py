@@ -1,6 +1,45 @@
 from django.apps import AppConfig
+from django.db.models.signals import m2m_changed, post_delete, post_save
 
 
 class ApiConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'api'
+
+    def ready(self):
+        from . import events, facets, home, loudness, suggest, sync
+        from .hydrate import drop_cached
+        from .models import Category, Podcast, Episode, Playlist, Subscription
+
+        for model in (Podcast, Episode):
+            post_save.connect(drop_cached, sender=model, dispatch_uid=f'hydrate-{model._meta.model_name}-save')
+            post_delete.connect(drop_cached, sender=model, dispatch_uid=f'hydrate-{model._meta.model_name}-delete')
+
+        for model in (Category, Podcast, Episode, Playlist, Subscription):
+            post_save.connect(home.drop_cached, sender=model, dispatch_uid=f'home-{model._meta.model_name}-save')
+            post_delete.connect(home.drop_cached, sender=model, dispatch_uid=f'home-{model._meta.model_name}-delete')
+
+        for model in (Category, Podcast, Episode):
+            post_save.connect(suggest.entry_saved, sender=model, dispatch_uid=f'suggest-{model._meta.model_name}-save')
+            post_delete.connect(suggest.entry_deleted, sender=model, dispatch_uid=f'suggest-{model._meta.model_name}-delete')
+
+        for model in (Category, Podcast):
+            post_save.connect(facets.bump, sender=model, dispatch_uid=f'facets-{model._meta.model_name}-save')
+            post_delete.connect(facets.bump, sender=model, dispatch_uid=f'facets-{model._meta.model_name}-delete')
+
+        post_save.connect(events.episode_saved, sender=Episode, dispatch_uid='events-episode-save')
+        post_save.connect(loudness.episode_saved, sender=Episode, dispatch_uid='loudness-episode-save')
+        post_save.connect(events.playlist_saved, sender=Playlist, dispatch_uid='events-playlist-save')
+        post_delete.connect(events.playlist_deleted, sender=Playlist, dispatch_uid='events-playlist-delete')
+        m2m_changed.connect(events.playlist_episodes_changed, sender=Playlist.episodes.through,
+                            dispatch_uid='events-playlist-episodes')
+        post_save.connect(events.subscription_saved, sender=Subscription, dispatch_uid='events-subscription-save')
+        post_delete.connect(events.subscription_deleted, sender=Subscription, dispatch_uid='events-subscription-delete')
+
+        # Delta sync log (api.sync); bulk updates and inserts log by hand
+        for model, receiver in ((Subscription, sync.subscription_changed), (Playlist, sync.playlist_changed),
+                                (Episode, sync.episode_changed), (Podcast, sync.podcast_changed)):
+            post_save.connect(receiver, sender=model, dispatch_uid=f'sync-{model._meta.model_name}-save')
+            post_delete.connect(receiver, sender=model, dispatch_uid=f'sync-{model._meta.model_name}-delete')
+        m2m_changed.connect(sync.playlist_episodes_changed, sender=Playlist.episodes.through,
+                            dispatch_uid='sync-playlist-episodes')
@@ -0,0 +1,276 @@
+"""
+Chapter boundaries found in episode audio, for episodes published without any.
+
+ffmpeg decodes each episode to mono at API_CHAPTERS['RATE'] (see
+``api.loudness``). Every 50 ms frame of the stream is measured, block by
+block, for two signals:
+- short-time energy. Silence gaps are runs of frames SILENCE_DB under the
+  episode's loud level (its 90th percentile) that last MIN_SILENCE seconds.
+- log energy in a few bands, averaged per second over the frames that
+  aren't silent. Spectral change is the distance between the mean spectrum
+  of the NOVELTY_SECONDS before and after each second. Its peaks, scored as
+  robust z-scores, are where music, an ad read or another voice takes over.
+
+A change near a silence gap moves into the gap. Gaps of CHAPTER_SILENCE
+seconds count on their own. Boundaries are taken best first, at least
+MIN_CHAPTER seconds apart, and stored on ``Chapters`` as 5-byte
+``(start ms, kind)`` markers. They are served as Podcasting 2.0 chapters
+JSON.
+
+``manage.py detect_chapters`` runs the analysis over the catalog in a
+process pool. Workers only decode and compute; the parent saves results in
+bulk.
+"""
+import logging
+import multiprocessing
+import resource
+import struct
+import time
+from concurrent.futures import ProcessPoolExecutor
+from itertools import islice
+
+from django.conf import settings
+from django.db import connections
+from django.utils import timezone
+
+from .loudness import AnalysisError, np, pcm_blocks, require_numpy
+from .models import Chapters
+
+logger = logging.getLogger(__name__)
+
+FRAME_SECONDS = 0.05
+BANDS = 16
+LOWEST_BAND = 50  # Hz
+PERCENTILE = 90   # An episode's loud level, silence is measured from it
+
+START, SILENCE, CHANGE, BOTH = range(4)
+KINDS = {START: 'start', SILENCE: 'silence', CHANGE: 'change', BOTH: 'silence+change'}
+MARKER = struct.Struct('<IB')
+
+
+def pack(markers):
+    """``[(start ms, kind)]`` -> bytes"""
+    return b''.join(MARKER.pack(start, kind) for start, kind in markers)
+
+
+def unpack(data):
+    return list(MARKER.iter_unpack(bytes(data)))
+
+
+# Analysis
+
+def band_edges(rate, frame):
+    """First FFT bin of each band, spaced evenly in log frequency up to Nyquist"""
+    frequencies = np.geomspace(LOWEST_BAND, rate / 2, BANDS + 1)[:-1]
+    return np.unique(np.round(frequencies * frame / rate).astype(int))
+
+
+class Detector:
+    """Streaming boundary detector; ``feed`` blocks shaped ``(channels, frames)`` or mono, then read ``result``"""
+
+    def __init__(self, rate):
+        require_numpy()
+        self.rate = rate
+        self.frame = round(rate * FRAME_SECONDS)
+        self.window = np.hanning(self.frame)
+        self.edges = band_edges(rate, self.frame)
+        self.pending = np.zeros(0)
+        self.energy, self.bands = [], []
+        self.samples = 0
+
+    def feed(self, block):
+        block = np.asarray(block, dtype=np.float64)
+        mono = block.mean(axis=0) if block.ndim == 2 else block
+        self.samples += len(mono)
+        samples = np.concatenate([self.pending, mono])
+        count = len(samples) // self.frame
+        self.pending = samples[count * self.frame:]
+        if not count:
+            return
+        frames = samples[:count * self.frame].reshape(count, self.frame)
+        self.energy.append(10 * np.log10((frames * frames).mean(axis=1) + 1e-12))
+        power = np.abs(np.fft.rfft(frames * self.window, axis=1)) ** 2
+        self.bands.append(np.log10(np.add.reduceat(power, self.edges, axis=1) + 1e-12).astype(np.float32))
+
+    def result(self):
+        """``([(start ms, kind)], seconds)``, the first marker always at 0"""
+        seconds = self.samples / self.rate
+        if not self.energy:
+            return [(0, START)], seconds
+        energy = np.concatenate(self.energy)
+        quiet = energy < np.percentile(energy, PERCENTILE) - settings.API_CHAPTERS['SILENCE_DB']
+        gaps = silences(quiet)
+        times, scores = changes(np.concatenate(self.bands), quiet)
+        return choose(gaps, times, scores, seconds), seconds
+
+
+def silences(quiet):
+    """``(n, 2)`` start and end seconds of the quiet runs long enough to be gaps"""
+    edges = np.diff(np.concatenate([[0], quiet.astype(np.int8), [0]]))
+    starts, ends = np.flatnonzero(edges == 1), np.flatnonzero(edges == -1)
+    long_enough = (ends - starts) * FRAME_SECONDS >= settings.API_CHAPTERS['MIN_SILENCE']
+    return np.stack([starts[long_enough], ends[long_enough]], axis=1) * FRAME_SECONDS
+
+
+def changes(bands, quiet):
+    """Seconds where the spectrum changes most, with their robust z-scores"""
+    config = settings.API_CHAPTERS
+    width, per_second = config['NOVELTY_SECONDS'], round(1 / FRAME_SECONDS)
+    whole = len(bands) // per_second
+    if whole < 2 * width + 1:
+        return np.zeros(0), np.zeros(0)
+
+    # Mean spectrum of each second's audible frames; silent seconds repeat the last one heard
+    audible = ~quiet[:whole * per_second].reshape(whole, per_second, 1)
+    sums = (bands[:whole * per_second].reshape(whole, per_second, -1) * audible).sum(axis=1, dtype=np.float64)
+    counts = audible.sum(axis=1)
+    heard = counts[:, 0] > 0
+    last_heard = np.maximum.accumulate(np.where(heard, np.arange(whole), 0))
+    spectra = (sums / np.maximum(counts, 1))[last_heard]
+
+    running = np.concatenate([np.zeros((1, spectra.shape[1])), np.cumsum(spectra, axis=0)])
+    at = np.arange(width, whole - width + 1)
+    before = (running[at] - running[at - width]) / width
+    after = (running[at + width] - running[at]) / width
+    novelty = np.sqrt(((after - before) ** 2).mean(axis=1))
+
+    median = np.median(novelty)
+    scores = (novelty - median) / (1.4826 * np.median(np.abs(novelty - median)) + 1e-9)
+    # Peaks: the best score within a window either side, and high enough
+    neighbourhood = np.lib.stride_tricks.sliding_window_view(
+        np.pad(scores, width, constant_values=-np.inf), 2 * width + 1,
+    ).max(axis=1)
+    peaks = (scores >= neighbourhood) & (scores > config['NOVELTY_Z'])
+    return at[peaks].astype(np.float64), scores[peaks]
+
+
+def choose(gaps, times, scores, seconds):
+    """The boundaries worth keeping, as markers"""
+    config = settings.API_CHAPTERS
+    middles, lengths = gaps.mean(axis=1), gaps[:, 1] - gaps[:, 0]
+    candidates, snapped = [], set()
+    for at, score in zip(times, scores):
+        distance = np.abs(middles - at)
+        nearest = int(distance.argmin()) if len(middles) else None
+        if nearest is not None and distance[nearest] <= config['SNAP_SECONDS']:
+            snapped.add(nearest)
+            candidates.append((score + lengths[nearest], middles[nearest], BOTH))
+        else:
+            candidates.append((score, at, CHANGE))
+    for index, (middle, length) in enumerate(zip(middles, lengths)):
+        if index not in snapped and length >= config['CHAPTER_SILENCE']:
+            # A long pause scores like a modest change
+            candidates.append((2 * length, middle, SILENCE))
+
+    chosen = []
+    for _, at, kind in sorted(candidates, key=lambda candidate: -candidate[0]):
+        if len(chosen) >= config['MAX_CHAPTERS'] - 1:
+            break
+        if at < config['MIN_CHAPTER'] or seconds - at < config['MIN_CHAPTER'] / 2:
+            continue
+        if all(abs(at - other) >= config['MIN_CHAPTER'] for other, _ in chosen):
+            chosen.append((at, kind))
+    return [(0, START)] + [(round(at * 1000), kind) for at, kind in sorted(chosen)]
+
+
+def detect(source):
+    """``([(start ms, kind)], seconds)`` for the audio at ``source``, a path or URL"""
+    require_numpy()
+    rate, _, blocks = pcm_blocks(source, settings.API_LOUDNESS['BLOCK_SECONDS'], settings.API_CHAPTERS['RATE'], 1)
+    detector = Detector(rate)
+    for block in blocks:
+        detector.feed(block)
+    return detector.result()
+
+
+# Output
+
+def chapter_list(chapters):
+    """``[{'start', 'end', 'kind'}]`` in seconds"""
+    markers = unpack(chapters.markers)
+    starts = [start / 1000 for start, _ in markers]
+    ends = starts[1:] + [chapters.seconds]
+    return [
+        {'start': start, 'end': round(end, 3), 'kind': KINDS.get(kind, 'change')}
+        for start, end, (_, kind) in zip(starts, ends, markers)
+    ]
+
+
+def podcasting_document(chapters):
+    """Podcasting 2.0 chapters JSON (application/json+chapters)"""
+    return {
+        'version': '1.2.0',
+        'chapters': [
+            {'startTime': chapter['start'], 'endTime': chapter['end'], 'title': f'Part {number}'}
+            for number, chapter in enumerate(chapter_list(chapters), 1)
+        ],
+    }
+
+
+# Catalog runs, "manage.py detect_chapters"
+
+def child_cpu_seconds():
+    usage = resource.getrusage(resource.RUSAGE_CHILDREN)
+    return usage.ru_utime + usage.ru_stime
+
+
+def detect_one(item):
+    """
+    Pool worker: ``(episode id, packed markers or None, seconds, CPU seconds,
+    error)``. CPU time counts the ffmpeg child decoding for it too.
+    """
+    episode_id, source = item
+    started = time.process_time() + child_cpu_seconds()
+    try:
+        markers, seconds = detect(source)
+    except Exception as exc:
+        # Anything one episode raises fails that episode, not the run
+        error = str(exc) if isinstance(exc, (AnalysisError, OSError)) else repr(exc)
+        return episode_id, None, 0.0, time.process_time() + child_cpu_seconds() - started, error
+    return episode_id, pack(markers), seconds, time.process_time() + child_cpu_seconds() - started, None
+
+
+def save(rows):
+    Chapters.objects.bulk_create(
+        rows, update_conflicts=True, unique_fields=['episode'], update_fields=['markers', 'seconds', 'analyzed_at'],
+    )
+
+
+def detect_catalog(items, processes, batch_size=100, log=None):
+    """
+    Analyse ``(episode id, source)`` items in ``processes`` forked workers, 0
+    for this process, saving every ``batch_size`` results. Items go to the
+    pool ``batch_size`` at a time, so a large catalog isn't queued up front.
+    Returns totals.
+    """
+    totals = {'episodes': 0, 'failed': 0, 'seconds': 0.0, 'cpu_seconds': 0.0}
+    pending = []
+
+    def collect(results):
+        for episode_id, markers, seconds, cpu_seconds, error in results:
+            totals['cpu_seconds'] += cpu_seconds
+            if error is not None:
+                totals['failed'] += 1
+                logger.warning('Chapters for episode %s failed: %s', episode_id, error)
+                continue
+            totals['episodes'] += 1
+            totals['seconds'] += seconds
+            pending.append(Chapters(episode_id=episode_id, markers=markers, seconds=seconds, analyzed_at=timezone.now()))
+            if len(pending) >= batch_size:
+                save(pending)
+                pending.clear()
+                if log:
+                    log(f'{totals["episodes"]} episodes, {totals["seconds"] / 3600:.1f} hours of audio')
+
+    if processes:
+        # Forked children must not share the parent's database connections
+        connections.close_all()
+        with ProcessPoolExecutor(processes, mp_context=multiprocessing.get_context('fork')) as pool:
+            items = iter(items)
+            while batch := list(islice(items, batch_size)):
+                collect(pool.map(detect_one, batch))
+    else:
+        collect(map(detect_one, items))
+    if pending:
+        save(pending)
+    return totals
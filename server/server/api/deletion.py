@@ -0,0 +1,123 @@
+"""
+Background removal of podcasts and episodes marked with ``mark_deleted()``.
+
+Rows are removed in bounded batches, each in its own transaction. Analytics
+rows would cascade from their episode or podcast in its transaction however
+many there are, so they go first in batches of their own. A batch's audio is
+checked for other references after its episode rows are deleted, in the same
+transaction, and unreferenced objects are deleted once it commits; an object
+left behind by a crash in between is found by ``reconcile_storage``.
+Interrupting a run at any point leaves the remaining rows still flagged, so
+the next run picks up where the last one stopped. Deletes through the API and the admin queue a
+``purge_marked`` job; ``process_deletions`` does the same work from cron.
+"""
+from django.core.files.storage import default_storage
+from django.db import transaction
+
+from .instrumentation import timed
+from .jobs import task
+from .models import AnalyticsEvent, EpisodeRollup, Job, Podcast, PodcastRollup, Episode, Playlist, Subscription
+from .sync import log_entries_removed
+
+
+def delete_storage_objects(storage, names):
+    names = [name for name in names if name]
+    if not names:
+        return
+    if hasattr(storage, 'delete_many'):
+        storage.delete_many(names)
+        return
+    with timed('storage'):
+        for name in names:
+            storage.delete(name)
+
+
+def unreferenced(names, exclude_ids):
+    """Audio names no other episode points at; identical uploads can share one object"""
+    still_used = set(
+        Episode.all_objects.filter(audio_file__in=names)
+        .exclude(pk__in=exclude_ids)
+        .values_list('audio_file', flat=True)
+    )
+    return [name for name in names if name not in still_used]
+
+
+def delete_in_batches(queryset, batch_size):
+    """Delete the rows of ``queryset`` ``batch_size`` at a time, each batch in its own transaction"""
+    deleted = 0
+    while True:
+        ids = list(queryset.values_list('pk', flat=True)[:batch_size])
+        if not ids:
+            return deleted
+        queryset.model._base_manager.filter(pk__in=ids).delete()
+        deleted += len(ids)
+
+
+def purge_episode_batch(rows, audio_storage, batch_size=500):
+    ids = [pk for pk, _ in rows]
+    names = list({name for _, name in rows if name})
+    for model in (AnalyticsEvent, EpisodeRollup):
+        delete_in_batches(model.objects.filter(episode_id__in=ids), batch_size)
+    with transaction.atomic():
+        entries = Playlist.episodes.through.objects.filter(episode_id__in=ids)
+        log_entries_removed(entries)
+        entries.delete()
+        Episode.all_objects.filter(pk__in=ids).delete()
+        names = unreferenced(names, ids)
+        transaction.on_commit(lambda: delete_storage_objects(audio_storage, names))
+    return len(ids)
+
+
+def purge_episodes(queryset, batch_size=500, audio_storage=None):
+    """Remove the episodes in ``queryset`` batch by batch, returns how many went"""
+    audio_storage = audio_storage or Episode._meta.get_field('audio_file').storage
+    removed = 0
+    while True:
+        rows = list(queryset.order_by('pk').values_list('pk', 'audio_file')[:batch_size])
+        if not rows:
+            return removed
+        removed += purge_episode_batch(rows, audio_storage, batch_size)
+
+
+def purge_podcast(podcast_id, batch_size=500, audio_storage=None, image_storage=None):
+    stats = {
+        'episodes': purge_episodes(Episode.all_objects.filter(podcast_id=podcast_id), batch_size, audio_storage),
+        'subscriptions': delete_in_batches(Subscription.all_objects.filter(podcast_id=podcast_id), batch_size),
+    }
+    for model in (AnalyticsEvent, EpisodeRollup, PodcastRollup):
+        delete_in_batches(model.objects.filter(podcast_id=podcast_id), batch_size)
+
+    # Nothing references the podcast any more, so this no longer cascades
+    cover = Podcast.all_objects.filter(pk=podcast_id).values_list('cover_image', flat=True).first()
+    delete_storage_objects(image_storage or default_storage, [cover])
+    Podcast.all_objects.filter(pk=podcast_id).delete()
+    return stats
+
+
+def process_pending(batch_size=500, audio_storage=None, image_storage=None, log=None):
+    """Purge every podcast and stray episode currently marked for deletion"""
+    totals = {'podcasts': 0, 'episodes': 0, 'subscriptions': 0}
+    pending = Podcast.all_objects.filter(deleted_at__isnull=False).order_by('deleted_at')
+    for podcast_id in pending.values_list('pk', flat=True).iterator():
+        stats = purge_podcast(podcast_id, batch_size, audio_storage, image_storage)
+        totals['podcasts'] += 1
+        totals['episodes'] += stats['episodes']
+        totals['subscriptions'] += stats['subscriptions']
+        if log:
+            log(f'podcast {podcast_id}: {stats["episodes"]} episodes, {stats["subscriptions"]} subscriptions')
+
+    totals['episodes'] += purge_episodes(
+        Episode.all_objects.filter(deleted_at__isnull=False), batch_size, audio_storage,
+    )
+    return totals
+
+
+@task(priority=-10)
+def purge_marked():
+    process_pending()
+
+
+def schedule_purge():
+    """Queue a purge unless one is already waiting, it takes everything marked by then"""
+    if not Job.objects.filter(task=purge_marked.name, status=Job.QUEUED).exists():
+        purge_marked.delay()
@@ -0,0 +1,274 @@
+"""
+Push changes to connected clients over Server-Sent Events.
+
+Model changes are published to topics (``podcast:<id>`` for new episodes,
+``user:<id>`` for that user's playlists and subscriptions) through the
+configured broker, which hands every event to the ``Hub`` of each worker
+process. The hub fans it out to that worker's open streams listening on
+the topic. Streams are async and need the ASGI entry point; under WSGI the
+handler would buffer the endless response, so the view answers 501 there.
+
+EventSource can't send headers, and a JWT in the query string would end up
+in access logs, so browsers first ``POST /api/events/ticket/`` for a
+single-use ticket that expires after TICKET_SECONDS and pass ``?ticket=``.
+"""
+import asyncio
+import hashlib
+import json
+import secrets
+import threading
+import time
+from collections import defaultdict
+from datetime import timedelta
+from functools import lru_cache
+from itertools import count
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from django.db import transaction
+from django.http import JsonResponse, StreamingHttpResponse
+from django.utils import timezone
+from rest_framework.exceptions import AuthenticationFailed
+from rest_framework_simplejwt.authentication import JWTAuthentication
+from rest_framework_simplejwt.exceptions import TokenError
+
+from .metrics import EVENT_CONNECTIONS, EVENTS_PUBLISHED
+from .models import Playlist, StreamTicket, Subscription
+
+
+class Subscriber:
+    """One open stream: a bounded queue owned by the event loop serving it"""
+
+    __slots__ = ('loop', 'queue', 'topics')
+
+    def __init__(self, loop, maxsize):
+        self.loop = loop
+        self.queue = asyncio.Queue(maxsize)
+        self.topics = set()
+
+    def deliver(self, event):
+        # A client that stopped reading loses its oldest events, not the worker's memory
+        if self.queue.full():
+            self.queue.get_nowait()
+        self.queue.put_nowait(event)
+
+
+class Hub:
+    """In-process fan-out from topics to subscribers; safe to publish to from any thread"""
+
+    def __init__(self):
+        self.topics = defaultdict(set)
+        self.lock = threading.Lock()
+
+    def subscribe(self, subscriber, topics):
+        with self.lock:
+            for topic in topics:
+                self.topics[topic].add(subscriber)
+                subscriber.topics.add(topic)
+
+    def unsubscribe(self, subscriber, topics=None):
+        with self.lock:
+            for topic in list(subscriber.topics if topics is None else topics):
+                listeners = self.topics.get(topic)
+                if listeners is not None:
+                    listeners.discard(subscriber)
+                    if not listeners:
+                        del self.topics[topic]
+                subscriber.topics.discard(topic)
+
+    def dispatch(self, topic, event):
+        with self.lock:
+            listeners = list(self.topics.get(topic, ()))
+        for subscriber in listeners:
+            try:
+                subscriber.loop.call_soon_threadsafe(subscriber.deliver, event)
+            except RuntimeError:
+                # Its loop shut down before the stream could unsubscribe
+                pass
+
+
+hub = Hub()
+
+
+class LocalBroker:
+    """One worker process: events go straight to its hub"""
+
+    def publish(self, topic, event):
+        hub.dispatch(topic, event)
+
+
+class RedisBroker:
+    """Relays events through a Redis channel so the hub of every worker sees them"""
+
+    def __init__(self, url, channel='api-events'):
+        try:
+            import redis
+        except ImportError:
+            raise ImproperlyConfigured('EVENTS_REDIS_URL is set but the redis package is not installed')
+        self.redis = redis
+        self.client = redis.Redis.from_url(url)
+        self.channel = channel
+        threading.Thread(target=self.listen, name='api-events-relay', daemon=True).start()
+
+    def publish(self, topic, event):
+        self.client.publish(self.channel, json.dumps([topic, event]))
+
+    def listen(self):
+        while True:
+            try:
+                pubsub = self.client.pubsub(ignore_subscribe_messages=True)
+                pubsub.subscribe(self.channel)
+                for message in pubsub.listen():
+                    hub.dispatch(*json.loads(message['data']))
+            except self.redis.ConnectionError:
+                time.sleep(1)
+
+
+@lru_cache(maxsize=None)
+def get_broker():
+    url = settings.API_EVENTS['REDIS_URL']
+    return RedisBroker(url) if url else LocalBroker()
+
+
+def publish(topic, type, **data):
+    """Publish once the current transaction commits, so clients never see rows they can't fetch yet"""
+    event = {'type': type, **data}
+
+    def send():
+        EVENTS_PUBLISHED.labels(type).inc()
+        get_broker().publish(topic, event)
+
+    transaction.on_commit(send)
+
+
+# Signal receivers, connected in ApiConfig.ready()
+
+def episode_saved(sender, instance, created, **kwargs):
+    if created and instance.deleted_at is None:
+        publish(
+            f'podcast:{instance.podcast_id}', 'episode.published',
+            episode=instance.pk, podcast=instance.podcast_id, title=instance.title,
+        )
+
+
+def playlist_saved(sender, instance, created, **kwargs):
+    publish(f'user:{instance.user_id}', 'playlist.changed', playlist=instance.pk,
+            action='created' if created else 'updated')
+
+
+def playlist_deleted(sender, instance, **kwargs):
+    publish(f'user:{instance.user_id}', 'playlist.changed', playlist=instance.pk, action='deleted')
+
+
+def playlist_episodes_changed(sender, instance, action, reverse, pk_set, **kwargs):
+    if action not in ('post_add', 'post_remove', 'post_clear'):
+        return
+    if reverse:
+        # episode.playlist_set.add(...): pk_set holds playlists
+        playlists = Playlist.objects.filter(pk__in=pk_set or ()).values_list('pk', 'user_id')
+    else:
+        playlists = [(instance.pk, instance.user_id)]
+    for playlist, user in playlists:
+        publish(f'user:{user}', 'playlist.changed', playlist=playlist, action='episodes')
+
+
+def subscription_saved(sender, instance, created, **kwargs):
+    if created:
+        publish(f'user:{instance.user_id}', 'subscription.changed', podcast=instance.podcast_id, subscribed=True)
+
+
+def subscription_deleted(sender, instance, **kwargs):
+    publish(f'user:{instance.user_id}', 'subscription.changed', podcast=instance.podcast_id, subscribed=False)
+
+
+# The stream
+
+def format_event(event_id, event):
+    return f'id: {event_id}\nevent: {event["type"]}\ndata: {json.dumps(event)}\n\n'
+
+
+def digest(key):
+    return hashlib.sha256(key.encode()).hexdigest()
+
+
+def ticket_cutoff():
+    return timezone.now() - timedelta(seconds=settings.API_EVENTS['TICKET_SECONDS'])
+
+
+def issue_ticket(user):
+    """A key ``?ticket=`` accepts once, within TICKET_SECONDS"""
+    StreamTicket.objects.filter(created_at__lt=ticket_cutoff()).delete()
+    key = secrets.token_urlsafe(32)
+    StreamTicket.objects.create(digest=digest(key), user=user)
+    return key
+
+
+def redeem_ticket(key):
+    """The ticket's user, or None; deleting the row is what claims it, so a replay finds nothing"""
+    tickets = StreamTicket.objects.filter(digest=digest(key))
+    ticket = tickets.filter(created_at__gte=ticket_cutoff()).select_related('user').first()
+    if ticket is None or not tickets.delete()[0] or not ticket.user.is_active:
+        return None
+    return ticket.user
+
+
+def authenticate(request):
+    """A stream ticket from ``?ticket=``, or a JWT from the Authorization header"""
+    key = request.GET.get('ticket')
+    if key is not None:
+        return redeem_ticket(key)
+    auth = JWTAuthentication()
+    header = auth.get_header(request)
+    raw = auth.get_raw_token(header) if header else None
+    if raw is None:
+        return None
+    try:
+        return auth.get_user(auth.get_validated_token(raw))
+    except (AuthenticationFailed, TokenError):
+        return None
+
+
+def subscribed_podcasts(user):
+    return list(Subscription.objects.filter(user=user).values_list('podcast_id', flat=True))
+
+
+async def stream(user_id, podcast_ids):
+    config = settings.API_EVENTS
+    subscriber = Subscriber(asyncio.get_running_loop(), config['QUEUE_SIZE'])
+    hub.subscribe(subscriber, [f'user:{user_id}', *(f'podcast:{pk}' for pk in podcast_ids)])
+    EVENT_CONNECTIONS.inc()
+    ids = count(1)
+    try:
+        yield f'retry: {config["RETRY_MS"]}\n\n'
+        while True:
+            try:
+                event = await asyncio.wait_for(subscriber.queue.get(), config['KEEPALIVE'])
+            except asyncio.TimeoutError:
+                # Comment line, keeps proxies from closing an idle connection
+                yield ': keepalive\n\n'
+                continue
+            if event['type'] == 'subscription.changed':
+                topic = f'podcast:{event["podcast"]}'
+                if event['subscribed']:
+                    hub.subscribe(subscriber, [topic])
+                else:
+                    hub.unsubscribe(subscriber, [topic])
+            yield format_event(next(ids), event)
+    finally:
+        hub.unsubscribe(subscriber)
+        EVENT_CONNECTIONS.dec()
+
+
+async def event_stream(request):
+    """``GET /api/events/``: new episodes of subscribed podcasts and the user's playlist changes"""
+    if 'wsgi.input' in request.META:
+        return JsonResponse({'detail': 'Event streams are only served by the ASGI application.'}, status=501)
+    user = await sync_to_async(authenticate)(request)
+    if user is None:
+        return JsonResponse({'detail': 'Authentication credentials were not provided.'}, status=401)
+    podcast_ids = await sync_to_async(subscribed_podcasts)(user)
+    response = StreamingHttpResponse(stream(user.pk, podcast_ids), content_type='text/event-stream')
+    response['Cache-Control'] = 'no-cache'
+    response['X-Accel-Buffering'] = 'no'
+    return response
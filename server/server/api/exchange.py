@@ -0,0 +1,312 @@
+"""Streaming NDJSON/CSV export and import of the catalog and user data"""
+import csv
+import json
+from contextlib import contextmanager
+
+from django.contrib.auth.hashers import make_password
+from django.contrib.auth.models import User
+from django.core.management.color import no_style
+from django.db import connection, transaction
+from django.utils.dateparse import parse_datetime
+
+from .fieldsets import iso_datetime
+from .models import Category, Podcast, Episode, Playlist, Subscription
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+# Dependency order: every record only references records of earlier kinds.
+# Users are referenced by username, everything else by its source id.
+EXPORT_FIELDS = {
+    'user': (User, {
+        'username': 'username', 'email': 'email', 'first_name': 'first_name',
+        'last_name': 'last_name', 'date_joined': 'date_joined',
+    }),
+    'category': (Category, {'id': 'id', 'name': 'name'}),
+    'podcast': (Podcast, {
+        'id': 'id', 'title': 'title', 'description': 'description', 'cover_image': 'cover_image',
+        'feed_url': 'feed_url', 'category': 'category_id', 'creator': 'creator__username', 'created_at': 'created_at',
+    }),
+    'episode': (Episode, {
+        'id': 'id', 'title': 'title', 'description': 'description', 'audio_file': 'audio_file',
+        'podcast': 'podcast_id', 'duration': 'duration', 'created_at': 'created_at',
+    }),
+    'playlist': (Playlist, {'id': 'id', 'name': 'name', 'user': 'user__username', 'created_at': 'created_at'}),
+    'playlist_episode': (Playlist.episodes.through, {'playlist': 'playlist_id', 'episode': 'episode_id'}),
+    'subscription': (Subscription, {'user': 'user__username', 'podcast': 'podcast_id', 'created_at': 'created_at'}),
+}
+
+INT_KEYS = {'id', 'category', 'podcast', 'episode', 'playlist', 'duration'}
+DATETIME_KEYS = {'created_at', 'date_joined'}
+
+
+@contextmanager
+def manual_timestamps(*models):
+    """Let bulk_create keep a given ``created_at`` instead of auto_now_add"""
+    fields = [model._meta.get_field('created_at') for model in models]
+    for field in fields:
+        field.auto_now_add = False
+    try:
+        yield
+    finally:
+        for field in fields:
+            field.auto_now_add = True
+
+
+def catalog_querysets():
+    return {kind: model._default_manager.all() for kind, (model, _) in EXPORT_FIELDS.items()}
+
+
+def user_querysets(user):
+    """Everything owned by ``user``: profile, shows and their episodes, playlists, subscriptions"""
+    return {
+        'user': User.objects.filter(pk=user.pk),
+        'category': Category.objects.filter(podcast__creator=user).distinct(),
+        'podcast': Podcast.objects.filter(creator=user),
+        'episode': Episode.objects.filter(podcast__creator=user),
+        'playlist': Playlist.objects.filter(user=user),
+        'playlist_episode': Playlist.episodes.through.objects.filter(playlist__user=user),
+        'subscription': Subscription.objects.filter(user=user),
+    }
+
+
+def export_records(querysets, chunk_size=2000):
+    """
+    Yield ``(kind, record)`` pairs for every row of ``querysets``.
+
+    Rows are read with ``iterator(chunk_size=...)`` (a server-side cursor on
+    PostgreSQL), so memory stays flat whatever the table size.
+    """
+    for kind, (model, fields) in EXPORT_FIELDS.items():
+        if kind not in querysets:
+            continue
+        names = list(fields)
+        rows = querysets[kind].order_by('pk').values_list(*fields.values()).iterator(chunk_size=chunk_size)
+        for row in rows:
+            record = dict(zip(names, row))
+            for key in DATETIME_KEYS.intersection(record):
+                record[key] = iso_datetime(record[key])
+            yield kind, record
+
+
+def ndjson_lines(records):
+    """Encode ``export_records`` output as NDJSON lines (bytes)"""
+    for kind, record in records:
+        record = {'model': kind, **record}
+        if orjson is not None:
+            yield orjson.dumps(record) + b'\n'
+        else:
+            yield (json.dumps(record, ensure_ascii=False) + '\n').encode()
+
+
+def read_ndjson(fh):
+    loads = orjson.loads if orjson is not None else json.loads
+    for line in fh:
+        if line.strip():
+            record = loads(line)
+            yield record.pop('model'), record
+
+
+def csv_path(directory, kind):
+    return directory / f'{kind}.csv'
+
+
+def write_csv(records, directory):
+    """One ``<kind>.csv`` per model in ``directory``"""
+    directory.mkdir(parents=True, exist_ok=True)
+    handle, writer, current = None, None, None
+    try:
+        for kind, record in records:
+            if kind != current:
+                if handle is not None:
+                    handle.close()
+                handle = open(csv_path(directory, kind), 'w', newline='')
+                writer = csv.DictWriter(handle, fieldnames=list(EXPORT_FIELDS[kind][1]))
+                writer.writeheader()
+                current = kind
+            writer.writerow(record)
+    finally:
+        if handle is not None:
+            handle.close()
+
+
+def read_csv(directory):
+    for kind in EXPORT_FIELDS:
+        path = csv_path(directory, kind)
+        if not path.exists():
+            continue
+        with open(path, newline='') as handle:
+            for record in csv.DictReader(handle):
+                yield kind, record
+
+
+class Importer:
+    """
+    Batched importer for ``export_records`` output.
+
+    ``upsert`` keeps source ids and updates rows that already exist, so
+    restoring a dump twice (or resuming after a failure) is safe. ``append``
+    gives every row a new id and translates foreign keys through in-memory
+    source -> new id maps. Usernames always resolve to existing users.
+    """
+
+    def __init__(self, mode='upsert', batch_size=5000):
+        if mode not in ('upsert', 'append'):
+            raise ValueError(f'Unknown import mode {mode!r}')
+        self.mode = mode
+        self.batch_size = batch_size
+        self.user_ids = {}
+        self.id_maps = {'category': {}, 'podcast': {}, 'episode': {}, 'playlist': {}}
+        self.counts = {}
+        self.skipped = {}
+        self.batch = []
+        self.batch_kind = None
+
+    def run(self, records):
+        with manual_timestamps(Podcast, Episode, Playlist, Subscription):
+            for kind, record in records:
+                if kind not in EXPORT_FIELDS:
+                    raise ValueError(f'Unknown record type {kind!r}')
+                if kind != self.batch_kind or len(self.batch) >= self.batch_size:
+                    self.flush()
+                    self.batch_kind = kind
+                self.batch.append(self.coerce(record))
+            self.flush()
+        if self.mode == 'upsert':
+            self.reset_sequences()
+        return self.counts
+
+    def coerce(self, record):
+        # CSV hands everything over as strings
+        for key in INT_KEYS.intersection(record):
+            record[key] = int(record[key])
+        for key in DATETIME_KEYS.intersection(record):
+            if isinstance(record[key], str):
+                record[key] = parse_datetime(record[key])
+        return record
+
+    def flush(self):
+        if not self.batch:
+            return
+        kind, batch = self.batch_kind, self.batch
+        self.batch = []
+        with transaction.atomic():
+            getattr(self, f'import_{kind}')(batch)
+
+    def count(self, kind, imported, total):
+        self.counts[kind] = self.counts.get(kind, 0) + imported
+        if total > imported:
+            self.skipped[kind] = self.skipped.get(kind, 0) + total - imported
+
+    def resolve_users(self, usernames):
+        missing = set(usernames) - self.user_ids.keys()
+        if missing:
+            self.user_ids.update(User.objects.filter(username__in=missing).values_list('username', 'pk'))
+        return self.user_ids
+
+    def ref(self, kind, source_id):
+        """Target id for a reference to a ``kind`` row, None if it isn't known"""
+        if self.mode == 'upsert':
+            return source_id
+        return self.id_maps[kind].get(source_id)
+
+    def save(self, kind, model, objects, sources, update_fields, total):
+        if self.mode == 'upsert':
+            model.objects.bulk_create(objects, update_conflicts=True, unique_fields=['id'], update_fields=update_fields)
+        else:
+            for obj in objects:
+                obj.pk = None
+            model.objects.bulk_create(objects)
+            if kind in self.id_maps:
+                self.id_maps[kind].update(zip(sources, (obj.pk for obj in objects)))
+        self.count(kind, len(objects), total)
+
+    def import_user(self, batch):
+        # Imported accounts can't log in until a password is set
+        password = make_password(None)
+        users = [User(password=password, **record) for record in batch]
+        User.objects.bulk_create(
+            users, update_conflicts=True, unique_fields=['username'],
+            update_fields=['email', 'first_name', 'last_name'],
+        )
+        self.resolve_users(record['username'] for record in batch)
+        self.count('user', len(users), len(batch))
+
+    def import_category(self, batch):
+        objects = [Category(id=record['id'], name=record['name']) for record in batch]
+        self.save('category', Category, objects, [record['id'] for record in batch], ['name'], len(batch))
+
+    def import_podcast(self, batch):
+        user_ids = self.resolve_users(record['creator'] for record in batch)
+        objects, sources = [], []
+        for record in batch:
+            creator, category = user_ids.get(record['creator']), self.ref('category', record['category'])
+            if creator is None or category is None:
+                continue
+            objects.append(Podcast(
+                id=record['id'], title=record['title'], description=record['description'],
+                cover_image=record['cover_image'], feed_url=record.get('feed_url') or '',
+                category_id=category, creator_id=creator, created_at=record['created_at'],
+            ))
+            sources.append(record['id'])
+        self.save('podcast', Podcast, objects, sources,
+                  ['title', 'description', 'cover_image', 'feed_url', 'category', 'creator', 'created_at'], len(batch))
+
+    def import_episode(self, batch):
+        objects, sources = [], []
+        for record in batch:
+            podcast = self.ref('podcast', record['podcast'])
+            if podcast is None:
+                continue
+            objects.append(Episode(
+                id=record['id'], title=record['title'], description=record['description'],
+                audio_file=record['audio_file'], podcast_id=podcast, duration=record['duration'],
+                created_at=record['created_at'],
+            ))
+            sources.append(record['id'])
+        self.save('episode', Episode, objects, sources,
+                  ['title', 'description', 'audio_file', 'podcast', 'duration', 'created_at'], len(batch))
+
+    def import_playlist(self, batch):
+        user_ids = self.resolve_users(record['user'] for record in batch)
+        objects, sources = [], []
+        for record in batch:
+            user = user_ids.get(record['user'])
+            if user is None:
+                continue
+            objects.append(Playlist(
+                id=record['id'], name=record['name'], user_id=user, created_at=record['created_at'],
+            ))
+            sources.append(record['id'])
+        self.save('playlist', Playlist, objects, sources, ['name', 'user', 'created_at'], len(batch))
+
+    def import_playlist_episode(self, batch):
+        through = Playlist.episodes.through
+        objects = []
+        for record in batch:
+            playlist, episode = self.ref('playlist', record['playlist']), self.ref('episode', record['episode'])
+            if playlist is not None and episode is not None:
+                objects.append(through(playlist_id=playlist, episode_id=episode))
+        through.objects.bulk_create(objects, ignore_conflicts=True)
+        self.count('playlist_episode', len(objects), len(batch))
+
+    def import_subscription(self, batch):
+        user_ids = self.resolve_users(record['user'] for record in batch)
+        objects = []
+        for record in batch:
+            user, podcast = user_ids.get(record['user']), self.ref('podcast', record['podcast'])
+            if user is not None and podcast is not None:
+                objects.append(Subscription(user_id=user, podcast_id=podcast, created_at=record['created_at']))
+        Subscription.objects.bulk_create(objects, ignore_conflicts=True)
+        self.count('subscription', len(objects), len(batch))
+
+    def reset_sequences(self):
+        # Explicit ids leave PostgreSQL sequences behind the table contents
+        statements = connection.ops.sequence_reset_sql(no_style(), [Category, Podcast, Episode, Playlist])
+        if statements:
+            with connection.cursor() as cursor:
+                for sql in statements:
+                    cursor.execute(sql)
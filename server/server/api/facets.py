@@ -0,0 +1,143 @@
+"""
+Per-category and per-creator podcast counts for the current filters.
+
+Facets count the way filter sidebars expect: each facet ignores its own
+filter, so picking "Comedy" still shows what the other categories hold for
+the same search. Both facets and the total come from a single grouped
+aggregate over ``(category, creator)`` for the search alone, which is split
+by the category and creator filters in Python. The result is cached per
+filter fingerprint under a generation number, kept in the database so every
+host reads the same one whatever the cache backend. Each process reuses the
+number it read for GENERATION_SECONDS, so a cached count costs no query and
+other hosts see a bump that much later. Saves and deletes of podcasts or
+categories bump that number once they commit, which retires every cached
+entry at once; a page counting before then caches under the old number.
+
+With a shared cache (CACHE_REDIS_URL), bumps also queue a job that counts
+the unfiltered case again before a page asks, WARM_DELAY seconds later, so a
+burst of saves shares one job and one check for it per host. A per-process
+cache would keep that count in the job worker, so no job is queued there.
+"""
+import hashlib
+import json
+import time
+from collections import Counter
+from datetime import timedelta
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import Count, F
+from django.utils import timezone
+
+from .jobs import task
+from .metrics import CACHE_REQUESTS
+from .models import CacheGeneration, Category, Job, Podcast
+
+GENERATION = 'facets'
+
+# ``(number, monotonic expiry)`` last read by this process
+read_generation = None
+
+# When the warm job this host last saw queued runs; bumps before then are covered
+warm_queued_until = None
+
+
+def generation():
+    global read_generation
+    if read_generation is None or time.monotonic() >= read_generation[1]:
+        number = CacheGeneration.objects.filter(name=GENERATION).values_list('number', flat=True).first() or 0
+        read_generation = (number, time.monotonic() + settings.API_FACETS['GENERATION_SECONDS'])
+    return read_generation[0]
+
+
+def bump(*args, **kwargs):
+    """Retire every cached count once the transaction commits; also a post_save/post_delete receiver"""
+    transaction.on_commit(advance)
+
+
+def advance():
+    global read_generation
+    if not CacheGeneration.objects.filter(name=GENERATION).update(number=F('number') + 1):
+        CacheGeneration.objects.get_or_create(name=GENERATION, defaults={'number': 1})
+    # This process sees its own bump right away
+    read_generation = None
+    if shared_cache():
+        schedule_warm()
+
+
+def shared_cache():
+    """Whether an entry a job worker caches reaches the web processes"""
+    return not settings.CACHES['default']['BACKEND'].endswith(('.LocMemCache', '.DummyCache'))
+
+
+def cache_key(filters):
+    fingerprint = hashlib.sha1(json.dumps(filters, sort_keys=True).encode()).hexdigest()
+    return f'facets:{generation()}:{fingerprint}'
+
+
+def count(filters):
+    """``{'total', 'categories', 'creators'}`` for ``filters`` (category, creator, search), from the database"""
+    category, creator, search = filters.get('category'), filters.get('creator'), filters.get('search')
+    queryset = Podcast.objects.all()
+    if search:
+        queryset = queryset.filter(title__icontains=search)
+    pairs = queryset.order_by().values_list('category_id', 'creator_id').annotate(podcasts=Count('pk'))
+
+    categories, creators = Counter(), Counter()
+    for category_id, creator_id, podcasts in pairs:
+        if creator is None or creator_id == creator:
+            categories[category_id] += podcasts
+        if category is None or category_id == category:
+            creators[creator_id] += podcasts
+    total = sum(categories.values()) if category is None else categories[category]
+
+    # Every category, but only the biggest creators, plus the one picked
+    shown = [pk for pk, _ in creators.most_common(settings.API_FACETS['CREATORS'])]
+    if creator is not None and creator not in shown:
+        shown.append(creator)
+    names = dict(Category.objects.values_list('pk', 'name'))
+    usernames = dict(User.objects.filter(pk__in=shown).values_list('pk', 'username'))
+    return {
+        'total': total,
+        'categories': sorted(
+            ({'id': pk, 'name': name, 'count': categories[pk]} for pk, name in names.items()),
+            key=lambda facet: (-facet['count'], facet['name']),
+        ),
+        'creators': [
+            {'id': pk, 'username': usernames[pk], 'count': creators[pk]} for pk in shown if pk in usernames
+        ],
+    }
+
+
+def facets(filters):
+    """``count(filters)``, cached"""
+    key = cache_key(filters)
+    result = cache.get(key)
+    if result is not None:
+        CACHE_REQUESTS.labels('facets', 'hit').inc()
+        return result
+    CACHE_REQUESTS.labels('facets', 'miss').inc()
+    result = count(filters)
+    cache.set(key, result, settings.API_FACETS['CACHE_TIMEOUT'])
+    return result
+
+
+# Behind the suggestion rebuild, which a page can't compute on the spot
+@task(priority=-10)
+def warm():
+    facets({})
+
+
+def schedule_warm():
+    """Queue a count of the unfiltered case WARM_DELAY seconds from now, unless one is already waiting"""
+    global warm_queued_until
+    now = timezone.now()
+    if warm_queued_until is not None and now < warm_queued_until:
+        return
+    waiting = Job.objects.filter(task=warm.name, status=Job.QUEUED).order_by('-run_at')
+    warm_queued_until = waiting.values_list('run_at', flat=True).first()
+    if warm_queued_until is None:
+        warm_queued_until = warm.schedule(timedelta(seconds=settings.API_FACETS['WARM_DELAY'])).run_at
+
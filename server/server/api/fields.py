@@ -1,62 +1,61 @@
+from urllib.parse import urlsplit, urlunsplit
+
 from django.db import models
-from cloudinary_storage.storage import MediaCloudinaryStorage
-import cloudinary.uploader
+from django.utils.functional import LazyObject
 
+# Schemes podcast apps register to open feeds with, e.g. feed://example.com/rss or feed:https://...
+FEED_SCHEMES = {'feed', 'itpc', 'pcast', 'podcast'}
+DEFAULT_PORTS = {'http': 80, 'https': 443}
+
+
+class LazyAudioStorage(LazyObject):
+    """``AudioCloudinaryStorage`` built on first use, so loading models doesn't import the Cloudinary SDK"""
+
+    def _setup(self):
+        from .storages import AudioCloudinaryStorage
+        self._wrapped = AudioCloudinaryStorage()
+
+    def __bool__(self):
+        # FileField.__init__ tests ``storage or default_storage``, don't set up for that
+        return True
 
-class AudioCloudinaryStorage(MediaCloudinaryStorage):
-    """Custom storage for audio files that uses raw resource type"""
-    
-    def _save(self, name, content):
-        # Get file extension
-        file_ext = name.lower().split('.')[-1] if '.' in name else ''
-        audio_extensions = ['mp3', 'wav', 'm4a', 'aac', 'ogg', 'flac', 'wma']
-        
-        if file_ext in audio_extensions:
-            # For audio files, upload directly with raw resource type
-            try:
-                result = cloudinary.uploader.upload(
-                    content,
-                    folder="episodes",
-                    resource_type="raw",
-                    use_filename=True,
-                    unique_filename=True,
-                    overwrite=False
-                )
-                
-                # Return the public_id which Cloudinary storage expects
-                return result.get('public_id')
-                
-            except Exception as e:
-                # Fall back to default behavior if direct upload fails
-                pass
-        
-        # For non-audio files or if direct upload fails, use default behavior
-        return super()._save(name, content)
-    
-    def url(self, name):
-        """Override URL generation to use correct resource type for audio files"""
-        if name:
-            # Check if this is an audio file based on extension
-            file_ext = name.lower().split('.')[-1] if '.' in name else ''
-            audio_extensions = ['mp3', 'wav', 'm4a', 'aac', 'ogg', 'flac', 'wma']
-            
-            if file_ext in audio_extensions:
-                # Generate raw URL for audio files
-                import cloudinary
-                try:
-                    return cloudinary.CloudinaryResource(name, resource_type="raw").build_url()
-                except:
-                    # If that fails, manually construct the URL
-                    base_url = f"https://res.cloudinary.com/{cloudinary.config().cloud_name}/raw/upload"
-                    return f"{base_url}/v1/{name}"
-        
-        # For non-audio files, use default URL generation
-        return super().url(name)
+
+# Migration 0004 builds the field's storage from here
+AudioCloudinaryStorage = LazyAudioStorage
 
 
 class AudioFileField(models.FileField):
     """Custom FileField for audio files that uses AudioCloudinaryStorage"""
     
     def __init__(self, *args, **kwargs):
-        kwargs.setdefault('storage', AudioCloudinaryStorage())
-        super().__init__(*args, **kwargs) 
\ No newline at end of file
+        kwargs.setdefault('storage', LazyAudioStorage())
+        super().__init__(*args, **kwargs) 
+
+
+def canonical_feed_url(url):
+    """One spelling per feed: lowercase scheme and host, no default port, userinfo or fragment"""
+    url = url.strip()
+    parts = urlsplit(url)
+    scheme = parts.scheme.lower()
+    if scheme in FEED_SCHEMES:
+        if parts.path.lower().startswith(('http:', 'https:')):
+            return canonical_feed_url(parts.path)
+        scheme = 'http'
+    try:
+        port = parts.port
+    except ValueError:
+        return url
+    host = parts.hostname or ''
+    if ':' in host:
+        host = f'[{host}]'
+    if port is not None and DEFAULT_PORTS.get(scheme) != port:
+        host = f'{host}:{port}'
+    return urlunsplit((scheme, host, parts.path or '/', parts.query, ''))
+
+
+class FeedURLField(models.URLField):
+    """URLField stored, and looked up, as ``canonical_feed_url``"""
+
+    def get_prep_value(self, value):
+        value = super().get_prep_value(value)
+        return canonical_feed_url(value) if value else value
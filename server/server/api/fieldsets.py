@@ -0,0 +1,238 @@
+from django.core.exceptions import FieldDoesNotExist
+from django.db import models
+from rest_framework import serializers
+from rest_framework.permissions import SAFE_METHODS
+from rest_framework.response import Response
+
+from .instrumentation import timed
+
+
+def parse_field_list(request, param):
+    """Return the comma separated names in ``?<param>=`` or None if absent"""
+    if request is None or request.method not in SAFE_METHODS:
+        return None
+    raw = request.query_params.get(param)
+    if not raw:
+        return None
+    return [name.strip() for name in raw.split(',') if name.strip()]
+
+
+def is_root_serializer(serializer):
+    parent = serializer.parent
+    if isinstance(parent, serializers.ListSerializer):
+        parent = parent.parent
+    return parent is None
+
+
+def iso_datetime(value):
+    """Same output as DRF's DateTimeField for aware UTC datetimes"""
+    if value is None:
+        return None
+    value = value.isoformat()
+    if value.endswith('+00:00'):
+        value = value[:-6] + 'Z'
+    return value
+
+
+class InstrumentedListSerializer(serializers.ListSerializer):
+
+    @property
+    def data(self):
+        with timed('serialize'):
+            data = super().data
+        if self.parent is None and hasattr(self.child, 'add_viewer_flags'):
+            self.child.add_viewer_flags(data)
+        return data
+
+
+class SparseFieldsetMixin:
+    """
+    Serializer mixin that honours ``?fields=`` and ``?expand=`` on reads.
+
+    ``Meta.expandable_fields`` maps extra field names to callables building the
+    field, so payloads that don't ask for them never pay for them.
+    ``Meta.values_fields`` maps output names to ORM lookups and enables the
+    ``values()`` fast path used by read-only list endpoints.
+    """
+
+    @classmethod
+    def many_init(cls, *args, **kwargs):
+        if not hasattr(cls.Meta, 'list_serializer_class'):
+            cls.Meta.list_serializer_class = InstrumentedListSerializer
+        return super().many_init(*args, **kwargs)
+
+    @property
+    def data(self):
+        with timed('serialize'):
+            return super().data
+
+    def get_fields(self):
+        fields = super().get_fields()
+        if not is_root_serializer(self):
+            return fields
+
+        request = self.context.get('request')
+
+        expandable = getattr(self.Meta, 'expandable_fields', {})
+        for name in parse_field_list(request, 'expand') or []:
+            if name in expandable and name not in fields:
+                fields[name] = expandable[name]()
+
+        requested = parse_field_list(request, 'fields')
+        if requested is not None:
+            fields = {name: field for name, field in fields.items() if name in requested}
+
+        return fields
+
+    def get_values_lookups(self):
+        """Output name -> ORM lookup for the current fields, or None if any field needs an instance"""
+        values_fields = getattr(self.Meta, 'values_fields', None)
+        if not values_fields:
+            return None
+        lookups = {}
+        for name in self.fields:
+            if name not in values_fields:
+                return None
+            lookups[name] = values_fields[name]
+        return lookups
+
+
+def _resolve_lookup(model, attrs):
+    """Turn serializer source attrs into an ORM lookup, following forward FKs"""
+    path = []
+    for index, attr in enumerate(attrs):
+        try:
+            field = model._meta.get_field(attr)
+        except FieldDoesNotExist:
+            return None, None
+        if field.many_to_many or field.one_to_many or not field.concrete:
+            return None, None
+        path.append(attr)
+        if field.is_relation and index < len(attrs) - 1:
+            model = field.related_model
+        elif index < len(attrs) - 1:
+            return None, None
+    return '__'.join(path), field
+
+
+def queryset_lookups(serializer):
+    """
+    Columns and joins needed to render ``serializer``'s fields.
+
+    Returns ``(only, related)`` or None when a field can't be mapped to columns
+    (method fields, properties, ``source='*'``), in which case nothing is narrowed.
+    """
+    model = serializer.Meta.model
+    only, related = set(), set()
+
+    for field in serializer.fields.values():
+        if field.write_only:
+            continue
+        if field.source == '*' or isinstance(field, (serializers.SerializerMethodField, serializers.ListSerializer)):
+            return None
+
+        lookup, model_field = _resolve_lookup(model, field.source_attrs)
+        if lookup is None:
+            return None
+
+        if isinstance(field, serializers.BaseSerializer):
+            nested = queryset_lookups(field)
+            if nested is None:
+                return None
+            related.add(lookup)
+            only.update(f'{lookup}__{name}' for name in nested[0])
+            related.update(f'{lookup}__{name}' for name in nested[1])
+            continue
+
+        only.add(lookup)
+        if '__' in lookup:
+            related.add(lookup.rsplit('__', 1)[0])
+
+    return only, related
+
+
+def narrow_queryset(queryset, serializer):
+    """Restrict ``queryset`` to the columns and joins ``serializer`` reads"""
+    lookups = queryset_lookups(serializer)
+    if lookups is None:
+        return queryset
+    only, related = lookups
+    return queryset.select_related(None).select_related(*related).only(*only)
+
+
+def values_converters(model, lookups, request):
+    """Per-column conversions so ``values()`` rows match serializer output"""
+    converters = {}
+    for name, lookup in lookups.items():
+        _, model_field = _resolve_lookup(model, lookup.split('__'))
+        if isinstance(model_field, models.DateTimeField):
+            converters[name] = iso_datetime
+        elif isinstance(model_field, models.FileField):
+            converters[name] = _file_url_converter(model_field.storage, request)
+    return converters
+
+
+def file_columns(model, lookups):
+    """Names in ``lookups`` whose ``values()`` rows carry file URLs"""
+    return [
+        name for name, lookup in lookups.items()
+        if isinstance(_resolve_lookup(model, lookup.split('__'))[1], models.FileField)
+    ]
+
+
+def _file_url_converter(storage, request):
+    def convert(value):
+        if not value:
+            return None
+        url = storage.url(value)
+        if request is not None:
+            return request.build_absolute_uri(url)
+        return url
+    return convert
+
+
+def values_rows(rows, lookups, model, request=None):
+    """Build plain dicts straight from ``values_list()`` rows, bypassing the serializer"""
+    converters = values_converters(model, lookups, request)
+    names = list(lookups)
+
+    with timed('serialize'):
+        items = []
+        for row in rows:
+            item = dict(zip(names, row))
+            for name, convert in converters.items():
+                item[name] = convert(item[name])
+            items.append(item)
+    return items
+
+
+class SparseFieldsetViewMixin:
+    """
+    ViewSet mixin pairing with ``SparseFieldsetMixin``.
+
+    Safe requests only select the columns the serializer renders, and lists whose
+    serializer declares ``values_fields`` skip serializer instances entirely.
+    """
+
+    def filter_queryset(self, queryset):
+        # Narrowing here rather than in get_queryset() also covers views overriding that
+        queryset = super().filter_queryset(queryset)
+        if self.request.method not in SAFE_METHODS:
+            return queryset
+        return narrow_queryset(queryset, self.get_serializer())
+
+    def list(self, request, *args, **kwargs):
+        serializer = self.get_serializer()
+        lookups = serializer.get_values_lookups() if isinstance(serializer, SparseFieldsetMixin) else None
+        if lookups is None:
+            return super().list(request, *args, **kwargs)
+
+        queryset = self.filter_queryset(self.get_queryset())
+        rows = queryset.values_list(*lookups.values())
+        page = self.paginate_queryset(rows)
+        items = values_rows(rows if page is None else page, lookups, queryset.model, request)
+        if hasattr(serializer, 'add_viewer_flags'):
+            serializer.add_viewer_flags(items)
+        if page is not None:
+            return self.get_paginated_response(items)
+        return Response(items)
@@ -0,0 +1,251 @@
+"""
+Everything the home and discover pages show, in one response.
+
+``/api/home/`` builds its sections (trending podcasts, recent episodes,
+categories and, for a signed-in viewer, their subscriptions and stats) side
+by side on a thread pool. Each section is cached on its own for its own TTL
+and kept for ``STALE_SECONDS`` past it. A section that isn't ready within
+its time budget is answered from that stale copy, or left empty, and listed
+under ``degraded``; its build carries on and fills the cache for the next
+request. Until it does, requests for the same cache key wait on that build
+instead of starting another, so a slow database can't pile up builds and
+connections. Saves that change a section drop its cached copy, and so does
+``mark_deleted``, whose bulk updates send no signals.
+
+Builders get the viewer's id, never the request, so a pool thread holds
+nothing of it. Public sections are shared by every host name the API answers
+on, so their file URLs are cached as the storage gives them and made
+absolute for each request on the way out.
+"""
+import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeoutError
+from functools import lru_cache
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import close_old_connections, connection
+from rest_framework.exceptions import ValidationError
+
+from .fieldsets import file_columns, values_rows
+from .instrumentation import RequestTimings, activate, current_timings, deactivate, query_wrapper
+from .metrics import CACHE_REQUESTS
+from .models import Category, Episode, Playlist, Podcast, Subscription
+from .serializers import CategorySerializer, EpisodeListSerializer, PodcastListSerializer, SubscriptionSerializer
+
+logger = logging.getLogger(__name__)
+
+
+# Sections
+
+def listing(serializer_class, queryset):
+    """Rows of ``queryset`` as ``serializer_class`` renders them by default, through ``values()``"""
+    lookups = serializer_class().get_values_lookups()
+    return values_rows(queryset.values_list(*lookups.values()), lookups, queryset.model)
+
+
+def trending(user_id):
+    return listing(PodcastListSerializer, Podcast.objects.order_by('-created_at')[:10])
+
+
+def recent_episodes(user_id):
+    return listing(EpisodeListSerializer, Episode.objects.order_by('-created_at')[:10])
+
+
+def categories(user_id):
+    return listing(CategorySerializer, Category.objects.order_by('pk'))
+
+
+def subscriptions(user_id):
+    queryset = Subscription.objects.filter(user_id=user_id).select_related('user', 'podcast')
+    return SubscriptionSerializer(queryset, many=True).data
+
+
+def stats(user_id):
+    return {
+        'podcasts_created': Podcast.objects.filter(creator_id=user_id).count(),
+        'playlists_created': Playlist.objects.filter(user_id=user_id).count(),
+        'subscriptions': Subscription.objects.filter(user_id=user_id).count(),
+    }
+
+
+# name -> (builder, cached per viewer)
+SECTIONS = {
+    'trending': (trending, False),
+    'recent_episodes': (recent_episodes, False),
+    'categories': (categories, False),
+    'subscriptions': (subscriptions, True),
+    'stats': (stats, True),
+}
+
+# Public listings: name -> (serializer, model), for the columns holding file URLs
+LISTINGS = {
+    'trending': (PodcastListSerializer, Podcast),
+    'recent_episodes': (EpisodeListSerializer, Episode),
+    'categories': (CategorySerializer, Category),
+}
+
+# model name -> (public sections, field holding the viewer whose sections go stale)
+DEPENDENCIES = {
+    'podcast': (['trending', 'recent_episodes'], 'creator_id'),
+    'episode': (['recent_episodes'], None),
+    'category': (['categories', 'trending'], None),
+    'subscription': ([], 'user_id'),
+    'playlist': ([], 'user_id'),
+}
+
+
+def cache_key(name, user_id=None):
+    return f'home:{name}' if user_id is None else f'home:{name}:{user_id}'
+
+
+def drop_cached(sender, instance, **kwargs):
+    """post_save/post_delete receiver"""
+    _, owner = DEPENDENCIES[sender._meta.model_name]
+    drop_sections(sender, [getattr(instance, owner)] if owner else [])
+
+
+def drop_sections(model, owners=()):
+    """Drop the sections a change to ``model`` rows makes stale, the per-viewer ones of ``owners`` too"""
+    public, _ = DEPENDENCIES[model._meta.model_name]
+    keys = [cache_key(name) for name in public]
+    keys += [cache_key(name, user_id) for user_id in owners for name, (_, per_user) in SECTIONS.items() if per_user]
+    cache.delete_many(keys)
+
+
+@lru_cache(maxsize=None)
+def url_columns(name):
+    serializer_class, model = LISTINGS[name]
+    return file_columns(model, serializer_class().get_values_lookups())
+
+
+def absolute_urls(request, name, data):
+    """``data`` with a public listing's relative file URLs made absolute for ``request``'s host"""
+    if name not in LISTINGS or not data:
+        return data
+    columns = url_columns(name)
+    if not columns:
+        return data
+    return [
+        {**row, **{column: request.build_absolute_uri(row[column]) for column in columns if row.get(column)}}
+        for row in data
+    ]
+
+
+def requested_sections(request):
+    """``?sections=trending,categories``, by default every section the viewer can see"""
+    visible = [name for name, (_, per_user) in SECTIONS.items() if request.user.is_authenticated or not per_user]
+    raw = request.query_params.get('sections')
+    if not raw:
+        return visible
+    names = list(dict.fromkeys(name.strip() for name in raw.split(',') if name.strip()))
+    unknown = [name for name in names if name not in SECTIONS]
+    if unknown:
+        raise ValidationError({'sections': f'Unknown sections: {", ".join(unknown)}.'})
+    hidden = [name for name in names if name not in visible]
+    if hidden:
+        raise ValidationError({'sections': f'Sign in to see: {", ".join(hidden)}.'})
+    return names
+
+
+# Building
+
+@lru_cache(maxsize=1)
+def executor():
+    return ThreadPoolExecutor(settings.API_HOME['WORKERS'], thread_name_prefix='home')
+
+
+def build(name, key, user_id, instrumented):
+    """Build a section on a pool thread and cache it; ``(data, timings)``"""
+    builder, _ = SECTIONS[name]
+    ttl = settings.API_HOME['SECTIONS'][name][0]
+    timings = RequestTimings()
+    token = activate(timings)
+    # A pool thread outlives requests, so it ages its connection out the way a request would
+    close_old_connections()
+    try:
+        if instrumented:
+            with connection.execute_wrapper(query_wrapper):
+                data = builder(user_id)
+        else:
+            data = builder(user_id)
+    finally:
+        close_old_connections()
+        deactivate(token)
+    cache.set(key, (time.time() + ttl, data), ttl + settings.API_HOME['STALE_SECONDS'])
+    return data, timings
+
+
+# cache key -> future of the build under way, one per key in this process
+in_flight = {}
+in_flight_lock = threading.Lock()
+
+
+def submit(name, key, user_id, instrumented):
+    """The build of ``key`` already running, or a new one; ``(future, started here)``"""
+    with in_flight_lock:
+        future = in_flight.get(key)
+        if future is not None:
+            return future, False
+        future = in_flight[key] = executor().submit(build, name, key, user_id, instrumented)
+
+    def done(finished):
+        with in_flight_lock:
+            if in_flight.get(key) is finished:
+                del in_flight[key]
+    future.add_done_callback(done)
+    return future, True
+
+
+def compose(request, names):
+    """Section name -> data for ``names``, plus name -> reason for sections served stale or empty"""
+    config = settings.API_HOME
+    user_id = request.user.pk if request.user.is_authenticated else None
+    keys = {name: cache_key(name, user_id if SECTIONS[name][1] else None) for name in names}
+    cached = cache.get_many(list(keys.values()))
+    now = time.time()
+
+    sections, stale = {}, {}
+    for name, key in keys.items():
+        entry = cached.get(key)
+        if entry is not None and entry[0] > now:
+            sections[name] = entry[1]
+        else:
+            stale[name] = entry[1] if entry is not None else None
+    CACHE_REQUESTS.labels('home', 'hit').inc(len(sections))
+    CACHE_REQUESTS.labels('home', 'miss').inc(len(stale))
+    if not stale:
+        return {name: absolute_urls(request, name, data) for name, data in sections.items()}, {}
+
+    timings = current_timings()
+    started = time.perf_counter()
+    if config['WORKERS']:
+        futures = {name: submit(name, keys[name], user_id, timings is not None) for name in stale}
+    degraded = {}
+    for name in stale:
+        try:
+            if config['WORKERS']:
+                remaining = started + config['SECTIONS'][name][1] / 1000 - time.perf_counter()
+                future, own = futures[name]
+                data, section_timings = future.result(timeout=max(remaining, 0))
+                # A build shared with another request counts toward that request's timings
+                section_timings = section_timings if own else None
+            else:
+                data, section_timings = build(name, keys[name], user_id, timings is not None)
+        except FutureTimeoutError:
+            degraded[name] = 'timeout'
+        except Exception:
+            logger.warning('Home section %s failed', name, exc_info=True)
+            degraded[name] = 'error'
+        else:
+            sections[name] = data
+            if timings is not None and section_timings is not None:
+                timings.merge(section_timings)
+            continue
+        if stale[name] is not None:
+            sections[name] = stale[name]
+            degraded[name] = 'stale'
+        else:
+            sections[name] = None
+    return {name: absolute_urls(request, name, data) for name, data in sections.items()}, degraded
@@ -0,0 +1,89 @@
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+
+_current = ContextVar('api_request_timings', default=None)
+
+
+class RequestTimings:
+    """Durations and SQL accounting collected while one request is handled"""
+
+    __slots__ = ('durations', 'queries')
+
+    def __init__(self):
+        # name -> seconds, e.g. 'serialize', 'render', 'storage'
+        self.durations = {}
+        # SQL template -> [executions, seconds]
+        self.queries = {}
+
+    def add(self, name, seconds):
+        self.durations[name] = self.durations.get(name, 0.0) + seconds
+
+    def record_query(self, sql, seconds):
+        entry = self.queries.get(sql)
+        if entry is None:
+            self.queries[sql] = [1, seconds]
+        else:
+            entry[0] += 1
+            entry[1] += seconds
+
+    def merge(self, other):
+        """Fold in what ``other`` collected, e.g. on a worker thread serving this request"""
+        for name, seconds in other.durations.items():
+            self.add(name, seconds)
+        for sql, (count, seconds) in other.queries.items():
+            entry = self.queries.setdefault(sql, [0, 0.0])
+            entry[0] += count
+            entry[1] += seconds
+
+    @property
+    def query_count(self):
+        return sum(count for count, _ in self.queries.values())
+
+    @property
+    def query_time(self):
+        return sum(seconds for _, seconds in self.queries.values())
+
+    def duplicate_queries(self, threshold=2):
+        """SQL templates executed at least ``threshold`` times, most repeated first"""
+        repeated = [(sql, count) for sql, (count, _) in self.queries.items() if count >= threshold]
+        return sorted(repeated, key=lambda item: item[1], reverse=True)
+
+
+def current_timings():
+    return _current.get()
+
+
+def activate(timings):
+    return _current.set(timings)
+
+
+def deactivate(token):
+    _current.reset(token)
+
+
+@contextmanager
+def timed(name):
+    """Add the time spent in the block to the current request, if there is one"""
+    timings = _current.get()
+    if timings is None:
+        yield
+        return
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        timings.add(name, time.perf_counter() - start)
+
+
+def query_wrapper(execute, sql, params, many, context):
+    """``connection.execute_wrapper`` hook feeding the current request's SQL accounting"""
+    timings = _current.get()
+    if timings is None:
+        return execute(sql, params, many, context)
+    start = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        timings.record_query(sql, time.perf_counter() - start)
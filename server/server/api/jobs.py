@@ -0,0 +1,328 @@
+"""
+Background jobs stored in the database.
+
+Functions decorated with ``@task`` are queued with ``.delay()`` or
+``.schedule()`` and run by ``manage.py runworker``. The job row is written in
+the caller's transaction, so a job queued by a request that rolls back never
+runs. Workers claim ready jobs highest priority first with
+``SELECT ... FOR UPDATE SKIP LOCKED`` on PostgreSQL, so any number of them
+can poll the table without queueing up behind each other's locks. SQLite has
+no row locks but serializes writes, and the claiming UPDATE only takes jobs
+that are still queued, so a job is never claimed twice there either.
+
+A job that raises is retried with exponential backoff and is kept as
+``dead``, with its traceback, once it runs out of attempts. While a worker
+holds a batch, a heartbeat thread refreshes ``locked_at`` every ``HEARTBEAT``
+seconds for every job of it not yet finished, the ones still waiting their
+turn too. Jobs without a heartbeat for ``TIMEOUT`` seconds, because their
+worker died, are requeued. Delivery is at least once, so tasks should be safe to run
+again. A run only finishes the claim it started with. If its job was
+requeued and claimed again meanwhile, the row belongs to the new run and is
+left alone. Finished jobs are deleted.
+"""
+import logging
+import multiprocessing
+import os
+import random
+import signal
+import socket
+import threading
+import time
+import traceback
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import DatabaseError, close_old_connections, connection, connections, transaction
+from django.db.models import F
+from django.utils import timezone
+from django.utils.module_loading import import_string
+
+from .metrics import JOB_DURATION, JOBS
+from .models import Job
+
+logger = logging.getLogger(__name__)
+
+registry = {}
+
+
+class Task:
+
+    def __init__(self, fn, name, priority, max_attempts):
+        self.fn = fn
+        self.name = name
+        self.priority = priority
+        self.max_attempts = max_attempts
+
+    def __call__(self, *args, **kwargs):
+        return self.fn(*args, **kwargs)
+
+    def delay(self, *args, **kwargs):
+        """Queue a call; arguments must be JSON serializable"""
+        return self.enqueue(args, kwargs)
+
+    def schedule(self, when, *args, **kwargs):
+        """Queue a call to run at ``when``, a datetime or a timedelta from now"""
+        if isinstance(when, timedelta):
+            when = timezone.now() + when
+        return self.enqueue(args, kwargs, run_at=when)
+
+    def enqueue(self, args=(), kwargs=None, run_at=None, priority=None):
+        return Job.objects.create(
+            task=self.name, args=list(args), kwargs=kwargs or {},
+            priority=self.priority if priority is None else priority,
+            max_attempts=self.max_attempts or settings.API_JOBS['MAX_ATTEMPTS'],
+            run_at=run_at or timezone.now(),
+        )
+
+
+def task(fn=None, *, priority=0, max_attempts=None):
+    """Make a module-level function queueable, ``@task`` or ``@task(priority=10)``"""
+    def register(fn):
+        registered = Task(fn, f'{fn.__module__}.{fn.__qualname__}', priority, max_attempts)
+        registry[registered.name] = registered
+        return registered
+    return register(fn) if fn else register
+
+
+def resolve(name):
+    # Importing the defining module registers the task
+    return registry.get(name) or import_string(name)
+
+
+# Claiming and running
+
+def claim(worker, limit=1, now=None):
+    """Mark up to ``limit`` ready jobs as running for ``worker`` and return them"""
+    now = now or timezone.now()
+    with transaction.atomic():
+        ready = Job.objects.filter(status=Job.QUEUED, run_at__lte=now).order_by('-priority', 'run_at', 'pk')
+        ids = list(ready.select_for_update(skip_locked=True).values_list('pk', flat=True)[:limit])
+        if not ids:
+            return []
+        # Without row locks (SQLite) another worker may have taken some of these since the SELECT
+        Job.objects.filter(pk__in=ids, status=Job.QUEUED).update(
+            status=Job.RUNNING, locked_by=worker, locked_at=now, attempts=F('attempts') + 1,
+        )
+        return list(Job.objects.filter(pk__in=ids, status=Job.RUNNING, locked_by=worker).order_by('-priority', 'run_at', 'pk'))
+
+
+def backoff(attempt):
+    config = settings.API_JOBS
+    delay = min(config['BACKOFF'] * 2 ** (attempt - 1), config['BACKOFF_MAX'])
+    # Spread out retries of jobs that failed together
+    return timedelta(seconds=delay * random.uniform(0.8, 1.2))
+
+
+def owned(job):
+    """The job's row while it is still held by the claim ``job`` was read from"""
+    # Attempts go up with every claim, so a worker that claims the same job again doesn't match either
+    return Job.objects.filter(pk=job.pk, status=Job.RUNNING, locked_by=job.locked_by, attempts=job.attempts)
+
+
+def fail(job, error):
+    if job.attempts >= job.max_attempts:
+        updated = owned(job).update(status=Job.DEAD, locked_by='', locked_at=None, last_error=error)
+        return 'dead' if updated else 'lost'
+    updated = owned(job).update(
+        status=Job.QUEUED, locked_by='', locked_at=None, last_error=error,
+        run_at=timezone.now() + backoff(job.attempts),
+    )
+    return 'retried' if updated else 'lost'
+
+
+class Heartbeat:
+    """Refreshes the ``locked_at`` of claimed jobs from a thread until they finish, so ``requeue_stale`` leaves them alone"""
+
+    def __init__(self, jobs):
+        self.jobs = {job.pk: job for job in jobs}
+        self.lock = threading.Lock()
+        self.stopped = threading.Event()
+        self.thread = threading.Thread(target=self.run, name=f'heartbeat-{min(self.jobs)}', daemon=True)
+
+    def __enter__(self):
+        self.thread.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.stopped.set()
+        self.thread.join()
+
+    def held(self, job):
+        with self.lock:
+            return job.pk in self.jobs
+
+    def finish(self, job):
+        with self.lock:
+            self.jobs.pop(job.pk, None)
+
+    def beat(self):
+        """The jobs whose claim is gone, which are no longer refreshed"""
+        with self.lock:
+            jobs = list(self.jobs.values())
+        now = timezone.now()
+        lost = [job for job in jobs if not owned(job).update(locked_at=now)]
+        for job in lost:
+            self.finish(job)
+        return lost
+
+    def run(self):
+        try:
+            while not self.stopped.wait(settings.API_JOBS['HEARTBEAT']):
+                try:
+                    for job in self.beat():
+                        logger.warning('Job %s (%s) was requeued while claimed', job.pk, job.task)
+                except DatabaseError:
+                    logger.warning('Heartbeat of jobs %s failed', sorted(self.jobs), exc_info=True)
+        finally:
+            connection.close()
+
+
+def execute(job, heartbeat=None):
+    """
+    Run a claimed job, then delete it or record the failure; returns the
+    outcome. ``heartbeat`` is its batch's, otherwise it gets one of its own.
+    """
+    if heartbeat is None:
+        with Heartbeat([job]) as heartbeat:
+            return execute(job, heartbeat)
+    started = time.perf_counter()
+    try:
+        resolve(job.task)(*job.args, **job.kwargs)
+    except Exception:
+        heartbeat.finish(job)
+        outcome = fail(job, traceback.format_exc())
+        logger.warning('Job %s (%s) failed, %s', job.pk, job.task, outcome, exc_info=True)
+    else:
+        heartbeat.finish(job)
+        outcome = 'done' if owned(job).delete()[0] else 'lost'
+    if outcome == 'lost':
+        logger.warning('Job %s (%s) finished after another worker took it over', job.pk, job.task)
+    JOB_DURATION.labels(job.task).observe(time.perf_counter() - started)
+    JOBS.labels(job.task, outcome).inc()
+    return outcome
+
+
+def requeue_stale(now=None):
+    """Hand jobs without a heartbeat for ``TIMEOUT`` (their worker died) back to the queue"""
+    now = now or timezone.now()
+    stale = Job.objects.filter(status=Job.RUNNING, locked_at__lt=now - timedelta(seconds=settings.API_JOBS['TIMEOUT']))
+    error = 'Worker stopped responding'
+    dead = stale.filter(attempts__gte=F('max_attempts')).update(status=Job.DEAD, locked_by='', locked_at=None, last_error=error)
+    requeued = stale.update(status=Job.QUEUED, locked_by='', locked_at=None, last_error=error, run_at=now)
+    return requeued, dead
+
+
+def retry(queryset):
+    """Put dead (or waiting) jobs back in front of the queue with fresh attempts"""
+    return queryset.exclude(status=Job.RUNNING).update(
+        status=Job.QUEUED, attempts=0, run_at=timezone.now(), locked_by='', locked_at=None,
+    )
+
+
+def pending(now=None):
+    return Job.objects.filter(status=Job.QUEUED, run_at__lte=now or timezone.now()).exists()
+
+
+# Workers
+
+class Worker:
+    """Claims and runs jobs until stopped, or until the queue is empty with ``burst``"""
+
+    def __init__(self, name, batch_size=None, poll_interval=None):
+        config = settings.API_JOBS
+        self.name = name
+        self.batch_size = batch_size or config['BATCH_SIZE']
+        self.poll_interval = config['POLL_INTERVAL'] if poll_interval is None else poll_interval
+        self.stopping = threading.Event()
+        self.processed = 0
+
+    def stop(self, *args):
+        self.stopping.set()
+
+    def run(self, burst=False):
+        sweep_at = 0
+        while not self.stopping.is_set():
+            close_old_connections()
+            try:
+                if time.monotonic() >= sweep_at:
+                    requeue_stale()
+                    sweep_at = time.monotonic() + settings.API_JOBS['TIMEOUT'] / 10
+                jobs = claim(self.name, self.batch_size)
+            except DatabaseError:
+                # e.g. SQLite's "database is locked" under many writers
+                logger.warning('Worker %s could not claim jobs', self.name, exc_info=True)
+                jobs = []
+            if not jobs:
+                if burst and not pending():
+                    break
+                self.stopping.wait(self.poll_interval * random.uniform(0.5, 1))
+                continue
+            # A claimed batch is finished even when stopping, so nothing waits for the stale timeout
+            with Heartbeat(jobs) as heartbeat:
+                for job in jobs:
+                    # Taken over while it waited, after missed beats; the other worker runs it
+                    if heartbeat.held(job):
+                        execute(job, heartbeat)
+                        self.processed += 1
+        return self.processed
+
+    def run_alone(self, burst=False):
+        """``run`` on a thread or process of its own, which closes its connection when done"""
+        try:
+            return self.run(burst)
+        finally:
+            connection.close()
+
+
+def worker_name(index):
+    return f'{socket.gethostname()}:{os.getpid()}:{index}'
+
+
+def run_process(index, burst, batch_size, poll_interval, processed):
+    worker = Worker(worker_name(index), batch_size, poll_interval)
+    signal.signal(signal.SIGTERM, worker.stop)
+    # The parent turns Ctrl-C into SIGTERM for every child
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    count = worker.run_alone(burst)
+    with processed.get_lock():
+        processed.value += count
+
+
+def run_pool(concurrency=1, threads=False, burst=False, batch_size=None, poll_interval=None, log=None):
+    """Run ``concurrency`` workers as processes (or threads) until signalled; returns jobs processed"""
+    if concurrency == 1:
+        worker = Worker(worker_name(0), batch_size, poll_interval)
+        handlers = {sig: signal.signal(sig, worker.stop) for sig in (signal.SIGINT, signal.SIGTERM)}
+        try:
+            return worker.run(burst)
+        finally:
+            for sig, handler in handlers.items():
+                signal.signal(sig, handler)
+
+    if threads:
+        workers = [Worker(worker_name(index), batch_size, poll_interval) for index in range(concurrency)]
+        pool = [threading.Thread(target=worker.run_alone, args=(burst,), name=worker.name) for worker in workers]
+        stop = lambda *args: [worker.stop() for worker in workers]
+    else:
+        # Forked children must not share the parent's database connections
+        connections.close_all()
+        context = multiprocessing.get_context('fork')
+        processed = context.Value('q', 0)
+        pool = [
+            context.Process(target=run_process, args=(index, burst, batch_size, poll_interval, processed))
+            for index in range(concurrency)
+        ]
+        stop = lambda *args: [process.terminate() for process in pool if process.is_alive()]
+
+    handlers = {sig: signal.signal(sig, stop) for sig in (signal.SIGINT, signal.SIGTERM)}
+    try:
+        for member in pool:
+            member.start()
+        if log:
+            log(f'Started {concurrency} worker {"threads" if threads else "processes"}')
+        for member in pool:
+            member.join()
+    finally:
+        for sig, handler in handlers.items():
+            signal.signal(sig, handler)
+    return sum(worker.processed for worker in workers) if threads else processed.value
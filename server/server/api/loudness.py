@@ -0,0 +1,343 @@
+"""
+Loudness of episode audio, so players can normalise without analysing it.
+
+Each episode gets three measurements:
+- integrated loudness in LUFS (ITU-R BS.1770-4, as used by EBU R128);
+- true peak in dBTP;
+- the gain that brings it to API_LOUDNESS['TARGET_LUFS'] without pushing
+  true peaks past the ceiling.
+
+ffmpeg decodes the audio to float PCM; plain PCM WAV is read directly. The
+PCM is measured block by block, so memory stays flat however long the
+episode is:
+- K-weighting (shelf and high-pass) runs as one FIR, the filter's impulse
+  response cut where it has decayed below float precision. It is applied
+  by FFT overlap-add, with the tail of each block carried into the next.
+- Mean squares are kept per 100 ms step. The 400 ms gating blocks (75%
+  overlap) are sums of four steps, gated at -70 LUFS and then 10 LU below
+  the mean of what passed.
+- True peak is the largest sample after 4x polyphase oversampling (2x from
+  96 kHz), computed only around samples within 12 dB of the peak so far.
+
+``analyze`` runs in the worker pool and is queued when an episode is created;
+``manage.py analyze_loudness`` queues the episodes not measured yet.
+"""
+import json
+import logging
+import math
+import os
+import subprocess
+import wave
+
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from django.utils import timezone
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+from .hydrate import invalidate
+from .jobs import task
+from .models import Episode
+
+logger = logging.getLogger(__name__)
+
+# BS.1770 K-weighting stages as (centre Hz, gain dB, Q); these give the
+# standard's published 48 kHz coefficients and the same response at other rates
+SHELF = (1681.974450955533, 3.999843853973347, 0.7071752369554196)
+HIGH_PASS = (38.13547087602444, 0.5003270373238773)
+# Impulse response kept; the slowest pole has decayed below 1e-30 at 48 kHz
+TAPS = 2 ** 14
+STEP_SECONDS = 0.1
+STEPS_PER_BLOCK = 4
+ABSOLUTE_GATE = -70.0
+RELATIVE_GATE = -10.0
+PEAK_TAPS = 12  # Per oversampling phase
+# dB below the peak so far where oversampling starts; between quieter samples
+# only contrived signals rise that far
+PEAK_MARGIN = 12
+WAV_TYPES = {2: ('<i2', 2 ** 15), 4: ('<i4', 2 ** 31)}
+
+
+class AnalysisError(Exception):
+    pass
+
+
+def require_numpy():
+    if np is None:
+        raise ImproperlyConfigured('Loudness analysis needs numpy, see requirements.txt')
+
+
+# Filters
+
+def k_weighting(rate):
+    """``(b, a)`` of the two K-weighting biquads as one 4th order filter at ``rate``"""
+    centre, gain, q = SHELF
+    k = math.tan(math.pi * centre / rate)
+    high = 10 ** (gain / 20)
+    band = high ** 0.4996667741545416
+    norm = 1 + k / q + k * k
+    shelf_b = [(high + band * k / q + k * k) / norm, 2 * (k * k - high) / norm, (high - band * k / q + k * k) / norm]
+    shelf_a = [1.0, 2 * (k * k - 1) / norm, (1 - k / q + k * k) / norm]
+
+    centre, q = HIGH_PASS
+    k = math.tan(math.pi * centre / rate)
+    norm = 1 + k / q + k * k
+    pass_b = [1.0, -2.0, 1.0]
+    pass_a = [1.0, 2 * (k * k - 1) / norm, (1 - k / q + k * k) / norm]
+    return np.convolve(shelf_b, pass_b), np.convolve(shelf_a, pass_a)
+
+
+def impulse_response(b, a, taps=TAPS):
+    """The first ``taps`` samples of ``b / a``'s impulse response, from its frequency response"""
+    return np.fft.irfft(np.fft.rfft(b, taps) / np.fft.rfft(a, taps), taps)
+
+
+def oversampling_phases(factor):
+    """``(factor, PEAK_TAPS)`` polyphase interpolation filter, a Kaiser-windowed sinc"""
+    length = factor * PEAK_TAPS
+    offsets = np.arange(length) - (length - 1) / 2
+    prototype = np.sinc(offsets / factor) * np.kaiser(length, 5.0)
+    return prototype.reshape(PEAK_TAPS, factor).T
+
+
+def channel_weights(channels):
+    # ffmpeg's 5.0/5.1 order is L R C (LFE) Ls Rs; LFE doesn't count, surrounds weigh 1.41
+    if channels == 6:
+        return np.array([1.0, 1.0, 1.0, 0.0, 1.41, 1.41])
+    if channels == 5:
+        return np.array([1.0, 1.0, 1.0, 1.41, 1.41])
+    return np.ones(channels)
+
+
+class Meter:
+    """Streaming BS.1770 meter; ``feed`` float blocks shaped ``(channels, frames)``, then read ``result``"""
+
+    def __init__(self, rate, channels):
+        require_numpy()
+        self.rate, self.channels = rate, channels
+        self.weights = channel_weights(channels)
+        self.response = impulse_response(*k_weighting(rate))
+        self.spectra = {}
+        self.tail = np.zeros((channels, TAPS - 1))
+        self.hop = round(rate * STEP_SECONDS)
+        self.partial = np.zeros(0)
+        self.steps = []
+        self.frames = 0
+
+        self.factor = 4 if rate < 96000 else 2 if rate < 192000 else 1
+        self.phases = oversampling_phases(self.factor) if self.factor > 1 else None
+        # (PEAK_TAPS, factor), for windows of samples in time order
+        self.reversed_phases = np.ascontiguousarray(self.phases[:, ::-1].T) if self.phases is not None else None
+        self.history = np.zeros((channels, PEAK_TAPS - 1))
+        self.peak = 0.0
+
+    def feed(self, block):
+        block = np.asarray(block, dtype=np.float64)
+        if block.ndim == 1:
+            block = block[np.newaxis]
+        if block.shape[1]:
+            self.frames += block.shape[1]
+            self.add_energy(self.filter(block))
+            self.add_peak(block)
+
+    def filter(self, block):
+        """K-weighted ``block``, by overlap-add against the carried tail"""
+        frames = block.shape[1]
+        size = 1 << (frames + TAPS - 2).bit_length()
+        if size not in self.spectra:
+            self.spectra[size] = np.fft.rfft(self.response, size)
+        weighted = np.fft.irfft(np.fft.rfft(block, size, axis=1) * self.spectra[size], size, axis=1)
+        weighted = weighted[:, :frames + TAPS - 1]
+        weighted[:, :TAPS - 1] += self.tail
+        self.tail = weighted[:, frames:].copy()
+        return weighted[:, :frames]
+
+    def add_energy(self, weighted):
+        squares = np.concatenate([self.partial, self.weights @ (weighted * weighted)])
+        whole = len(squares) // self.hop * self.hop
+        if whole:
+            self.steps.append(squares[:whole].reshape(-1, self.hop).sum(axis=1))
+        self.partial = squares[whole:]
+
+    def add_peak(self, block):
+        """Sample peak, then oversampled wherever the audio comes within PEAK_MARGIN of it"""
+        self.peak = max(self.peak, float(np.abs(block).max()))
+        padded = np.concatenate([self.history, block], axis=1)
+        self.history = padded[:, -(PEAK_TAPS - 1):]
+        if self.phases is None or not self.peak:
+            return
+        # Output j interpolates between padded samples j + 5 and j + 6
+        frames, middle = block.shape[1], PEAK_TAPS // 2
+        level = np.abs(padded).max(axis=0)
+        near = np.maximum(level[middle - 1:middle - 1 + frames], level[middle:middle + frames])
+        positions = np.flatnonzero(near >= self.peak * 10 ** (-PEAK_MARGIN / 20))
+        if not positions.size:
+            return
+        if positions.size > frames // 3:
+            # Dense, as in heavily compressed audio: gathering costs more than doing every sample
+            windows = np.lib.stride_tricks.sliding_window_view(padded, PEAK_TAPS, axis=1)
+        else:
+            windows = padded[:, positions[:, np.newaxis] + np.arange(PEAK_TAPS)]
+        self.peak = max(self.peak, float(np.abs(windows @ self.reversed_phases).max()))
+
+    def integrated(self):
+        """Gated loudness in LUFS, None for silence or under one gating block"""
+        steps = np.concatenate(self.steps) if self.steps else np.zeros(0)
+        if len(steps) < STEPS_PER_BLOCK:
+            return None
+        running = np.concatenate([[0.0], np.cumsum(steps)])
+        blocks = (running[STEPS_PER_BLOCK:] - running[:-STEPS_PER_BLOCK]) / (STEPS_PER_BLOCK * self.hop)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            levels = -0.691 + 10 * np.log10(blocks)
+        audible = levels > ABSOLUTE_GATE
+        if not audible.any():
+            return None
+        relative = -0.691 + 10 * math.log10(blocks[audible].mean()) + RELATIVE_GATE
+        gated = blocks[audible & (levels > relative)]
+        return -0.691 + 10 * math.log10(gated.mean())
+
+    def true_peak(self):
+        return 20 * math.log10(self.peak) if self.peak > 0 else None
+
+    def result(self):
+        loudness, true_peak = self.integrated(), self.true_peak()
+        return {
+            'loudness': loudness,
+            'true_peak': true_peak,
+            'gain': recommended_gain(loudness, true_peak),
+            'seconds': self.frames / self.rate,
+        }
+
+
+def recommended_gain(loudness, true_peak):
+    """dB towards TARGET_LUFS, less if the true peak would pass PEAK_CEILING"""
+    if loudness is None:
+        return None
+    config = settings.API_LOUDNESS
+    gain = config['TARGET_LUFS'] - loudness
+    if true_peak is not None:
+        gain = min(gain, config['PEAK_CEILING'] - true_peak)
+    return round(gain, 2)
+
+
+# Decoding
+
+def wav_blocks(path, seconds):
+    """``(rate, channels, blocks)`` of a 16 or 32-bit PCM WAV, read without ffmpeg"""
+    audio = wave.open(path, 'rb')
+    try:
+        dtype, scale = WAV_TYPES[audio.getsampwidth()]
+    except KeyError:
+        audio.close()
+        raise wave.Error(f'{audio.getsampwidth() * 8}-bit WAV')
+    rate, channels = audio.getframerate(), audio.getnchannels()
+
+    def blocks():
+        with audio:
+            while data := audio.readframes(int(rate * seconds)):
+                yield np.frombuffer(data, dtype).reshape(-1, channels).T / scale
+    return rate, channels, blocks()
+
+
+def probe(source):
+    """``(rate, channels)`` of the first audio stream"""
+    config = settings.API_LOUDNESS
+    command = [
+        config['FFPROBE'], '-v', 'error', '-select_streams', 'a:0',
+        '-show_entries', 'stream=sample_rate,channels', '-of', 'json', source,
+    ]
+    try:
+        output = subprocess.run(command, capture_output=True, check=True, timeout=config['PROBE_TIMEOUT']).stdout
+        stream = json.loads(output)['streams'][0]
+        return int(stream['sample_rate']), int(stream['channels'])
+    except FileNotFoundError:
+        raise ImproperlyConfigured(f'{config["FFPROBE"]} not found, loudness analysis needs ffmpeg')
+    except subprocess.CalledProcessError as exc:
+        raise AnalysisError(exc.stderr.decode(errors='replace').strip() or 'ffprobe failed')
+    except (KeyError, IndexError, ValueError, subprocess.TimeoutExpired):
+        raise AnalysisError(f'No audio stream found in {source}')
+
+
+def ffmpeg_blocks(source, seconds, rate=None, channels=None):
+    """
+    ``(rate, channels, blocks)`` of anything ffmpeg decodes, resampled and
+    mixed to ``rate`` and ``channels`` when given, as it comes otherwise
+    """
+    if rate is None or channels is None:
+        native = probe(source)
+        rate, channels = rate or native[0], channels or native[1]
+    command = [
+        settings.API_LOUDNESS['FFMPEG'], '-nostdin', '-v', 'error', '-i', source,
+        '-map', '0:a:0', '-f', 'f32le', '-acodec', 'pcm_f32le', '-ar', str(rate), '-ac', str(channels), 'pipe:1',
+    ]
+    size = int(rate * seconds) * channels * 4
+
+    def blocks():
+        process = subprocess.Popen(command, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+        try:
+            while data := process.stdout.read(size):
+                whole = len(data) // (channels * 4) * channels * 4
+                yield np.frombuffer(data[:whole], '<f4').reshape(-1, channels).T
+            if process.wait() != 0:
+                raise AnalysisError(process.stderr.read().decode(errors='replace').strip() or 'ffmpeg failed')
+        finally:
+            if process.poll() is None:
+                process.kill()
+            process.wait()
+    return rate, channels, blocks()
+
+
+def pcm_blocks(source, seconds, rate=None, channels=None):
+    """Decoded blocks of ``source``; ``rate`` and ``channels`` are what ffmpeg should convert to, WAV is read as is"""
+    if source.lower().endswith('.wav'):
+        try:
+            return wav_blocks(source, seconds)
+        except (wave.Error, EOFError):
+            pass  # Compressed or unusual WAV, ffmpeg handles those
+    return ffmpeg_blocks(source, seconds, rate, channels)
+
+
+def measure(source):
+    """``{'loudness', 'true_peak', 'gain', 'seconds'}`` of the audio at ``source``, a path or URL"""
+    require_numpy()
+    rate, channels, blocks = pcm_blocks(source, settings.API_LOUDNESS['BLOCK_SECONDS'])
+    meter = Meter(rate, channels)
+    for block in blocks:
+        meter.feed(block)
+    return meter.result()
+
+
+def source(episode):
+    """A local path when the storage has the file, the audio URL otherwise"""
+    try:
+        path = episode.audio_file.path
+    except NotImplementedError:
+        path = None
+    return path if path and os.path.exists(path) else episode.audio_file_url
+
+
+# Jobs
+
+# Behind everything a page waits on; a long episode takes a while
+@task(priority=-20)
+def analyze(episode_id):
+    episode = Episode.objects.filter(pk=episode_id).first()
+    if episode is None or not episode.audio_file:
+        return
+    result = measure(source(episode))
+    Episode.all_objects.filter(pk=episode_id).update(
+        loudness_lufs=result['loudness'], true_peak_dbtp=result['true_peak'], gain_db=result['gain'],
+        loudness_measured_at=timezone.now(),
+    )
+    # update() sends no post_save
+    invalidate(Episode, [episode_id])
+    logger.info('Episode %s: %s LUFS, %s dBTP over %.0fs', episode_id, result['loudness'], result['true_peak'], result['seconds'])
+
+
+def episode_saved(sender, instance, created, **kwargs):
+    """post_save receiver: measure new uploads"""
+    if created and instance.audio_file:
+        analyze.delay(instance.pk)
@@ -0,0 +1,25 @@
+from django.core.management.base import BaseCommand
+
+from api.loudness import analyze
+from api.models import Episode
+
+
+class Command(BaseCommand):
+    help = 'Queue loudness analysis for episodes not measured yet, or measure them here with --now'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--all', action='store_true', help='Measure episodes again even if they have been')
+        parser.add_argument('--now', action='store_true', help='Measure in this process instead of queueing jobs')
+        parser.add_argument('--limit', type=int)
+
+    def handle(self, *args, **options):
+        episodes = Episode.objects.exclude(audio_file='').order_by('pk')
+        if not options['all']:
+            episodes = episodes.filter(loudness_measured_at__isnull=True)
+        ids = list(episodes.values_list('pk', flat=True)[:options['limit']])
+        for pk in ids:
+            if options['now']:
+                analyze(pk)
+            else:
+                analyze.delay(pk)
+        self.stdout.write(f'{"Measured" if options["now"] else "Queued"} {len(ids)} episodes')
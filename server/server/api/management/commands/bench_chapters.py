@@ -0,0 +1,92 @@
+import multiprocessing
+import os
+import tempfile
+import time
+import wave
+from concurrent.futures import ProcessPoolExecutor
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from api.chapters import detect_one, unpack
+from api.loudness import np
+
+
+class Command(BaseCommand):
+    help = 'Time chapter detection over synthetic episodes in a process pool, in hours of audio per CPU-minute'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--episodes', type=int, default=16)
+        parser.add_argument('--minutes', type=float, default=30)
+        parser.add_argument('--processes', type=int, nargs='+', default=[1, os.cpu_count()])
+        parser.add_argument('--seed', type=int, default=42)
+
+    def handle(self, *args, **options):
+        if np is None:
+            raise CommandError('numpy is not installed')
+        rng = np.random.default_rng(options['seed'])
+        rate = settings.API_CHAPTERS['RATE']
+        with tempfile.TemporaryDirectory() as directory:
+            items, planted = [], {}
+            for number in range(options['episodes']):
+                path = os.path.join(directory, f'episode-{number}.wav')
+                planted[number] = self.write(path, rng, rate, options['minutes'] * 60)
+                items.append((number, path))
+            hours = options['episodes'] * options['minutes'] / 60
+            self.stdout.write(f'{options["episodes"]} episodes, {hours:.1f} hours at {rate} Hz, mono WAV')
+
+            for processes in options['processes']:
+                started = time.perf_counter()
+                with ProcessPoolExecutor(processes, mp_context=multiprocessing.get_context('fork')) as pool:
+                    results = list(pool.map(detect_one, items))
+                elapsed = time.perf_counter() - started
+                cpu_minutes = sum(result[3] for result in results) / 60
+                found = {episode_id: [start / 1000 for start, _ in unpack(markers)[1:]]
+                         for episode_id, markers, *_ in results}
+                hits = sum(any(abs(at - other) <= 3 for other in found[number])
+                           for number, times in planted.items() for at in times)
+                extra = sum(len(times) for times in found.values()) - hits
+                self.stdout.write(
+                    f'{processes:>3} processes  {elapsed:>6.1f}s wall  {hours / cpu_minutes:>6.1f} hours per CPU-minute'
+                    f'  {hours * 3600 / elapsed:>7.0f}x real time'
+                    f'  found {hits}/{sum(map(len, planted.values()))} planted boundaries, {extra} others'
+                )
+
+    def write(self, path, rng, rate, seconds):
+        """Speech-like noise broken by pauses, music beds and long silences; returns where the breaks are"""
+        breaks, at, parts = [], 0.0, []
+        while True:
+            length = min(rng.uniform(120, 600), seconds - at)
+            parts.append(self.speech(rng, rate, length))
+            at += length
+            if seconds - at < 120:
+                break
+            if rng.random() < 0.5:
+                length = rng.uniform(2.5, 4)
+                parts.append(rng.standard_normal(int(rate * length)) * 1e-4)
+                breaks.append(at + length / 2)
+            else:
+                length = rng.uniform(30, 90)
+                parts.append(self.music(rng, rate, length))
+                breaks += [at, at + length]
+            at += length
+        with wave.open(path, 'wb') as audio:
+            audio.setnchannels(1)
+            audio.setsampwidth(2)
+            audio.setframerate(rate)
+            audio.writeframes((np.clip(np.concatenate(parts), -1, 1 - 2 ** -15) * 2 ** 15).astype('<i2').tobytes())
+        return breaks
+
+    def speech(self, rng, rate, seconds):
+        frames = int(rate * seconds)
+        noise = np.convolve(rng.standard_normal(frames), np.ones(8) / 8, 'same') * 0.3
+        envelope = np.abs(np.sin(np.arange(frames) * (2 * np.pi * 3 / rate)))
+        # Breaths and pauses between phrases, a third of a second to a second
+        step = rate // 3
+        pauses = np.repeat(rng.random(frames // step + 1) > 0.1, step)[:frames]
+        return noise * envelope * pauses
+
+    def music(self, rng, rate, seconds):
+        t = np.arange(int(rate * seconds)) / rate
+        notes = rng.choice([220, 330, 440, 660, 880], size=3)
+        return sum(0.15 * np.sin(2 * np.pi * note * t) for note in notes) + 0.01 * rng.standard_normal(len(t))
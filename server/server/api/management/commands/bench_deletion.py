@@ -0,0 +1,74 @@
+import tempfile
+import time
+from pathlib import Path
+
+from django.contrib.auth.models import User
+from django.core.files.storage import FileSystemStorage
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from api.deletion import purge_podcast
+from api.models import Category, Podcast, Episode, Playlist, Subscription
+
+
+class Command(BaseCommand):
+    help = 'Time deleting a large podcast: synchronous cascade vs mark_deleted() + batched purge'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--episodes', type=int, default=10000)
+        parser.add_argument('--subscribers', type=int, default=2000)
+        parser.add_argument('--playlists', type=int, default=500)
+        parser.add_argument('--batch-size', type=int, default=500)
+
+    def handle(self, *args, **options):
+        # Storage is a scratch directory so the numbers include real file deletes
+        with tempfile.TemporaryDirectory() as media_root, transaction.atomic():
+            storage = FileSystemStorage(location=media_root)
+
+            podcast = self.seed(options, Path(media_root), 'cascade')
+            started = time.perf_counter()
+            Podcast.all_objects.get(pk=podcast.pk).delete()
+            self.stdout.write(f'{"synchronous cascade delete":<32} {time.perf_counter() - started:>8.2f}s  (blobs left behind)')
+
+            podcast = self.seed(options, Path(media_root), 'deferred')
+            started = time.perf_counter()
+            podcast.mark_deleted()
+            self.stdout.write(f'{"mark_deleted (request path)":<32} {(time.perf_counter() - started) * 1000:>8.1f}ms')
+
+            started = time.perf_counter()
+            stats = purge_podcast(podcast.pk, options['batch_size'], audio_storage=storage, image_storage=storage)
+            elapsed = time.perf_counter() - started
+            self.stdout.write(
+                f'{"background purge":<32} {elapsed:>8.2f}s  '
+                f'({stats["episodes"] / elapsed:,.0f} episodes/s, {len(list(Path(media_root).glob("episodes/deferred-*")))} blobs left)'
+            )
+            transaction.set_rollback(True)
+
+    def seed(self, options, media_root, label):
+        user = User.objects.create_user(f'bench-deletion-{label}')
+        category = Category.objects.create(name=f'Benchmark {label}')
+        podcast = Podcast.objects.create(title=f'Deletion benchmark {label}', description='', category=category, creator=user)
+
+        (media_root / 'episodes').mkdir(exist_ok=True)
+        names = [f'episodes/{label}-{i}.mp3' for i in range(options['episodes'])]
+        for name in names:
+            (media_root / name).touch()
+        episodes = Episode.objects.bulk_create([
+            Episode(title=f'Episode {i}', description='', audio_file=name, podcast=podcast, duration=30)
+            for i, name in enumerate(names)
+        ], batch_size=1000)
+
+        listeners = User.objects.bulk_create([
+            User(username=f'bench-deletion-{label}-{i}') for i in range(max(options['subscribers'], options['playlists']))
+        ], batch_size=1000)
+        Subscription.objects.bulk_create([
+            Subscription(user=listener, podcast=podcast) for listener in listeners[:options['subscribers']]
+        ], batch_size=1000)
+        playlists = Playlist.objects.bulk_create([
+            Playlist(name=f'Playlist {i}', user=listener) for i, listener in enumerate(listeners[:options['playlists']])
+        ], batch_size=1000)
+        Playlist.episodes.through.objects.bulk_create([
+            Playlist.episodes.through(playlist_id=playlist.pk, episode_id=episodes[(i * 7 + n) % len(episodes)].pk)
+            for i, playlist in enumerate(playlists) for n in range(10)
+        ], batch_size=1000, ignore_conflicts=True)
+        return podcast
@@ -0,0 +1,101 @@
+import asyncio
+import logging
+import resource
+import time
+import tracemalloc
+
+from django.core.asgi import get_asgi_application
+from django.core.management.base import BaseCommand, CommandError
+from rest_framework_simplejwt.tokens import RefreshToken
+
+from api.events import get_broker, hub
+from api.models import Subscription
+
+
+def rss_bytes():
+    with open('/proc/self/statm') as fh:
+        return int(fh.read().split()[1]) * resource.getpagesize()
+
+
+class Connection:
+    """One /api/events/ stream driven straight through the ASGI app"""
+
+    def __init__(self, app, query):
+        self.app = app
+        self.query = query
+        self.opened = asyncio.Event()
+        self.received = asyncio.Event()
+        self.disconnect = asyncio.Event()
+        self.started = False
+
+    async def receive(self):
+        if not self.started:
+            self.started = True
+            return {'type': 'http.request', 'body': b'', 'more_body': False}
+        await self.disconnect.wait()
+        return {'type': 'http.disconnect'}
+
+    async def send(self, message):
+        if message['type'] != 'http.response.body' or not message.get('body'):
+            return
+        if message['body'].startswith(b'retry:'):
+            self.opened.set()
+        elif not message['body'].startswith(b':'):
+            self.received.set()
+
+    async def run(self):
+        scope = {
+            'type': 'http', 'asgi': {'version': '3.0'}, 'http_version': '1.1', 'method': 'GET',
+            'scheme': 'http', 'path': '/api/events/', 'raw_path': b'/api/events/', 'root_path': '',
+            'query_string': self.query.encode(), 'headers': [(b'host', b'localhost')],
+            'client': ('127.0.0.1', 0), 'server': ('localhost', 80),
+        }
+        await self.app(scope, self.receive, self.send)
+
+
+class Command(BaseCommand):
+    help = 'Hold many idle /api/events/ streams in one worker and report memory per stream and fan-out time'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--connections', type=int, default=2000)
+        parser.add_argument('--batch', type=int, default=200, help='Streams opened concurrently')
+
+    def handle(self, *args, **options):
+        subscription = Subscription.objects.select_related('user').order_by('pk').first()
+        if subscription is None:
+            raise CommandError('No subscriptions found, run generate_dataset first')
+        token = str(RefreshToken.for_user(subscription.user).access_token)
+        # Every open is slow while the batch queues on the sync thread, don't log each one
+        logging.getLogger('api.performance').setLevel(logging.ERROR)
+        asyncio.run(self.run(get_asgi_application(), f'token={token}', subscription, options))
+
+    async def run(self, app, query, subscription, options):
+        tracemalloc.start()
+        heap_before, rss_before = tracemalloc.get_traced_memory()[0], rss_bytes()
+
+        connections, tasks = [], []
+        started = time.perf_counter()
+        for start in range(0, options['connections'], options['batch']):
+            batch = [Connection(app, query) for _ in range(min(options['batch'], options['connections'] - start))]
+            tasks += [asyncio.create_task(connection.run()) for connection in batch]
+            await asyncio.gather(*(connection.opened.wait() for connection in batch))
+            connections += batch
+        opened = time.perf_counter() - started
+
+        count = len(connections)
+        heap, rss = tracemalloc.get_traced_memory()[0] - heap_before, rss_bytes() - rss_before
+        self.stdout.write(f'{count} idle streams opened in {opened:.2f}s ({count / opened:,.0f}/s)')
+        self.stdout.write(f'python heap {heap / count / 1024:>8.1f} KiB/stream   rss {rss / count / 1024:>8.1f} KiB/stream')
+        self.stdout.write(f'{len(hub.topics)} topics in the hub')
+
+        # One event on a topic every stream listens on
+        started = time.perf_counter()
+        get_broker().publish(f'podcast:{subscription.podcast_id}', {'type': 'episode.published', 'podcast': subscription.podcast_id})
+        await asyncio.gather(*(connection.received.wait() for connection in connections))
+        self.stdout.write(f'fan-out to {count} streams  {(time.perf_counter() - started) * 1000:>8.1f} ms')
+
+        for connection in connections:
+            connection.disconnect.set()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        tracemalloc.stop()
+        self.stdout.write(f'{len(hub.topics)} topics left after disconnecting')
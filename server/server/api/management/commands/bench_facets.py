@@ -0,0 +1,102 @@
+import random
+import statistics
+import time
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.test.utils import CaptureQueriesContext
+
+from api.facets import count, facets
+from api.models import Category, Podcast
+
+from .generate_dataset import WORDS, zipf_cum_weights
+
+
+class Rollback(Exception):
+    pass
+
+
+class Command(BaseCommand):
+    help = 'Time facet counts (grouped aggregate, cached) against one count query per facet value'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--podcasts', type=int, default=100_000, help='Synthetic podcasts added for the run')
+        parser.add_argument('--creators', type=int, default=2000)
+        parser.add_argument('--rounds', type=int, default=5)
+        parser.add_argument('--seed', type=int, default=42)
+
+    def handle(self, *args, **options):
+        rng = random.Random(options['seed'])
+        categories = list(Category.objects.values_list('pk', flat=True))
+        if not categories:
+            raise CommandError('No categories, run generate_dataset first')
+
+        # Everything below is rolled back, the catalog is left as it was
+        try:
+            with transaction.atomic():
+                self.populate(rng, categories, options)
+                self.stdout.write(f'{Podcast.objects.count():,} podcasts, {len(categories)} categories')
+                creator = Podcast.objects.values_list('creator_id', flat=True).first()
+                cases = {
+                    'unfiltered': {},
+                    'category': {'category': categories[0]},
+                    'search': {'search': 'news'},
+                    'search + creator': {'search': 'news', 'creator': creator},
+                }
+                for label, filters in cases.items():
+                    self.report(f'{label}, one count per value', lambda: self.per_value(filters), options['rounds'])
+                    self.report(f'{label}, grouped', lambda: count(filters), options['rounds'])
+                    facets(filters)
+                    self.report(f'{label}, cached', lambda: facets(filters), options['rounds'])
+                raise Rollback
+        except Rollback:
+            pass
+        finally:
+            cache.clear()
+
+    def populate(self, rng, categories, options):
+        started = time.perf_counter()
+        creators = User.objects.bulk_create([
+            User(username=f'bench-facets-{i}', password='!') for i in range(options['creators'])
+        ])
+        creator_weights = zipf_cum_weights(len(creators), 1.1)
+        category_weights = zipf_cum_weights(len(categories), 0.8)
+        batch = 5000
+        for offset in range(0, options['podcasts'], batch):
+            size = min(batch, options['podcasts'] - offset)
+            picked = rng.choices(creators, cum_weights=creator_weights, k=size)
+            in_categories = rng.choices(categories, cum_weights=category_weights, k=size)
+            Podcast.objects.bulk_create([
+                Podcast(title=' '.join(rng.choice(WORDS) for _ in range(3)).title(), description='...',
+                        category_id=in_categories[i], creator=picked[i])
+                for i in range(size)
+            ])
+        self.stdout.write(f'Added {options["podcasts"]:,} podcasts in {time.perf_counter() - started:.1f}s')
+
+    def per_value(self, filters):
+        """What the UI did without facets: a count per category and per listed creator"""
+        queryset = Podcast.objects.all()
+        if filters.get('search'):
+            queryset = queryset.filter(title__icontains=filters['search'])
+        by_creator = queryset.filter(creator_id=filters['creator']) if 'creator' in filters else queryset
+        by_category = queryset.filter(category_id=filters['category']) if 'category' in filters else queryset
+        for pk in Category.objects.values_list('pk', flat=True):
+            by_creator.filter(category_id=pk).count()
+        top = User.objects.order_by('pk').values_list('pk', flat=True)[:settings.API_FACETS['CREATORS']]
+        for pk in top:
+            by_category.filter(creator_id=pk).count()
+
+    def report(self, label, run, rounds):
+        timings = []
+        with CaptureQueriesContext(connection) as queries:
+            for _ in range(rounds):
+                started = time.perf_counter()
+                run()
+                timings.append((time.perf_counter() - started) * 1000)
+        self.stdout.write(
+            f'{label:<40} p50 {statistics.median(timings):>8.1f} ms  max {max(timings):>8.1f} ms'
+            f'  {len(queries) // rounds:>3} queries'
+        )
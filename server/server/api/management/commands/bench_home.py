@@ -0,0 +1,69 @@
+import statistics
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.core.management.base import BaseCommand, CommandError
+from django.test import Client, override_settings
+from rest_framework_simplejwt.tokens import RefreshToken
+
+# What the home page fetched before /api/home/, in the order it asked
+FAN_OUT = ['/api/trending/', '/api/episodes/recent/', '/api/categories/', '/api/subscriptions/', '/api/stats/']
+
+
+class Command(BaseCommand):
+    help = 'Compare time-to-render of the home page: separate section requests against one /api/home/ call'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rounds', type=int, default=30)
+        parser.add_argument('--username', help='Viewer to sign in as (defaults to one with subscriptions)')
+
+    def handle(self, *args, **options):
+        if options['username']:
+            user = User.objects.filter(username=options['username']).first()
+        else:
+            user = User.objects.filter(subscription__isnull=False).order_by('pk').first()
+        if user is None:
+            raise CommandError('No viewer found, run generate_dataset first')
+        token = str(RefreshToken.for_user(user).access_token)
+        headers = {'Authorization': f'Bearer {token}'}
+
+        throttling = {**settings.API_THROTTLING, 'ENABLED': False}
+        with override_settings(API_THROTTLING=throttling), ThreadPoolExecutor(len(FAN_OUT)) as browser:
+            clients = [Client(SERVER_NAME='localhost') for _ in FAN_OUT]
+
+            def fan_out():
+                # A browser sends these side by side; the page renders once the slowest is back
+                list(browser.map(lambda pair: self.get(pair[0], pair[1], headers), zip(clients, FAN_OUT)))
+
+            def composite(cold):
+                if cold:
+                    cache.clear()
+                self.get(clients[0], '/api/home/', headers)
+
+            self.report('separate requests, in parallel', fan_out, options['rounds'])
+            self.report('separate requests, one by one',
+                        lambda: [self.get(clients[0], path, headers) for path in FAN_OUT], options['rounds'])
+            self.report('/api/home/, cold cache', lambda: composite(True), options['rounds'])
+            self.report('/api/home/, warm cache', lambda: composite(False), options['rounds'])
+        cache.clear()
+
+    def get(self, client, path, headers):
+        response = client.get(path, headers=headers)
+        if response.status_code != 200:
+            raise CommandError(f'{path} returned {response.status_code}')
+        return response
+
+    def report(self, label, render, rounds):
+        render()  # Connections and first-import costs stay out of the numbers
+        timings = []
+        for _ in range(rounds):
+            started = time.perf_counter()
+            render()
+            timings.append((time.perf_counter() - started) * 1000)
+        timings.sort()
+        self.stdout.write(
+            f'{label:<32} p50 {statistics.median(timings):>7.1f} ms  p95 {timings[int(len(timings) * .95) - 1]:>7.1f} ms'
+        )
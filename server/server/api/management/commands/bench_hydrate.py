@@ -0,0 +1,55 @@
+import random
+import time
+
+from django.core.cache import cache
+from django.core.management.base import BaseCommand, CommandError
+from django.test import Client
+
+from api.management.commands.bench_routes import QUERIES_RE
+from api.models import Podcast, Episode
+
+
+class Command(BaseCommand):
+    help = 'Compare loading a page of episodes/podcasts one detail call at a time against one batch call'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--ids', type=int, default=50, help='Objects per simulated page')
+        parser.add_argument('--rounds', type=int, default=5)
+        parser.add_argument('--seed', type=int, default=42)
+
+    def handle(self, *args, **options):
+        rng = random.Random(options['seed'])
+        client = Client(SERVER_NAME='localhost')
+        for model, path in ((Episode, '/api/episodes/'), (Podcast, '/api/podcasts/')):
+            pool = list(model.objects.order_by('?').values_list('pk', flat=True)[:options['ids'] * options['rounds']])
+            if len(pool) < options['ids']:
+                raise CommandError(f'Not enough {model._meta.verbose_name_plural}, run generate_dataset first')
+
+            results = {'per item': [], 'batch, cold cache': [], 'batch, warm cache': []}
+            for _ in range(options['rounds']):
+                ids = rng.sample(pool, options['ids'])
+                results['per item'].append(self.run(client, [f'{path}{pk}/' for pk in ids]))
+                cache.clear()
+                batch = [f'{path}batch/?ids={",".join(map(str, ids))}']
+                results['batch, cold cache'].append(self.run(client, batch))
+                results['batch, warm cache'].append(self.run(client, batch))
+
+            self.stdout.write(f'{model._meta.verbose_name_plural}, {options["ids"]} per page')
+            for label, runs in results.items():
+                count = len(runs)
+                self.stdout.write(
+                    f'  {label:<20} {runs[0][0]:>4} round-trips  {sum(r[1] for r in runs) / count:>8.1f} ms'
+                    f'  {sum(r[2] for r in runs) / count:>6.1f} queries'
+                )
+
+    def run(self, client, urls):
+        """``(round-trips, ms, queries)`` for fetching ``urls`` one after another"""
+        queries = 0
+        started = time.perf_counter()
+        for url in urls:
+            response = client.get(url)
+            if response.status_code != 200:
+                raise CommandError(f'{url} returned {response.status_code}')
+            match = QUERIES_RE.search(response.headers.get('Server-Timing', ''))
+            queries += int(match.group(1)) if match else 0
+        return len(urls), (time.perf_counter() - started) * 1000, queries
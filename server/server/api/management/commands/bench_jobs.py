@@ -0,0 +1,42 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from api.jobs import run_pool, task
+from api.models import Job
+
+
+@task
+def bench_job(work_ms=0):
+    if work_ms:
+        time.sleep(work_ms / 1000)
+
+
+class Command(BaseCommand):
+    help = 'Measure job queue throughput in jobs/s for a range of worker counts'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--jobs', type=int, default=2000)
+        parser.add_argument('--concurrency', default='1,2,4,8', help='Comma-separated worker counts')
+        parser.add_argument('--threads', action='store_true', help='Thread workers instead of processes')
+        parser.add_argument('--work-ms', type=float, default=0, help='Simulated work per job (sleep)')
+        parser.add_argument('--batch-size', type=int, default=1)
+
+    def handle(self, *args, **options):
+        Job.objects.filter(task=bench_job.name).delete()
+        try:
+            for concurrency in [int(value) for value in options['concurrency'].split(',')]:
+                Job.objects.bulk_create([
+                    Job(task=bench_job.name, kwargs={'work_ms': options['work_ms']}) for _ in range(options['jobs'])
+                ], batch_size=1000)
+                started = time.perf_counter()
+                processed = run_pool(
+                    concurrency, options['threads'], burst=True, batch_size=options['batch_size'], poll_interval=0.05,
+                )
+                elapsed = time.perf_counter() - started
+                self.stdout.write(
+                    f'{concurrency:>3} {"threads" if options["threads"] else "processes":<9} {processed:>7} jobs'
+                    f'  {elapsed:>7.2f}s  {processed / elapsed:>8.0f} jobs/s'
+                )
+        finally:
+            Job.objects.filter(task=bench_job.name).delete()
@@ -0,0 +1,73 @@
+import os
+import statistics
+import tempfile
+import time
+import wave
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from api.loudness import Meter, measure, np
+
+
+class Command(BaseCommand):
+    help = 'Time loudness analysis as a multiple of real time, on synthetic speech-like audio and optionally a file'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--minutes', type=float, default=30)
+        parser.add_argument('--rate', type=int, default=44100)
+        parser.add_argument('--channels', type=int, default=2)
+        parser.add_argument('--rounds', type=int, default=3)
+        parser.add_argument('--file', help='Also measure this file, decoded by ffmpeg')
+
+    def handle(self, *args, **options):
+        if np is None:
+            raise CommandError('numpy is not installed')
+        rate, channels = options['rate'], options['channels']
+        seconds = options['minutes'] * 60
+        rng = np.random.default_rng(42)
+        block = int(rate * settings.API_LOUDNESS['BLOCK_SECONDS'])
+        blocks = [self.speech(rng, rate, channels, min(block, int(rate * seconds) - start))
+                  for start in range(0, int(rate * seconds), block)]
+        self.stdout.write(f'{options["minutes"]:.0f} min, {rate} Hz, {channels} channels, {len(blocks)} blocks')
+
+        def meter_only():
+            meter = Meter(rate, channels)
+            for pcm in blocks:
+                meter.feed(pcm)
+            return meter.result()
+        self.report('meter, PCM in memory', meter_only, seconds, options['rounds'])
+
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'bench.wav')
+            with wave.open(path, 'wb') as audio:
+                audio.setnchannels(channels)
+                audio.setsampwidth(2)
+                audio.setframerate(rate)
+                for pcm in blocks:
+                    audio.writeframes((np.clip(pcm, -1, 1 - 2 ** -15).T * 2 ** 15).astype('<i2').tobytes())
+            self.report('WAV read + meter', lambda: measure(path), seconds, options['rounds'])
+
+        if options['file']:
+            result = measure(options['file'])
+            self.report(f'ffmpeg decode + meter ({os.path.basename(options["file"])})',
+                        lambda: measure(options['file']), result['seconds'], options['rounds'])
+
+    def speech(self, rng, rate, channels, frames):
+        """Noise shaped into syllables and pauses, loud enough to land near -20 LUFS"""
+        noise = rng.standard_normal((channels, frames)) * 0.1
+        envelope = np.abs(np.sin(np.arange(frames) * (2 * np.pi * 4 / rate)))
+        pauses = np.repeat(rng.random(frames // rate + 1) > 0.2, rate)[:frames]
+        return noise * envelope * pauses
+
+    def report(self, label, run, seconds, rounds):
+        timings = []
+        for _ in range(rounds):
+            started = time.perf_counter()
+            result = run()
+            timings.append(time.perf_counter() - started)
+        elapsed = statistics.median(timings)
+        self.stdout.write(
+            f'{label:<44} {elapsed * 1000:>8.0f} ms  {seconds / elapsed:>7.0f}x real time'
+            f'  {result["loudness"]:.2f} LUFS  {result["true_peak"]:.2f} dBTP  gain {result["gain"]:+.2f} dB'
+        )
@@ -0,0 +1,76 @@
+import time
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.test import Client, override_settings
+from django.test.utils import CaptureQueriesContext
+from rest_framework_simplejwt.tokens import RefreshToken
+
+from api.models import Category, Podcast
+
+
+class Rollback(Exception):
+    pass
+
+
+class Command(BaseCommand):
+    help = 'Compare moving N subscriptions in with one OPML import against one subscribe call per show'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--feeds', type=int, default=1000)
+
+    def handle(self, *args, **options):
+        count = options['feeds']
+        creator = User.objects.order_by('pk').first()
+        category = Category.objects.order_by('pk').first()
+        if creator is None or category is None:
+            raise CommandError('No users or categories, run generate_dataset first')
+
+        throttling = {**settings.API_THROTTLING, 'ENABLED': False}
+        # Everything below is rolled back, the catalog is left as it was
+        try:
+            with override_settings(API_THROTTLING=throttling), transaction.atomic():
+                shows = Podcast.objects.bulk_create([
+                    Podcast(title=f'Bench show {i}', description='...', category=category, creator=creator,
+                            feed_url=f'https://feeds.example.com/bench/{i}.xml')
+                    for i in range(count)
+                ])
+                for size in sorted({min(10, count), min(100, count), count}):
+                    self.run_import(shows[:size])
+
+                client = self.client_for('bench-opml-one-by-one')
+                with CaptureQueriesContext(connection) as queries:
+                    started = time.perf_counter()
+                    for show in shows:
+                        response = client.post(f'/api/podcasts/{show.pk}/subscribe/')
+                        if response.status_code != 200:
+                            raise CommandError(f'subscribe returned {response.status_code}')
+                    elapsed = time.perf_counter() - started
+                self.stdout.write(
+                    f'{count:>5} subscribe calls      {elapsed * 1000:>8.1f} ms  {len(queries):>6} queries'
+                )
+                raise Rollback
+        except Rollback:
+            pass
+
+    def document(self, shows):
+        outlines = ''.join(f'<outline type="rss" text="{show.title}" xmlUrl="{show.feed_url}"/>' for show in shows)
+        return f'<?xml version="1.0"?><opml version="2.0"><head/><body>{outlines}</body></opml>'
+
+    def client_for(self, username):
+        user = User.objects.create_user(username)
+        token = str(RefreshToken.for_user(user).access_token)
+        return Client(SERVER_NAME='localhost', headers={'Authorization': f'Bearer {token}'})
+
+    def run_import(self, shows):
+        size, document = len(shows), self.document(shows)
+        client = self.client_for(f'bench-opml-{size}')
+        with CaptureQueriesContext(connection) as queries:
+            started = time.perf_counter()
+            response = client.generic('POST', '/api/subscriptions/opml/', document, content_type='text/x-opml')
+            elapsed = time.perf_counter() - started
+        if response.status_code != 200 or response.json()['subscribed'] != size:
+            raise CommandError(f'OPML import returned {response.status_code}')
+        self.stdout.write(f'{size:>5} feeds, one OPML import {elapsed * 1000:>8.1f} ms  {len(queries):>6} queries')
@@ -0,0 +1,102 @@
+import random
+import statistics
+import time
+from datetime import timedelta
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.db.models import Count
+from django.test import Client
+from django.utils import timezone
+from rest_framework_simplejwt.tokens import RefreshToken
+
+from api.analytics import catch_up
+from api.management.commands.bench_routes import QUERIES_RE
+from api.models import AnalyticsEvent, Episode, Podcast
+
+KINDS = [AnalyticsEvent.PLAY] * 85 + [AnalyticsEvent.PLAYLIST_ADD] * 8 + [AnalyticsEvent.SUBSCRIBE] * 5 + [AnalyticsEvent.UNSUBSCRIBE] * 2
+
+
+class Command(BaseCommand):
+    help = 'Time folding synthetic analytics events into the rollups, and /api/creator/stats/ reading them'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--events', type=int, default=200_000, help='Backlog spread over --days')
+        parser.add_argument('--increment', type=int, default=10_000, help='Fresh events rolled up afterwards')
+        parser.add_argument('--days', type=int, default=30)
+        parser.add_argument('--batch-size', type=int)
+        parser.add_argument('--rounds', type=int, default=20)
+        parser.add_argument('--seed', type=int, default=42)
+
+    def handle(self, *args, **options):
+        rng = random.Random(options['seed'])
+        creator = (
+            User.objects.annotate(shows=Count('podcast')).filter(shows__gt=0).order_by('-shows').first()
+        )
+        if creator is None:
+            raise CommandError('No podcasts found, run generate_dataset first')
+        # Half the traffic goes to the creator being measured, the rest to everyone else
+        own = list(Episode.objects.filter(podcast__creator=creator).values_list('pk', 'podcast_id', 'duration')[:5000])
+        others = list(Episode.objects.exclude(podcast__creator=creator).values_list('pk', 'podcast_id', 'duration')[:5000]) or own
+        users = list(User.objects.values_list('pk', flat=True)[:20000]) + [None] * 100
+        now = timezone.now()
+
+        # Rolled back at the end, the dataset is left as it was
+        with transaction.atomic():
+            self.seed(rng, own, others, users, options['events'], now - timedelta(days=options['days']), now - timedelta(minutes=5))
+            started = time.perf_counter()
+            totals = catch_up(options['batch_size'], now=now)
+            self.report('backlog', totals, time.perf_counter() - started)
+
+            self.seed(rng, own, others, users, options['increment'], now - timedelta(hours=1), now - timedelta(minutes=5))
+            started = time.perf_counter()
+            totals = catch_up(options['batch_size'], now=now)
+            self.report('increment', totals, time.perf_counter() - started)
+
+            client = Client(SERVER_NAME='localhost', HTTP_AUTHORIZATION=f'Bearer {RefreshToken.for_user(creator).access_token}')
+            shows = Podcast.objects.filter(creator=creator).count()
+            for query in ({'period': 'day', 'days': options['days']}, {'period': 'hour', 'days': 2}):
+                self.dashboard(client, query, shows, options['rounds'])
+            transaction.set_rollback(True)
+
+    def seed(self, rng, own, others, users, count, start, end):
+        span = (end - start).total_seconds()
+        events = []
+        for _ in range(count):
+            episode, podcast, duration = rng.choice(own if rng.random() < .5 else others)
+            kind = rng.choice(KINDS)
+            seconds = rng.randint(0, duration * 60) if kind == AnalyticsEvent.PLAY else 0
+            events.append(AnalyticsEvent(
+                kind=kind, podcast_id=podcast,
+                episode_id=episode if kind in (AnalyticsEvent.PLAY, AnalyticsEvent.PLAYLIST_ADD) else None,
+                user_id=rng.choice(users), seconds=seconds, completed=seconds >= duration * 60 * .9,
+                created_at=start + timedelta(seconds=rng.random() * span),
+            ))
+        # Ids follow time, as they would for live traffic
+        events.sort(key=lambda event: event.created_at)
+        AnalyticsEvent.objects.bulk_create(events, batch_size=5000)
+
+    def report(self, label, totals, elapsed):
+        per_million = elapsed / totals['events'] * 1_000_000 if totals['events'] else 0
+        self.stdout.write(
+            f'{label:<10} {totals["events"]:>9,} events  {elapsed:>7.2f}s  {per_million:>7.1f}s per million events'
+            f'  {totals["rows"]:>8,} rollup rows written'
+        )
+
+    def dashboard(self, client, query, shows, rounds):
+        timings, queries = [], 0
+        for _ in range(rounds):
+            started = time.perf_counter()
+            response = client.get('/api/creator/stats/', query)
+            timings.append((time.perf_counter() - started) * 1000)
+            if response.status_code != 200:
+                raise CommandError(f'/api/creator/stats/ returned {response.status_code}')
+            match = QUERIES_RE.search(response.headers.get('Server-Timing', ''))
+            queries = int(match.group(1)) if match else 0
+        timings.sort()
+        self.stdout.write(
+            f'creator/stats period={query["period"]:<4} days={query["days"]:<3} ({shows} podcasts, '
+            f'{len(response.json()["series"])} buckets)  p50 {statistics.median(timings):>6.1f} ms'
+            f'  p95 {timings[int(len(timings) * .95) - 1]:>6.1f} ms  {queries} queries'
+        )
@@ -0,0 +1,247 @@
+import json
+import random
+import re
+import subprocess
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections
+from django.test import Client, override_settings
+from django.urls import URLPattern, URLResolver, reverse
+from rest_framework_simplejwt.tokens import RefreshToken
+
+from api import urls as api_urls
+from api.models import Category, Podcast, Episode, Playlist
+
+
+# url name -> (method, needs auth, reverse kwargs/query/body builder)
+ROUTES = {
+    'api-root': ('GET', False, lambda f: ({}, {}, None)),
+    'podcast-list': ('GET', False, lambda f: ({}, {}, None)),
+    'podcast-detail': ('GET', False, lambda f: ({'pk': f.pick('podcast')}, {}, None)),
+    'podcast-my-podcasts': ('GET', True, lambda f: ({}, {}, None)),
+    'podcast-batch': ('GET', False, lambda f: ({}, {'ids': ','.join(str(f.pick('podcast')) for _ in range(20))}, None)),
+    'podcast-facets': ('GET', False, lambda f: ({}, {'search': f.pick('term')[:4]}, None)),
+    'podcast-subscribe': ('POST', True, lambda f: ({'pk': f.pick('podcast')}, {}, None)),
+    'episode-list': ('GET', False, lambda f: ({}, {'podcast': f.pick('podcast')}, None)),
+    'episode-detail': ('GET', False, lambda f: ({'pk': f.pick('episode')}, {}, None)),
+    'episode-batch': ('GET', False, lambda f: ({}, {'ids': ','.join(str(f.pick('episode')) for _ in range(20))}, None)),
+    'episode-recent': ('GET', False, lambda f: ({}, {}, None)),
+    'playlist-list': ('GET', True, lambda f: ({}, {}, None)),
+    'playlist-detail': ('GET', True, lambda f: ({'pk': f.pick('playlist')}, {}, None)),
+    'playlist-add-episode': ('POST', True, lambda f: ({'pk': f.pick('playlist')}, {}, {'episode_id': f.pick('episode')})),
+    'login': ('POST', False, lambda f: ({}, {}, {'username': f.user.username, 'password': f.password})),
+    'category-list': ('GET', False, lambda f: ({}, {}, None)),
+    'category-detail': ('GET', False, lambda f: ({'pk': f.pick('category')}, {}, None)),
+    'subscription-list': ('GET', True, lambda f: ({}, {}, None)),
+    'subscription-opml': ('GET', True, lambda f: ({}, {}, None)),
+    'search': ('GET', False, lambda f: ({}, {'q': f.pick('term')}, None)),
+    'search-suggest': ('GET', False, lambda f: ({}, {'q': f.pick('term')[:3]}, None)),
+    'trending': ('GET', False, lambda f: ({}, {}, None)),
+    'sync': ('GET', True, lambda f: ({}, {}, None)),
+    'home': ('GET', True, lambda f: ({}, {}, None)),
+    'user-profile': ('GET', True, lambda f: ({}, {}, None)),
+    'user-stats': ('GET', True, lambda f: ({}, {}, None)),
+    'user-export': ('GET', True, lambda f: ({}, {}, None)),
+}
+
+# Routes that can't be replayed without changing what the next request sees
+SKIPPED = {
+    'register': 'creates a new user per call',
+    'logout': 'blacklists the refresh token',
+    'token_refresh': 'rotation blacklists the refresh token after one use',
+    'podcast-unsubscribe': 'only succeeds once per subscription',
+    'playlist-remove-episode': 'only succeeds once per membership',
+    'events': 'long-lived stream, see bench_events',
+    'episode-chapters': 'only episodes run through detect_chapters have any, see bench_chapters',
+}
+
+QUERIES_RE = re.compile(r'desc="(\d+) queries"')
+
+
+def url_names(patterns):
+    for pattern in patterns:
+        if isinstance(pattern, URLResolver):
+            yield from url_names(pattern.url_patterns)
+        elif isinstance(pattern, URLPattern) and pattern.name:
+            yield pattern.name
+
+
+def percentile(values, pct):
+    """Nearest-rank percentile of an already sorted list"""
+    return values[min(len(values) - 1, int(round(pct / 100 * (len(values) - 1))))]
+
+
+class Fixtures:
+    """Ids the routes are pointed at, sampled so detail calls don't hit one hot row"""
+
+    def __init__(self, user, password, sample, seed):
+        self.user = user
+        self.password = password
+        self.rng = random.Random(seed)
+        self.lock = threading.Lock()
+        self.ids = {
+            'podcast': list(Podcast.objects.order_by('?').values_list('pk', flat=True)[:sample]),
+            'episode': list(Episode.objects.order_by('?').values_list('pk', flat=True)[:sample]),
+            'category': list(Category.objects.values_list('pk', flat=True)[:sample]),
+            'playlist': list(Playlist.objects.filter(user=user).values_list('pk', flat=True)[:sample]),
+            'term': [title.split()[0] for title in Podcast.objects.values_list('title', flat=True)[:sample]],
+        }
+        empty = [name for name, values in self.ids.items() if not values]
+        if empty:
+            raise CommandError(f'No {", ".join(empty)} rows to benchmark against, run generate_dataset first')
+
+    def pick(self, kind):
+        with self.lock:
+            return self.rng.choice(self.ids[kind])
+
+
+class Command(BaseCommand):
+    help = 'Hit every API route at fixed concurrency and write latency/throughput/query stats as JSON'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--base-url', help='Benchmark a running server instead of an in-process client')
+        parser.add_argument('--concurrency', type=int, default=8)
+        parser.add_argument('--requests', type=int, default=200, help='Requests per route')
+        parser.add_argument('--username', help='User to authenticate as (defaults to one owning playlists)')
+        parser.add_argument('--password', default='password123', help='Password of that user, for the login route')
+        parser.add_argument('--route', action='append', help='Only benchmark these url names')
+        parser.add_argument('--seed', type=int, default=42)
+        parser.add_argument('--output', default='bench-routes.json')
+        parser.add_argument('--baseline', help='Earlier report to compare p95 latency against')
+
+    def handle(self, *args, **options):
+        user = self.get_user(options['username'])
+        fixtures = Fixtures(user, options['password'], 50, options['seed'])
+        token = str(RefreshToken.for_user(user).access_token)
+
+        uncovered = set(url_names(api_urls.urlpatterns)) - set(ROUTES) - set(SKIPPED)
+        if uncovered:
+            self.stderr.write(f'Routes without a benchmark case: {", ".join(sorted(uncovered))}')
+
+        names = options['route'] or list(ROUTES)
+        report = {
+            'commit': self.git_commit(),
+            'timestamp': datetime.now(timezone.utc).isoformat(),
+            'target': options['base_url'] or 'in-process',
+            'concurrency': options['concurrency'],
+            'requests_per_route': options['requests'],
+            'routes': {},
+            'skipped': SKIPPED,
+        }
+        # Hundreds of in-process calls from one user would otherwise mostly measure 429s
+        throttling = {**settings.API_THROTTLING, 'ENABLED': False}
+        for name in names:
+            with override_settings(API_THROTTLING=throttling):
+                result = self.run_route(name, fixtures, token, options)
+            report['routes'][name] = result
+            self.stdout.write(
+                f'{name:<24} p50 {result["p50_ms"]:>8.1f}  p95 {result["p95_ms"]:>8.1f}  p99 {result["p99_ms"]:>8.1f} ms'
+                f'  {result["throughput_rps"]:>8.1f} req/s  {result["queries_per_request"]:>6.1f} q/req'
+                f'  errors {result["errors"]}'
+            )
+
+        with open(options['output'], 'w') as fh:
+            json.dump(report, fh, indent=2)
+        self.stdout.write(self.style.SUCCESS(f'Report written to {options["output"]}'))
+
+        if options['baseline']:
+            self.compare(options['baseline'], report)
+
+    def get_user(self, username):
+        if username:
+            try:
+                return User.objects.get(username=username)
+            except User.DoesNotExist:
+                raise CommandError(f'User "{username}" does not exist')
+        user = User.objects.filter(playlist__isnull=False).order_by('pk').first()
+        if user is None:
+            raise CommandError('No user with playlists found, run generate_dataset first')
+        return user
+
+    def run_route(self, name, fixtures, token, options):
+        method, needs_auth, build = ROUTES[name]
+        headers = {'Authorization': f'Bearer {token}'} if needs_auth else {}
+        send = self.http_sender(options['base_url']) if options['base_url'] else self.client_sender()
+
+        def one(_):
+            kwargs, query, body = build(fixtures)
+            path = reverse(name, kwargs=kwargs)
+            start = time.perf_counter()
+            status, server_timing = send(method, path, query, body, headers)
+            elapsed = time.perf_counter() - start
+            match = QUERIES_RE.search(server_timing or '')
+            return elapsed, status, int(match.group(1)) if match else None
+
+        started = time.perf_counter()
+        with ThreadPoolExecutor(options['concurrency']) as pool:
+            results = list(pool.map(one, range(options['requests'])))
+        wall = time.perf_counter() - started
+        connections.close_all()
+
+        latencies = sorted(elapsed * 1000 for elapsed, _, _ in results)
+        queries = [count for _, _, count in results if count is not None]
+        statuses = {}
+        for _, status, _ in results:
+            statuses[str(status)] = statuses.get(str(status), 0) + 1
+        return {
+            'method': method,
+            'p50_ms': round(percentile(latencies, 50), 2),
+            'p95_ms': round(percentile(latencies, 95), 2),
+            'p99_ms': round(percentile(latencies, 99), 2),
+            'mean_ms': round(sum(latencies) / len(latencies), 2),
+            'throughput_rps': round(len(results) / wall, 1),
+            'queries_per_request': round(sum(queries) / len(queries), 2) if queries else 0,
+            'errors': sum(1 for _, status, _ in results if status >= 500),
+            'status_codes': statuses,
+        }
+
+    def client_sender(self):
+        local = threading.local()
+
+        def send(method, path, query, body, headers):
+            if not hasattr(local, 'client'):
+                local.client = Client(SERVER_NAME='localhost')
+            if method == 'GET':
+                response = local.client.get(path, query, headers=headers)
+            else:
+                response = local.client.post(path, body or {}, content_type='application/json', headers=headers)
+            return response.status_code, response.headers.get('Server-Timing')
+        return send
+
+    def http_sender(self, base_url):
+        import requests
+
+        local = threading.local()
+
+        def send(method, path, query, body, headers):
+            if not hasattr(local, 'session'):
+                local.session = requests.Session()
+            response = local.session.request(method, base_url.rstrip('/') + path, params=query, json=body, headers=headers)
+            return response.status_code, response.headers.get('Server-Timing')
+        return send
+
+    def git_commit(self):
+        try:
+            return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'], text=True).strip()
+        except (OSError, subprocess.CalledProcessError):
+            return None
+
+    def compare(self, baseline_path, report):
+        with open(baseline_path) as fh:
+            baseline = json.load(fh)
+        self.stdout.write(f'\np95 vs {baseline.get("commit") or baseline_path}')
+        for name, result in report['routes'].items():
+            before = baseline['routes'].get(name)
+            if not before:
+                continue
+            change = (result['p95_ms'] - before['p95_ms']) / before['p95_ms'] * 100 if before['p95_ms'] else 0
+            self.stdout.write(
+                f'{name:<24} {before["p95_ms"]:>8.1f} -> {result["p95_ms"]:>8.1f} ms  ({change:+.0f}%)'
+                f'  queries {before["queries_per_request"]} -> {result["queries_per_request"]}'
+            )
@@ -0,0 +1,71 @@
+import time
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from rest_framework.renderers import JSONRenderer
+from rest_framework.request import Request
+from rest_framework.test import APIRequestFactory
+
+from api.fieldsets import values_rows
+from api.models import Category, Podcast, Episode
+from api.renderers import ORJSONRenderer
+from api.serializers import PodcastListSerializer, EpisodeListSerializer
+
+
+class Command(BaseCommand):
+    help = 'Compare list serialization throughput (rows/s) of the serializer and values() paths'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rows', type=int, default=10000, help='Rows per page')
+        parser.add_argument('--repeat', type=int, default=3, help='Runs per case, best one is reported')
+
+    def handle(self, *args, **options):
+        rows, repeat = options['rows'], options['repeat']
+        request = Request(APIRequestFactory().get('/api/'))
+
+        # Everything is seeded inside a transaction that is rolled back at the end
+        with transaction.atomic():
+            self.seed(rows)
+            cases = [
+                ('podcasts', PodcastListSerializer, Podcast.objects.select_related('creator', 'category')),
+                ('episodes', EpisodeListSerializer, Episode.objects.select_related('podcast')),
+            ]
+            for label, serializer_class, queryset in cases:
+                queryset = queryset.order_by('pk')[:rows]
+                self.stdout.write(f'{label} ({rows} rows)')
+                self.report('serializer + JSONRenderer', rows, repeat, lambda: JSONRenderer().render(
+                    serializer_class(queryset.all(), many=True, context={'request': request}).data))
+                self.report('serializer + ORJSONRenderer', rows, repeat, lambda: ORJSONRenderer().render(
+                    serializer_class(queryset.all(), many=True, context={'request': request}).data))
+                self.report('values() + ORJSONRenderer', rows, repeat, lambda: ORJSONRenderer().render(
+                    self.values_page(serializer_class, queryset, request)))
+            transaction.set_rollback(True)
+
+    def values_page(self, serializer_class, queryset, request):
+        lookups = serializer_class(context={'request': request}).get_values_lookups()
+        return values_rows(queryset.values_list(*lookups.values()), lookups, queryset.model, request)
+
+    def report(self, name, rows, repeat, run):
+        best = None
+        for _ in range(repeat):
+            start = time.perf_counter()
+            run()
+            elapsed = time.perf_counter() - start
+            best = elapsed if best is None else min(best, elapsed)
+        self.stdout.write(f'  {name:<30} {rows / best:>12,.0f} rows/s  ({best * 1000:.1f} ms)')
+
+    def seed(self, rows):
+        user = User.objects.create_user('bench-serialization')
+        category = Category.objects.create(name='Benchmark')
+        podcasts = Podcast.objects.bulk_create([
+            Podcast(title=f'Podcast {i}', description='Benchmark podcast', category=category, creator=user)
+            for i in range(rows)
+        ], batch_size=1000)
+        Episode.objects.bulk_create([
+            Episode(
+                title=f'Episode {i}', description='Benchmark episode', podcast=podcasts[i % len(podcasts)],
+                audio_file=f'episodes/bench-{i}.mp3', duration=30,
+            )
+            for i in range(rows)
+        ], batch_size=1000)
@@ -0,0 +1,97 @@
+import os
+import random
+import statistics
+import tempfile
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from api.suggest import SuggestIndex, normalize, word_starts, write
+
+SYLLABLES = ['ka', 'lo', 'mi', 'ne', 'ru', 'sa', 'ti', 'vo', 'ze', 'an', 'el', 'or', 'un', 'st', 'br', 'ch', 'dy', 'gh']
+
+
+def memory_kib():
+    """``(private, file-backed)`` resident KiB of this process"""
+    fields = {}
+    with open('/proc/self/status') as fh:
+        for line in fh:
+            name, _, value = line.partition(':')
+            fields[name] = value.split()[0] if value.split() else '0'
+    return int(fields.get('RssAnon', 0)), int(fields.get('RssFile', 0)) + int(fields.get('RssShmem', 0))
+
+
+class Command(BaseCommand):
+    help = 'Measure size, build time and lookup latency of the suggestion index over synthetic titles'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--entries', type=int, default=1_000_000)
+        parser.add_argument('--lookups', type=int, default=20_000)
+        parser.add_argument('--changes', type=int, default=1000, help='Logged saves replayed on top of the snapshot')
+        parser.add_argument('--seed', type=int, default=42)
+
+    def handle(self, *args, **options):
+        rng = random.Random(options['seed'])
+        config = settings.API_SUGGEST
+        vocabulary = list({''.join(rng.choices(SYLLABLES, k=rng.randint(2, 4))) for _ in range(30_000)})
+        # Word use and popularity both follow a long tail, like real titles and audiences
+        word = lambda: vocabulary[min(int(rng.paretovariate(1.1)) - 1, len(vocabulary) - 1)]
+        title = lambda: ' '.join(word() for _ in range(rng.randint(2, 7))).title()
+        podcasts = max(1, options['entries'] // 100)
+        entries = [('category', pk, title(), rng.randint(0, 10**6)) for pk in range(1, 51)]
+        entries += [('podcast', pk, title(), int(rng.paretovariate(1.2))) for pk in range(1, podcasts + 1)]
+        entries += [('episode', pk, f'{title()} #{pk % 300}', int(rng.paretovariate(1.2)))
+                    for pk in range(1, options['entries'] - len(entries) + 1)]
+
+        directory = tempfile.mkdtemp()
+        path = os.path.join(directory, 'suggest')
+        started = time.perf_counter()
+        stats = write(path, entries, config['MAX_WORDS'], config['KEY_CHARS'], config['SCAN_LIMIT'], config['TOP'])
+        self.stdout.write(
+            f'{stats["entries"]:,} entries, {stats["keys"]:,} keys, {stats["heavy_prefixes"]:,} precomputed prefixes: '
+            f'{stats["bytes"] / 2**20:.1f} MiB file, built in {time.perf_counter() - started:.1f}s'
+        )
+
+        queries = []
+        for _ in range(options['lookups']):
+            normalized = normalize(rng.choice(entries)[2])
+            start = rng.choice(word_starts(normalized, config['MAX_WORDS']))
+            queries.append(normalized[start:start + rng.randint(1, 10)].strip() or normalized[:1])
+        del entries
+
+        try:
+            before = memory_kib()
+            index = SuggestIndex(
+                path, config['MAX_WORDS'], config['KEY_CHARS'], config['SCAN_LIMIT'], changes=lambda position: (),
+                interval=config['REFRESH_SECONDS'],
+            )
+            self.measure(index, queries, 'snapshot only')
+            after = memory_kib()
+            self.stdout.write(
+                f'  per worker: {(after[0] - before[0]) / 1024:.1f} MiB private, '
+                f'{(after[1] - before[1]) / 1024:.1f} MiB of the shared file mapped'
+            )
+
+            # Rows as api.suggest.logged_changes reads them from the database
+            logged = [(pk, 'put', 'episode', 10**9 + pk, title(), True) for pk in range(1, options['changes'] + 1)]
+            index.changes = lambda position: [row for row in logged if row[0] > position]
+            index.checked_at = None
+            self.measure(index, queries, f'with {options["changes"]} logged changes')
+        finally:
+            for name in os.listdir(directory):
+                os.remove(os.path.join(directory, name))
+            os.rmdir(directory)
+
+    def measure(self, index, queries, label):
+        index.lookup(queries[0], 8)  # Maps the file and replays the changes
+        timings = []
+        for query in queries:
+            started = time.perf_counter()
+            index.lookup(query, 8)
+            timings.append((time.perf_counter() - started) * 1e6)
+        timings.sort()
+        self.stdout.write(
+            f'{label:<28} p50 {statistics.median(timings):>6.0f} us  p95 {timings[int(len(timings) * .95)]:>6.0f} us'
+            f'  p99 {timings[int(len(timings) * .99)]:>6.0f} us  max {timings[-1]:>7.0f} us'
+        )
@@ -0,0 +1,87 @@
+import statistics
+import time
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.db.models import Count
+from django.test import Client, override_settings
+from django.test.utils import CaptureQueriesContext
+from rest_framework_simplejwt.tokens import RefreshToken
+
+from api.models import Episode, Playlist, Subscription
+from api.sync import compact
+
+
+class Rollback(Exception):
+    pass
+
+
+class Command(BaseCommand):
+    help = 'Compare an incremental /api/sync/ against refetching the library, in bytes and server time'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--episodes', type=int, default=5, help='New episodes on subscribed podcasts between syncs')
+        parser.add_argument('--rounds', type=int, default=20)
+
+    def handle(self, *args, **options):
+        listener = (
+            Subscription.objects.values('user').annotate(n=Count('pk')).order_by('-n').values_list('user', flat=True).first()
+        )
+        if listener is None:
+            raise CommandError('No subscriptions, run generate_dataset first')
+
+        throttling = {**settings.API_THROTTLING, 'ENABLED': False}
+        sync_settings = {**settings.API_SYNC, 'SETTLE_SECONDS': 0}
+        # Everything below is rolled back, the catalog is left as it was
+        try:
+            with override_settings(API_THROTTLING=throttling, API_SYNC=sync_settings), transaction.atomic():
+                client = self.client_for(listener)
+                token = client.get('/api/sync/').json()['token']
+                self.change_library(listener, options['episodes'])
+                compact()
+
+                self.report('full refetch: /subscriptions/ + /playlists/', client,
+                            ['/api/subscriptions/', '/api/playlists/'], options['rounds'])
+                self.report('full snapshot: /sync/ without a token', client, ['/api/sync/'], options['rounds'])
+                self.report('incremental: /sync/?token=', client, [f'/api/sync/?token={token}'], options['rounds'])
+                raise Rollback
+        except Rollback:
+            pass
+
+    def client_for(self, user_id):
+        token = str(RefreshToken.for_user(User.objects.get(pk=user_id)).access_token)
+        return Client(SERVER_NAME='localhost', headers={'Authorization': f'Bearer {token}'})
+
+    def change_library(self, user_id, episodes):
+        """A typical gap between two syncs: a few new episodes, one queued, one playlist renamed"""
+        podcasts = list(Subscription.objects.filter(user_id=user_id).values_list('podcast_id', flat=True))
+        new = [
+            Episode.objects.create(title=f'Bench sync {n}', description='...', podcast_id=podcasts[n % len(podcasts)],
+                                   audio_file=f'episodes/bench-sync-{n}.mp3', duration=1800)
+            for n in range(episodes)
+        ]
+        playlist = Playlist.objects.filter(user_id=user_id).first() or Playlist.objects.create(user_id=user_id, name='Bench')
+        playlist.episodes.add(new[0])
+        playlist.name = f'{playlist.name} (renamed)'
+        playlist.save()
+        libraries = Subscription.objects.filter(user_id=user_id).count(), Playlist.objects.filter(user_id=user_id).count()
+        self.stdout.write(f'Listener {user_id}: {libraries[0]} subscriptions, {libraries[1]} playlists, {episodes} new episodes')
+
+    def report(self, label, client, urls, rounds):
+        timings, size = [], 0
+        with CaptureQueriesContext(connection) as queries:
+            for _ in range(rounds):
+                started = time.perf_counter()
+                size = 0
+                for url in urls:
+                    response = client.get(url)
+                    if response.status_code != 200:
+                        raise CommandError(f'{url} returned {response.status_code}')
+                    size += len(response.content)
+                timings.append((time.perf_counter() - started) * 1000)
+        self.stdout.write(
+            f'{label:<46} {size / 1024:>8.1f} KiB  p50 {statistics.median(timings):>7.1f} ms'
+            f'  {len(queries) // rounds:>3} queries'
+        )
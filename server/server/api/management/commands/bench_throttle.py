@@ -0,0 +1,51 @@
+import os
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+from django.core.management.base import BaseCommand
+
+from api.throttling import RedisBucketStore, SharedMemoryBucketStore
+
+
+def run_checks(store_args, checks, keys, offset):
+    """Time ``checks`` consumes spread over ``keys`` buckets; runs in a worker process"""
+    path, redis_url = store_args
+    store = RedisBucketStore(redis_url) if redis_url else SharedMemoryBucketStore(path)
+    names = [f'bench:ip:10.0.{(offset + i) // 256 % 256}.{(offset + i) % 256}' for i in range(keys)]
+    allowed = 0
+    started = time.perf_counter()
+    for i in range(checks):
+        allowed += store.consume(names[i % keys], 20, 1.0)[0]
+    elapsed = time.perf_counter() - started
+    store.close()
+    return elapsed, allowed
+
+
+class Command(BaseCommand):
+    help = 'Measure the cost of one token-bucket check, alone and with several processes sharing the store'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--checks', type=int, default=200000, help='Checks per process')
+        parser.add_argument('--keys', type=int, default=10000, help='Distinct buckets per process')
+        parser.add_argument('--processes', type=int, default=4)
+        parser.add_argument('--redis-url', help='Benchmark a Redis store instead of the shared-memory one')
+
+    def handle(self, *args, **options):
+        with tempfile.TemporaryDirectory() as directory:
+            store_args = (os.path.join(directory, 'buckets'), options['redis_url'])
+            label = 'redis' if options['redis_url'] else 'shared memory'
+            for processes, shared_keys in ((1, False), (options['processes'], False), (options['processes'], True)):
+                with ProcessPoolExecutor(processes) as pool:
+                    results = list(pool.map(
+                        run_checks, [store_args] * processes, [options['checks']] * processes, [options['keys']] * processes,
+                        [0 if shared_keys else n * options['keys'] for n in range(processes)],
+                    ))
+                checks = options['checks'] * processes
+                wall = max(elapsed for elapsed, _ in results)
+                per_check = sum(elapsed for elapsed, _ in results) / checks
+                self.stdout.write(
+                    f'{label:<14} {processes} proc {"same keys" if shared_keys else "own keys":<10}'
+                    f' {per_check * 1e6:>7.2f} us/check  {checks / wall:>12,.0f} checks/s'
+                    f'  {sum(allowed for _, allowed in results) / checks:>6.1%} allowed'
+                )
@@ -0,0 +1,20 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from api.suggest import build
+
+
+class Command(BaseCommand):
+    help = 'Rebuild the prefix index behind /api/search/suggest/ from the database'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--path', help='Index file (default API_SUGGEST["PATH"])')
+
+    def handle(self, *args, **options):
+        started = time.perf_counter()
+        stats = build(options['path'])
+        self.stdout.write(
+            f'Indexed {stats["entries"]} entries under {stats["keys"]} keys, {stats["heavy_prefixes"]} prefixes '
+            f'precomputed, {stats["bytes"] / 2**20:.1f} MiB in {time.perf_counter() - started:.1f}s'
+        )
@@ -0,0 +1,82 @@
+import json
+import os
+import subprocess
+import sys
+from collections import Counter
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+# Run in a fresh interpreter: import the WSGI app, then serve one request the way Vercel would
+PROBE = '''
+import io, json, resource, sys, time
+started = time.perf_counter()
+from server.wsgi import application
+imported = time.perf_counter()
+status = []
+environ = {
+    'REQUEST_METHOD': 'GET', 'PATH_INFO': sys.argv[1], 'QUERY_STRING': '', 'SERVER_NAME': 'localhost',
+    'SERVER_PORT': '80', 'REMOTE_ADDR': '127.0.0.1',
+    'wsgi.url_scheme': 'http', 'wsgi.input': io.BytesIO(), 'wsgi.errors': sys.stderr,
+}
+b''.join(application(environ, lambda s, headers, exc_info=None: status.append(s)))
+done = time.perf_counter()
+print(json.dumps({
+    'status': status[0], 'import_ms': (imported - started) * 1000, 'first_request_ms': (done - imported) * 1000,
+    'modules': sorted(sys.modules), 'max_rss_kib': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+}))
+'''
+
+
+def parse_importtime(output):
+    """``{module: self time in microseconds}`` from ``python -X importtime`` stderr"""
+    modules = {}
+    for line in output.splitlines():
+        if not line.startswith('import time:') or 'self [us]' in line:
+            continue
+        self_us, _, name = line[len('import time:'):].split('|')
+        modules[name.strip()] = int(self_us)
+    return modules
+
+
+def by_package(modules):
+    totals = Counter()
+    for name, self_us in modules.items():
+        totals[name.split('.')[0]] += self_us
+    return totals
+
+
+def probe(serverless, path='/api/trending/'):
+    """``(measurements, import self time per module)`` of one cold start"""
+    env = {**os.environ, 'SERVERLESS': '1' if serverless else '0', 'VERCEL': ''}
+    result = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-c', PROBE, path],
+        cwd=settings.BASE_DIR, env=env, capture_output=True, text=True,
+    )
+    if result.returncode:
+        raise CommandError(result.stderr.strip().splitlines()[-1])
+    return json.loads(result.stdout.strip().splitlines()[-1]), parse_importtime(result.stderr)
+
+
+class Command(BaseCommand):
+    help = 'Compare cold starts (import server.wsgi plus one request) of the default and serverless profiles'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--runs', type=int, default=5)
+        parser.add_argument('--path', default='/api/trending/')
+        parser.add_argument('--top', type=int, default=15, help='Packages listed in the import breakdown')
+
+    def handle(self, *args, **options):
+        for label, serverless in (('default', False), ('serverless', True)):
+            runs = [probe(serverless, options['path']) for _ in range(options['runs'])]
+            measured = [run[0] for run in runs]
+            best = lambda key: min(run[key] for run in measured)
+            self.stdout.write(
+                f'{label:<11} {measured[0]["status"]:<8} import {best("import_ms"):>7.1f} ms'
+                f'  first request {best("first_request_ms"):>6.1f} ms  {len(measured[0]["modules"]):>5} modules'
+                f'  max rss {best("max_rss_kib") / 1024:>6.1f} MiB'
+            )
+            packages = by_package(runs[-1][1])
+            for name, self_us in packages.most_common(options['top']):
+                self.stdout.write(f'    {name:<24} {self_us / 1000:>7.1f} ms')
+            self.stdout.write(f'    {"total":<24} {sum(packages.values()) / 1000:>7.1f} ms')
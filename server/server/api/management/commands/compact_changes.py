@@ -0,0 +1,14 @@
+from django.core.management.base import BaseCommand
+
+from api.sync import compact
+
+
+class Command(BaseCommand):
+    help = 'Trim the delta sync change log: expired rows and rows superseded by a newer one for the same key'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, help='Ids per delete (default API_SYNC["COMPACT_BATCH_SIZE"])')
+
+    def handle(self, *args, **options):
+        stats = compact(batch_size=options['batch_size'])
+        self.stdout.write(f'Removed {stats["expired"]} expired and {stats["superseded"]} superseded changes')
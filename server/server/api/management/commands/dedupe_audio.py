@@ -0,0 +1,93 @@
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+from django.conf import settings
+from django.core.files.storage import FileSystemStorage
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import Count
+
+from api.deletion import delete_storage_objects
+from api.models import Episode
+from api.uploads import hash_chunks, stream_object
+
+
+class Command(BaseCommand):
+    help = 'Hash stored episode audio, point episodes with identical files at one object and delete the rest'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, default=8, help='Objects downloaded and hashed in parallel')
+        parser.add_argument('--batch-size', type=int, default=200)
+        parser.add_argument('--dry-run', action='store_true', help='Record hashes and report, without merging or deleting')
+        parser.add_argument('--local', action='store_true', help='Read MEDIA_ROOT instead of the configured audio storage')
+
+    def handle(self, *args, **options):
+        storage = (
+            FileSystemStorage(location=settings.MEDIA_ROOT) if options['local']
+            else Episode._meta.get_field('audio_file').storage
+        )
+        started = time.perf_counter()
+        sizes = self.backfill(storage, options['workers'], options['batch_size'])
+        merged, reclaimed = self.merge(storage, sizes, options['dry_run'])
+        verb = 'Would reclaim' if options['dry_run'] else 'Reclaimed'
+        self.stdout.write(self.style.SUCCESS(
+            f'{verb} {reclaimed:,} bytes from {merged} duplicate objects in {time.perf_counter() - started:.1f}s'
+        ))
+
+    def backfill(self, storage, workers, batch_size):
+        """Hash every referenced name without a hash yet; returns ``{digest: size}`` for what was read"""
+        def hash_one(name):
+            try:
+                return name, *hash_chunks(stream_object(storage, name))
+            except (OSError, requests.RequestException) as e:
+                self.stderr.write(f'Skipping {name}: {e}')
+                return name, None, None
+
+        pending = (
+            Episode.all_objects.filter(audio_hash='').exclude(audio_file='')
+            .order_by('audio_file').values_list('audio_file', flat=True).distinct()
+        )
+        sizes, hashed, last = {}, 0, None
+        with ThreadPoolExecutor(workers) as pool:
+            while True:
+                # Keyset pages, rows leave the filter as they are hashed but missing objects don't
+                page = list((pending.filter(audio_file__gt=last) if last else pending)[:batch_size])
+                if not page:
+                    break
+                last = page[-1]
+                for name, digest, size in pool.map(hash_one, page):
+                    if digest is None:
+                        continue
+                    Episode.all_objects.filter(audio_file=name, audio_hash='').update(audio_hash=digest)
+                    sizes[digest] = size
+                    hashed += 1
+                self.stdout.write(f'hashed {hashed} objects')
+        return sizes
+
+    def merge(self, storage, sizes, dry_run):
+        duplicated = list(
+            Episode.all_objects.exclude(audio_hash='').values('audio_hash')
+            .annotate(objects=Count('audio_file', distinct=True)).filter(objects__gt=1)
+            .values_list('audio_hash', flat=True)
+        )
+        merged = reclaimed = 0
+        for digest in duplicated:
+            keep, *drop = sorted(set(Episode.all_objects.filter(audio_hash=digest).values_list('audio_file', flat=True)))
+            merged += len(drop)
+            reclaimed += self.size(storage, keep, sizes.get(digest)) * len(drop)
+            if dry_run:
+                continue
+            with transaction.atomic():
+                Episode.all_objects.filter(audio_hash=digest, audio_file__in=drop).update(audio_file=keep)
+            delete_storage_objects(storage, drop)
+        return merged, reclaimed
+
+    def size(self, storage, name, known):
+        """Size read during this run, or asked of storage for objects hashed by an earlier one"""
+        if known is not None:
+            return known
+        try:
+            return storage.size(name)
+        except (OSError, NotImplementedError, requests.RequestException):
+            return 0
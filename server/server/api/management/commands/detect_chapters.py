@@ -0,0 +1,36 @@
+import os
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from api.chapters import detect_catalog
+from api.loudness import np, source
+from api.models import Episode
+
+
+class Command(BaseCommand):
+    help = 'Find chapter boundaries in episodes not analysed yet, in a process pool'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--processes', type=int, default=os.cpu_count(), help='0 analyses in this process')
+        parser.add_argument('--all', action='store_true', help='Analyse episodes again even if they have been')
+        parser.add_argument('--batch-size', type=int, default=100, help='Results saved per write')
+        parser.add_argument('--limit', type=int)
+
+    def handle(self, *args, **options):
+        if np is None:
+            raise CommandError('numpy is not installed')
+        episodes = Episode.objects.exclude(audio_file='').order_by('pk')
+        if not options['all']:
+            episodes = episodes.filter(chapters__isnull=True)
+        # Sources are resolved here, the workers never touch the database
+        items = [(episode.pk, source(episode)) for episode in episodes[:options['limit']]]
+
+        started = time.perf_counter()
+        totals = detect_catalog(items, options['processes'], options['batch_size'], log=self.stdout.write)
+        elapsed = time.perf_counter() - started
+        hours = totals['seconds'] / 3600
+        self.stdout.write(
+            f'{totals["episodes"]} episodes ({totals["failed"]} failed), {hours:.1f} hours of audio in {elapsed:.1f}s,'
+            f' {hours / max(totals["cpu_seconds"] / 60, 1e-9):.1f} hours per CPU-minute'
+        )
@@ -0,0 +1,56 @@
+import resource
+import sys
+import time
+from pathlib import Path
+
+from django.core.management.base import BaseCommand, CommandError
+
+from api.exchange import EXPORT_FIELDS, catalog_querysets, export_records, ndjson_lines, write_csv
+
+
+class Command(BaseCommand):
+    help = 'Stream the catalog and user data out as NDJSON (one file or stdout) or CSV (one file per model)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('output', help='NDJSON file, "-" for stdout, or a directory for --format csv')
+        parser.add_argument('--format', choices=['ndjson', 'csv'], default='ndjson')
+        parser.add_argument('--models', help=f'Comma separated subset of: {", ".join(EXPORT_FIELDS)}')
+        parser.add_argument('--chunk-size', type=int, default=2000, help='Rows fetched per cursor round-trip')
+
+    def handle(self, *args, **options):
+        querysets = catalog_querysets()
+        if options['models']:
+            wanted = options['models'].split(',')
+            unknown = set(wanted) - set(EXPORT_FIELDS)
+            if unknown:
+                raise CommandError(f'Unknown models: {", ".join(sorted(unknown))}')
+            querysets = {kind: queryset for kind, queryset in querysets.items() if kind in wanted}
+
+        counts = {}
+
+        def counted(records):
+            for kind, record in records:
+                counts[kind] = counts.get(kind, 0) + 1
+                yield kind, record
+
+        started = time.perf_counter()
+        records = counted(export_records(querysets, options['chunk_size']))
+        if options['format'] == 'csv':
+            if options['output'] == '-':
+                raise CommandError('CSV exports need a directory')
+            write_csv(records, Path(options['output']))
+        elif options['output'] == '-':
+            sys.stdout.buffer.writelines(ndjson_lines(records))
+        else:
+            with open(options['output'], 'wb') as fh:
+                fh.writelines(ndjson_lines(records))
+        elapsed = time.perf_counter() - started
+
+        # Progress goes to stderr so NDJSON on stdout stays clean
+        total = sum(counts.values())
+        for kind, count in counts.items():
+            self.stderr.write(f'{kind:<18} {count:>12,} rows')
+        self.stderr.write(
+            f'{total:,} rows in {elapsed:.1f}s ({total / max(elapsed, 1e-9):,.0f} rows/s), '
+            f'peak RSS {resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024:.0f} MiB'
+        )
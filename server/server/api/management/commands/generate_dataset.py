@@ -0,0 +1,181 @@
+import csv
+import io
+import random
+import time
+from datetime import timedelta
+from itertools import accumulate
+
+from django.contrib.auth.hashers import make_password
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.utils import timezone
+
+from api.exchange import manual_timestamps
+from api.models import Category, Podcast, Episode, Playlist, Subscription
+
+
+WORDS = (
+    'daily news history science comedy true crime business tech culture sports health '
+    'politics design music money startup mystery deep dive weekly stories interview '
+    'late night morning coffee future past hidden world city code data art film'
+).split()
+
+SAMPLE_AUDIO = [
+    'episodes/Allusionist-HSBC-PRE-2019-07-12.mp3',
+    'episodes/HSBC_Canada_Announcer_7819_updated.mp3',
+    'episodes/Porsche-Macan-July-5-2018-1.mp3',
+]
+
+
+def zipf_cum_weights(n, exponent):
+    """Cumulative Zipf weights for ranks 1..n, for ``random.choices(cum_weights=...)``"""
+    return list(accumulate(1.0 / rank ** exponent for rank in range(1, n + 1)))
+
+
+class Command(BaseCommand):
+    help = 'Generate a large synthetic catalog (users, podcasts, episodes, playlists, subscriptions)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=1000)
+        parser.add_argument('--categories', type=int, default=30)
+        parser.add_argument('--podcasts', type=int, default=2000)
+        parser.add_argument('--episodes-per-podcast', type=int, default=25)
+        parser.add_argument('--playlists-per-user', type=int, default=2)
+        parser.add_argument('--episodes-per-playlist', type=int, default=15)
+        parser.add_argument('--subscriptions-per-user', type=int, default=10)
+        parser.add_argument('--zipf', type=float, default=1.1, help='Zipf exponent for popularity')
+        parser.add_argument('--seed', type=int, default=42)
+        parser.add_argument('--batch-size', type=int, default=5000)
+        parser.add_argument('--prefix', default='synthetic', help='Username prefix for generated users')
+
+    def handle(self, *args, **options):
+        self.rng = random.Random(options['seed'])
+        self.batch_size = options['batch_size']
+        self.now = timezone.now()
+        prefix = options['prefix']
+
+        if User.objects.filter(username__startswith=f'{prefix}-').exists():
+            raise CommandError(f'Users prefixed "{prefix}-" already exist, pick another --prefix')
+
+        started = time.perf_counter()
+        with transaction.atomic(), manual_timestamps(Podcast, Episode, Playlist, Subscription):
+            users = self.create_users(prefix, options['users'])
+            categories = self.create_categories(prefix, options['categories'])
+            podcasts = self.create_podcasts(options['podcasts'], users, categories)
+            episodes = self.create_episodes(podcasts, options['episodes_per_podcast'])
+            self.create_playlists(users, episodes, options['playlists_per_user'],
+                                  options['episodes_per_playlist'], options['zipf'])
+            self.create_subscriptions(users, podcasts, options['subscriptions_per_user'], options['zipf'])
+
+        self.stdout.write(self.style.SUCCESS(f'Done in {time.perf_counter() - started:.1f}s'))
+
+    def report(self, label, count, started):
+        elapsed = time.perf_counter() - started
+        self.stdout.write(f'{label:<20} {count:>10,} rows  {count / max(elapsed, 1e-9):>12,.0f} rows/s')
+
+    def past(self, max_days=730):
+        return self.now - timedelta(seconds=self.rng.randrange(max_days * 86400))
+
+    def title(self, words=3):
+        return ' '.join(self.rng.choice(WORDS) for _ in range(words)).title()
+
+    def create_users(self, prefix, count):
+        started = time.perf_counter()
+        # Hashing is deliberately slow, every generated user shares one hash
+        password = make_password('password123')
+        users = User.objects.bulk_create([
+            User(username=f'{prefix}-{i}', email=f'{prefix}-{i}@example.com', password=password)
+            for i in range(count)
+        ], batch_size=self.batch_size)
+        self.report('users', len(users), started)
+        return [user.pk for user in users]
+
+    def create_categories(self, prefix, count):
+        started = time.perf_counter()
+        categories = Category.objects.bulk_create([
+            Category(name=f'{self.title(1)} {i}') for i in range(count)
+        ])
+        self.report('categories', len(categories), started)
+        return [category.pk for category in categories]
+
+    def create_podcasts(self, count, users, categories):
+        started = time.perf_counter()
+        # A minority of users create most shows
+        creators = self.rng.choices(users[:max(1, len(users) // 10)], k=count)
+        podcasts = Podcast.objects.bulk_create([
+            Podcast(
+                title=self.title(), description=f'{self.title(8)}.',
+                category_id=self.rng.choice(categories), creator_id=creators[i],
+                created_at=self.past(),
+            )
+            for i in range(count)
+        ], batch_size=self.batch_size)
+        self.report('podcasts', len(podcasts), started)
+        return [podcast.pk for podcast in podcasts]
+
+    def create_episodes(self, podcasts, per_podcast):
+        started = time.perf_counter()
+        rows = (
+            (f'{self.title()} #{n + 1}', f'{self.title(12)}.', self.rng.choice(SAMPLE_AUDIO),
+             podcast, self.rng.randint(5, 120), self.past())
+            for podcast in podcasts for n in range(per_podcast)
+        )
+        count = self.insert(Episode, ['title', 'description', 'audio_file', 'podcast_id', 'duration', 'created_at'], rows)
+        self.report('episodes', count, started)
+        return list(Episode.objects.filter(podcast_id__in=podcasts).order_by('pk').values_list('pk', flat=True))
+
+    def create_playlists(self, users, episodes, per_user, per_playlist, exponent):
+        started = time.perf_counter()
+        playlists = Playlist.objects.bulk_create([
+            Playlist(name=self.title(2), user_id=user, created_at=self.past(365))
+            for user in users for _ in range(per_user)
+        ], batch_size=self.batch_size)
+        self.report('playlists', len(playlists), started)
+
+        started = time.perf_counter()
+        # Popular episodes land in many playlists, the long tail in few
+        cum_weights = zipf_cum_weights(len(episodes), exponent)
+        rows = (
+            (playlist.pk, episode)
+            for playlist in playlists
+            for episode in set(self.rng.choices(episodes, cum_weights=cum_weights, k=per_playlist))
+        )
+        count = self.insert(Playlist.episodes.through, ['playlist_id', 'episode_id'], rows)
+        self.report('playlist episodes', count, started)
+
+    def create_subscriptions(self, users, podcasts, per_user, exponent):
+        started = time.perf_counter()
+        cum_weights = zipf_cum_weights(len(podcasts), exponent)
+        rows = (
+            (user, podcast, self.past(365))
+            for user in users
+            for podcast in set(self.rng.choices(podcasts, cum_weights=cum_weights, k=per_user))
+        )
+        count = self.insert(Subscription, ['user_id', 'podcast_id', 'created_at'], rows)
+        self.report('subscriptions', count, started)
+
+    def insert(self, model, columns, rows):
+        """Stream ``rows`` into ``model``'s table, with COPY on PostgreSQL and bulk_create elsewhere"""
+        count = 0
+        batch = []
+        for row in rows:
+            batch.append(row)
+            if len(batch) >= self.batch_size:
+                count += self.flush(model, columns, batch)
+                batch = []
+        if batch:
+            count += self.flush(model, columns, batch)
+        return count
+
+    def flush(self, model, columns, batch):
+        if connection.vendor == 'postgresql':
+            buffer = io.StringIO()
+            csv.writer(buffer).writerows(batch)
+            buffer.seek(0)
+            db_columns = ', '.join(model._meta.get_field(column).column for column in columns)
+            with connection.cursor() as cursor:
+                cursor.copy_expert(f'COPY {model._meta.db_table} ({db_columns}) FROM STDIN WITH (FORMAT csv)', buffer)
+        else:
+            model.objects.bulk_create([model(**dict(zip(columns, row))) for row in batch])
+        return len(batch)
@@ -0,0 +1,43 @@
+import resource
+import sys
+import time
+from pathlib import Path
+
+from django.core.management.base import BaseCommand, CommandError
+
+from api.exchange import Importer, read_csv, read_ndjson
+
+
+class Command(BaseCommand):
+    help = 'Import an export_data dump with batched upserts'
+
+    def add_arguments(self, parser):
+        parser.add_argument('input', help='NDJSON file, "-" for stdin, or a directory of CSV files')
+        parser.add_argument('--mode', choices=['upsert', 'append'], default='upsert',
+                            help='upsert keeps source ids (restore), append assigns new ids (seed/merge)')
+        parser.add_argument('--batch-size', type=int, default=5000)
+
+    def handle(self, *args, **options):
+        path = options['input']
+        importer = Importer(options['mode'], options['batch_size'])
+
+        started = time.perf_counter()
+        if path == '-':
+            counts = importer.run(read_ndjson(sys.stdin.buffer))
+        elif Path(path).is_dir():
+            counts = importer.run(read_csv(Path(path)))
+        elif Path(path).exists():
+            with open(path, 'rb') as fh:
+                counts = importer.run(read_ndjson(fh))
+        else:
+            raise CommandError(f'{path} does not exist')
+        elapsed = time.perf_counter() - started
+
+        total = sum(counts.values())
+        for kind, count in counts.items():
+            skipped = importer.skipped.get(kind)
+            self.stdout.write(f'{kind:<18} {count:>12,} rows' + (f'  ({skipped:,} skipped)' if skipped else ''))
+        self.stdout.write(self.style.SUCCESS(
+            f'{total:,} rows in {elapsed:.1f}s ({total / max(elapsed, 1e-9):,.0f} rows/s), '
+            f'peak RSS {resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024:.0f} MiB'
+        ))
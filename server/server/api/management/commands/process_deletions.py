@@ -0,0 +1,26 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from api.deletion import process_pending
+
+
+class Command(BaseCommand):
+    help = 'Remove podcasts and episodes marked for deletion, in batches, along with their storage objects'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=500)
+        parser.add_argument('--loop', action='store_true', help='Keep polling for new deletions')
+        parser.add_argument('--interval', type=float, default=10, help='Seconds between polls with --loop')
+
+    def handle(self, *args, **options):
+        while True:
+            totals = process_pending(options['batch_size'], log=self.stdout.write)
+            if any(totals.values()):
+                self.stdout.write(
+                    f'Removed {totals["podcasts"]} podcasts, {totals["episodes"]} episodes, '
+                    f'{totals["subscriptions"]} subscriptions'
+                )
+            if not options['loop']:
+                return
+            time.sleep(options['interval'])
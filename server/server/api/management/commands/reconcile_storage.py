@@ -0,0 +1,57 @@
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.files.storage import FileSystemStorage
+from django.core.management.base import BaseCommand
+
+from api.models import Podcast, Episode
+from api.reconcile import delete_orphans, find_orphans, referenced_names, storage_listing
+
+
+# label -> (model, field) whose storage and upload_to folder get reconciled
+TARGETS = {
+    'audio': (Episode, 'audio_file'),
+    'covers': (Podcast, 'cover_image'),
+}
+
+
+class Command(BaseCommand):
+    help = 'Find storage objects no podcast or episode references and delete them in rate-limited batches'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--dry-run', action='store_true', help='Only report orphans')
+        parser.add_argument('--target', choices=list(TARGETS), action='append', help='Only reconcile these targets')
+        parser.add_argument('--min-age-hours', type=float, default=24,
+                            help='Leave objects younger than this alone, their rows may not be committed yet')
+        parser.add_argument('--batch-size', type=int, default=100)
+        parser.add_argument('--pause', type=float, default=1.0, help='Seconds to sleep between delete batches')
+        parser.add_argument('--local', action='store_true', help='Reconcile MEDIA_ROOT instead of the configured storages')
+        parser.add_argument('--show', type=int, default=20, help='How many orphan names to print')
+
+    def handle(self, *args, **options):
+        local = FileSystemStorage(location=settings.MEDIA_ROOT) if options['local'] else None
+        for label in options['target'] or list(TARGETS):
+            model, field_name = TARGETS[label]
+            field = model._meta.get_field(field_name)
+            storage = local or field.storage
+            self.reconcile(label, storage, field.upload_to, options)
+
+    def reconcile(self, label, storage, prefix, options):
+        orphans, stats = find_orphans(
+            storage_listing(storage, prefix), referenced_names(), timedelta(hours=options['min_age_hours']),
+        )
+        with orphans:
+            self.stdout.write(
+                f'{label}: {stats["listed"]} objects listed, {stats["too_recent"]} too recent, '
+                f'{stats["orphans"]} orphaned ({stats["orphan_bytes"] / 1024 ** 2:.1f} MiB)'
+            )
+            for i, name in enumerate(orphans):
+                if i >= options['show']:
+                    self.stdout.write(f'  ... and {stats["orphans"] - i} more')
+                    break
+                self.stdout.write(f'  {name}')
+
+            if options['dry_run'] or not stats['orphans']:
+                return
+            deleted = delete_orphans(storage, orphans, options['batch_size'], options['pause'], log=self.stdout.write)
+            self.stdout.write(self.style.SUCCESS(f'{label}: deleted {deleted} orphaned objects'))
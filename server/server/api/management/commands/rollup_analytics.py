@@ -0,0 +1,23 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from api.analytics import catch_up
+
+
+class Command(BaseCommand):
+    help = 'Fold new analytics events into the hourly and daily rollups behind /api/creator/stats/'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, help='Event ids per transaction (default API_ANALYTICS["BATCH_SIZE"])')
+        parser.add_argument('--loop', action='store_true', help='Keep polling for new events')
+        parser.add_argument('--interval', type=float, default=60, help='Seconds between polls with --loop')
+
+    def handle(self, *args, **options):
+        while True:
+            totals = catch_up(options['batch_size'])
+            if totals['events']:
+                self.stdout.write(f'Rolled up {totals["events"]} events into {totals["rows"]} rollup rows')
+            if not options['loop']:
+                return
+            time.sleep(options['interval'])
@@ -0,0 +1,20 @@
+from django.core.management.base import BaseCommand
+
+from api.jobs import run_pool
+
+
+class Command(BaseCommand):
+    help = 'Run background jobs from the database queue'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--concurrency', type=int, default=1, help='Workers to run')
+        parser.add_argument('--threads', action='store_true', help='Run workers as threads instead of processes')
+        parser.add_argument('--burst', action='store_true', help='Exit once no job is ready')
+        parser.add_argument('--batch-size', type=int, help='Jobs claimed at a time (default API_JOBS["BATCH_SIZE"])')
+
+    def handle(self, *args, **options):
+        processed = run_pool(
+            options['concurrency'], options['threads'], options['burst'], options['batch_size'],
+            log=self.stdout.write,
+        )
+        self.stdout.write(f'Processed {processed} jobs')
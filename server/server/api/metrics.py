@@ -0,0 +1,111 @@
+import ipaddress
+import os
+import time
+
+from django.conf import settings
+from django.http import HttpResponse, HttpResponseForbidden
+from django.utils.crypto import constant_time_compare
+from prometheus_client import (
+    CONTENT_TYPE_LATEST,
+    REGISTRY,
+    CollectorRegistry,
+    Counter,
+    Gauge,
+    Histogram,
+    generate_latest,
+    multiprocess,
+)
+
+from .middleware import view_name
+
+
+# With PROMETHEUS_MULTIPROC_DIR set every worker writes its samples to mmap'd
+# files in that directory and /metrics merges them at scrape time.
+LATENCY_BUCKETS = (.005, .01, .025, .05, .1, .25, .5, 1, 2.5, 5, 10)
+
+REQUEST_LATENCY = Histogram(
+    'api_request_duration_seconds', 'Request latency by route',
+    ['method', 'route'], buckets=LATENCY_BUCKETS,
+)
+REQUESTS = Counter(
+    'api_requests_total', 'Responses by route and status code',
+    ['method', 'route', 'status'],
+)
+IN_FLIGHT = Gauge(
+    'api_requests_in_flight', 'Requests currently being handled',
+    multiprocess_mode='livesum',
+)
+DB_QUERIES = Counter('api_db_queries_total', 'SQL queries executed by route', ['route'])
+DB_QUERY_SECONDS = Counter('api_db_query_seconds_total', 'Time spent in SQL by route', ['route'])
+CACHE_REQUESTS = Counter('api_cache_requests_total', 'Cache lookups by cache and result', ['cache', 'result'])
+
+SUBSCRIPTIONS = Counter('api_subscriptions_total', 'Subscribe and unsubscribe actions', ['action'])
+PLAYLIST_ADDS = Counter('api_playlist_episode_adds_total', 'Episodes added to playlists')
+UPLOADS = Counter('api_uploads_total', 'Media uploads by outcome', ['outcome'])
+EVENT_CONNECTIONS = Gauge(
+    'api_event_stream_connections', 'Open /api/events/ streams',
+    multiprocess_mode='livesum',
+)
+EVENTS_PUBLISHED = Counter('api_events_published_total', 'Events published to stream topics', ['type'])
+JOBS = Counter('api_jobs_total', 'Background jobs run by task and outcome', ['task', 'outcome'])
+JOB_DURATION = Histogram('api_job_duration_seconds', 'Background job run time by task', ['task'], buckets=LATENCY_BUCKETS)
+THROTTLED = Counter('api_throttled_requests_total', 'Requests refused by a token-bucket throttle', ['scope'])
+
+
+def registry():
+    if 'PROMETHEUS_MULTIPROC_DIR' not in os.environ:
+        return REGISTRY
+    collector_registry = CollectorRegistry()
+    multiprocess.MultiProcessCollector(collector_registry)
+    return collector_registry
+
+
+def loopback(request):
+    try:
+        return ipaddress.ip_address(request.META.get('REMOTE_ADDR', '')).is_loopback
+    except ValueError:
+        return False
+
+
+def metrics_view(request):
+    """Prometheus text exposition, behind ``METRICS_TOKEN``, or to loopback clients only without one"""
+    token = settings.METRICS_TOKEN
+    if token:
+        allowed = constant_time_compare(request.headers.get('Authorization', ''), f'Bearer {token}')
+    else:
+        allowed = loopback(request)
+    if not allowed:
+        return HttpResponseForbidden()
+    return HttpResponse(generate_latest(registry()), content_type=CONTENT_TYPE_LATEST)
+
+
+class MetricsMiddleware:
+    """
+    Per-route latency, status and SQL counters.
+
+    Sits outside ``RequestTimingMiddleware`` so the query accounting it
+    collected is complete by the time the response comes back here.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        IN_FLIGHT.inc()
+        start = time.perf_counter()
+        try:
+            response = self.get_response(request)
+        finally:
+            IN_FLIGHT.dec()
+        elapsed = time.perf_counter() - start
+
+        route = view_name(request) or 'unmatched'
+        REQUEST_LATENCY.labels(request.method, route).observe(elapsed)
+        REQUESTS.labels(request.method, route, response.status_code).inc()
+
+        timings = getattr(request, 'timings', None)
+        if timings is not None and timings.queries:
+            DB_QUERIES.labels(route).inc(timings.query_count)
+            DB_QUERY_SECONDS.labels(route).inc(timings.query_time)
+
+        return response
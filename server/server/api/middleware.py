@@ -0,0 +1,120 @@
+import cProfile
+import json
+import logging
+import pstats
+import random
+import re
+import time
+from contextlib import ExitStack
+from pathlib import Path
+
+from django.conf import settings
+from django.db import connections
+
+from .instrumentation import RequestTimings, activate, deactivate, query_wrapper
+
+
+logger = logging.getLogger('api.performance')
+
+TIMED_SECTIONS = ['serialize', 'render', 'storage']
+
+
+def view_name(request):
+    match = getattr(request, 'resolver_match', None)
+    if match is None:
+        return None
+    return match.view_name or match.route
+
+
+def server_timing_header(timings, total):
+    parts = [f'db;dur={timings.query_time * 1000:.1f};desc="{timings.query_count} queries"']
+    for name in TIMED_SECTIONS:
+        if name in timings.durations:
+            parts.append(f'{name};dur={timings.durations[name] * 1000:.1f}')
+    parts.append(f'total;dur={total * 1000:.1f}')
+    return ', '.join(parts)
+
+
+class RequestTimingMiddleware:
+    """
+    Records SQL, serialization, render and storage time for every request.
+
+    The breakdown is sent back as a ``Server-Timing`` header and logged as one
+    JSON line on the ``api.performance`` logger. A sampled fraction of requests
+    runs under cProfile and slow ones are dumped to ``PROFILE_DIR``.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        config = settings.API_INSTRUMENTATION
+        self.sample_rate = config['PROFILE_SAMPLE_RATE']
+        self.slow_ms = config['SLOW_REQUEST_MS']
+        self.profile_dir = Path(config['PROFILE_DIR'])
+        self.profile_keep = config['PROFILE_KEEP']
+        self.duplicate_threshold = config['DUPLICATE_QUERY_THRESHOLD']
+
+    def __call__(self, request):
+        timings = RequestTimings()
+        request.timings = timings
+
+        profiler = None
+        if self.sample_rate and random.random() < self.sample_rate:
+            profiler = cProfile.Profile()
+
+        token = activate(timings)
+        start = time.perf_counter()
+        try:
+            with ExitStack() as stack:
+                for alias in connections:
+                    stack.enter_context(connections[alias].execute_wrapper(query_wrapper))
+                if profiler is not None:
+                    profiler.enable()
+                try:
+                    response = self.get_response(request)
+                finally:
+                    if profiler is not None:
+                        profiler.disable()
+        finally:
+            deactivate(token)
+        total = time.perf_counter() - start
+
+        response['Server-Timing'] = server_timing_header(timings, total)
+        self.log(request, response, timings, total)
+
+        if profiler is not None and total * 1000 >= self.slow_ms:
+            self.dump_profile(profiler, request)
+
+        return response
+
+    def log(self, request, response, timings, total):
+        duplicates = timings.duplicate_queries(self.duplicate_threshold)
+        slow = total * 1000 >= self.slow_ms
+        level = logging.WARNING if duplicates or slow else logging.INFO
+        if not logger.isEnabledFor(level):
+            return
+
+        record = {
+            'method': request.method,
+            'path': request.path,
+            'view': view_name(request),
+            'status': response.status_code,
+            'total_ms': round(total * 1000, 2),
+            'db_queries': timings.query_count,
+            'db_ms': round(timings.query_time * 1000, 2),
+        }
+        for name in TIMED_SECTIONS:
+            record[f'{name}_ms'] = round(timings.durations.get(name, 0.0) * 1000, 2)
+        if duplicates:
+            # Same SQL template run over and over is the N+1 signature
+            record['duplicate_queries'] = [{'sql': sql, 'count': count} for sql, count in duplicates]
+        logger.log(level, json.dumps(record))
+
+    def dump_profile(self, profiler, request):
+        self.profile_dir.mkdir(parents=True, exist_ok=True)
+        name = re.sub(r'[^A-Za-z0-9_.-]+', '_', view_name(request) or request.path).strip('_')
+        path = self.profile_dir / f'{time.time_ns()}-{name or "root"}.prof'
+        pstats.Stats(profiler).dump_stats(path)
+
+        dumps = sorted(self.profile_dir.glob('*.prof'))
+        for old in dumps[:-self.profile_keep]:
+            old.unlink(missing_ok=True)
@@ -0,0 +1,50 @@
+# Generated by Django 5.2.3 on 2026-10-19 02:43
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+# icontains can only use an index through pg_trgm; other backends keep scanning
+TRIGRAM_INDEXES = [
+    ('api_podcast_title_trgm', 'api_podcast', 'title'),
+    ('api_episode_title_trgm', 'api_episode', 'title'),
+    ('api_playlist_name_trgm', 'api_playlist', 'name'),
+    ('auth_user_username_trgm', 'auth_user', 'username'),
+]
+
+
+def create_trigram_indexes(apps, schema_editor):
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    schema_editor.execute('CREATE EXTENSION IF NOT EXISTS pg_trgm')
+    for name, table, column in TRIGRAM_INDEXES:
+        schema_editor.execute(
+            f'CREATE INDEX IF NOT EXISTS {name} ON {table} USING gin (UPPER({column}) gin_trgm_ops)'
+        )
+
+
+def drop_trigram_indexes(apps, schema_editor):
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    for name, _, _ in TRIGRAM_INDEXES:
+        schema_editor.execute(f'DROP INDEX IF EXISTS {name}')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0004_alter_episode_audio_file'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='episode',
+            index=models.Index(fields=['-created_at'], name='episode_created_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='podcast',
+            index=models.Index(fields=['-created_at'], name='podcast_created_idx'),
+        ),
+        migrations.RunPython(create_trigram_indexes, drop_trigram_indexes),
+    ]
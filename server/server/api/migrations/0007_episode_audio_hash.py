@@ -0,0 +1,18 @@
+# Generated by Django 5.2.3 on 2026-10-19 02:50
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0006_deferred_deletion'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='episode',
+            name='audio_hash',
+            field=models.CharField(blank=True, db_index=True, editable=False, max_length=64),
+        ),
+    ]
@@ -0,0 +1,79 @@
+# Generated by Django 5.2.3 on 2026-10-19 03:09
+
+import django.db.models.deletion
+import django.utils.timezone
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0007_episode_audio_hash'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='RollupWatermark',
+            fields=[
+                ('name', models.CharField(max_length=50, primary_key=True, serialize=False)),
+                ('position', models.BigIntegerField(default=0)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='AnalyticsEvent',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('kind', models.CharField(choices=[('play', 'Play'), ('subscribe', 'Subscribe'), ('unsubscribe', 'Unsubscribe'), ('playlist_add', 'Playlist add')], max_length=16)),
+                ('seconds', models.PositiveIntegerField(default=0, help_text='Seconds listened, plays only')),
+                ('completed', models.BooleanField(default=False)),
+                ('created_at', models.DateTimeField(default=django.utils.timezone.now)),
+                ('episode', models.ForeignKey(blank=True, db_index=False, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='+', to='api.episode')),
+                ('podcast', models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, related_name='+', to='api.podcast')),
+                ('user', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'indexes': [models.Index(fields=['episode', 'created_at'], name='event_episode_idx'), models.Index(fields=['podcast', 'created_at'], name='event_podcast_idx')],
+            },
+        ),
+        migrations.CreateModel(
+            name='EpisodeRollup',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('period', models.CharField(choices=[('hour', 'Hour'), ('day', 'Day')], max_length=4)),
+                ('bucket', models.DateTimeField(help_text='Start of the hour or day, UTC')),
+                ('plays', models.PositiveIntegerField(default=0)),
+                ('listeners', models.PositiveIntegerField(default=0)),
+                ('completions', models.PositiveIntegerField(default=0)),
+                ('listened_seconds', models.PositiveBigIntegerField(default=0)),
+                ('playlist_adds', models.PositiveIntegerField(default=0)),
+                ('episode', models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, related_name='+', to='api.episode')),
+                ('podcast', models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, related_name='+', to='api.podcast')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['podcast', 'period', 'bucket'], name='episode_rollup_podcast_idx')],
+                'constraints': [models.UniqueConstraint(fields=('episode', 'period', 'bucket'), name='episode_rollup_key')],
+            },
+        ),
+        migrations.CreateModel(
+            name='PodcastRollup',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('period', models.CharField(choices=[('hour', 'Hour'), ('day', 'Day')], max_length=4)),
+                ('bucket', models.DateTimeField(help_text='Start of the hour or day, UTC')),
+                ('plays', models.PositiveIntegerField(default=0)),
+                ('listeners', models.PositiveIntegerField(default=0)),
+                ('completions', models.PositiveIntegerField(default=0)),
+                ('listened_seconds', models.PositiveBigIntegerField(default=0)),
+                ('playlist_adds', models.PositiveIntegerField(default=0)),
+                ('subscribes', models.PositiveIntegerField(default=0)),
+                ('unsubscribes', models.PositiveIntegerField(default=0)),
+                ('podcast', models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, related_name='+', to='api.podcast')),
+            ],
+            options={
+                'constraints': [models.UniqueConstraint(fields=('podcast', 'period', 'bucket'), name='podcast_rollup_key')],
+            },
+        ),
+    ]
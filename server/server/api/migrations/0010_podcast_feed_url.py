@@ -0,0 +1,19 @@
+# Generated by Django 5.2.3 on 2026-10-19 03:44
+
+import api.fields
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0009_job_queue'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='podcast',
+            name='feed_url',
+            field=api.fields.FeedURLField(blank=True, db_index=True, help_text='RSS feed the show is also published at; OPML imports match on it', max_length=500),
+        ),
+    ]
@@ -0,0 +1,19 @@
+# Generated by Django 5.2.3 on 2026-10-19 03:51
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0010_podcast_feed_url'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='analyticsevent',
+            index=models.Index(condition=models.Q(('kind', 'play')), fields=['user', 'episode', '-created_at'], name='event_user_play_idx'),
+        ),
+    ]
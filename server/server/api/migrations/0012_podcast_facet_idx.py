@@ -0,0 +1,19 @@
+# Generated by Django 5.2.3 on 2026-10-19 03:57
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0011_analyticsevent_user_play_idx'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='podcast',
+            index=models.Index(condition=models.Q(('deleted_at__isnull', True)), fields=['category', 'creator'], name='podcast_facet_idx'),
+        ),
+    ]
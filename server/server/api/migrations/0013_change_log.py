@@ -0,0 +1,32 @@
+# Generated by Django 5.2.3 on 2026-10-19 04:04
+
+import django.db.models.deletion
+import django.utils.timezone
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0012_podcast_facet_idx'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Change',
+            fields=[
+                ('id', models.BigAutoField(primary_key=True, serialize=False)),
+                ('kind', models.CharField(choices=[('s', 'Subscription'), ('p', 'Playlist'), ('m', 'Playlist episode'), ('e', 'Episode'), ('c', 'Podcast')], max_length=1)),
+                ('ref', models.BigIntegerField()),
+                ('parent', models.BigIntegerField(default=0)),
+                ('created_at', models.DateTimeField(default=django.utils.timezone.now)),
+                ('podcast', models.ForeignKey(blank=True, db_constraint=False, db_index=False, null=True, on_delete=django.db.models.deletion.DO_NOTHING, related_name='+', to='api.podcast')),
+                ('user', models.ForeignKey(blank=True, db_index=False, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='+', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'indexes': [models.Index(condition=models.Q(('user__isnull', False)), fields=['user', 'id'], name='change_user_idx'), models.Index(condition=models.Q(('podcast__isnull', False)), fields=['podcast', 'id'], name='change_podcast_idx'), models.Index(fields=['created_at'], name='change_created_idx')],
+            },
+        ),
+    ]
@@ -0,0 +1,33 @@
+# Generated by Django 5.2.3 on 2026-10-19 04:12
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0013_change_log'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='episode',
+            name='gain_db',
+            field=models.FloatField(blank=True, editable=False, help_text="Playback gain to API_LOUDNESS['TARGET_LUFS'], under the peak ceiling", null=True),
+        ),
+        migrations.AddField(
+            model_name='episode',
+            name='loudness_lufs',
+            field=models.FloatField(blank=True, editable=False, help_text='Integrated loudness (BS.1770)', null=True),
+        ),
+        migrations.AddField(
+            model_name='episode',
+            name='loudness_measured_at',
+            field=models.DateTimeField(blank=True, editable=False, null=True),
+        ),
+        migrations.AddField(
+            model_name='episode',
+            name='true_peak_dbtp',
+            field=models.FloatField(blank=True, editable=False, null=True),
+        ),
+    ]
@@ -0,0 +1,27 @@
+# Generated by Django 5.2.3 on 2026-10-19 04:25
+
+import django.db.models.deletion
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0014_episode_loudness'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Chapters',
+            fields=[
+                ('episode', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='chapters', serialize=False, to='api.episode')),
+                ('markers', models.BinaryField()),
+                ('seconds', models.FloatField(help_text='Length of the analysed audio')),
+                ('analyzed_at', models.DateTimeField(default=django.utils.timezone.now)),
+            ],
+            options={
+                'verbose_name_plural': 'Chapters',
+            },
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.3 on 2026-10-19 04:36
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0015_episode_chapters'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='episode',
+            name='audio_hash',
+            field=models.CharField(blank=True, db_default='', db_index=True, default='', editable=False, max_length=64),
+        ),
+    ]
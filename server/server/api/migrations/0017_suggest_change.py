@@ -0,0 +1,25 @@
+# Generated by Django 5.2.3 on 2026-10-19 04:41
+
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0016_episode_audio_hash_default'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SuggestChange',
+            fields=[
+                ('id', models.BigAutoField(primary_key=True, serialize=False)),
+                ('op', models.CharField(max_length=3)),
+                ('kind', models.CharField(max_length=8)),
+                ('ref', models.BigIntegerField()),
+                ('text', models.TextField(blank=True)),
+                ('created_at', models.DateTimeField(db_index=True, default=django.utils.timezone.now)),
+            ],
+        ),
+    ]
@@ -0,0 +1,20 @@
+# Generated by Django 5.2.3 on 2026-10-19 04:47
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0017_suggest_change'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CacheGeneration',
+            fields=[
+                ('name', models.CharField(max_length=50, primary_key=True, serialize=False)),
+                ('number', models.BigIntegerField(default=0)),
+            ],
+        ),
+    ]
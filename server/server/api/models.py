@@ -1,9 +1,86 @@
-from django.db import models
+from django.db import models, transaction
 from django.contrib.auth.models import User
-from .fields import AudioFileField
+from django.utils import timezone
+from .fields import AudioFileField, FeedURLField
+from .hydrate import invalidate
+from .instrumentation import timed
+from .metrics import UPLOADS
+from .uploads import content_hash
 
 # Create your models here.
 
+class LiveManager(models.Manager):
+    """Hides rows marked for deletion, ``all_objects`` still reaches them"""
+    
+    def get_queryset(self):
+        return super().get_queryset().filter(deleted_at__isnull=True)
+
+
+class PodcastQuerySet(models.QuerySet):
+    
+    def mark_deleted(self):
+        """Hide the podcasts and their episodes now, ``process_deletions`` removes them later"""
+        now = timezone.now()
+        with transaction.atomic():
+            rows = list(self.values_list('pk', 'creator_id'))
+            ids = [pk for pk, _ in rows]
+            Podcast.all_objects.filter(pk__in=ids, deleted_at__isnull=True).update(deleted_at=now)
+            # Flag the episodes too so episode queries don't need to join podcasts
+            episodes = Episode.all_objects.filter(podcast_id__in=ids, deleted_at__isnull=True)
+            episode_ids = list(episodes.values_list('pk', flat=True))
+            episodes.update(deleted_at=now)
+        # Updates skip post_save, drop cached payloads by hand
+        invalidate(Podcast, ids)
+        invalidate(Episode, episode_ids)
+        forget_suggestions('podcast', ids)
+        forget_suggestions('episode', episode_ids)
+        drop_home_sections(Podcast, {creator for _, creator in rows})
+        drop_home_sections(Episode)
+        retire_facets()
+        log_changes(Change.PODCAST, [(pk, pk) for pk in ids])
+        return len(ids)
+
+
+class EpisodeQuerySet(models.QuerySet):
+    
+    def mark_deleted(self):
+        rows = list(self.values_list('pk', 'podcast_id'))
+        ids = [pk for pk, _ in rows]
+        marked = Episode.all_objects.filter(pk__in=ids, deleted_at__isnull=True).update(deleted_at=timezone.now())
+        invalidate(Episode, ids)
+        forget_suggestions('episode', ids)
+        drop_home_sections(Episode)
+        log_changes(Change.EPISODE, rows)
+        return marked
+
+
+def forget_suggestions(kind, ids):
+    # api.suggest builds from these models, so it can't be imported up top
+    from .suggest import forget
+    forget(kind, ids)
+
+
+def drop_home_sections(model, owners=()):
+    from .home import drop_sections
+    drop_sections(model, owners)
+
+
+def retire_facets():
+    from .facets import bump
+    bump()
+
+
+def log_changes(kind, pairs):
+    from .sync import log_podcast_changes
+    log_podcast_changes(kind, pairs)
+
+
+class SubscriptionManager(models.Manager):
+    
+    def get_queryset(self):
+        return super().get_queryset().filter(podcast__deleted_at__isnull=True)
+
+
 class Category(models.Model):
     name = models.CharField(max_length=100)
     def __str__(self):
@@ -16,11 +93,25 @@ class Podcast(models.Model):
     title = models.CharField(max_length=200)
     description = models.TextField()
     cover_image = models.ImageField(upload_to='podcasts/', blank=True)
+    feed_url = FeedURLField(max_length=500, blank=True, db_index=True, help_text="RSS feed the show is also published at; OPML imports match on it")
     category = models.ForeignKey(Category, on_delete=models.CASCADE)
     creator = models.ForeignKey(User, on_delete=models.CASCADE)
     created_at = models.DateTimeField(auto_now_add=True)
+    deleted_at = models.DateTimeField(null=True, blank=True, editable=False)
     
-
+    objects = LiveManager.from_queryset(PodcastQuerySet)()
+    all_objects = PodcastQuerySet.as_manager()
+    
+    class Meta:
+        indexes = [
+            models.Index(fields=['-created_at'], name='podcast_created_idx'),
+            models.Index(fields=['deleted_at'], name='podcast_deleted_idx', condition=models.Q(deleted_at__isnull=False)),
+            # Covers the facet count's GROUP BY category, creator (api.facets)
+            models.Index(fields=['category', 'creator'], name='podcast_facet_idx', condition=models.Q(deleted_at__isnull=True)),
+        ]
+    
+    def mark_deleted(self):
+        Podcast.objects.filter(pk=self.pk).mark_deleted()
     
     def __str__(self):
         return self.title
@@ -29,13 +120,43 @@ class Episode(models.Model):
     title = models.CharField(max_length=200)
     description = models.TextField()
     audio_file = AudioFileField(upload_to='episodes/')
+    # SHA-256 of the audio, episodes with identical files share one stored object. The
+    # database default covers raw inserts that leave it out, like generate_dataset's COPY
+    audio_hash = models.CharField(max_length=64, blank=True, default='', db_default='', db_index=True, editable=False)
     podcast = models.ForeignKey(Podcast, on_delete=models.CASCADE)
     duration = models.IntegerField(help_text="Duration in minutes")
+    # Measured by api.loudness after upload; null until then, and for silence
+    loudness_lufs = models.FloatField(null=True, blank=True, editable=False, help_text="Integrated loudness (BS.1770)")
+    true_peak_dbtp = models.FloatField(null=True, blank=True, editable=False)
+    gain_db = models.FloatField(null=True, blank=True, editable=False, help_text="Playback gain to API_LOUDNESS['TARGET_LUFS'], under the peak ceiling")
+    loudness_measured_at = models.DateTimeField(null=True, blank=True, editable=False)
     created_at = models.DateTimeField(auto_now_add=True)
+    deleted_at = models.DateTimeField(null=True, blank=True, editable=False)
+    
+    objects = LiveManager.from_queryset(EpisodeQuerySet)()
+    all_objects = EpisodeQuerySet.as_manager()
+    
+    class Meta:
+        indexes = [
+            models.Index(fields=['-created_at'], name='episode_created_idx'),
+            models.Index(fields=['deleted_at'], name='episode_deleted_idx', condition=models.Q(deleted_at__isnull=False)),
+        ]
+    
+    def mark_deleted(self):
+        Episode.objects.filter(pk=self.pk).mark_deleted()
     
     def save(self, *args, **kwargs):
         # If this is a new upload, ensure it goes to Cloudinary with correct resource type
-        if self.pk is None and self.audio_file:
+        if self.pk is None and self.audio_file and not self.audio_file._committed:
+            self.audio_hash = content_hash(self.audio_file.file)
+            known = Episode.objects.filter(audio_hash=self.audio_hash).values_list('audio_file', flat=True).first()
+            if known:
+                # Same bytes are already stored, point at them instead of uploading again
+                self.audio_file.name = known
+                self.audio_file._committed = True
+                UPLOADS.labels('deduplicated').inc()
+        
+        if self.pk is None and self.audio_file and not self.audio_file._committed:
             try:
                 # Check if it's an audio file
                 file_name = self.audio_file.name
@@ -46,20 +167,24 @@ class Episode(models.Model):
                     import cloudinary.uploader
                     
                     # Upload directly to Cloudinary with raw resource type
-                    result = cloudinary.uploader.upload(
-                        self.audio_file.file,
-                        folder="episodes",
-                        resource_type="raw",
-                        use_filename=True,
-                        unique_filename=True,
-                        overwrite=False
-                    )
+                    with timed('storage'):
+                        result = cloudinary.uploader.upload(
+                            self.audio_file.file,
+                            folder="episodes",
+                            resource_type="raw",
+                            use_filename=True,
+                            unique_filename=True,
+                            overwrite=False
+                        )
                     
                     # Store the public_id instead of the file
                     self.audio_file.name = result.get('public_id')
+                    # Already stored, don't let the field upload it a second time
+                    self.audio_file._committed = True
+                    UPLOADS.labels('ok').inc()
             except Exception as e:
                 # If direct upload fails, proceed with normal save
-                pass
+                UPLOADS.labels('error').inc()
         
         super().save(*args, **kwargs)
     
@@ -107,6 +232,18 @@ class Episode(models.Model):
     def __str__(self):
         return self.title
 
+class Chapters(models.Model):
+    """Chapter boundaries found in an episode's audio by ``api.chapters``"""
+    episode = models.OneToOneField(Episode, on_delete=models.CASCADE, primary_key=True, related_name='chapters')
+    # Packed by api.chapters.pack, 5 bytes per boundary; an hour rarely needs 100
+    markers = models.BinaryField()
+    seconds = models.FloatField(help_text="Length of the analysed audio")
+    analyzed_at = models.DateTimeField(default=timezone.now)
+    
+    class Meta:
+        verbose_name_plural = "Chapters"
+
+
 class Playlist(models.Model):
     name = models.CharField(max_length=200)
     user = models.ForeignKey(User, on_delete=models.CASCADE)
@@ -121,8 +258,184 @@ class Subscription(models.Model):
     podcast = models.ForeignKey(Podcast, on_delete=models.CASCADE)
     created_at = models.DateTimeField(auto_now_add=True)
     
+    # Subscriptions to podcasts awaiting deletion are hidden until they are purged
+    objects = SubscriptionManager()
+    all_objects = models.Manager()
+    
     class Meta:
         unique_together = ['user', 'podcast']
     
     def __str__(self):
         return f"{self.user.username} follows {self.podcast.title}"
+
+
+class AnalyticsEvent(models.Model):
+    """Append-only log the analytics rollups are built from, see ``api.analytics``"""
+    PLAY = 'play'
+    SUBSCRIBE = 'subscribe'
+    UNSUBSCRIBE = 'unsubscribe'
+    PLAYLIST_ADD = 'playlist_add'
+    KINDS = [
+        (PLAY, 'Play'),
+        (SUBSCRIBE, 'Subscribe'),
+        (UNSUBSCRIBE, 'Unsubscribe'),
+        (PLAYLIST_ADD, 'Playlist add'),
+    ]
+    
+    kind = models.CharField(max_length=16, choices=KINDS)
+    # Indexed together with created_at below
+    podcast = models.ForeignKey(Podcast, on_delete=models.CASCADE, related_name='+', db_index=False)
+    episode = models.ForeignKey(Episode, on_delete=models.CASCADE, related_name='+', db_index=False, null=True, blank=True)
+    user = models.ForeignKey(User, on_delete=models.SET_NULL, related_name='+', null=True, blank=True)
+    seconds = models.PositiveIntegerField(default=0, help_text="Seconds listened, plays only")
+    completed = models.BooleanField(default=False)
+    created_at = models.DateTimeField(default=timezone.now)
+    
+    class Meta:
+        indexes = [
+            models.Index(fields=['episode', 'created_at'], name='event_episode_idx'),
+            models.Index(fields=['podcast', 'created_at'], name='event_podcast_idx'),
+            # A viewer's last play of each episode, for resume positions (api.viewer)
+            models.Index(fields=['user', 'episode', '-created_at'], name='event_user_play_idx', condition=models.Q(kind='play')),
+        ]
+
+
+class Rollup(models.Model):
+    HOUR = 'hour'
+    DAY = 'day'
+    PERIODS = [(HOUR, 'Hour'), (DAY, 'Day')]
+    
+    period = models.CharField(max_length=4, choices=PERIODS)
+    bucket = models.DateTimeField(help_text="Start of the hour or day, UTC")
+    plays = models.PositiveIntegerField(default=0)
+    listeners = models.PositiveIntegerField(default=0)
+    completions = models.PositiveIntegerField(default=0)
+    listened_seconds = models.PositiveBigIntegerField(default=0)
+    playlist_adds = models.PositiveIntegerField(default=0)
+    
+    class Meta:
+        abstract = True
+
+
+class EpisodeRollup(Rollup):
+    episode = models.ForeignKey(Episode, on_delete=models.CASCADE, related_name='+', db_index=False)
+    podcast = models.ForeignKey(Podcast, on_delete=models.CASCADE, related_name='+', db_index=False)
+    
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['episode', 'period', 'bucket'], name='episode_rollup_key'),
+        ]
+        indexes = [
+            models.Index(fields=['podcast', 'period', 'bucket'], name='episode_rollup_podcast_idx'),
+        ]
+
+
+class PodcastRollup(Rollup):
+    podcast = models.ForeignKey(Podcast, on_delete=models.CASCADE, related_name='+', db_index=False)
+    subscribes = models.PositiveIntegerField(default=0)
+    unsubscribes = models.PositiveIntegerField(default=0)
+    
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['podcast', 'period', 'bucket'], name='podcast_rollup_key'),
+        ]
+
+
+class SuggestChange(models.Model):
+    """
+    Saves and deletes since the suggestion index files were built, replayed
+    on top of them by every host (``api.suggest``)
+    """
+    id = models.BigAutoField(primary_key=True)
+    op = models.CharField(max_length=3)     # 'put' or 'del'
+    kind = models.CharField(max_length=8)   # api.suggest.KINDS
+    ref = models.BigIntegerField()
+    text = models.TextField(blank=True)
+    created_at = models.DateTimeField(default=timezone.now, db_index=True)
+
+
+class StreamTicket(models.Model):
+    """Single-use pass to ``/api/events/``, see ``api.events.issue_ticket``; only the key's digest is stored"""
+    digest = models.CharField(max_length=64, primary_key=True)
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='+')
+    created_at = models.DateTimeField(default=timezone.now, db_index=True)
+
+
+class Change(models.Model):
+    """
+    Append-only log of which rows changed for whom, read by delta sync
+    (``api.sync``). A row only names what changed; sync reads the current
+    state, so older rows for the same key can be compacted away.
+    """
+    SUBSCRIPTION = 's'      # ref: podcast, for user
+    PLAYLIST = 'p'          # ref: playlist, for user
+    PLAYLIST_EPISODE = 'm'  # ref: episode, parent: playlist, for user
+    EPISODE = 'e'           # ref: episode, for the podcast's subscribers
+    PODCAST = 'c'           # ref: podcast, for its subscribers
+    KINDS = [
+        (SUBSCRIPTION, 'Subscription'),
+        (PLAYLIST, 'Playlist'),
+        (PLAYLIST_EPISODE, 'Playlist episode'),
+        (EPISODE, 'Episode'),
+        (PODCAST, 'Podcast'),
+    ]
+    
+    id = models.BigAutoField(primary_key=True)
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='+', db_index=False, null=True, blank=True)
+    # No constraint: rows about a purged podcast must outlive it to reach its former subscribers
+    podcast = models.ForeignKey(Podcast, on_delete=models.DO_NOTHING, db_constraint=False, related_name='+', db_index=False, null=True, blank=True)
+    kind = models.CharField(max_length=1, choices=KINDS)
+    ref = models.BigIntegerField()
+    parent = models.BigIntegerField(default=0)  # 0 unless set above; compaction compares keys with =
+    created_at = models.DateTimeField(default=timezone.now)
+    
+    class Meta:
+        indexes = [
+            models.Index(fields=['user', 'id'], name='change_user_idx', condition=models.Q(user__isnull=False)),
+            models.Index(fields=['podcast', 'id'], name='change_podcast_idx', condition=models.Q(podcast__isnull=False)),
+            models.Index(fields=['created_at'], name='change_created_idx'),
+        ]
+
+
+class RollupWatermark(models.Model):
+    """Last event a rollup job has folded in"""
+    name = models.CharField(max_length=50, primary_key=True)
+    position = models.BigIntegerField(default=0)
+    updated_at = models.DateTimeField(auto_now=True)
+
+
+class CacheGeneration(models.Model):
+    """Number in the keys of a family of cached entries; bumping it retires them all on every host"""
+    name = models.CharField(max_length=50, primary_key=True)
+    number = models.BigIntegerField(default=0)
+
+
+class Job(models.Model):
+    """A task call waiting for ``runworker``, see ``api.jobs``"""
+    QUEUED = 'queued'
+    RUNNING = 'running'
+    DEAD = 'dead'
+    STATUSES = [(QUEUED, 'Queued'), (RUNNING, 'Running'), (DEAD, 'Dead')]
+    
+    task = models.CharField(max_length=200)
+    args = models.JSONField(default=list, blank=True)
+    kwargs = models.JSONField(default=dict, blank=True)
+    priority = models.SmallIntegerField(default=0, help_text="Higher runs first")
+    status = models.CharField(max_length=8, choices=STATUSES, default=QUEUED)
+    run_at = models.DateTimeField(default=timezone.now, help_text="Not claimed before this time")
+    attempts = models.PositiveSmallIntegerField(default=0)
+    max_attempts = models.PositiveSmallIntegerField(default=5)
+    locked_by = models.CharField(max_length=100, blank=True)
+    locked_at = models.DateTimeField(null=True, blank=True)
+    last_error = models.TextField(blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    
+    class Meta:
+        indexes = [
+            # Only the rows workers poll for, finished jobs are deleted
+            models.Index(fields=['-priority', 'run_at'], name='job_ready_idx', condition=models.Q(status='queued')),
+            models.Index(fields=['locked_at'], name='job_running_idx', condition=models.Q(status='running')),
+        ]
+    
+    def __str__(self):
+        return f"{self.task} #{self.pk}"
@@ -0,0 +1,211 @@
+"""
+OPML import and export of a listener's subscriptions.
+
+Each outline of an imported file is matched to a podcast in this order:
+- by the podcast's ``feed_url``, compared as ``canonical_feed_url`` and
+  treating http and https as the same feed;
+- by the ``/api/podcasts/<id>/`` URL that exports write for shows without a
+  feed, when it points at this host;
+- by title, when exactly one podcast has that title.
+
+An import runs a fixed number of queries however long the file is:
+- one query resolves every outline;
+- one reads the viewer's existing subscriptions;
+- one ``INSERT ... ON CONFLICT DO NOTHING`` adds the new subscriptions
+  (``unique_together`` still decides on races);
+- one insert logs the subscribe events;
+- one insert logs the changes for delta sync.
+
+SQLite caps statements at 999 parameters, so there the two inserts are split
+into batches.
+"""
+import re
+import xml.etree.ElementTree as ET
+from email.utils import format_datetime
+from urllib.parse import urlsplit
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Q
+from django.db.models.functions import Upper
+from django.urls import Resolver404, resolve, reverse
+from django.utils import timezone
+from rest_framework.parsers import BaseParser
+
+from .events import subscription_saved
+from .fields import canonical_feed_url
+from .home import drop_cached
+from .metrics import SUBSCRIPTIONS
+from .models import AnalyticsEvent, Podcast, Subscription
+from .sync import log_subscriptions
+
+# OPML has no use for a DTD, and without one there are no entities to expand
+DTD = re.compile(rb'<!\s*(DOCTYPE|ENTITY)', re.IGNORECASE)
+
+SUBSCRIBED = 'subscribed'
+ALREADY_SUBSCRIBED = 'already_subscribed'
+DUPLICATE = 'duplicate'
+NOT_FOUND = 'not_found'
+OUTCOMES = (SUBSCRIBED, ALREADY_SUBSCRIBED, DUPLICATE, NOT_FOUND)
+
+
+class OPMLError(ValueError):
+    pass
+
+
+class OPMLParser(BaseParser):
+    """The raw request body; apps send OPML as text/x-opml, text/xml, application/xml or no type at all"""
+
+    media_type = '*/*'
+
+    def parse(self, stream, media_type=None, parser_context=None):
+        return stream.read(settings.API_OPML['MAX_BYTES'] + 1) if stream is not None else b''
+
+
+# Export
+
+def feed_link(request, podcast_id, feed_url):
+    return feed_url or request.build_absolute_uri(reverse('podcast-detail', args=[podcast_id]))
+
+
+def export(request):
+    """The viewer's subscriptions as an OPML 2.0 document (bytes)"""
+    rows = (
+        Subscription.objects.filter(user=request.user).order_by('created_at', 'pk')
+        .values_list('podcast_id', 'podcast__title', 'podcast__feed_url')
+    )
+    root = ET.Element('opml', version='2.0')
+    head = ET.SubElement(root, 'head')
+    ET.SubElement(head, 'title').text = f'{request.user.username} subscriptions'
+    ET.SubElement(head, 'dateCreated').text = format_datetime(timezone.now(), usegmt=True)
+    body = ET.SubElement(root, 'body')
+    for podcast_id, title, feed_url in rows.iterator():
+        ET.SubElement(body, 'outline', type='rss', text=title, title=title, xmlUrl=feed_link(request, podcast_id, feed_url))
+    return ET.tostring(root, encoding='utf-8', xml_declaration=True)
+
+
+# Import
+
+def parse(data):
+    """``(title, xml_url)`` for every feed outline, with folders flattened"""
+    config = settings.API_OPML
+    if isinstance(data, str):
+        data = data.encode()
+    if not data:
+        raise OPMLError('The OPML document is empty.')
+    if len(data) > config['MAX_BYTES']:
+        raise OPMLError(f'OPML documents are limited to {config["MAX_BYTES"] // 1024} KiB.')
+    if DTD.search(data):
+        raise OPMLError('OPML documents may not declare a DTD or entities.')
+    try:
+        root = ET.fromstring(data)
+    except ET.ParseError as exc:
+        raise OPMLError(f'Not a valid XML document: {exc}.')
+    body = root.find('body') if root.tag == 'opml' else None
+    if body is None:
+        raise OPMLError('Not an OPML document, expected <opml> with a <body>.')
+
+    outlines = []
+    for outline in body.iter('outline'):
+        attrs = {name.lower(): value.strip() for name, value in outline.attrib.items()}
+        if not attrs.get('xmlurl') and attrs.get('type', '').lower() != 'rss':
+            continue
+        outlines.append((attrs.get('title') or attrs.get('text') or '', attrs.get('xmlurl', '')))
+    if len(outlines) > config['MAX_OUTLINES']:
+        raise OPMLError(f'OPML documents are limited to {config["MAX_OUTLINES"]} feeds.')
+    return outlines
+
+
+def feed_variants(url):
+    """Spellings of ``url`` that name the same feed, the given scheme first"""
+    url = canonical_feed_url(url)
+    scheme, _, rest = url.partition('://')
+    if scheme == 'https':
+        return [url, f'http://{rest}']
+    if scheme == 'http':
+        return [url, f'https://{rest}']
+    return [url]
+
+
+def own_podcast_id(url, host):
+    """The podcast a ``/api/podcasts/<id>/`` URL on this host points at"""
+    parts = urlsplit(url)
+    if parts.scheme not in ('http', 'https') or parts.netloc.lower() != host.lower():
+        return None
+    try:
+        match = resolve(parts.path)
+    except Resolver404:
+        return None
+    pk = match.kwargs.get('pk', '')
+    return int(pk) if match.url_name == 'podcast-detail' and pk.isdigit() else None
+
+
+def resolve_outlines(outlines, host):
+    """Podcast id, or None, for each ``(title, xml_url)``, in one query"""
+    links = [own_podcast_id(url, host) if url else None for _, url in outlines]
+    variants = [feed_variants(url) if url and link is None else [] for (_, url), link in zip(outlines, links)]
+    ids = {link for link in links if link is not None}
+    feeds = {feed for spellings in variants for feed in spellings}
+    titles = {title.upper() for title, _ in outlines if title}
+    if not ids and not feeds and not titles:
+        return [None] * len(outlines)
+
+    # UPPER(title) is what the trigram index of migration 0005 covers on PostgreSQL
+    rows = (
+        Podcast.objects.annotate(upper_title=Upper('title'))
+        .filter(Q(pk__in=ids) | Q(feed_url__in=feeds) | Q(upper_title__in=titles))
+        .order_by('pk').values_list('pk', 'feed_url', 'upper_title')
+    )
+    found, by_feed, by_title = set(), {}, {}
+    for pk, feed_url, upper_title in rows:
+        found.add(pk)
+        if feed_url:
+            by_feed.setdefault(feed_url, pk)
+        by_title.setdefault(upper_title, []).append(pk)
+
+    resolved = []
+    for (title, _), link, spellings in zip(outlines, links, variants):
+        pk = link if link in found else next((by_feed[feed] for feed in spellings if feed in by_feed), None)
+        if pk is None and link is None:
+            matches = by_title.get(title.upper(), [])
+            pk = matches[0] if len(matches) == 1 else None
+        resolved.append(pk)
+    return resolved
+
+
+def import_subscriptions(user, outlines, host):
+    """Subscribe ``user`` to every outline that resolves; one result per outline, in order"""
+    resolved = resolve_outlines(outlines, host)
+    wanted = {pk for pk in resolved if pk is not None}
+    existing = set(
+        Subscription.all_objects.filter(user=user, podcast_id__in=wanted).values_list('podcast_id', flat=True)
+    ) if wanted else set()
+
+    results, new = [], {}
+    for (title, url), pk in zip(outlines, resolved):
+        if pk is None:
+            outcome = NOT_FOUND
+        elif pk in existing:
+            outcome = ALREADY_SUBSCRIBED
+        elif pk in new:
+            outcome = DUPLICATE
+        else:
+            outcome = SUBSCRIBED
+            new[pk] = None
+        results.append({'title': title, 'xml_url': url, 'podcast': pk, 'status': outcome})
+
+    if new:
+        with transaction.atomic():
+            subscriptions = Subscription.objects.bulk_create(
+                [Subscription(user=user, podcast_id=pk) for pk in new], ignore_conflicts=True,
+            )
+            AnalyticsEvent.objects.bulk_create(
+                [AnalyticsEvent(kind=AnalyticsEvent.SUBSCRIBE, podcast_id=pk, user=user) for pk in new]
+            )
+            # bulk_create sends no post_save; the viewer's home sections don't depend on which podcast
+            drop_cached(Subscription, subscriptions[0])
+            log_subscriptions(user, new)
+            for subscription in subscriptions:
+                subscription_saved(Subscription, subscription, created=True)
+        SUBSCRIPTIONS.labels('subscribe').inc(len(new))
+    return results
@@ -0,0 +1,168 @@
+"""
+Find and remove storage objects no Episode or Podcast row points at.
+
+The storage listing is streamed into a temporary SQLite file and referenced
+names are struck off it as they stream out of the database, so memory stays
+flat however many objects the bucket holds.
+"""
+import os
+import sqlite3
+import tempfile
+import time
+from datetime import datetime, timezone as dt_timezone
+from pathlib import Path
+
+import cloudinary.api
+from cloudinary_storage.storage import MediaCloudinaryStorage
+from django.core.files.storage import FileSystemStorage
+
+from .deletion import delete_storage_objects
+from .storages import AudioCloudinaryStorage
+from .models import Podcast, Episode
+
+
+def cloudinary_listing(locations, page_size=500):
+    """Yield ``(public_id, created, bytes)`` for every uploaded resource at ``(resource_type, prefix)`` locations"""
+    for resource_type, prefix in locations:
+        cursor = None
+        while True:
+            params = {'type': 'upload', 'resource_type': resource_type, 'prefix': prefix, 'max_results': page_size}
+            if cursor:
+                params['next_cursor'] = cursor
+            page = cloudinary.api.resources(**params)
+            for resource in page.get('resources', []):
+                created = datetime.fromisoformat(resource['created_at'].replace('Z', '+00:00'))
+                yield resource['public_id'], created, resource.get('bytes', 0)
+            cursor = page.get('next_cursor')
+            if not cursor:
+                break
+
+
+def filesystem_listing(storage, prefix):
+    """Yield ``(name, modified, bytes)`` for every file under ``prefix`` of a FileSystemStorage"""
+    root = Path(storage.location)
+    stack = [root / prefix]
+    while stack:
+        directory = stack.pop()
+        try:
+            entries = os.scandir(directory)
+        except FileNotFoundError:
+            continue
+        with entries:
+            for entry in entries:
+                if entry.is_dir(follow_symlinks=False):
+                    stack.append(Path(entry.path))
+                elif entry.is_file(follow_symlinks=False):
+                    stat = entry.stat()
+                    name = Path(entry.path).relative_to(root).as_posix()
+                    yield name, datetime.fromtimestamp(stat.st_mtime, dt_timezone.utc), stat.st_size
+
+
+def storage_listing(storage, prefix):
+    if isinstance(storage, FileSystemStorage):
+        return filesystem_listing(storage, prefix)
+    if not isinstance(storage, MediaCloudinaryStorage):
+        raise TypeError(f'Cannot list objects of {type(storage).__name__}')
+    locations = [(storage.RESOURCE_TYPE, storage._prepend_prefix(prefix))]
+    if isinstance(storage, AudioCloudinaryStorage):
+        # Audio goes up as raw without the media prefix, anything else through the image pipeline
+        locations.insert(0, ('raw', prefix))
+    return cloudinary_listing(locations)
+
+
+def referenced_names():
+    """Every stored name a row points at, rows awaiting purge included"""
+    yield from Episode.all_objects.exclude(audio_file='').values_list('audio_file', flat=True).iterator(chunk_size=5000)
+    yield from Podcast.all_objects.exclude(cover_image='').values_list('cover_image', flat=True).iterator(chunk_size=5000)
+
+
+class DiskSet:
+    """Set of ``(name, size)`` entries kept in a temporary SQLite file"""
+
+    def __init__(self, batch_size=10000):
+        self.batch_size = batch_size
+        self.directory = tempfile.TemporaryDirectory()
+        self.db = sqlite3.connect(os.path.join(self.directory.name, 'set.sqlite3'))
+        self.db.execute('PRAGMA journal_mode = OFF')
+        self.db.execute('PRAGMA synchronous = OFF')
+        self.db.execute('CREATE TABLE entries (name TEXT PRIMARY KEY, size INTEGER) WITHOUT ROWID')
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.db.close()
+        self.directory.cleanup()
+
+    def _batched(self, sql, rows):
+        batch = []
+        for row in rows:
+            batch.append(row)
+            if len(batch) >= self.batch_size:
+                self.db.executemany(sql, batch)
+                batch = []
+        if batch:
+            self.db.executemany(sql, batch)
+        self.db.commit()
+
+    def add_many(self, entries):
+        self._batched('INSERT OR REPLACE INTO entries (name, size) VALUES (?, ?)', entries)
+
+    def discard_many(self, names):
+        self._batched('DELETE FROM entries WHERE name = ?', ((name,) for name in names))
+
+    def __len__(self):
+        return self.db.execute('SELECT COUNT(*) FROM entries').fetchone()[0]
+
+    def total_size(self):
+        return self.db.execute('SELECT COALESCE(SUM(size), 0) FROM entries').fetchone()[0]
+
+    def __iter__(self):
+        """Names in sorted order, streamed from the file"""
+        for name, in self.db.execute('SELECT name FROM entries ORDER BY name'):
+            yield name
+
+
+def find_orphans(listing, referenced, min_age, now=None):
+    """
+    Collect listed objects that nothing references into a ``DiskSet``.
+
+    Objects younger than ``min_age`` are left out: ``Episode.save`` uploads
+    before its row is committed, so a fresh object may just not be visible yet.
+    Returns ``(orphans, stats)``; the caller closes ``orphans``.
+    """
+    cutoff = (now or datetime.now(dt_timezone.utc)) - min_age
+    stats = {'listed': 0, 'too_recent': 0}
+
+    def old_enough():
+        for name, modified, size in listing:
+            stats['listed'] += 1
+            if modified > cutoff:
+                stats['too_recent'] += 1
+                continue
+            yield name, size
+
+    orphans = DiskSet()
+    orphans.add_many(old_enough())
+    orphans.discard_many(referenced)
+    stats['orphans'] = len(orphans)
+    stats['orphan_bytes'] = orphans.total_size()
+    return orphans, stats
+
+
+def delete_orphans(storage, names, batch_size=100, pause=1.0, log=None):
+    """Delete ``names`` in batches, sleeping ``pause`` seconds between them to stay under API rate limits"""
+    batch, deleted = [], 0
+    for name in names:
+        batch.append(name)
+        if len(batch) >= batch_size:
+            delete_storage_objects(storage, batch)
+            deleted += len(batch)
+            if log:
+                log(f'deleted {deleted} objects')
+            batch = []
+            time.sleep(pause)
+    if batch:
+        delete_storage_objects(storage, batch)
+        deleted += len(batch)
+    return deleted
@@ -0,0 +1,41 @@
+from rest_framework.renderers import JSONRenderer
+from rest_framework.utils.encoders import JSONEncoder
+
+from .instrumentation import timed
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+_fallback_encoder = JSONEncoder()
+
+
+def _default(obj):
+    # Decimals, lazy strings, querysets etc. go through DRF's encoder rules
+    return _fallback_encoder.default(obj)
+
+
+class ORJSONRenderer(JSONRenderer):
+    """JSON renderer backed by orjson, falling back to DRF's encoder"""
+
+    options = (orjson.OPT_UTC_Z | orjson.OPT_NON_STR_KEYS) if orjson else 0
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if data is None:
+            return b''
+
+        with timed('render'):
+            # Indented output is only asked for by humans, keep the stdlib path for it
+            if orjson is None or self.get_indent(accepted_media_type, renderer_context or {}):
+                return super().render(data, accepted_media_type, renderer_context)
+
+            return orjson.dumps(data, default=_default, option=self.options)
+
+
+class ChaptersRenderer(ORJSONRenderer):
+    """Podcasting 2.0 chapters JSON, what podcast apps fetch from a feed's <podcast:chapters>"""
+
+    media_type = 'application/json+chapters'
+    format = 'chapters'
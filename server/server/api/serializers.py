@@ -1,13 +1,17 @@
 from rest_framework import serializers
+from django.conf import settings
 from django.contrib.auth.models import User
 from .models import Category, Podcast, Episode, Playlist, Subscription
+from .fieldsets import SparseFieldsetMixin
+from .viewer import ViewerFlagsMixin
 
 
-class CategorySerializer(serializers.ModelSerializer):
+class CategorySerializer(SparseFieldsetMixin, serializers.ModelSerializer):
     
     class Meta:
         model = Category
         fields = '__all__'
+        values_fields = {'id': 'id', 'name': 'name'}
 
 
 class UserSerializer(serializers.ModelSerializer):
@@ -18,7 +22,7 @@ class UserSerializer(serializers.ModelSerializer):
         read_only_fields = ['id', 'date_joined']
 
 
-class PodcastSerializer(serializers.ModelSerializer):
+class PodcastSerializer(ViewerFlagsMixin, SparseFieldsetMixin, serializers.ModelSerializer):
     
     creator_name = serializers.CharField(source='creator.username', read_only=True)
     category_name = serializers.CharField(source='category.name', read_only=True)
@@ -26,14 +30,14 @@ class PodcastSerializer(serializers.ModelSerializer):
     class Meta:
         model = Podcast
         fields = [
-            'id', 'title', 'description', 'cover_image', 
+            'id', 'title', 'description', 'cover_image', 'feed_url',
             'category', 'category_name', 'creator', 'creator_name', 
             'created_at'
         ]
         read_only_fields = ['id', 'creator', 'created_at']
 
 
-class EpisodeSerializer(serializers.ModelSerializer):
+class EpisodeSerializer(ViewerFlagsMixin, SparseFieldsetMixin, serializers.ModelSerializer):
     
     podcast_title = serializers.CharField(source='podcast.title', read_only=True)
     
@@ -41,13 +45,16 @@ class EpisodeSerializer(serializers.ModelSerializer):
         model = Episode
         fields = [
             'id', 'title', 'description', 'audio_file',
-            'podcast', 'podcast_title', 'duration', 'created_at'
+            'podcast', 'podcast_title', 'duration', 'loudness_lufs', 'true_peak_dbtp', 'gain_db', 'created_at'
         ]
-        read_only_fields = ['id', 'created_at']
+        read_only_fields = ['id', 'loudness_lufs', 'true_peak_dbtp', 'gain_db', 'created_at']
     
     def to_representation(self, instance):
         """Override representation to use correct audio URL"""
         ret = super().to_representation(instance)
+        if 'audio_file' not in ret:
+            # Sparse fieldset without the file, don't touch the (possibly deferred) column
+            return ret
         try:
             # Add audio_file_url and replace audio_file with the correct URL if available
             audio_url = instance.audio_file_url
@@ -67,7 +74,7 @@ class EpisodeSerializer(serializers.ModelSerializer):
         return value
 
 
-class PlaylistSerializer(serializers.ModelSerializer):
+class PlaylistSerializer(SparseFieldsetMixin, serializers.ModelSerializer):
     
     episodes = EpisodeSerializer(many=True, read_only=True)
     episode_count = serializers.SerializerMethodField()
@@ -89,7 +96,7 @@ class PlaylistCreateSerializer(serializers.ModelSerializer):
         read_only_fields = ['id']
 
 
-class SubscriptionSerializer(serializers.ModelSerializer):
+class SubscriptionSerializer(SparseFieldsetMixin, serializers.ModelSerializer):
     
     user_name = serializers.CharField(source='user.username', read_only=True)
     podcast_title = serializers.CharField(source='podcast.title', read_only=True)
@@ -103,7 +110,7 @@ class SubscriptionSerializer(serializers.ModelSerializer):
 
 
 
-class PodcastListSerializer(serializers.ModelSerializer):
+class PodcastListSerializer(ViewerFlagsMixin, SparseFieldsetMixin, serializers.ModelSerializer):
     
     creator_name = serializers.CharField(source='creator.username', read_only=True)
     category_name = serializers.CharField(source='category.name', read_only=True)
@@ -111,15 +118,41 @@ class PodcastListSerializer(serializers.ModelSerializer):
     class Meta:
         model = Podcast
         fields = ['id', 'title', 'cover_image', 'creator_name', 'category_name', 'created_at']
-
-
-class EpisodeListSerializer(serializers.ModelSerializer):
+        expandable_fields = {
+            'description': lambda: serializers.CharField(read_only=True),
+            'category': lambda: CategorySerializer(read_only=True),
+        }
+        values_fields = {
+            'id': 'id',
+            'title': 'title',
+            'cover_image': 'cover_image',
+            'creator_name': 'creator__username',
+            'category_name': 'category__name',
+            'created_at': 'created_at',
+            'description': 'description',
+        }
+
+
+class EpisodeListSerializer(ViewerFlagsMixin, SparseFieldsetMixin, serializers.ModelSerializer):
     
     podcast_title = serializers.CharField(source='podcast.title', read_only=True)
     
     class Meta:
         model = Episode
         fields = ['id', 'title', 'podcast_title', 'duration', 'created_at']
+        expandable_fields = {
+            'description': lambda: serializers.CharField(read_only=True),
+            'podcast': lambda: PodcastListSerializer(read_only=True),
+            'audio_file_url': lambda: serializers.ReadOnlyField(),
+        }
+        values_fields = {
+            'id': 'id',
+            'title': 'title',
+            'podcast_title': 'podcast__title',
+            'duration': 'duration',
+            'created_at': 'created_at',
+            'description': 'description',
+        }
 
 
 class UserRegistrationSerializer(serializers.ModelSerializer):  
@@ -140,4 +173,38 @@ class UserRegistrationSerializer(serializers.ModelSerializer):
         validated_data.pop('password_confirm')
         
         user = User.objects.create_user(**validated_data)
-        return user 
\ No newline at end of file
+        return user 
+
+class PlaySerializer(serializers.Serializer):
+    seconds = serializers.IntegerField(min_value=0, help_text="Seconds of the episode listened to")
+
+
+class CreatorStatsQuerySerializer(serializers.Serializer):
+    period = serializers.ChoiceField(choices=['hour', 'day'], default='day')
+    days = serializers.IntegerField(min_value=1, default=30)
+    podcast = serializers.IntegerField(required=False)
+    
+    def validate(self, data):
+        limit = settings.API_ANALYTICS['MAX_DAYS'][data['period']]
+        if data['days'] > limit:
+            raise serializers.ValidationError({'days': f'At most {limit} days of {data["period"]}ly stats.'})
+        return data
+
+
+class FacetQuerySerializer(serializers.Serializer):
+    category = serializers.IntegerField(required=False)
+    creator = serializers.IntegerField(required=False)
+    search = serializers.CharField(required=False, allow_blank=True, max_length=200)
+    
+    def validate(self, data):
+        # icontains ignores case, so "Comedy" and "comedy" share a cache entry
+        search = data.pop('search', '').strip().lower()
+        return {**data, 'search': search} if search else data
+
+
+class SuggestQuerySerializer(serializers.Serializer):
+    q = serializers.CharField(max_length=200, trim_whitespace=False)
+    limit = serializers.IntegerField(min_value=1, default=8)
+    
+    def validate_limit(self, value):
+        return min(value, settings.API_SUGGEST['MAX_LIMIT'])
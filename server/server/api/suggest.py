@@ -0,0 +1,496 @@
+"""
+Search-as-you-type suggestions from a prefix index shared by the workers on one host.
+
+Podcast titles, episode titles, category names and creators' usernames are
+indexed under the start of each of their first ``MAX_WORDS`` words, after
+``normalize``, and ranked by subscribers: a podcast's own, its podcast's
+for an episode, and the total over their podcasts for a creator or a
+category. ``build`` writes the index as a single file of sorted arrays that
+every worker maps read-only, so a host keeps one copy in its page cache
+however many workers read it. A lookup binary-searches the range of keys
+starting with the typed prefix. Prefixes matching more than ``SCAN_LIMIT``
+keys have their ``TOP`` entries stored with the index instead.
+
+Saves and deletes are logged as ``SuggestChange`` rows in the saving
+transaction. Every worker on every host replays them on top of its
+snapshot, reading at most once per ``REFRESH_SECONDS``, so all hosts serve
+the same suggestions. A snapshot records how far into the log it is. Rows
+younger than ``SETTLE_SECONDS`` are read again each time, because a lower
+id may still be committing.
+
+The files are per host, so each host rebuilds its own: run
+``manage.py build_suggest_index`` from cron on every host, hourly for
+example, and at least once per ``KEEP_HOURS``. A build also deletes rows
+older than that. A worker whose overlay passes ``REBUILD_AFTER`` changes
+queues a rebuild job as well. That job refreshes the rankings early on a
+single host setup.
+"""
+import fcntl
+import heapq
+import mmap
+import os
+import re
+import struct
+import threading
+import time
+import unicodedata
+from array import array
+from bisect import bisect_left, insort
+from datetime import timedelta
+from functools import lru_cache
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.signals import setting_changed
+from django.db.models import Count, Max, Q
+from django.utils import timezone
+
+from .jobs import task
+from .models import Category, Episode, Job, Podcast, SuggestChange
+
+KINDS = ('category', 'creator', 'podcast', 'episode')  # Also the order equal weights are listed in
+CODES = {kind: code for code, kind in enumerate(KINDS)}
+MAGIC = b'SUGGEST2'
+EMPTY = 0xFFFFFFFF
+# Sorts after every key that starts with the same prefix
+PAST = '\U0010ffff'
+SEPARATORS = re.compile(r'[\W_]+')
+
+SECTIONS = (
+    ('kinds', 'B'), ('ids', 'Q'), ('weights', 'I'), ('text_offsets', 'I'), ('texts', 'B'),
+    ('key_docs', 'I'), ('key_starts', 'H'), ('prefix_offsets', 'I'), ('prefixes', 'B'), ('tops', 'I'),
+)
+HEADER = struct.Struct('<8sIIQ' + 'QQ' * len(SECTIONS))  # magic, key chars, top, log position, (offset, size) per section
+
+
+def normalize(text):
+    """Casefolded, accents stripped, anything but letters and digits collapsed to single spaces"""
+    if not text.isascii():
+        text = ''.join(char for char in unicodedata.normalize('NFKD', text) if not unicodedata.combining(char))
+    return SEPARATORS.sub(' ', text.casefold()).strip()
+
+
+def word_starts(normalized, max_words):
+    starts = [0] if normalized else []
+    position = normalized.find(' ')
+    while position != -1 and len(starts) < max_words:
+        starts.append(position + 1)
+        position = normalized.find(' ', position + 1)
+    return starts
+
+
+# Writing
+
+def top_prefixes(keys, rank, scan_limit, top, key_chars):
+    """
+    ``(prefix, ranks)`` for every prefix matching more than ``scan_limit`` of
+    the sorted ``keys``, with the ``top`` best ranks among its entries.
+
+    A heavy prefix's best come from its heavy extensions' best plus the keys
+    of its light ones, so each key is looked at once rather than once per
+    heavy prefix it falls under.
+    """
+    heavy = []
+
+    def best(lo, hi, length):
+        found = set()
+        i = lo
+        while i < hi:
+            key = keys[i][0]
+            if len(key) < length:
+                # Exactly the parent prefix, or a key cut to key_chars
+                found.add(rank[keys[i][1]])
+                i += 1
+                continue
+            prefix = key[:length]
+            end = bisect_left(keys, (prefix + PAST,), i, hi)
+            if end - i > scan_limit and length <= key_chars:
+                ranks = best(i, end, length + 1)
+                heavy.append((prefix, ranks))
+                found.update(ranks)
+            else:
+                found.update(rank[keys[k][1]] for k in range(i, end))
+            i = end
+        return heapq.nsmallest(top, found)
+
+    best(0, len(keys), 1)
+    heavy.sort()
+    return heavy
+
+
+def write(path, entries, max_words, key_chars, scan_limit, top, log_position=0):
+    """
+    Write ``(kind, id, text, weight)`` entries to an index file at ``path``,
+    replacing it atomically; ``log_position`` is the last change they include
+    """
+    docs = sorted(entries, key=lambda entry: (CODES[entry[0]], entry[1]))
+    kinds = array('B', (CODES[kind] for kind, _, _, _ in docs))
+    weights = array('I', (min(weight, EMPTY) for _, _, _, weight in docs))
+    # Best first: heaviest, then by kind, then oldest
+    order = sorted(range(len(docs)), key=lambda doc: (-weights[doc], kinds[doc], doc))
+    rank = array('I', bytes(4 * len(docs)))
+    for position, doc in enumerate(order):
+        rank[doc] = position
+
+    texts = bytearray()
+    text_offsets = array('I', [0])
+    keys = []
+    for doc, (_, _, text, _) in enumerate(docs):
+        texts += text.encode()
+        text_offsets.append(len(texts))
+        normalized = normalize(text)
+        keys.extend((normalized[start:start + key_chars], doc, start) for start in word_starts(normalized, max_words))
+    keys.sort()
+
+    heavy = top_prefixes(keys, rank, scan_limit, top, key_chars)
+    prefixes = bytearray()
+    prefix_offsets = array('I', [0])
+    tops = array('I')
+    for prefix, ranks in heavy:
+        prefixes += prefix.encode()
+        prefix_offsets.append(len(prefixes))
+        tops.extend([order[position] for position in ranks] + [EMPTY] * (top - len(ranks)))
+
+    sections = {
+        'kinds': kinds, 'ids': array('Q', (pk for _, pk, _, _ in docs)), 'weights': weights,
+        'text_offsets': text_offsets, 'texts': texts,
+        'key_docs': array('I', (doc for _, doc, _ in keys)), 'key_starts': array('H', (start for _, _, start in keys)),
+        'prefix_offsets': prefix_offsets, 'prefixes': prefixes, 'tops': tops,
+    }
+    layout, offset = [], HEADER.size
+    for name, _ in SECTIONS:
+        size = len(memoryview(sections[name]).cast('B'))
+        offset += -offset % 8
+        layout += [offset, size]
+        offset += size
+
+    temporary = f'{path}.tmp'
+    with open(temporary, 'wb') as fh:
+        fh.write(HEADER.pack(MAGIC, key_chars, top, log_position, *layout))
+        for (name, _), start in zip(SECTIONS, layout[::2]):
+            fh.write(bytes(start - fh.tell()))
+            fh.write(memoryview(sections[name]).cast('B'))
+    os.replace(temporary, path)
+    return {'entries': len(docs), 'keys': len(keys), 'heavy_prefixes': len(heavy), 'bytes': offset}
+
+
+# Reading
+
+class Strings:
+    """Sequence view of UTF-8 strings packed back to back, for ``bisect``"""
+
+    def __init__(self, offsets, blob):
+        self.offsets = offsets
+        self.blob = blob
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def __getitem__(self, index):
+        return str(self.blob[self.offsets[index]:self.offsets[index + 1]], 'utf-8')
+
+
+class Keys:
+    """Sequence view of the sorted keys, cut from the normalized text of their entries"""
+
+    def __init__(self, index):
+        self.index = index
+
+    def __len__(self):
+        return len(self.index.key_docs)
+
+    def __getitem__(self, position):
+        index = self.index
+        start = index.key_starts[position]
+        return normalize(index.texts[index.key_docs[position]])[start:start + index.key_chars]
+
+
+class Snapshot:
+    """A built index file, mapped read-only"""
+
+    def __init__(self, path):
+        with open(path, 'rb') as fh:
+            self.map = mmap.mmap(fh.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, self.key_chars, self.top, self.position, *layout = HEADER.unpack_from(self.map)
+        if magic != MAGIC:
+            raise ValueError(f'{path} is not a suggestion index')
+        view = memoryview(self.map)
+        for (name, fmt), start, size in zip(SECTIONS, layout[::2], layout[1::2]):
+            setattr(self, name, view[start:start + size].cast(fmt))
+        self.texts = Strings(self.text_offsets, self.texts)
+        self.prefixes = Strings(self.prefix_offsets, self.prefixes)
+        self.keys = Keys(self)
+        self.bounds = [bisect_left(self.kinds, code) for code in range(len(KINDS) + 1)]
+
+    def find(self, code, pk):
+        """Position of the entry for ``(kind code, id)``, or None"""
+        lo, hi = self.bounds[code], self.bounds[code + 1]
+        doc = bisect_left(self.ids, pk, lo, hi)
+        return doc if doc < hi and self.ids[doc] == pk else None
+
+    def candidates(self, query, scan_cap):
+        """Entries with a key starting with the normalized ``query``"""
+        probe = query[:self.key_chars]
+        if len(query) <= self.key_chars:
+            heavy = bisect_left(self.prefixes, probe)
+            if heavy < len(self.prefixes) and self.prefixes[heavy] == probe:
+                tops = self.tops[heavy * self.top:(heavy + 1) * self.top]
+                return [doc for doc in tops if doc != EMPTY]
+        lo = bisect_left(self.keys, probe)
+        hi = bisect_left(self.keys, probe + PAST, lo)
+        if len(query) <= self.key_chars:
+            return set(self.key_docs[lo:hi])
+        # Past key_chars the keys can't tell entries apart, check the rest on the text
+        found = set()
+        for position in range(lo, min(hi, lo + scan_cap)):
+            doc = self.key_docs[position]
+            if normalize(self.texts[doc])[self.key_starts[position]:].startswith(query):
+                found.add(doc)
+        return found
+
+    def close(self):
+        for name, _ in SECTIONS:
+            value = getattr(self, name)
+            (value.blob if isinstance(value, Strings) else value).release()
+        try:
+            self.map.close()
+        except BufferError:
+            # A lookup still holds a slice; the mapping goes once that is collected
+            pass
+
+
+class Overlay:
+    """Changes logged since the snapshot: ``(code, id)`` -> ``(text, weight, keys)``, or None once deleted"""
+
+    def __init__(self, key_chars, max_words, weight):
+        self.key_chars = key_chars
+        self.max_words = max_words
+        self.weight = weight
+        self.entries = {}
+        self.keys = []
+        # Live entries best first, walked instead of the keys when a short prefix matches most of them
+        self.ranked = []
+        self.changes = 0
+
+    def apply(self, op, kind, pk, text=None):
+        code = CODES[kind]
+        old = self.entries.get((code, pk))
+        if old is not None:
+            for key in old[2]:
+                del self.keys[bisect_left(self.keys, key)]
+            del self.ranked[bisect_left(self.ranked, (-old[1], code, pk))]
+        self.entries[(code, pk)] = None
+        if op == 'put':
+            normalized = normalize(text)
+            keys = [(normalized[start:start + self.key_chars], code, pk, start) for start in word_starts(normalized, self.max_words)]
+            # Rankings only change on a rebuild, a saved entry keeps the weight it was built with
+            weight = self.weight(code, pk)
+            self.entries[(code, pk)] = (text, weight, keys)
+            for key in keys:
+                insort(self.keys, key)
+            insort(self.ranked, (-weight, code, pk))
+        self.changes += 1
+
+    def matches(self, key, query):
+        _, code, pk, start = key
+        return len(query) <= self.key_chars or normalize(self.entries[(code, pk)][0])[start:].startswith(query)
+
+    def candidates(self, query, limit):
+        """Up to the best ``limit`` entries matching ``query``, or all of them"""
+        probe = query[:self.key_chars]
+        lo = bisect_left(self.keys, (probe,))
+        hi = bisect_left(self.keys, (probe + PAST,), lo)
+        if hi - lo <= 4 * limit:
+            return {(key[1], key[2]) for key in self.keys[lo:hi] if self.matches(key, query)}
+        found = []
+        for _, code, pk in self.ranked:
+            if any(key[0].startswith(probe) and self.matches(key, query) for key in self.entries[(code, pk)][2]):
+                found.append((code, pk))
+                if len(found) == limit:
+                    break
+        return found
+
+
+def file_id(path):
+    try:
+        stat = os.stat(path)
+    except FileNotFoundError:
+        return None
+    return stat.st_ino, stat.st_mtime_ns, stat.st_size
+
+
+class SuggestIndex:
+    """
+    The snapshot at ``path`` with the changes logged since replayed on top,
+    brought up to date at most every ``interval`` seconds on lookups
+    """
+
+    def __init__(self, path, max_words, key_chars, scan_limit, changes=None, interval=0):
+        self.path = path
+        self.max_words = max_words
+        self.key_chars = key_chars
+        self.scan_limit = scan_limit
+        self.changes = changes or logged_changes
+        self.interval = interval
+        self.lock = threading.Lock()
+        self.state = None
+        self.snapshot = None
+        self.overlay = Overlay(key_chars, max_words, self.weight)
+        self.position = 0
+        self.checked_at = None
+        self.rebuild_queued = False
+
+    def refresh(self):
+        now = time.monotonic()
+        if self.checked_at is not None and now - self.checked_at < self.interval:
+            return
+        self.checked_at = now
+        state = file_id(self.path)
+        if state != self.state:
+            # A rebuild landed: start over from the new snapshot's place in the log
+            if self.snapshot:
+                self.snapshot.close()
+            self.snapshot = Snapshot(self.path) if state else None
+            key_chars = self.snapshot.key_chars if self.snapshot else self.key_chars
+            self.overlay = Overlay(key_chars, self.max_words, self.weight)
+            self.position = self.snapshot.position if self.snapshot else 0
+            self.state = state
+            self.rebuild_queued = False
+        settled = True
+        for pk, op, kind, ref, text, old_enough in self.changes(self.position):
+            self.overlay.apply(op, kind, ref, text)
+            # Only past a settled prefix; later rows are applied again, in order, next time
+            settled = settled and old_enough
+            if settled:
+                self.position = pk
+        if self.overlay.changes > settings.API_SUGGEST['REBUILD_AFTER'] and not self.rebuild_queued:
+            self.rebuild_queued = True
+            schedule_rebuild()
+
+    def weight(self, code, pk):
+        doc = self.snapshot.find(code, pk) if self.snapshot else None
+        return self.snapshot.weights[doc] if doc is not None else 0
+
+    def lookup(self, query, limit):
+        """Best ``limit`` entries for a normalized, non-empty ``query``: ``(kind, id, text)``"""
+        with self.lock:
+            self.refresh()
+            snapshot, overlay = self.snapshot, self.overlay
+            ranked = []
+            if snapshot:
+                for doc in snapshot.candidates(query, self.scan_limit * 8):
+                    code, pk = snapshot.kinds[doc], snapshot.ids[doc]
+                    if (code, pk) not in overlay.entries:
+                        ranked.append((-snapshot.weights[doc], code, pk, doc))
+            for code, pk in overlay.candidates(query, limit):
+                ranked.append((-overlay.entries[(code, pk)][1], code, pk, None))
+            # Only the winners' texts are decoded
+            return [
+                (KINDS[code], pk, overlay.entries[(code, pk)][0] if doc is None else snapshot.texts[doc])
+                for _, code, pk, doc in heapq.nsmallest(limit, ranked)
+            ]
+
+
+# Django glue
+
+@lru_cache(maxsize=1)
+def get_index():
+    config = settings.API_SUGGEST
+    return SuggestIndex(
+        config['PATH'], config['MAX_WORDS'], config['KEY_CHARS'], config['SCAN_LIMIT'], interval=config['REFRESH_SECONDS'],
+    )
+
+
+def reset_index(*, setting, **kwargs):
+    if setting == 'API_SUGGEST':
+        get_index.cache_clear()
+
+
+setting_changed.connect(reset_index)
+
+
+def suggest(query, limit):
+    """Suggestions for what the user has typed so far, best first"""
+    query = normalize(query)
+    if not query:
+        return []
+    return [{'type': kind, 'id': pk, 'text': text} for kind, pk, text in get_index().lookup(query, limit)]
+
+
+def entries():
+    """``(kind, id, text, weight)`` for everything suggestions can point at"""
+    live = Q(podcast__deleted_at__isnull=True)
+    for pk, name, weight in Category.objects.annotate(weight=Count('podcast__subscription', filter=live)).values_list('pk', 'name', 'weight'):
+        yield 'category', pk, name, weight
+    creators = User.objects.filter(live, podcast__isnull=False).annotate(weight=Count('podcast__subscription'))
+    for pk, name, weight in creators.values_list('pk', 'username', 'weight'):
+        yield 'creator', pk, name, weight
+    subscribers = dict(Podcast.objects.annotate(weight=Count('subscription')).values_list('pk', 'weight'))
+    for pk, title in Podcast.objects.values_list('pk', 'title').iterator(chunk_size=5000):
+        yield 'podcast', pk, title, subscribers.get(pk, 0)
+    for pk, title, podcast_id in Episode.objects.values_list('pk', 'title', 'podcast_id').iterator(chunk_size=5000):
+        yield 'episode', pk, title, subscribers.get(podcast_id, 0)
+
+
+def build(path=None):
+    """Rebuild this host's index from the database and drop log rows every host is past"""
+    config = settings.API_SUGGEST
+    path = path or config['PATH']
+    with open(f'{path}.lock', 'a') as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        # Changes that settled before reading are in what is read below; replaying more is harmless
+        horizon = timezone.now() - timedelta(seconds=config['SETTLE_SECONDS'])
+        position = SuggestChange.objects.filter(created_at__lt=horizon).aggregate(last=Max('pk'))['last'] or 0
+        stats = write(path, entries(), config['MAX_WORDS'], config['KEY_CHARS'], config['SCAN_LIMIT'], config['TOP'], position)
+    SuggestChange.objects.filter(created_at__lt=timezone.now() - timedelta(hours=config['KEEP_HOURS'])).delete()
+    return stats
+
+
+@task(priority=-5)
+def rebuild():
+    build()
+
+
+def schedule_rebuild():
+    """Queue a rebuild unless one is already waiting"""
+    if not Job.objects.filter(task=rebuild.name, status=Job.QUEUED).exists():
+        rebuild.delay()
+
+
+def logged_changes(position):
+    """``(id, op, kind, ref, text, settled)`` for the changes past ``position``, oldest first"""
+    horizon = timezone.now() - timedelta(seconds=settings.API_SUGGEST['SETTLE_SECONDS'])
+    rows = SuggestChange.objects.filter(pk__gt=position).order_by('pk')
+    for pk, op, kind, ref, text, created_at in rows.values_list('pk', 'op', 'kind', 'ref', 'text', 'created_at').iterator(2000):
+        yield pk, op, kind, ref, text, created_at < horizon
+
+
+def log_changes(*changes):
+    """``(op, kind, id[, text])`` changes, logged in the caller's transaction; a rollback takes them back"""
+    SuggestChange.objects.bulk_create([
+        SuggestChange(op=change[0], kind=change[1], ref=change[2], text=change[3] if len(change) > 3 else '')
+        for change in changes
+    ])
+
+
+def forget(kind, ids):
+    """Drop entries whose rows were hidden with an update, which sends no signals"""
+    if ids:
+        log_changes(*[('del', kind, pk) for pk in ids])
+
+
+def entry_saved(sender, instance, **kwargs):
+    """post_save receiver for categories, podcasts and episodes"""
+    kind = sender._meta.model_name
+    if getattr(instance, 'deleted_at', None):
+        log_changes(('del', kind, instance.pk))
+        return
+    changes = [('put', kind, instance.pk, instance.name if kind == 'category' else instance.title)]
+    if kind == 'podcast' and kwargs.get('created'):
+        changes.append(('put', 'creator', instance.creator_id, instance.creator.username))
+    log_changes(*changes)
+
+
+def entry_deleted(sender, instance, **kwargs):
+    """post_delete receiver"""
+    log_changes(('del', sender._meta.model_name, instance.pk))
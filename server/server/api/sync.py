@@ -0,0 +1,280 @@
+"""
+Delta sync (/api/sync/): what changed in a listener's library since a token.
+
+The library is the listener's subscriptions, playlists, playlist entries and
+the episodes of subscribed podcasts or in a playlist. Receivers append one
+``Change`` row per changed key:
+- subscriptions, playlists and playlist entries are logged for their owner,
+  also when a purge removes the entries of deleted episodes;
+- episodes and podcasts are logged for the podcast, which reaches every
+  subscriber. Listeners with episodes of a podcast in a playlist read that
+  podcast's rows too, but only for the podcast itself and those episodes.
+
+A sync reads the log past the token's position through two index ranges,
+then reads the current state of the keys it names. Its cost follows the
+number of changes, not the size of the library. A key that no longer exists
+is reported as deleted. Since only the key matters, ``compact`` can drop all
+but the newest row per key, and every row older than the retention window.
+
+Tokens are a signed position and expire with that window. A missing, forged
+or expired token gets a full snapshot with ``reset`` set instead.
+"""
+from datetime import timedelta
+
+from django.conf import settings
+from django.core import signing
+from django.db.models import Exists, F, Max, Min, OuterRef, Q
+from django.utils import timezone
+
+from .models import Change, Episode, Playlist, Subscription
+
+SALT = 'api.sync'
+Entry = Playlist.episodes.through
+
+EPISODE_FIELDS = {'podcast_title': F('podcast__title')}
+EPISODE_VALUES = ['id', 'podcast', 'title', 'duration', 'created_at']
+
+
+# Logging, receivers connected in ApiConfig.ready()
+
+def subscription_changed(sender, instance, **kwargs):
+    Change.objects.create(user_id=instance.user_id, kind=Change.SUBSCRIPTION, ref=instance.podcast_id)
+
+
+def playlist_changed(sender, instance, **kwargs):
+    Change.objects.create(user_id=instance.user_id, kind=Change.PLAYLIST, ref=instance.pk)
+
+
+def playlist_episodes_changed(sender, instance, action, reverse, pk_set, **kwargs):
+    # post_clear doesn't say what went, so clears are read beforehand
+    if action == 'pre_clear':
+        entries = Entry.objects.filter(**{'episode_id' if reverse else 'playlist_id': instance.pk})
+        pairs = list(entries.values_list('playlist_id', 'episode_id'))
+    elif action in ('post_add', 'post_remove'):
+        pairs = [(pk, instance.pk) if reverse else (instance.pk, pk) for pk in pk_set or ()]
+    else:
+        return
+    if reverse:
+        # episode.playlist_set.add(...): the playlists may belong to anyone
+        owners = dict(Playlist.objects.filter(pk__in={playlist for playlist, _ in pairs}).values_list('pk', 'user_id'))
+    else:
+        owners = {instance.pk: instance.user_id}
+    Change.objects.bulk_create([
+        Change(user_id=owners[playlist], kind=Change.PLAYLIST_EPISODE, ref=episode, parent=playlist)
+        for playlist, episode in pairs if playlist in owners
+    ])
+
+
+def episode_changed(sender, instance, **kwargs):
+    Change.objects.create(podcast_id=instance.podcast_id, kind=Change.EPISODE, ref=instance.pk)
+
+
+def podcast_changed(sender, instance, **kwargs):
+    Change.objects.create(podcast_id=instance.pk, kind=Change.PODCAST, ref=instance.pk)
+
+
+def log_subscriptions(user, podcast_ids):
+    """For bulk inserts, which send no post_save"""
+    Change.objects.bulk_create([Change(user=user, kind=Change.SUBSCRIPTION, ref=pk) for pk in podcast_ids])
+
+
+def log_podcast_changes(kind, pairs):
+    """``(podcast, ref)`` pairs, for bulk updates"""
+    Change.objects.bulk_create([Change(podcast_id=podcast, kind=kind, ref=ref) for podcast, ref in pairs])
+
+
+def log_entries_removed(entries):
+    """For bulk deletes of playlist entries, which send no m2m_changed; read before deleting"""
+    Change.objects.bulk_create([
+        Change(user_id=user, kind=Change.PLAYLIST_EPISODE, ref=episode, parent=playlist)
+        for playlist, episode, user in entries.values_list('playlist_id', 'episode_id', 'playlist__user_id')
+    ])
+
+
+# Tokens
+
+def retention():
+    return timedelta(days=settings.API_SYNC['RETENTION_DAYS'])
+
+
+def make_token(position):
+    return signing.dumps(position, salt=SALT, compress=True)
+
+
+def read_token(token):
+    """The position a token was issued at, or None when it must start over"""
+    if not token:
+        return None
+    try:
+        position = signing.loads(token, salt=SALT, max_age=retention())
+    except signing.BadSignature:
+        return None
+    return position if isinstance(position, int) else None
+
+
+def head(now=None):
+    """
+    How far a token may point: the newest change, short of any younger than
+    SETTLE_SECONDS. Ids are handed out before commit, so a lower one may
+    still be in flight; those changes are sent again instead of skipped,
+    which is harmless as sync returns state.
+    """
+    horizon = (now or timezone.now()) - timedelta(seconds=settings.API_SYNC['SETTLE_SECONDS'])
+    last = Change.objects.aggregate(last=Max('pk'))['last'] or 0
+    first = Change.objects.filter(created_at__gte=horizon).aggregate(first=Min('pk'))['first']
+    return last if first is None else min(last, first - 1)
+
+
+# Reading
+
+def changes_since(user, position, limit):
+    """Up to ``limit + 1`` ``(pk, kind, ref, parent)`` past ``position``, oldest first"""
+    columns = ('pk', 'kind', 'ref', 'parent')
+    own = Change.objects.filter(user=user, pk__gt=position).order_by('pk').values_list(*columns)
+    rows = list(own[:limit + 1])
+    # Subqueries, so the library's size never leaves the database. Hidden
+    # subscriptions count too, so podcasts awaiting deletion reach their subscribers
+    subscribed = Subscription.all_objects.filter(user=user).values('podcast_id')
+    entries = Entry.objects.filter(playlist__user=user)
+    # Podcasts reached through a playlist: the podcast itself and the episodes in it
+    playlisted = Q(podcast_id__in=entries.values('episode__podcast_id')) & (
+        Q(kind=Change.PODCAST) | Q(kind=Change.EPISODE, ref__in=entries.values('episode_id'))
+    )
+    shared = Change.objects.filter(Q(podcast_id__in=subscribed) | playlisted, pk__gt=position)
+    rows += shared.order_by('pk').values_list(*columns)[:limit + 1]
+    return sorted(rows)[:limit + 1]
+
+
+def subscription_rows(user, podcast_ids=None):
+    subscriptions = Subscription.objects.filter(user=user)
+    if podcast_ids is not None:
+        subscriptions = subscriptions.filter(podcast_id__in=podcast_ids)
+    return list(
+        subscriptions.order_by('pk').values('id', 'podcast', 'created_at', podcast_title=F('podcast__title'))
+    )
+
+
+def playlist_rows(user, ids=None):
+    playlists = Playlist.objects.filter(user=user)
+    if ids is not None:
+        playlists = playlists.filter(pk__in=ids)
+    return list(playlists.order_by('pk').values('id', 'name', 'created_at'))
+
+
+def episode_rows(episodes):
+    return list(episodes.order_by('pk').values(*EPISODE_VALUES, **EPISODE_FIELDS))
+
+
+def snapshot(user):
+    """The whole library"""
+    entries = list(
+        Entry.objects.filter(playlist__user=user).order_by('playlist_id', 'pk').values_list('playlist_id', 'episode_id')
+    )
+    subscribed = Subscription.objects.filter(user=user).values('podcast_id')
+    episodes = Episode.objects.filter(Q(podcast_id__in=subscribed) | Q(pk__in={episode for _, episode in entries}))
+    return {
+        'subscriptions': {'upserted': subscription_rows(user), 'deleted': []},
+        'playlists': {'upserted': playlist_rows(user), 'deleted': []},
+        'playlist_episodes': {'added': [list(entry) for entry in entries], 'removed': []},
+        'episodes': {'upserted': episode_rows(episodes), 'deleted': []},
+    }
+
+
+def delta(user, rows):
+    """The current state of every key named in ``rows``"""
+    keys = {kind: {} for kind, _ in Change.KINDS}
+    for _, kind, ref, parent in rows:
+        keys[kind][(parent, ref)] = None
+
+    subscribed = {ref for _, ref in keys[Change.SUBSCRIPTION]}
+    podcasts, changed = set(subscribed), {ref for _, ref in keys[Change.EPISODE]}
+    changed_podcasts = {ref for _, ref in keys[Change.PODCAST]}
+    if changed_podcasts:
+        followed = set(
+            Subscription.all_objects.filter(user=user, podcast_id__in=changed_podcasts).values_list('podcast_id', flat=True)
+        )
+        podcasts |= followed
+        # A podcast only reached through a playlist sends those episodes again, or their deletion
+        playlisted = Entry.objects.filter(playlist__user=user, episode__podcast_id__in=changed_podcasts - podcasts)
+        changed |= set(playlisted.values_list('episode_id', flat=True))
+    subscriptions = subscription_rows(user, podcasts) if podcasts else []
+    found = {row['podcast'] for row in subscriptions}
+
+    playlist_ids = {ref for _, ref in keys[Change.PLAYLIST]}
+    playlists = playlist_rows(user, playlist_ids) if playlist_ids else []
+
+    pairs, present = set(keys[Change.PLAYLIST_EPISODE]), set()
+    if pairs:
+        entries = Entry.objects.filter(
+            playlist__user=user, playlist_id__in={playlist for playlist, _ in pairs},
+            episode_id__in={episode for _, episode in pairs},
+        )
+        present = set(entries.values_list('playlist_id', 'episode_id')) & pairs
+
+    # Changed episodes, and what a new subscription or playlist entry brings along
+    wanted, new_podcasts = changed | {episode for _, episode in present}, subscribed & found
+    episodes = []
+    if wanted or new_podcasts:
+        episodes = episode_rows(Episode.objects.filter(Q(pk__in=wanted) | Q(podcast_id__in=new_podcasts)))
+    live = {row['id'] for row in episodes}
+
+    return {
+        'subscriptions': {'upserted': subscriptions, 'deleted': sorted(podcasts - found)},
+        'playlists': {'upserted': playlists, 'deleted': sorted(playlist_ids - {row['id'] for row in playlists})},
+        'playlist_episodes': {
+            'added': sorted([list(pair) for pair in present]),
+            'removed': sorted([list(pair) for pair in pairs - present]),
+        },
+        'episodes': {'upserted': episodes, 'deleted': sorted(changed - live)},
+    }
+
+
+def sync(user, token=None):
+    """The changes since ``token``, or everything when it can't be used, with the token to send next"""
+    position = read_token(token)
+    # Fixed before reading, changes made meanwhile come again next time
+    end = head()
+    if position is None:
+        return {'token': make_token(end), 'reset': True, 'more': False, **snapshot(user)}
+
+    limit = settings.API_SYNC['LIMIT']
+    rows = changes_since(user, position, limit)
+    more = len(rows) > limit
+    rows = rows[:limit]
+    # A full page stops at its last row; never past a change that may be in flight, never back
+    last = rows[-1][0] if more else end
+    position = max(position, min(last, end))
+    return {'token': make_token(position), 'reset': False, 'more': more and position == last, **delta(user, rows)}
+
+
+# Compaction, run by "manage.py compact_changes"
+
+def compact(now=None, batch_size=None):
+    """Drop changes no token can still need; returns ``{'expired', 'superseded'}``"""
+    now = now or timezone.now()
+    batch_size = batch_size or settings.API_SYNC['COMPACT_BATCH_SIZE']
+    # Every token younger than the window points past rows created before it, less the settle margin
+    cutoff = now - retention() - timedelta(seconds=settings.API_SYNC['SETTLE_SECONDS'])
+    stats = {'expired': 0, 'superseded': 0}
+    expired = Change.objects.filter(created_at__lt=cutoff)
+    while True:
+        ids = list(expired.order_by('pk').values_list('pk', flat=True)[:batch_size])
+        if not ids:
+            break
+        stats['expired'] += Change.objects.filter(pk__in=ids).delete()[0]
+
+    # Sync reads state, so a newer row for the same key stands in for older ones
+    same_key = {field: OuterRef(field) for field in ('kind', 'ref', 'parent')}
+    newer = {
+        'user': Change.objects.filter(user_id=OuterRef('user_id'), pk__gt=OuterRef('pk'), **same_key),
+        'podcast': Change.objects.filter(podcast_id=OuterRef('podcast_id'), pk__gt=OuterRef('pk'), **same_key),
+    }
+    bounds = Change.objects.aggregate(first=Min('pk'), last=Max('pk'))
+    if bounds['first'] is None:
+        return stats
+    for start in range(bounds['first'], bounds['last'] + 1, batch_size):
+        window = Change.objects.filter(pk__gte=start, pk__lt=start + batch_size)
+        for scope, rows in newer.items():
+            superseded = window.filter(**{f'{scope}__isnull': False}).filter(Exists(rows))
+            stats['superseded'] += superseded.delete()[0]
+    return stats
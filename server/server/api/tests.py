@@ -1,3 +1,1743 @@
-from django.test import TestCase
+import asyncio
+import hashlib
+import io
+import json
+import multiprocessing
+import os
+import random
+import tempfile
+import threading
+import time
+import wave
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from datetime import timedelta
+from pathlib import Path
+from unittest import mock, skipUnless
 
-# Create your tests here.
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.core.exceptions import ImproperlyConfigured
+from django.core.files.storage import FileSystemStorage
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.db import connection, transaction
+from django.test import TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from rest_framework.renderers import JSONRenderer
+from rest_framework.request import Request
+from prometheus_client import REGISTRY
+from rest_framework.test import APITestCase, APIRequestFactory
+from rest_framework_simplejwt.tokens import RefreshToken
+
+from .admin import EstimatedCountPaginator
+from .analytics import catch_up, roll_up
+from .deletion import process_pending, purge_marked
+from .management.commands.coldstart_report import by_package, probe
+from .events import hub
+from .exchange import Importer, catalog_querysets, export_records, ndjson_lines, read_ndjson
+from .fields import canonical_feed_url
+from .fieldsets import values_rows
+from . import home
+from .instrumentation import RequestTimings
+from .jobs import Heartbeat, Worker, claim, execute, requeue_stale, retry, task
+from .models import AnalyticsEvent, Category, CacheGeneration, Change, Chapters, Podcast, Episode, EpisodeRollup, Job, Playlist, PodcastRollup, StreamTicket, Subscription, SuggestChange
+from .reconcile import delete_orphans, find_orphans, referenced_names, storage_listing
+from .renderers import ORJSONRenderer
+from .serializers import PodcastListSerializer
+from . import chapters, facets, loudness, opml, suggest, sync
+from .throttling import SharedMemoryBucketStore, get_store
+
+
+def make_catalog(podcasts=3, episodes_per_podcast=2):
+    """Small catalog; episodes go through bulk_create so no upload is attempted"""
+    user = User.objects.create_user('creator', 'creator@example.com', 'password123')
+    category = Category.objects.create(name='Comedy')
+    shows = [
+        Podcast.objects.create(
+            title=f'Show {i}', description=f'About show {i}',
+            category=category, creator=user,
+        )
+        for i in range(podcasts)
+    ]
+    Episode.objects.bulk_create([
+        Episode(
+            title=f'{show.title} ep {n}', description='...', podcast=show,
+            audio_file=f'episodes/{show.pk}-{n}.mp3', duration=30,
+        )
+        for show in shows for n in range(episodes_per_podcast)
+    ])
+    return user, category, shows
+
+
+class SparseFieldsetTests(APITestCase):
+
+    def setUp(self):
+        self.user, self.category, self.shows = make_catalog()
+
+    def test_fields_param_narrows_output(self):
+        response = self.client.get('/api/podcasts/', {'fields': 'id,title'})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(set(response.json()[0]), {'id', 'title'})
+
+    def test_expand_adds_fields(self):
+        response = self.client.get('/api/podcasts/', {'expand': 'description,category'})
+        row = response.json()[0]
+        self.assertEqual(row['description'], 'About show 0')
+        self.assertEqual(row['category'], {'id': self.category.pk, 'name': 'Comedy'})
+
+    def test_list_query_count_is_constant(self):
+        with self.assertNumQueries(1):
+            self.client.get('/api/episodes/', {'expand': 'podcast'})
+
+    def test_values_path_matches_serializer(self):
+        request = Request(APIRequestFactory().get('/api/podcasts/'))
+        queryset = Podcast.objects.select_related('creator', 'category').order_by('pk')
+        expected = PodcastListSerializer(queryset, many=True, context={'request': request}).data
+
+        serializer = PodcastListSerializer(context={'request': request})
+        lookups = serializer.get_values_lookups()
+        rows = values_rows(queryset.values_list(*lookups.values()), lookups, Podcast, request)
+
+        self.assertEqual(rows, [dict(row) for row in expected])
+
+    def test_detail_respects_fields(self):
+        episode = Episode.objects.first()
+        response = self.client.get(f'/api/episodes/{episode.pk}/', {'fields': 'title,duration'})
+        self.assertEqual(response.json(), {'title': episode.title, 'duration': 30})
+
+
+class ORJSONRendererTests(TestCase):
+
+    def test_matches_drf_renderer(self):
+        data = {'title': 'Café', 'count': 3, 'items': [1.5, None, True]}
+        self.assertEqual(
+            ORJSONRenderer().render(data),
+            JSONRenderer().render(data),
+        )
+
+
+class RequestTimingMiddlewareTests(APITestCase):
+
+    def setUp(self):
+        make_catalog()
+
+    def test_server_timing_header(self):
+        response = self.client.get('/api/podcasts/')
+        header = response['Server-Timing']
+        self.assertIn('db;dur=', header)
+        self.assertIn('desc="1 queries"', header)
+        self.assertIn('serialize;dur=', header)
+        self.assertIn('render;dur=', header)
+        self.assertIn('total;dur=', header)
+
+    def test_duplicate_queries_are_logged(self):
+        with self.assertLogs('api.performance', level='WARNING') as logs:
+            user = User.objects.get(username='creator')
+            self.client.force_authenticate(user)
+            for n in range(5):
+                self.client.post('/api/playlists/', {'name': f'List {n}'})
+            self.client.get('/api/playlists/')
+        self.assertIn('duplicate_queries', logs.output[-1])
+
+    def test_sampled_slow_requests_are_profiled_and_rotated(self):
+        with tempfile.TemporaryDirectory() as profile_dir:
+            config = {
+                **settings.API_INSTRUMENTATION,
+                'PROFILE_SAMPLE_RATE': 1.0,
+                'SLOW_REQUEST_MS': 0,
+                'PROFILE_DIR': profile_dir,
+                'PROFILE_KEEP': 2,
+            }
+            with override_settings(API_INSTRUMENTATION=config), self.assertLogs('api.performance', level='WARNING'):
+                for _ in range(3):
+                    self.client.get('/api/categories/')
+            self.assertEqual(len(list(Path(profile_dir).glob('*.prof'))), 2)
+
+
+class RequestTimingsTests(TestCase):
+
+    def test_duplicate_detection(self):
+        timings = RequestTimings()
+        for _ in range(3):
+            timings.record_query('SELECT 1 WHERE id = %s', 0.001)
+        timings.record_query('SELECT 2', 0.002)
+        self.assertEqual(timings.query_count, 4)
+        self.assertEqual(timings.duplicate_queries(3), [('SELECT 1 WHERE id = %s', 3)])
+
+
+class MetricsTests(APITestCase):
+
+    def setUp(self):
+        self.user, _, self.shows = make_catalog()
+
+    def test_metrics_endpoint_exposes_route_metrics(self):
+        self.client.get('/api/podcasts/')
+        response = self.client.get('/metrics')
+        self.assertEqual(response.status_code, 200)
+        body = response.content.decode()
+        self.assertIn('api_requests_total{method="GET",route="podcast-list",status="200"}', body)
+        self.assertIn('api_request_duration_seconds_bucket', body)
+        self.assertIn('api_db_queries_total{route="podcast-list"}', body)
+
+    @override_settings(METRICS_TOKEN='secret')
+    def test_metrics_token(self):
+        self.assertEqual(self.client.get('/metrics').status_code, 403)
+        response = self.client.get('/metrics', HTTP_AUTHORIZATION='Bearer secret')
+        self.assertEqual(response.status_code, 200)
+
+    def test_metrics_without_token_serve_loopback_only(self):
+        self.assertEqual(self.client.get('/metrics', REMOTE_ADDR='::1').status_code, 200)
+        self.assertEqual(self.client.get('/metrics', REMOTE_ADDR='10.0.0.2').status_code, 403)
+
+    def test_subscription_counter(self):
+        before = REGISTRY.get_sample_value('api_subscriptions_total', {'action': 'subscribe'}) or 0
+        self.client.force_authenticate(self.user)
+        self.client.post(f'/api/podcasts/{self.shows[0].pk}/subscribe/')
+        self.client.post(f'/api/podcasts/{self.shows[0].pk}/subscribe/')
+        after = REGISTRY.get_sample_value('api_subscriptions_total', {'action': 'subscribe'})
+        self.assertEqual(after - before, 1)
+
+
+class GenerateDatasetTests(TestCase):
+
+    def test_generates_requested_volumes(self):
+        call_command(
+            'generate_dataset', users=20, categories=3, podcasts=10, episodes_per_podcast=4,
+            playlists_per_user=1, episodes_per_playlist=5, subscriptions_per_user=3, stdout=io.StringIO(),
+        )
+        self.assertEqual(User.objects.filter(username__startswith='synthetic-').count(), 20)
+        self.assertEqual(Podcast.objects.count(), 10)
+        self.assertEqual(Episode.objects.count(), 40)
+        self.assertEqual(Playlist.objects.count(), 20)
+        self.assertTrue(Playlist.episodes.through.objects.exists())
+        self.assertTrue(0 < Subscription.objects.count() <= 60)
+        # Timestamps are spread out rather than all set to "now"
+        self.assertGreater(Episode.objects.values('created_at').distinct().count(), 1)
+
+    def test_raw_episode_inserts_may_leave_out_the_audio_hash(self):
+        # What COPY does on PostgreSQL, with the column list generate_dataset uses
+        podcast = make_catalog(podcasts=1, episodes_per_podcast=0)[2][0]
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f'INSERT INTO {Episode._meta.db_table} (title, description, audio_file, podcast_id, duration, created_at)'
+                ' VALUES (%s, %s, %s, %s, %s, %s)',
+                ['Raw', '...', 'episodes/raw.mp3', podcast.pk, 5, timezone.now()],
+            )
+        self.assertEqual(Episode.objects.get(title='Raw').audio_hash, '')
+
+
+class ExportImportTests(APITestCase):
+
+    def setUp(self):
+        self.user, self.category, self.shows = make_catalog()
+        self.playlist = Playlist.objects.create(name='Favourites', user=self.user)
+        self.playlist.episodes.add(*Episode.objects.all()[:3])
+        Subscription.objects.create(user=self.user, podcast=self.shows[0])
+
+    def snapshot(self):
+        return {
+            'podcasts': sorted(Podcast.objects.values_list('id', 'title', 'creator__username', 'created_at')),
+            'episodes': sorted(Episode.objects.values_list('id', 'title', 'podcast_id', 'audio_file')),
+            'memberships': sorted(Playlist.episodes.through.objects.values_list('playlist_id', 'episode_id')),
+            'subscriptions': sorted(Subscription.objects.values_list('user__username', 'podcast_id')),
+        }
+
+    def clear(self):
+        Category.objects.all().delete()
+        Playlist.objects.all().delete()
+
+    def test_ndjson_round_trip_upsert(self):
+        expected = self.snapshot()
+        dump = io.BytesIO()
+        dump.writelines(ndjson_lines(export_records(catalog_querysets())))
+        self.clear()
+
+        dump.seek(0)
+        Importer('upsert').run(read_ndjson(dump))
+        self.assertEqual(self.snapshot(), expected)
+
+        # Importing the same dump again changes nothing
+        dump.seek(0)
+        Importer('upsert').run(read_ndjson(dump))
+        self.assertEqual(self.snapshot(), expected)
+
+    def test_csv_round_trip_append_remaps_ids(self):
+        with tempfile.TemporaryDirectory() as directory:
+            call_command('export_data', directory, format='csv', stderr=io.StringIO())
+            call_command('import_data', directory, mode='append', stdout=io.StringIO())
+        self.assertEqual(Podcast.objects.count(), 6)
+        self.assertEqual(Episode.objects.count(), 12)
+        self.assertEqual(Playlist.episodes.through.objects.count(), 6)
+        copy = Playlist.objects.exclude(pk=self.playlist.pk).get()
+        self.assertEqual(
+            sorted(copy.episodes.values_list('title', flat=True)),
+            sorted(self.playlist.episodes.values_list('title', flat=True)),
+        )
+        self.assertFalse(copy.episodes.filter(pk__in=self.playlist.episodes.all()).exists())
+
+    def test_user_export_endpoint(self):
+        other = User.objects.create_user('listener', password='password123')
+        Playlist.objects.create(name='Not mine', user=other)
+        self.client.force_authenticate(self.user)
+        response = self.client.get('/api/export/')
+        self.assertEqual(response['Content-Type'], 'application/x-ndjson')
+        records = list(read_ndjson(io.BytesIO(b''.join(response.streaming_content))))
+        playlists = [record['name'] for kind, record in records if kind == 'playlist']
+        self.assertEqual(playlists, ['Favourites'])
+        self.assertEqual([record['username'] for kind, record in records if kind == 'user'], ['creator'])
+
+
+class AdminChangelistTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        call_command(
+            'generate_dataset', users=40, categories=5, podcasts=60, episodes_per_podcast=10,
+            playlists_per_user=1, episodes_per_playlist=10, subscriptions_per_user=5, stdout=io.StringIO(),
+        )
+        cls.admin = User.objects.create_superuser('admin', 'admin@example.com', 'password123')
+
+    def setUp(self):
+        self.client.force_login(self.admin)
+
+    def assertCheapPage(self, url, max_queries=12, max_seconds=2.0):
+        with CaptureQueriesContext(connection) as queries:
+            start = time.perf_counter()
+            response = self.client.get(url)
+            elapsed = time.perf_counter() - start
+        self.assertEqual(response.status_code, 200)
+        self.assertLessEqual(len(queries), max_queries, [query['sql'] for query in queries])
+        self.assertLess(elapsed, max_seconds)
+        return response
+
+    def test_changelists(self):
+        for model in ['podcast', 'episode', 'playlist', 'subscription']:
+            with self.subTest(model=model):
+                self.assertCheapPage(f'/admin/api/{model}/')
+                self.assertCheapPage(f'/admin/api/{model}/?q=a')
+
+    def test_estimates_ignore_the_managers_own_filters(self):
+        for model in [Podcast, Episode, Subscription, Playlist]:
+            with self.subTest(model=model.__name__):
+                self.assertTrue(EstimatedCountPaginator.unfiltered(model.objects.order_by('-pk')))
+                self.assertFalse(EstimatedCountPaginator.unfiltered(model.objects.filter(pk__gt=1)))
+
+    def test_episode_filter_does_not_list_every_podcast(self):
+        response = self.assertCheapPage('/admin/api/episode/')
+        # A plain related filter renders one podcast__id__exact link per podcast
+        self.assertLess(response.content.count(b'podcast__id__exact'), 10)
+
+    def test_playlist_form_does_not_load_every_episode(self):
+        playlist = Playlist.objects.first()
+        response = self.assertCheapPage(f'/admin/api/playlist/{playlist.pk}/change/')
+        # Only the selected episodes are rendered as options
+        self.assertLessEqual(response.content.count(b'<option'), playlist.episodes.count() + 5)
+
+
+class DeferredDeletionTests(APITestCase):
+
+    def setUp(self):
+        self.user, _, self.shows = make_catalog()
+        self.show = self.shows[0]
+        self.playlist = Playlist.objects.create(name='Mix', user=self.user)
+        self.playlist.episodes.add(*Episode.objects.all())
+        Subscription.objects.create(user=self.user, podcast=self.show)
+        self.client.force_authenticate(self.user)
+
+        self.media = tempfile.TemporaryDirectory()
+        self.addCleanup(self.media.cleanup)
+        self.storage = FileSystemStorage(location=self.media.name)
+        for name in Episode.objects.values_list('audio_file', flat=True):
+            self.storage.save(name, io.BytesIO(b'audio'))
+
+    def test_delete_hides_everything_immediately(self):
+        response = self.client.delete(f'/api/podcasts/{self.show.pk}/')
+        self.assertEqual(response.status_code, 204)
+
+        self.assertFalse(Podcast.objects.filter(pk=self.show.pk).exists())
+        self.assertFalse(Episode.objects.filter(podcast_id=self.show.pk).exists())
+        self.assertFalse(Subscription.objects.filter(podcast_id=self.show.pk).exists())
+        self.assertEqual(self.playlist.episodes.count(), 4)
+        self.assertEqual(self.client.get(f'/api/podcasts/{self.show.pk}/').status_code, 404)
+        # Nothing is actually gone yet
+        self.assertTrue(Episode.all_objects.filter(podcast_id=self.show.pk).exists())
+
+    def test_process_pending_purges_rows_and_unshared_media(self):
+        doomed = list(Episode.all_objects.filter(podcast=self.show).values_list('audio_file', flat=True))
+        # Another show's episode uploaded the same file, that object has to stay
+        Episode.objects.filter(podcast=self.shows[1]).update(audio_file=doomed[0])
+        self.show.mark_deleted()
+
+        # Storage objects go once the rows' deletion commits
+        with self.captureOnCommitCallbacks(execute=True):
+            totals = process_pending(batch_size=1, audio_storage=self.storage, image_storage=self.storage)
+
+        self.assertEqual(totals, {'podcasts': 1, 'episodes': 2, 'subscriptions': 1})
+        self.assertFalse(Podcast.all_objects.filter(pk=self.show.pk).exists())
+        self.assertEqual(Playlist.episodes.through.objects.count(), 4)
+        self.assertTrue(self.storage.exists(doomed[0]))
+        self.assertFalse(self.storage.exists(doomed[1]))
+
+        # Running again is a no-op
+        self.assertEqual(
+            process_pending(audio_storage=self.storage, image_storage=self.storage),
+            {'podcasts': 0, 'episodes': 0, 'subscriptions': 0},
+        )
+
+    def test_deleted_episode_is_purged_alone(self):
+        episode = Episode.objects.filter(podcast=self.show).first()
+        self.client.delete(f'/api/episodes/{episode.pk}/')
+        self.assertEqual(self.playlist.episodes.count(), 5)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            totals = process_pending(audio_storage=self.storage, image_storage=self.storage)
+        self.assertEqual(totals['episodes'], 1)
+        self.assertFalse(self.storage.exists(episode.audio_file.name))
+        self.assertTrue(Podcast.objects.filter(pk=self.show.pk).exists())
+
+
+    def test_analytics_rows_go_in_batches_of_their_own(self):
+        episode = Episode.objects.filter(podcast=self.show).first()
+        AnalyticsEvent.objects.bulk_create(
+            AnalyticsEvent(kind=AnalyticsEvent.PLAY, podcast=self.show, episode=episode) for _ in range(5)
+        )
+        AnalyticsEvent.objects.create(kind=AnalyticsEvent.SUBSCRIBE, podcast=self.show)
+        EpisodeRollup.objects.create(episode=episode, podcast=self.show, period='day', bucket=timezone.now())
+        PodcastRollup.objects.create(podcast=self.show, period='day', bucket=timezone.now())
+        self.show.mark_deleted()
+
+        with CaptureQueriesContext(connection) as queries:
+            process_pending(batch_size=2, audio_storage=self.storage, image_storage=self.storage)
+        self.assertFalse(AnalyticsEvent.objects.exists())
+        self.assertFalse(EpisodeRollup.objects.exists() or PodcastRollup.objects.exists())
+        # Never more than a batch per statement, rather than all of them with the episode
+        deletes = [query['sql'] for query in queries if query['sql'].startswith('DELETE FROM "api_analyticsevent"')]
+        # Two at a time for the episode's plays, then the podcast's own event; the cascades find nothing left
+        self.assertEqual(len([sql for sql in deletes if '"api_analyticsevent"."id" IN' in sql]), 4)
+
+
+class StorageReconcileTests(TestCase):
+
+    def setUp(self):
+        make_catalog(podcasts=2)
+        self.media = tempfile.TemporaryDirectory()
+        self.addCleanup(self.media.cleanup)
+        self.storage = FileSystemStorage(location=self.media.name)
+        for name in Episode.objects.values_list('audio_file', flat=True):
+            self.storage.save(name, io.BytesIO(b'audio'))
+        self.orphans = [self.storage.save(f'episodes/orphan-{i}.mp3', io.BytesIO(b'lost')) for i in range(5)]
+        old = time.time() - 3 * 86400
+        for path in Path(self.media.name).rglob('*'):
+            os.utime(path, (old, old))
+        # Just uploaded, its row may not be committed yet
+        self.fresh = self.storage.save('episodes/fresh.mp3', io.BytesIO(b'new'))
+
+    def find(self):
+        return find_orphans(storage_listing(self.storage, 'episodes/'), referenced_names(), timedelta(hours=24))
+
+    def test_reports_only_old_unreferenced_objects(self):
+        orphans, stats = self.find()
+        with orphans:
+            self.assertEqual(list(orphans), sorted(self.orphans))
+        self.assertEqual(stats, {'listed': 10, 'too_recent': 1, 'orphans': 5, 'orphan_bytes': 20})
+
+    def test_delete_in_batches_keeps_referenced_and_recent(self):
+        orphans, _ = self.find()
+        with orphans:
+            self.assertEqual(delete_orphans(self.storage, orphans, batch_size=2, pause=0), 5)
+        for name in self.orphans:
+            self.assertFalse(self.storage.exists(name))
+        self.assertTrue(self.storage.exists(self.fresh))
+        for name in Episode.objects.values_list('audio_file', flat=True):
+            self.assertTrue(self.storage.exists(name))
+
+    def test_command_dry_run_deletes_nothing(self):
+        out = io.StringIO()
+        with override_settings(MEDIA_ROOT=self.media.name):
+            call_command('reconcile_storage', '--local', '--target', 'audio', '--dry-run', stdout=out)
+        self.assertIn('5 orphaned', out.getvalue())
+        for name in self.orphans:
+            self.assertTrue(self.storage.exists(name))
+
+
+@override_settings(API_THROTTLING={**settings.API_THROTTLING, 'ENABLED': False})
+class AudioDedupeTests(APITestCase):
+    # Upload buckets outlive a test run, repeated runs would hit the limit
+
+    def setUp(self):
+        self.user, _, self.shows = make_catalog(podcasts=1, episodes_per_podcast=0)
+        self.client.force_authenticate(self.user)
+
+    def post_episode(self, content):
+        return self.client.post('/api/episodes/', {
+            'title': 'Ad break', 'description': '...', 'podcast': self.shows[0].pk, 'duration': 1,
+            'audio_file': SimpleUploadedFile('spot.mp3', content, content_type='audio/mpeg'),
+        }, format='multipart')
+
+    @mock.patch('cloudinary.uploader.upload', return_value={'public_id': 'episodes/spot_abc.mp3'})
+    def test_known_audio_is_not_uploaded_again(self, upload):
+        self.assertEqual(self.post_episode(b'same spot').status_code, 201)
+        self.assertEqual(self.post_episode(b'same spot').status_code, 201)
+        self.assertEqual(upload.call_count, 1)
+
+        first, second = Episode.objects.order_by('pk')
+        self.assertEqual(first.audio_file.name, 'episodes/spot_abc.mp3')
+        self.assertEqual(second.audio_file.name, first.audio_file.name)
+        self.assertEqual(second.audio_hash, hashlib.sha256(b'same spot').hexdigest())
+
+        upload.return_value = {'public_id': 'episodes/other_def.mp3'}
+        self.post_episode(b'another spot')
+        self.assertEqual(upload.call_count, 2)
+
+    def test_backfill_merges_identical_objects(self):
+        media = tempfile.TemporaryDirectory()
+        self.addCleanup(media.cleanup)
+        storage = FileSystemStorage(location=media.name)
+        contents = {'episodes/a.mp3': b'x' * 100, 'episodes/b.mp3': b'x' * 100, 'episodes/c.mp3': b'y' * 50}
+        for name, content in contents.items():
+            storage.save(name, io.BytesIO(content))
+        Episode.objects.bulk_create([
+            Episode(title=name, description='', audio_file=name, podcast=self.shows[0], duration=1)
+            for name in [*contents, 'episodes/b.mp3']
+        ])
+
+        out = io.StringIO()
+        with override_settings(MEDIA_ROOT=media.name):
+            call_command('dedupe_audio', '--local', '--workers', '2', '--batch-size', '2', stdout=out)
+
+        self.assertIn('Reclaimed 100 bytes from 1 duplicate objects', out.getvalue())
+        self.assertEqual(
+            sorted(Episode.objects.values_list('audio_file', flat=True)),
+            ['episodes/a.mp3', 'episodes/a.mp3', 'episodes/a.mp3', 'episodes/c.mp3'],
+        )
+        self.assertFalse(storage.exists('episodes/b.mp3'))
+        self.assertTrue(storage.exists('episodes/a.mp3'))
+        self.assertFalse(Episode.objects.filter(audio_hash='').exists())
+
+
+def drain_bucket(path, key, attempts):
+    """Worker process for the shared-store test"""
+    store = SharedMemoryBucketStore(path, slots=1024)
+    allowed = sum(store.consume(key, 10, 1 / 3600)[0] for _ in range(attempts))
+    store.close()
+    return allowed
+
+
+class ThrottlingTests(APITestCase):
+
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.path = os.path.join(directory.name, 'buckets')
+        throttling = {**settings.API_THROTTLING, 'PATH': self.path, 'SLOTS': 1024,
+                      'BUCKETS': {'search': ('1/min', 2)}}
+        overrides = override_settings(API_THROTTLING=throttling)
+        overrides.enable()
+        self.addCleanup(overrides.disable)
+
+    def test_burst_then_retry_after_per_client(self):
+        for _ in range(2):
+            self.assertEqual(self.client.get('/api/search/', {'q': 'x'}).status_code, 200)
+        response = self.client.get('/api/search/', {'q': 'x'})
+        self.assertEqual(response.status_code, 429)
+        self.assertTrue(50 <= int(response['Retry-After']) <= 60)
+
+        # Another address and a signed-in user have buckets of their own
+        self.assertEqual(self.client.get('/api/search/', {'q': 'x'}, REMOTE_ADDR='10.0.0.2').status_code, 200)
+        self.client.force_authenticate(User.objects.create_user('listener'))
+        self.assertEqual(self.client.get('/api/search/', {'q': 'x'}).status_code, 200)
+        # Unthrottled scopes are untouched
+        self.assertEqual(self.client.get('/api/trending/').status_code, 200)
+
+    def test_anonymous_plays_are_limited(self):
+        episode = make_catalog(podcasts=1, episodes_per_podcast=1)[2][0].episode_set.get()
+        throttling = {**settings.API_THROTTLING, 'BUCKETS': {'plays': ('1/hour', 2)}}
+        with override_settings(API_THROTTLING=throttling):
+            statuses = [self.client.post(f'/api/episodes/{episode.pk}/play/', {'seconds': 30}).status_code for _ in range(3)]
+        self.assertEqual(statuses, [201, 201, 429])
+        self.assertEqual(AnalyticsEvent.objects.count(), 2)
+
+    def test_colliding_keys_keep_their_own_buckets(self):
+        # A single set, so every key collides
+        store = SharedMemoryBucketStore(self.path, slots=SharedMemoryBucketStore.WAYS)
+        self.addCleanup(store.close)
+        keys = [f'ip:10.0.0.{i}' for i in range(SharedMemoryBucketStore.WAYS)]
+        # Taking turns gives no one a fresh bucket
+        rounds = [[store.consume(key, 2, 0.001, now=100.0 + n)[0] for key in keys] for n in range(3)]
+        self.assertEqual(rounds, [[True] * 4, [True] * 4, [False] * 4])
+
+        # A key more than the set holds takes the least recently used record, the others stay put
+        self.assertTrue(store.consume('ip:10.0.0.9', 2, 0.001, now=110.0)[0])
+        self.assertFalse(store.consume(keys[3], 2, 0.001, now=111.0)[0])
+        self.assertTrue(store.consume(keys[0], 2, 0.001, now=112.0)[0])
+
+    def test_production_needs_a_bucket_file_on_purpose(self):
+        with override_settings(API_THROTTLING={**settings.API_THROTTLING, 'PATH': None, 'REDIS_URL': None}):
+            with self.assertRaises(ImproperlyConfigured):
+                get_store()
+
+    def test_noisy_client_does_not_starve_others(self):
+        store = SharedMemoryBucketStore(self.path, slots=1024)
+        self.addCleanup(store.close)
+        rate, burst, window = 10, 3, 1.0
+        deadline = time.perf_counter() + window
+        counts = {}
+        lock = threading.Lock()
+
+        def call(key, pause):
+            allowed = 0
+            while time.perf_counter() < deadline:
+                allowed += store.consume(key, burst, rate)[0]
+                time.sleep(pause)
+            with lock:
+                counts[key] = counts.get(key, 0) + allowed
+
+        # A scraper retrying flat out from four threads, four clients calling every 10ms
+        calls = [('scraper', 0)] * 4 + [(f'client-{i}', 0.01) for i in range(4)]
+        with ThreadPoolExecutor(len(calls)) as pool:
+            list(pool.map(lambda args: call(*args), calls))
+
+        allowance = burst + rate * window
+        self.assertLessEqual(counts['scraper'], allowance + 1)
+        for i in range(4):
+            self.assertLessEqual(counts[f'client-{i}'], allowance + 1)
+            self.assertGreaterEqual(counts[f'client-{i}'], 0.8 * allowance)
+
+    def test_bucket_is_shared_across_processes(self):
+        with ProcessPoolExecutor(4, mp_context=multiprocessing.get_context('fork')) as pool:
+            allowed = sum(pool.map(drain_bucket, [self.path] * 4, ['login:ip:10.0.0.1'] * 4, [200] * 4))
+        self.assertEqual(allowed, 10)
+
+
+class BatchHydrateTests(APITestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.addCleanup(cache.clear)
+        make_catalog(podcasts=3, episodes_per_podcast=3)
+        self.episodes = list(Episode.objects.order_by('pk').values_list('pk', flat=True))
+
+    def batch(self, path, ids, **params):
+        return self.client.get(path, {'ids': ','.join(map(str, ids)), **params})
+
+    def test_requested_order_with_missing_ids(self):
+        wanted = [self.episodes[4], 999999, self.episodes[0], self.episodes[4], self.episodes[7]]
+        with self.assertNumQueries(1):
+            response = self.batch('/api/episodes/batch/', wanted)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([item['id'] for item in response.data['results']],
+                         [self.episodes[4], self.episodes[0], self.episodes[7]])
+        self.assertEqual(response.data['missing'], [999999])
+        self.assertIn('podcast_title', response.data['results'][0])
+
+    def test_warm_cache_skips_the_database_until_a_save(self):
+        shows = list(Podcast.objects.values_list('pk', flat=True))
+        self.batch('/api/podcasts/batch/', shows)
+        with self.assertNumQueries(0):
+            self.batch('/api/podcasts/batch/', shows)
+
+        show = Podcast.objects.get(pk=shows[1])
+        show.title = 'Renamed'
+        show.save()
+        with self.assertNumQueries(1):
+            response = self.batch('/api/podcasts/batch/', shows)
+        self.assertEqual(response.data['results'][1]['title'], 'Renamed')
+
+        Podcast.objects.filter(pk=shows[2]).mark_deleted()
+        response = self.batch('/api/podcasts/batch/', shows)
+        self.assertEqual(response.data['missing'], [shows[2]])
+        self.assertFalse(Episode.objects.filter(podcast_id=shows[2]).exists())
+
+    def test_sparse_fields_are_served_uncached(self):
+        response = self.batch('/api/episodes/batch/', self.episodes[:2], fields='title')
+        self.assertEqual(response.data['results'], [{'title': 'Show 0 ep 0'}, {'title': 'Show 0 ep 1'}])
+        with self.assertNumQueries(1):
+            response = self.batch('/api/episodes/batch/', self.episodes[:2])
+        self.assertIn('audio_file', response.data['results'][0])
+
+    def test_rejects_bad_and_oversized_id_lists(self):
+        self.assertEqual(self.client.get('/api/episodes/batch/', {'ids': '1,x'}).status_code, 400)
+        self.assertEqual(self.client.get('/api/episodes/batch/').status_code, 400)
+        too_many = range(1, settings.API_HYDRATE['MAX_IDS'] + 2)
+        self.assertEqual(self.batch('/api/episodes/batch/', too_many).status_code, 400)
+
+
+class EventStreamTests(TestCase):
+
+    def setUp(self):
+        self.user, _, self.shows = make_catalog(podcasts=2, episodes_per_podcast=0)
+        Subscription.objects.create(user=self.user, podcast=self.shows[0])
+        self.token = str(RefreshToken.for_user(self.user).access_token)
+
+    def ticket(self):
+        response = self.client.post('/api/events/ticket/', HTTP_AUTHORIZATION=f'Bearer {self.token}')
+        self.assertEqual(response.status_code, 200)
+        return response.data['ticket']
+
+    def committed(self, change):
+        with self.captureOnCommitCallbacks(execute=True):
+            change()
+
+    def publish_episode(self, show, title):
+        self.committed(lambda: Episode.objects.create(
+            title=title, description='', podcast=show, duration=1, audio_file='episodes/new.mp3',
+        ))
+
+    async def next_event(self, chunks):
+        while True:
+            chunk = (await asyncio.wait_for(anext(chunks), 2)).decode()
+            if not chunk.startswith(':'):
+                return chunk
+
+    async def test_pushes_subscribed_episodes_and_playlist_changes(self):
+        ticket = await sync_to_async(self.ticket)()
+        response = await self.async_client.get('/api/events/', {'ticket': ticket})
+        self.assertEqual(response['Content-Type'], 'text/event-stream')
+        chunks = aiter(response.streaming_content)
+        self.assertTrue((await anext(chunks)).startswith(b'retry:'))
+
+        # Not subscribed to the second show, so only the first episode arrives
+        await sync_to_async(self.publish_episode)(self.shows[1], 'Elsewhere')
+        await sync_to_async(self.publish_episode)(self.shows[0], 'Fresh')
+        event = await self.next_event(chunks)
+        self.assertIn('event: episode.published', event)
+        self.assertEqual(json.loads(event.split('data: ')[1])['title'], 'Fresh')
+
+        playlist = await Playlist.objects.acreate(name='Queue', user=self.user)
+        await sync_to_async(self.committed)(lambda: playlist.episodes.add(*Episode.objects.all()))
+        event = await self.next_event(chunks)
+        self.assertIn('event: playlist.changed', event)
+        self.assertIn('"action": "episodes"', event)
+
+        # Subscribing mid-stream starts delivering that show's episodes too
+        await sync_to_async(self.committed)(lambda: Subscription.objects.create(user=self.user, podcast=self.shows[1]))
+        self.assertIn('event: subscription.changed', await self.next_event(chunks))
+        await sync_to_async(self.publish_episode)(self.shows[1], 'Now followed')
+        self.assertIn('Now followed', await self.next_event(chunks))
+
+        # The ASGI handler cancels the response task when the client disconnects
+        waiting = asyncio.ensure_future(anext(chunks))
+        await asyncio.sleep(0)
+        waiting.cancel()
+        with self.assertRaises(asyncio.CancelledError):
+            await waiting
+        self.assertFalse(hub.topics)
+
+    async def test_requires_a_fresh_ticket(self):
+        self.assertEqual((await self.async_client.get('/api/events/')).status_code, 401)
+        # Access tokens stay out of URLs, and so out of access logs
+        self.assertEqual((await self.async_client.get('/api/events/', {'token': self.token})).status_code, 401)
+        self.assertEqual((await self.async_client.get('/api/events/', {'ticket': 'nope'})).status_code, 401)
+
+        ticket = await sync_to_async(self.ticket)()
+        self.assertEqual((await self.async_client.get('/api/events/', {'ticket': ticket})).status_code, 200)
+        self.assertEqual((await self.async_client.get('/api/events/', {'ticket': ticket})).status_code, 401)
+
+        stale = await sync_to_async(self.ticket)()
+        await StreamTicket.objects.aupdate(created_at=timezone.now() - timedelta(minutes=5))
+        self.assertEqual((await self.async_client.get('/api/events/', {'ticket': stale})).status_code, 401)
+        headers = {'Authorization': f'Bearer {self.token}'}
+        self.assertEqual((await self.async_client.get('/api/events/', headers=headers)).status_code, 200)
+
+    def test_wsgi_requests_are_refused(self):
+        # The WSGI handler would buffer the endless stream instead of sending it
+        response = self.client.get('/api/events/', {'ticket': self.ticket()})
+        self.assertEqual(response.status_code, 501)
+        self.assertEqual(StreamTicket.objects.count(), 1)
+
+
+class ColdStartTests(TestCase):
+    # Loaded on first use in the serverless profile, not by startup and a request that doesn't need them
+    DEFERRED = ('cloudinary.', 'cloudinary_storage.storage', 'api.storages', 'api.admin', 'unfold.admin')
+
+    def deferred(self, modules):
+        return [name for name in modules if name.startswith(self.DEFERRED)]
+
+    def test_serverless_profile_defers_heavy_imports(self):
+        lean, import_times = probe(True, '/metrics')
+        full, _ = probe(False, '/metrics')
+        self.assertEqual(lean['status'], '200 OK')
+        self.assertEqual(self.deferred(lean['modules']), [])
+        self.assertTrue(self.deferred(full['modules']))
+
+        breakdown = ', '.join(f'{name} {us / 1000:.1f}ms' for name, us in by_package(import_times).most_common(10))
+        self.assertLessEqual(len(lean['modules']), len(full['modules']) - 50, f'import breakdown: {breakdown}')
+
+    def test_serverless_admin_loads_on_first_request(self):
+        measured, _ = probe(True, '/admin/login/')
+        self.assertEqual(measured['status'], '200 OK')
+        self.assertIn('api.admin', measured['modules'])
+
+
+@override_settings(API_THROTTLING={**settings.API_THROTTLING, 'ENABLED': False})
+class AnalyticsRollupTests(APITestCase):
+
+    def setUp(self):
+        self.creator, _, self.shows = make_catalog(podcasts=2, episodes_per_podcast=2)
+        self.episode = Episode.objects.filter(podcast=self.shows[0]).order_by('pk').first()
+        self.listeners = [User.objects.create_user(f'listener{i}') for i in range(2)]
+        self.later = timezone.now() + timedelta(minutes=5)
+
+    def play(self, user, seconds, episode=None):
+        self.client.force_authenticate(user)
+        response = self.client.post(f'/api/episodes/{(episode or self.episode).pk}/play/', {'seconds': seconds})
+        self.assertEqual(response.status_code, 201)
+
+    def rollup(self, period, model=PodcastRollup, **filters):
+        return model.objects.get(period=period, **filters)
+
+    def test_folds_new_events_in_once(self):
+        self.play(self.listeners[0], 1700)   # past 90% of 30 minutes
+        self.play(self.listeners[0], 60)
+        self.play(self.listeners[1], 9999)   # clamped to the duration
+        self.client.force_authenticate(self.listeners[1])
+        self.client.post(f'/api/podcasts/{self.shows[0].pk}/subscribe/')
+        playlist = Playlist.objects.create(name='Queue', user=self.listeners[1])
+        self.client.post(f'/api/playlists/{playlist.pk}/add_episode/', {'episode_id': self.episode.pk})
+
+        # Too recent to be settled yet
+        self.assertIsNone(roll_up())
+        self.assertEqual(catch_up(now=self.later)['events'], 5)
+
+        for period in ('hour', 'day'):
+            episode = self.rollup(period, EpisodeRollup, episode=self.episode)
+            self.assertEqual((episode.plays, episode.listeners, episode.completions), (3, 2, 2))
+            self.assertEqual(episode.listened_seconds, 1700 + 60 + 1800)
+            self.assertEqual(episode.playlist_adds, 1)
+            podcast = self.rollup(period, podcast=self.shows[0])
+            self.assertEqual((podcast.plays, podcast.subscribes, podcast.playlist_adds), (3, 1, 1))
+
+        # Nothing new: a rerun changes nothing
+        self.assertEqual(catch_up(now=self.later)['events'], 0)
+        self.assertEqual(self.rollup('day', podcast=self.shows[0]).plays, 3)
+
+        # Increments add to the stored rows; a returning listener isn't counted twice
+        self.play(self.listeners[0], 10)
+        self.play(self.creator, 10)
+        self.client.force_authenticate(self.listeners[1])
+        self.client.delete(f'/api/podcasts/{self.shows[0].pk}/unsubscribe/')
+        self.assertEqual(catch_up(batch_size=1, now=self.later)['events'], 3)
+        podcast = self.rollup('day', podcast=self.shows[0])
+        self.assertEqual((podcast.plays, podcast.listeners, podcast.unsubscribes), (5, 3, 1))
+
+    def test_creator_stats_reads_rollups_only(self):
+        self.play(self.listeners[0], 1800)
+        self.play(self.listeners[1], 10)
+        catch_up(now=self.later)
+
+        self.client.force_authenticate(self.creator)
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get('/api/creator/stats/', {'period': 'hour', 'days': 1})
+        self.assertEqual(response.status_code, 200)
+        self.assertFalse([q['sql'] for q in queries if 'api_analyticsevent' in q['sql']])
+
+        stats = response.json()
+        self.assertEqual(stats['totals']['plays'], 2)
+        self.assertEqual(stats['totals']['listen_through_rate'], 0.5)
+        self.assertEqual(len(stats['series']), 1)
+        self.assertEqual(stats['series'][0]['listeners'], 2)
+        self.assertEqual([p['plays'] for p in stats['podcasts']], [2, 0])
+        self.assertEqual(stats['top_episodes'][0]['id'], self.episode.pk)
+
+        response = self.client.get('/api/creator/stats/', {'podcast': self.shows[1].pk})
+        self.assertEqual(response.json()['totals']['plays'], 0)
+        self.assertEqual(self.client.get('/api/creator/stats/', {'period': 'hour', 'days': 400}).status_code, 400)
+
+        # Someone else's dashboard doesn't include these podcasts
+        self.client.force_authenticate(self.listeners[0])
+        self.assertEqual(self.client.get('/api/creator/stats/').json()['podcasts'], [])
+
+
+calls = []
+
+
+@task
+def record_call(value):
+    calls.append(value)
+
+
+@task(max_attempts=2)
+def always_fails():
+    raise RuntimeError('boom')
+
+
+@task
+def outlive_timeout():
+    time.sleep(settings.API_JOBS['TIMEOUT'] * 3)
+    # Another worker's sweep, once this run has taken longer than TIMEOUT
+    calls.append(requeue_stale())
+
+
+@override_settings(API_JOBS={**settings.API_JOBS, 'POLL_INTERVAL': 0})
+class JobQueueTests(TestCase):
+
+    def setUp(self):
+        calls.clear()
+
+    def test_runs_ready_jobs_by_priority(self):
+        record_call.delay('low')
+        record_call.enqueue(['high'], priority=5)
+        record_call.schedule(timedelta(hours=1), 'later')
+
+        call_command('runworker', burst=True, stdout=io.StringIO())
+        self.assertEqual(calls, ['high', 'low'])
+        # Finished jobs are deleted, the scheduled one waits
+        self.assertEqual(list(Job.objects.values_list('args', flat=True)), [['later']])
+
+    def test_claims_never_overlap(self):
+        for n in range(5):
+            record_call.delay(n)
+        first = claim('worker-a', limit=3)
+        second = claim('worker-b', limit=3)
+        self.assertEqual(len(first), 3)
+        self.assertEqual(len(second), 2)
+        self.assertFalse({job.pk for job in first} & {job.pk for job in second})
+        self.assertEqual(claim('worker-c'), [])
+
+    def test_retries_with_backoff_then_dead_letters(self):
+        job = always_fails.delay()
+        self.assertEqual(execute(claim('worker')[0]), 'retried')
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.attempts), (Job.QUEUED, 1))
+        self.assertGreater(job.run_at, timezone.now() + timedelta(seconds=5))
+        self.assertIn('RuntimeError: boom', job.last_error)
+
+        # Not due yet
+        self.assertEqual(claim('worker'), [])
+        self.assertEqual(execute(claim('worker', now=job.run_at)[0]), 'dead')
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.attempts), (Job.DEAD, 2))
+
+        self.assertEqual(retry(Job.objects.filter(pk=job.pk)), 1)
+        self.assertEqual(claim('worker')[0].attempts, 1)
+
+    def test_requeues_jobs_of_dead_workers(self):
+        record_call.delay('orphan')
+        claim('crashed-worker')
+        self.assertEqual(requeue_stale(), (0, 0))
+        later = timezone.now() + timedelta(hours=1)
+        self.assertEqual(requeue_stale(later), (1, 0))
+        self.assertEqual(claim('worker', now=later)[0].args, ['orphan'])
+
+    def test_heartbeat_holds_the_claim_and_late_runs_leave_the_new_one(self):
+        record_call.delay('slow')
+        first = claim('worker-a')[0]
+        self.assertEqual(Heartbeat([first]).beat(), [])
+        self.assertEqual(requeue_stale(timezone.now() + timedelta(seconds=settings.API_JOBS['TIMEOUT'] - 60)), (0, 0))
+
+        # Without further beats it is taken over; the first run ending late must not finish the second
+        later = timezone.now() + timedelta(hours=1)
+        self.assertEqual(requeue_stale(later), (1, 0))
+        second = claim('worker-b', now=later)[0]
+        self.assertEqual(Heartbeat([first]).beat(), [first])
+        self.assertEqual(execute(first), 'lost')
+        self.assertEqual(Job.objects.get().locked_by, 'worker-b')
+        self.assertEqual(execute(second), 'done')
+        self.assertEqual(calls, ['slow', 'slow'])
+        self.assertFalse(Job.objects.exists())
+
+    def test_deleting_a_podcast_queues_a_purge(self):
+        user, _, shows = make_catalog(podcasts=2)
+        token = RefreshToken.for_user(user).access_token
+        for show in shows:
+            self.client.delete(f'/api/podcasts/{show.pk}/', HTTP_AUTHORIZATION=f'Bearer {token}')
+        self.assertEqual(Job.objects.filter(task=purge_marked.name).count(), 1)
+
+        with mock.patch('api.storages.AudioCloudinaryStorage.delete_many') as delete_many:
+            with self.captureOnCommitCallbacks(execute=True):
+                call_command('runworker', burst=True, stdout=io.StringIO())
+        self.assertEqual(len(delete_many.call_args[0][0]), 2)
+        self.assertFalse(Podcast.all_objects.exists())
+        self.assertFalse(Job.objects.exists())
+
+
+@override_settings(API_JOBS={**settings.API_JOBS, 'HEARTBEAT': 0.05, 'TIMEOUT': 0.3})
+class JobBatchHeartbeatTests(TransactionTestCase):
+    # Committed rows, so the heartbeat thread's own connection sees the claims
+
+    def setUp(self):
+        calls.clear()
+
+    def test_jobs_waiting_in_a_batch_keep_their_claim(self):
+        outlive_timeout.enqueue(priority=1)
+        record_call.delay('waiting')
+        worker = Worker('worker-a', batch_size=2, poll_interval=0)
+        self.assertEqual(worker.run(burst=True), 2)
+        # The sweep found neither job stale, and the waiting one ran once
+        self.assertEqual(calls, [(0, 0), 'waiting'])
+        self.assertFalse(Job.objects.exists())
+
+
+def slow_section(user_id):
+    time.sleep(0.3)
+    return [{'title': 'fresh'}]
+
+
+def broken_section(user_id):
+    raise RuntimeError('boom')
+
+
+@override_settings(
+    API_THROTTLING={**settings.API_THROTTLING, 'ENABLED': False},
+    API_HOME={**settings.API_HOME, 'WORKERS': 0},
+)
+class HomeTests(APITestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.addCleanup(cache.clear)
+        self.creator, self.category, self.shows = make_catalog(podcasts=3, episodes_per_podcast=2)
+        self.listener = User.objects.create_user('listener', 'listener@example.com', 'password123')
+
+    def test_sections_match_the_separate_endpoints(self):
+        response = self.client.get('/api/home/')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(set(response.data), {'trending', 'recent_episodes', 'categories', 'degraded'})
+        self.assertEqual(response.data['degraded'], {})
+        self.assertEqual(response.json()['trending'], self.client.get('/api/trending/').json())
+        self.assertEqual(response.json()['recent_episodes'], self.client.get('/api/episodes/recent/').json())
+        self.assertEqual(response.json()['categories'], self.client.get('/api/categories/').json())
+
+    def test_viewer_sections_are_cached_per_user_until_a_change(self):
+        self.client.force_authenticate(self.listener)
+        response = self.client.get('/api/home/')
+        self.assertEqual(response.data['subscriptions'], [])
+        self.assertEqual(response.data['stats'], {'podcasts_created': 0, 'playlists_created': 0, 'subscriptions': 0})
+        with self.assertNumQueries(0):
+            self.client.get('/api/home/')
+
+        self.client.post(f'/api/podcasts/{self.shows[0].pk}/subscribe/')
+        response = self.client.get('/api/home/', {'sections': 'subscriptions,stats'})
+        self.assertEqual(set(response.data), {'subscriptions', 'stats', 'degraded'})
+        self.assertEqual([row['podcast'] for row in response.data['subscriptions']], [self.shows[0].pk])
+        self.assertEqual(response.data['stats']['subscriptions'], 1)
+
+        self.client.force_authenticate(self.creator)
+        response = self.client.get('/api/home/', {'sections': 'stats'})
+        self.assertEqual(response.data['stats']['podcasts_created'], 3)
+
+    def test_podcast_changes_reach_every_public_section(self):
+        self.client.get('/api/home/')
+        show = self.shows[0]
+        show.title = 'Renamed'
+        show.save()
+        titles = {row['podcast_title'] for row in self.client.get('/api/home/').data['recent_episodes']}
+        self.assertIn('Renamed', titles)
+
+        # Bulk updates send no signals, mark_deleted drops the sections itself
+        show.mark_deleted()
+        data = self.client.get('/api/home/').data
+        self.assertNotIn(show.pk, [row['id'] for row in data['trending']])
+        self.assertNotIn('Renamed', [row['podcast_title'] for row in data['recent_episodes']])
+        Episode.objects.filter(podcast=self.shows[1]).mark_deleted()
+        titles = [row['podcast_title'] for row in self.client.get('/api/home/').data['recent_episodes']]
+        self.assertNotIn(self.shows[1].title, titles)
+        self.assertIn(self.shows[2].title, titles)
+
+    def test_cached_urls_follow_the_requests_host(self):
+        Podcast.objects.filter(pk=self.shows[0].pk).update(cover_image='covers/show.png')
+        covers = {}
+        for host in ('localhost', '127.0.0.1'):
+            rows = self.client.get('/api/home/', {'sections': 'trending'}, HTTP_HOST=host).data['trending']
+            covers[host] = {row['id']: row['cover_image'] for row in rows}[self.shows[0].pk]
+        # The second request is served from the cache the first filled
+        self.assertEqual(covers, {host: f'http://{host}/media/covers/show.png' for host in covers})
+        cached = cache.get(home.cache_key('trending'))[1]
+        self.assertIn('/media/covers/show.png', [row['cover_image'] for row in cached])
+
+    def test_rejects_unknown_and_signed_in_only_sections(self):
+        self.assertEqual(self.client.get('/api/home/', {'sections': 'trending,nope'}).status_code, 400)
+        self.assertEqual(self.client.get('/api/home/', {'sections': 'stats'}).status_code, 400)
+
+    def test_slow_or_failing_sections_degrade_on_their_own(self):
+        config = {**settings.API_HOME, 'WORKERS': 2, 'SECTIONS': {**settings.API_HOME['SECTIONS'], 'trending': (60, 50)}}
+        sections = {'trending': (slow_section, False), 'categories': (broken_section, False)}
+        with override_settings(API_HOME=config), mock.patch.dict(home.SECTIONS, sections):
+            with self.assertLogs('api.home', level='WARNING'):
+                response = self.client.get('/api/home/', {'sections': 'trending,categories'})
+            self.assertEqual(response.data['degraded'], {'trending': 'timeout', 'categories': 'error'})
+            self.assertIsNone(response.data['trending'])
+
+            # The slow build finishes in the background and is served next time
+            time.sleep(0.5)
+            response = self.client.get('/api/home/', {'sections': 'trending'})
+            self.assertEqual(response.data, {'trending': [{'title': 'fresh'}], 'degraded': {}})
+
+            # Past its TTL it still stands in while a rebuild runs over budget
+            cache.set(home.cache_key('trending'), (time.time() - 1, [{'title': 'old'}]), 60)
+            response = self.client.get('/api/home/', {'sections': 'trending'})
+            self.assertEqual(response.data, {'trending': [{'title': 'old'}], 'degraded': {'trending': 'stale'}})
+
+    def test_requests_share_a_build_in_flight(self):
+        builds = []
+        def counted(user_id):
+            builds.append(user_id)
+            return slow_section(user_id)
+        config = {**settings.API_HOME, 'WORKERS': 4, 'SECTIONS': {**settings.API_HOME['SECTIONS'], 'trending': (60, 20)}}
+        with override_settings(API_HOME=config), mock.patch.dict(home.SECTIONS, {'trending': (counted, False)}):
+            for _ in range(5):
+                response = self.client.get('/api/home/', {'sections': 'trending'})
+                self.assertEqual(response.data['degraded'], {'trending': 'timeout'})
+            time.sleep(0.5)
+            self.assertEqual(self.client.get('/api/home/', {'sections': 'trending'}).data['trending'], [{'title': 'fresh'}])
+        self.assertEqual(len(builds), 1)
+        self.assertEqual(home.in_flight, {})
+
+
+@override_settings(API_THROTTLING={**settings.API_THROTTLING, 'ENABLED': False})
+class SuggestTests(APITestCase):
+
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        config = {**settings.API_SUGGEST, 'PATH': os.path.join(directory.name, 'suggest'), 'REFRESH_SECONDS': 0}
+        overrides = override_settings(API_SUGGEST=config)
+        overrides.enable()
+        self.addCleanup(overrides.disable)
+
+        self.creator, self.category, self.shows = make_catalog(podcasts=3, episodes_per_podcast=2)
+        fans = [User.objects.create_user(f'fan{i}', f'fan{i}@example.com', 'password123') for i in range(3)]
+        for fan in fans:
+            Subscription.objects.create(user=fan, podcast=self.shows[2])
+        Subscription.objects.create(user=fans[0], podcast=self.shows[1])
+        suggest.build()
+
+    def suggestions(self, q, **params):
+        response = self.client.get('/api/search/suggest/', {'q': q, **params})
+        self.assertEqual(response.status_code, 200)
+        return [(row['type'], row['text']) for row in response.data['results']]
+
+    def test_prefixes_of_any_leading_word_ranked_by_subscribers(self):
+        self.assertEqual(self.suggestions('SHOW', limit=3), [
+            ('podcast', 'Show 2'), ('episode', 'Show 2 ep 0'), ('episode', 'Show 2 ep 1'),
+        ])
+        self.assertEqual(self.suggestions('ep 1', limit=2), [('episode', 'Show 2 ep 1'), ('episode', 'Show 1 ep 1')])
+        self.assertEqual(self.suggestions('com'), [('category', 'Comedy')])
+        self.assertEqual(self.suggestions('crea'), [('creator', 'creator')])
+        self.assertEqual(self.suggestions('zzz'), [])
+        self.assertEqual(self.client.get('/api/search/suggest/').status_code, 400)
+
+    def test_changes_show_up_before_the_next_rebuild(self):
+        self.client.force_authenticate(self.creator)
+        with self.captureOnCommitCallbacks(execute=True):
+            show = Podcast.objects.create(title='Café Über', description='...', category=self.category, creator=self.creator)
+        self.assertEqual(self.suggestions('cafe'), [('podcast', 'Café Über')])
+        self.assertEqual(self.suggestions('über'), [('podcast', 'Café Über')])
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.shows[2].title = 'Renamed'
+            self.shows[2].save()
+            self.client.delete(f'/api/podcasts/{self.shows[0].pk}/')
+        self.assertEqual(self.suggestions('renamed'), [('podcast', 'Renamed')])
+        self.assertEqual(self.suggestions('show', limit=10), [
+            ('episode', 'Show 2 ep 0'), ('episode', 'Show 2 ep 1'), ('podcast', 'Show 1'),
+            ('episode', 'Show 1 ep 0'), ('episode', 'Show 1 ep 1'),
+        ])
+
+        before = {q: self.suggestions(q, limit=10) for q in ('cafe', 'renamed', 'show')}
+        suggest.build()
+        self.assertEqual({q: self.suggestions(q, limit=10) for q in before}, before)
+        # Other hosts may still need the log, only rows older than KEEP_HOURS go
+        self.assertTrue(SuggestChange.objects.exists())
+        with override_settings(API_SUGGEST={**settings.API_SUGGEST, 'KEEP_HOURS': 0}):
+            suggest.build()
+        self.assertFalse(SuggestChange.objects.exists())
+        self.assertEqual({q: self.suggestions(q, limit=10) for q in before}, before)
+        show.delete()
+
+    def test_every_host_replays_the_shared_log(self):
+        other_host = os.path.join(os.path.dirname(settings.API_SUGGEST['PATH']), 'other-host')
+        suggest.build(other_host)
+        config = settings.API_SUGGEST
+        index = suggest.SuggestIndex(other_host, config['MAX_WORDS'], config['KEY_CHARS'], config['SCAN_LIMIT'])
+        Podcast.objects.create(title='Zebra Talk', description='...', category=self.category, creator=self.creator)
+        try:
+            with transaction.atomic():
+                Podcast.objects.create(title='Zebra Lost', description='...', category=self.category, creator=self.creator)
+                raise RuntimeError
+        except RuntimeError:
+            pass
+        self.assertEqual([text for _, _, text in index.lookup('zebra', 5)], ['Zebra Talk'])
+        self.assertEqual(self.suggestions('zebra'), [('podcast', 'Zebra Talk')])
+
+    def test_long_change_log_queues_a_rebuild(self):
+        with override_settings(API_SUGGEST={**settings.API_SUGGEST, 'REBUILD_AFTER': 2}):
+            for show in self.shows:
+                show.save()
+            self.assertEqual(Job.objects.filter(task=suggest.rebuild.name).count(), 0)
+            self.suggestions('show')
+            self.suggestions('show')
+            self.assertEqual(Job.objects.filter(task=suggest.rebuild.name).count(), 1)
+            self.assertEqual(execute(claim('test')[0]), 'done')
+
+    def test_lookups_match_a_full_scan(self):
+        rng = random.Random(7)
+        words = ['alpha', 'alps', 'beta', 'bet', 'gamma', 'gam', 'über', 'delta']
+        entries = [
+            (rng.choice(suggest.KINDS), pk, ' '.join(rng.choices(words, k=rng.randint(1, 5))), rng.randint(0, 5))
+            for pk in range(1, 400)
+        ]
+        path = os.path.join(os.path.dirname(settings.API_SUGGEST['PATH']), 'scan')
+        # A tiny scan limit and key length exercise the precomputed prefixes and the text checks
+        suggest.write(path, entries, max_words=3, key_chars=8, scan_limit=5, top=10)
+        index = suggest.SuggestIndex(path, max_words=3, key_chars=8, scan_limit=5, changes=lambda position: ())
+        for query in ['a', 'al', 'alp', 'b', 'bet', 'beta', 'g', 'gamma gam', 'alpha alpha a', 'uber', 'x']:
+            expected = sorted(
+                (-weight, suggest.CODES[kind], pk) for kind, pk, text, weight in entries
+                if any(suggest.normalize(text)[start:].startswith(query)
+                       for start in suggest.word_starts(suggest.normalize(text), 3))
+            )[:10]
+            got = [(kind, pk) for kind, pk, _ in index.lookup(query, 10)]
+            self.assertEqual(got, [(suggest.KINDS[code], pk) for _, code, pk in expected], query)
+
+
+def opml_document(*outlines):
+    body = ''.join(f'<outline type="rss" text="{title}" xmlUrl="{url}"/>' for title, url in outlines)
+    return f'<?xml version="1.0"?><opml version="2.0"><head/><body><outline text="Folder">{body}</outline></body></opml>'
+
+
+@override_settings(API_THROTTLING={**settings.API_THROTTLING, 'ENABLED': False})
+class OPMLTests(APITestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.addCleanup(cache.clear)
+        self.creator, self.category, self.shows = make_catalog(podcasts=4, episodes_per_podcast=0)
+        self.listener = User.objects.create_user('listener', 'listener@example.com', 'password123')
+        Podcast.objects.filter(pk=self.shows[0].pk).update(feed_url='https://Feeds.Example.com:443/show0.xml#latest')
+        Podcast.objects.filter(pk=self.shows[3].pk).update(feed_url='http://feeds.example.com/show3.xml')
+        Subscription.objects.create(user=self.listener, podcast=self.shows[3])
+        self.client.force_authenticate(self.listener)
+
+    def import_opml(self, document):
+        return self.client.generic('POST', '/api/subscriptions/opml/', document, content_type='text/x-opml')
+
+    def test_canonical_feed_url(self):
+        self.assertEqual(canonical_feed_url(' HTTPS://Feeds.Example.com:443/Show.xml?x=1#top '), 'https://feeds.example.com/Show.xml?x=1')
+        self.assertEqual(canonical_feed_url('feed://example.com'), 'http://example.com/')
+        self.assertEqual(canonical_feed_url('feed:https://example.com/rss'), 'https://example.com/rss')
+        self.assertEqual(canonical_feed_url('http://user:pw@example.com:8080/rss'), 'http://example.com:8080/rss')
+        self.assertEqual(Podcast.objects.get(feed_url='https://feeds.example.com/show0.xml'), self.shows[0])
+
+    def test_import_resolves_feeds_links_and_titles(self):
+        response = self.import_opml(opml_document(
+            ('Renamed elsewhere', 'http://feeds.example.com/show0.xml'),
+            ('Show 1', f'http://testserver/api/podcasts/{self.shows[1].pk}/'),
+            ('show 2', 'https://unknown.example.com/rss'),
+            ('Show 3', 'https://feeds.example.com/show3.xml'),
+            ('Again', 'feed://feeds.example.com/show0.xml'),
+            ('Nowhere', 'https://nowhere.example.com/rss'),
+        ))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(
+            [(row['podcast'], row['status']) for row in response.data['results']],
+            [(self.shows[0].pk, 'subscribed'), (self.shows[1].pk, 'subscribed'), (self.shows[2].pk, 'subscribed'),
+             (self.shows[3].pk, 'already_subscribed'), (self.shows[0].pk, 'duplicate'), (None, 'not_found')],
+        )
+        self.assertEqual(
+            {key: response.data[key] for key in opml.OUTCOMES},
+            {'subscribed': 3, 'already_subscribed': 1, 'duplicate': 1, 'not_found': 1},
+        )
+        self.assertEqual(Subscription.objects.filter(user=self.listener).count(), 4)
+        self.assertEqual(AnalyticsEvent.objects.filter(kind=AnalyticsEvent.SUBSCRIBE, user=self.listener).count(), 3)
+
+    def test_import_queries_do_not_grow_with_the_document(self):
+        extra = Podcast.objects.bulk_create([
+            Podcast(title=f'Extra {i}', description='...', category=self.category, creator=self.creator,
+                    feed_url=f'https://feeds.example.com/extra{i}.xml')
+            for i in range(40)
+        ])
+        small = opml_document(*[(show.title, show.feed_url) for show in extra[:3]])
+        large = opml_document(*[(show.title, show.feed_url) for show in extra[3:]])
+        with CaptureQueriesContext(connection) as few:
+            self.assertEqual(self.import_opml(small).data['subscribed'], 3)
+        with CaptureQueriesContext(connection) as many:
+            self.assertEqual(self.import_opml(large).data['subscribed'], 37)
+        self.assertEqual(len(many), len(few))
+
+    def test_export_round_trips_through_import(self):
+        self.client.post(f'/api/podcasts/{self.shows[1].pk}/subscribe/')
+        response = self.client.get('/api/subscriptions/opml/')
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response['Content-Type'].startswith('text/x-opml'))
+        self.assertEqual(
+            opml.parse(response.content),
+            [('Show 3', 'http://feeds.example.com/show3.xml'),
+             ('Show 1', f'http://testserver/api/podcasts/{self.shows[1].pk}/')],
+        )
+
+        other = User.objects.create_user('other', 'other@example.com', 'password123')
+        self.client.force_authenticate(other)
+        upload = SimpleUploadedFile('subscriptions.opml', response.content, content_type='text/x-opml')
+        response = self.client.post('/api/subscriptions/opml/', {'file': upload}, format='multipart')
+        self.assertEqual(response.data['subscribed'], 2)
+        self.assertEqual(
+            set(Subscription.objects.filter(user=other).values_list('podcast_id', flat=True)),
+            {self.shows[1].pk, self.shows[3].pk},
+        )
+
+    def test_rejects_documents_that_are_not_plain_opml(self):
+        entities = '<?xml version="1.0"?><!DOCTYPE opml [<!ENTITY a "aaaa">]><opml><body>&a;</body></opml>'
+        for document in (entities, '<rss><channel/></rss>', '<opml><body>'):
+            response = self.import_opml(document)
+            self.assertEqual(response.status_code, 400, document)
+            self.assertIn('opml', response.data)
+        self.assertEqual(self.import_opml('').status_code, 400)
+        with override_settings(API_OPML={**settings.API_OPML, 'MAX_OUTLINES': 1}):
+            response = self.import_opml(opml_document(('Show 1', ''), ('Show 2', '')))
+        self.assertEqual(response.status_code, 400)
+        self.assertFalse(Subscription.objects.filter(user=self.listener).exclude(podcast=self.shows[3]).exists())
+
+
+
+@override_settings(API_THROTTLING={**settings.API_THROTTLING, 'ENABLED': False})
+class ViewerFlagsTests(APITestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.addCleanup(cache.clear)
+        self.creator, self.category, self.shows = make_catalog(podcasts=3, episodes_per_podcast=2)
+        self.listener = User.objects.create_user('listener', 'listener@example.com', 'password123')
+        Subscription.objects.create(user=self.listener, podcast=self.shows[1])
+        self.episodes = list(Episode.objects.order_by('pk'))
+        self.playlists = [Playlist.objects.create(name=name, user=self.listener) for name in ('Later', 'Best')]
+        self.playlists[0].episodes.add(self.episodes[0], self.episodes[1])
+        self.playlists[1].episodes.add(self.episodes[0])
+        Playlist.objects.create(name='Not mine', user=self.creator).episodes.add(self.episodes[1])
+        AnalyticsEvent.objects.create(kind=AnalyticsEvent.PLAY, podcast=self.shows[0], episode=self.episodes[0],
+                                      user=self.listener, seconds=60, created_at=timezone.now() - timedelta(hours=1))
+        AnalyticsEvent.objects.create(kind=AnalyticsEvent.PLAY, podcast=self.shows[0], episode=self.episodes[0],
+                                      user=self.listener, seconds=300)
+        AnalyticsEvent.objects.create(kind=AnalyticsEvent.PLAY, podcast=self.shows[0], episode=self.episodes[1],
+                                      user=self.listener, seconds=1800, completed=True)
+
+    def add_shows(self, count):
+        shows = Podcast.objects.bulk_create([
+            Podcast(title=f'More {i}', description='...', category=self.category, creator=self.creator)
+            for i in range(count)
+        ])
+        Episode.objects.bulk_create([
+            Episode(title=f'{show.title} ep', description='...', podcast=show, audio_file='episodes/x.mp3', duration=30)
+            for show in shows
+        ])
+
+    def queries(self, path, params=None):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(path, params or {})
+        self.assertEqual(response.status_code, 200)
+        return response, len(queries)
+
+    def test_flags_on_lists_and_details(self):
+        self.client.force_authenticate(self.listener)
+        podcasts = {row['id']: row for row in self.client.get('/api/podcasts/').data}
+        self.assertEqual({pk for pk, row in podcasts.items() if row['is_subscribed']}, {self.shows[1].pk})
+        self.assertTrue(self.client.get(f'/api/podcasts/{self.shows[1].pk}/').data['is_subscribed'])
+
+        episodes = {row['id']: row for row in self.client.get('/api/episodes/').data}
+        first, second = episodes[self.episodes[0].pk], episodes[self.episodes[1].pk]
+        self.assertEqual(first['playlist_ids'], [self.playlists[0].pk, self.playlists[1].pk])
+        self.assertEqual(first['resume_at'], 300)
+        self.assertEqual((second['playlist_ids'], second['resume_at']), ([self.playlists[0].pk], None))
+        self.assertEqual(episodes[self.episodes[2].pk]['playlist_ids'], [])
+        detail = self.client.get(f'/api/episodes/{self.episodes[0].pk}/').data
+        self.assertEqual((detail['resume_at'], len(detail['playlist_ids'])), (300, 2))
+        recent = self.client.get('/api/episodes/recent/', {'fields': 'id,resume_at'}).data
+        self.assertEqual({tuple(row) for row in recent}, {('id', 'resume_at')})
+
+    def test_flags_on_search_and_trending(self):
+        self.client.force_authenticate(self.listener)
+        trending = {row['id']: row['is_subscribed'] for row in self.client.get('/api/trending/').data}
+        self.assertEqual(trending, {show.pk: show == self.shows[1] for show in self.shows})
+        found = self.client.get('/api/search/', {'q': 'Show 0'}).data
+        self.assertEqual([row['is_subscribed'] for row in found['podcasts']], [False])
+        first = next(row for row in found['episodes'] if row['id'] == self.episodes[0].pk)
+        self.assertEqual((first['resume_at'], len(first['playlist_ids'])), (300, 2))
+
+    def test_anonymous_payloads_are_unchanged(self):
+        for path in ('/api/podcasts/', '/api/episodes/', f'/api/podcasts/{self.shows[0].pk}/', '/api/trending/'):
+            data = self.client.get(path).data
+            for row in data if isinstance(data, list) else [data]:
+                self.assertFalse({'is_subscribed', 'playlist_ids', 'resume_at'} & set(row), path)
+
+    def test_cost_per_page_is_constant(self):
+        self.client.force_authenticate(self.listener)
+        small = {path: self.queries(path)[1] for path in ('/api/podcasts/', '/api/episodes/')}
+        self.client.force_authenticate(None)
+        anonymous = {path: self.queries(path)[1] for path in small}
+        self.assertEqual(small['/api/podcasts/'] - anonymous['/api/podcasts/'], 1)
+        self.assertEqual(small['/api/episodes/'] - anonymous['/api/episodes/'], 2)
+
+        self.add_shows(20)
+        self.assertEqual({path: self.queries(path)[1] for path in small}, anonymous)
+        self.client.force_authenticate(self.listener)
+        self.assertEqual({path: self.queries(path)[1] for path in small}, small)
+        ids = ','.join(str(pk) for pk in Episode.objects.values_list('pk', flat=True))
+        _, batch = self.queries('/api/episodes/batch/', {'ids': ids})
+        self.assertEqual(self.queries('/api/episodes/batch/', {'ids': ids})[1], batch - 1)
+
+    def test_batch_cache_stays_shared(self):
+        self.client.force_authenticate(self.listener)
+        ids = f'{self.shows[0].pk},{self.shows[1].pk}'
+        results = self.client.get('/api/podcasts/batch/', {'ids': ids}).data['results']
+        self.assertEqual([row['is_subscribed'] for row in results], [False, True])
+        self.client.force_authenticate(None)
+        results = self.client.get('/api/podcasts/batch/', {'ids': ids}).data['results']
+        self.assertFalse(any('is_subscribed' in row for row in results))
+        self.client.force_authenticate(self.creator)
+        results = self.client.get('/api/podcasts/batch/', {'ids': ids}).data['results']
+        self.assertEqual([row['is_subscribed'] for row in results], [False, False])
+
+
+@override_settings(API_THROTTLING={**settings.API_THROTTLING, 'ENABLED': False})
+class FacetTests(APITestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.addCleanup(cache.clear)
+        facets.read_generation = facets.warm_queued_until = None
+        self.creator, self.comedy, self.shows = make_catalog(podcasts=3, episodes_per_podcast=0)
+        self.reporter = User.objects.create_user('reporter', 'reporter@example.com', 'password123')
+        self.news = Category.objects.create(name='News')
+        Podcast.objects.create(title='Daily News', description='...', category=self.news, creator=self.reporter)
+        Podcast.objects.create(title='Comedy News', description='...', category=self.comedy, creator=self.reporter)
+        Category.objects.create(name='Empty')
+
+    def get(self, **params):
+        response = self.client.get('/api/podcasts/facets/', params)
+        self.assertEqual(response.status_code, 200)
+        return response.data
+
+    def summary(self, data):
+        return (
+            data['total'],
+            {facet['name']: facet['count'] for facet in data['categories']},
+            {facet['username']: facet['count'] for facet in data['creators']},
+        )
+
+    def test_each_facet_ignores_its_own_filter(self):
+        self.assertEqual(self.summary(self.get()), (5, {'Comedy': 4, 'News': 1, 'Empty': 0}, {'creator': 3, 'reporter': 2}))
+        self.assertEqual(
+            self.summary(self.get(category=self.news.pk)),
+            (1, {'Comedy': 4, 'News': 1, 'Empty': 0}, {'reporter': 1}),
+        )
+        self.assertEqual(
+            self.summary(self.get(category=self.comedy.pk, creator=self.reporter.pk)),
+            (1, {'Comedy': 1, 'News': 1, 'Empty': 0}, {'creator': 3, 'reporter': 1}),
+        )
+        self.assertEqual(
+            self.summary(self.get(search='NEWS')),
+            (2, {'Comedy': 1, 'News': 1, 'Empty': 0}, {'reporter': 2}),
+        )
+        self.assertEqual(self.client.get('/api/podcasts/facets/', {'category': 'comedy'}).status_code, 400)
+
+    def test_counts_are_cached_until_a_podcast_changes(self):
+        self.get(search='news')
+        with self.assertNumQueries(0):
+            self.assertEqual(self.get(search='News')['total'], 2)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            Podcast.objects.create(title='Night News', description='...', category=self.news, creator=self.creator)
+            # Not retired until the save commits
+            self.assertEqual(self.get(search='news')['total'], 2)
+        # The worker's per-process cache would keep a warmed count to itself
+        self.assertFalse(Job.objects.filter(task=facets.warm.name).exists())
+        self.assertEqual(self.get(search='news')['total'], 3)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.shows[0].mark_deleted()
+        self.assertEqual(self.get()['total'], 5)
+
+    def test_generation_is_shared_and_warming_is_debounced(self):
+        self.enterContext(mock.patch.object(facets, 'shared_cache', return_value=True))
+        start = facets.generation()
+        with self.captureOnCommitCallbacks(execute=True):
+            self.news.save()
+        # In the database, where every host's cache keys read it
+        self.assertEqual(CacheGeneration.objects.get(name=facets.GENERATION).number, start + 1)
+        # Other processes read it again once theirs expires
+        facets.read_generation = (start, time.monotonic() + 60)
+        self.assertEqual(facets.generation(), start)
+        facets.read_generation = (start, time.monotonic())
+        self.assertEqual(facets.generation(), start + 1)
+
+        job = Job.objects.get(task=facets.warm.name)
+        self.assertGreater(job.run_at, timezone.now() + timedelta(seconds=5))
+        with CaptureQueriesContext(connection) as queries:
+            with self.captureOnCommitCallbacks(execute=True):
+                for podcast in self.shows:
+                    podcast.save()
+        self.assertEqual(facets.generation(), start + 4)
+        self.assertFalse([query for query in queries if 'api_job' in query['sql']])
+        self.assertEqual(Job.objects.filter(task=facets.warm.name).count(), 1)
+
+        # Another host finds the waiting job instead of queueing a second one
+        facets.warm_queued_until = None
+        with self.captureOnCommitCallbacks(execute=True):
+            facets.bump()
+        self.assertEqual(Job.objects.filter(task=facets.warm.name).count(), 1)
+
+    def test_search_can_include_facets(self):
+        response = self.client.get('/api/search/', {'q': 'news', 'facets': 'true'})
+        self.assertEqual(response.data['facets'], self.get(search='news'))
+        self.assertNotIn('facets', self.client.get('/api/search/', {'q': 'news'}).data)
+
+
+@override_settings(API_SYNC={**settings.API_SYNC, 'SETTLE_SECONDS': 0, 'LIMIT': 1000})
+class SyncTests(APITestCase):
+
+    def setUp(self):
+        self.creator, self.category, self.shows = make_catalog(podcasts=3, episodes_per_podcast=2)
+        self.user = User.objects.create_user('listener', 'listener@example.com', 'password123')
+        Subscription.objects.create(user=self.user, podcast=self.shows[0])
+        self.playlist = Playlist.objects.create(user=self.user, name='Later')
+        self.queued = Episode.objects.filter(podcast=self.shows[1]).first()
+        self.playlist.episodes.add(self.queued)
+        self.client.force_authenticate(self.user)
+
+    def sync(self, token=None):
+        response = self.client.get('/api/sync/', {'token': token} if token else {})
+        self.assertEqual(response.status_code, 200)
+        return response.data
+
+    def ids(self, section, key='upserted'):
+        return sorted(row['id'] if isinstance(row, dict) else row for row in section[key])
+
+    def test_first_sync_is_the_whole_library(self):
+        data = self.sync()
+        self.assertTrue(data['reset'])
+        self.assertEqual([row['podcast'] for row in data['subscriptions']['upserted']], [self.shows[0].pk])
+        self.assertEqual(self.ids(data['playlists']), [self.playlist.pk])
+        self.assertEqual(data['playlist_episodes']['added'], [[self.playlist.pk, self.queued.pk]])
+        expected = set(Episode.objects.filter(podcast=self.shows[0]).values_list('pk', flat=True)) | {self.queued.pk}
+        self.assertEqual(self.ids(data['episodes']), sorted(expected))
+        self.assertTrue(self.sync('not-a-token')['reset'])
+
+    def test_delta_holds_only_what_changed_for_the_viewer(self):
+        token = self.sync()['token']
+        self.assertEqual(self.ids(self.sync(token)['episodes']), [])
+
+        new = Episode.objects.create(title='New', description='...', podcast=self.shows[0], audio_file='episodes/new.mp3', duration=30)
+        Episode.objects.create(title='Elsewhere', description='...', podcast=self.shows[2], audio_file='episodes/other.mp3', duration=30)
+        self.playlist.name = 'Soon'
+        self.playlist.save()
+        self.playlist.episodes.remove(self.queued)
+        self.playlist.episodes.add(new)
+        Subscription.objects.create(user=self.user, podcast=self.shows[2])
+        Subscription.objects.create(user=self.creator, podcast=self.shows[1])
+
+        data = self.sync(token)
+        self.assertFalse(data['reset'])
+        self.assertEqual([row['podcast'] for row in data['subscriptions']['upserted']], [self.shows[2].pk])
+        self.assertEqual([row['name'] for row in data['playlists']['upserted']], ['Soon'])
+        self.assertEqual(data['playlist_episodes'], {
+            'added': [[self.playlist.pk, new.pk]], 'removed': [[self.playlist.pk, self.queued.pk]],
+        })
+        # The new episode, plus what the new subscription brings along
+        expected = {new.pk} | set(Episode.objects.filter(podcast=self.shows[2]).values_list('pk', flat=True))
+        self.assertEqual(self.ids(data['episodes']), sorted(expected))
+        self.assertEqual(self.ids(self.sync(data['token'])['episodes']), [])
+
+    def test_deletes_are_reported(self):
+        token = self.sync()['token']
+        gone = Episode.objects.filter(podcast=self.shows[0]).first()
+        Episode.objects.filter(pk=gone.pk).mark_deleted()
+        data = self.sync(token)
+        self.assertEqual(data['episodes']['deleted'], [gone.pk])
+
+        playlist = self.playlist.pk
+        self.shows[0].mark_deleted()
+        self.playlist.delete()
+        data = self.sync(data['token'])
+        self.assertEqual(data['subscriptions']['deleted'], [self.shows[0].pk])
+        self.assertEqual(data['playlists']['deleted'], [playlist])
+
+    def test_playlisted_episodes_of_unfollowed_podcasts_are_kept_current(self):
+        token = self.sync()['token']
+        # shows[1] is only reached through the playlist
+        self.queued.title = 'Renamed'
+        self.queued.save()
+        Episode.objects.create(title='Unrelated', description='...', podcast=self.shows[1], audio_file='episodes/u.mp3', duration=30)
+        data = self.sync(token)
+        self.assertEqual([row['title'] for row in data['episodes']['upserted']], ['Renamed'])
+
+        self.shows[1].mark_deleted()
+        data = self.sync(data['token'])
+        self.assertEqual(data['episodes']['deleted'], [self.queued.pk])
+        self.assertEqual(data['subscriptions']['deleted'], [])
+
+        with tempfile.TemporaryDirectory() as media:
+            storage = FileSystemStorage(location=media)
+            process_pending(audio_storage=storage, image_storage=storage)
+        self.assertEqual(self.sync(data['token'])['playlist_episodes']['removed'], [[self.playlist.pk, self.queued.pk]])
+
+    def test_pages_and_settling(self):
+        token = self.sync()['token']
+        for n in range(3):
+            Episode.objects.create(title=f'New {n}', description='...', podcast=self.shows[0], audio_file=f'episodes/{n}.mp3', duration=30)
+        with override_settings(API_SYNC={**settings.API_SYNC, 'SETTLE_SECONDS': 0, 'LIMIT': 2}):
+            first = self.sync(token)
+            self.assertTrue(first['more'])
+            second = self.sync(first['token'])
+        self.assertFalse(second['more'])
+        self.assertEqual(len(first['episodes']['upserted']) + len(second['episodes']['upserted']), 3)
+
+        # Changes too young to be settled come again rather than risk skipping one still in flight
+        Episode.objects.create(title='Fresh', description='...', podcast=self.shows[0], audio_file='episodes/f.mp3', duration=30)
+        with override_settings(API_SYNC={**settings.API_SYNC, 'SETTLE_SECONDS': 60}):
+            again = self.sync(second['token'])
+            self.assertEqual(self.sync(again['token'])['episodes'], again['episodes'])
+        self.assertEqual([row['title'] for row in again['episodes']['upserted']], ['Fresh'])
+
+    def test_compaction_keeps_what_tokens_still_need(self):
+        token = self.sync()['token']
+        for name in ('One', 'Two', 'Three'):
+            self.playlist.name = name
+            self.playlist.save()
+        Change.objects.filter(pk=Change.objects.order_by('pk').first().pk).update(created_at=timezone.now() - timedelta(days=365))
+        before = Change.objects.count()
+        # The oldest row expires; the playlist's create and first two renames are superseded
+        self.assertEqual(sync.compact(), {'expired': 1, 'superseded': 3})
+        self.assertEqual(Change.objects.count(), before - 4)
+        self.assertEqual([row['name'] for row in self.sync(token)['playlists']['upserted']], ['Three'])
+
+        with mock.patch('django.core.signing.time.time', return_value=time.time() + 400 * 86400):
+            self.assertTrue(self.sync(token)['reset'])
+
+
+@skipUnless(loudness.np is not None, 'numpy is not installed')
+class LoudnessTests(APITestCase):
+
+    def tone(self, seconds, rate=48000, amplitude=1.0, frequency=997, phase=0.0):
+        t = loudness.np.arange(int(seconds * rate)) / rate
+        return amplitude * loudness.np.sin(2 * loudness.np.pi * frequency * t + phase)
+
+    def measure(self, signal, rate=48000, channels=1, block=30000):
+        meter = loudness.Meter(rate, channels)
+        for start in range(0, signal.shape[-1], block):
+            meter.feed(loudness.np.tile(signal[start:start + block], (channels, 1)))
+        return meter.result()
+
+    def test_reference_tones(self):
+        # BS.1770: a full scale 997 Hz sine reads -3.01 LUFS on one channel, 0 on two
+        self.assertAlmostEqual(self.measure(self.tone(20))['loudness'], -3.01, delta=0.05)
+        self.assertAlmostEqual(self.measure(self.tone(20), channels=2)['loudness'], 0.0, delta=0.05)
+        self.assertAlmostEqual(self.measure(self.tone(20, amplitude=10 ** (-20 / 20)))['loudness'], -23.01, delta=0.05)
+        # Sampled at 45 degrees, an fs/4 sine never shows a sample above -3 dBFS
+        result = self.measure(self.tone(5, frequency=12000, phase=loudness.np.pi / 4))
+        self.assertAlmostEqual(result['true_peak'], 0.0, delta=0.3)
+        self.assertIsNone(self.measure(loudness.np.zeros(48000))['loudness'])
+
+    def test_gain_stays_under_the_peak_ceiling(self):
+        self.assertEqual(loudness.recommended_gain(-26.0, -23.0), 10.0)
+        self.assertEqual(loudness.recommended_gain(-26.0, -5.0), 4.0)
+        self.assertIsNone(loudness.recommended_gain(None, None))
+
+    def test_new_episodes_are_measured_by_a_job(self):
+        _, _, shows = make_catalog(podcasts=1, episodes_per_podcast=0)
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'tone.wav')
+            with wave.open(path, 'wb') as audio:
+                audio.setnchannels(1)
+                audio.setsampwidth(2)
+                audio.setframerate(44100)
+                audio.writeframes((self.tone(3, rate=44100, amplitude=0.1) * 2 ** 15).astype('<i2').tobytes())
+            episode = Episode.objects.create(title='Tone', description='...', podcast=shows[0], audio_file='episodes/tone.wav', duration=1)
+            job = Job.objects.get(task=loudness.analyze.name)
+            self.assertEqual(job.args, [episode.pk])
+            with mock.patch.object(loudness, 'source', return_value=path):
+                loudness.analyze(episode.pk)
+
+        data = self.client.get(f'/api/episodes/{episode.pk}/').data
+        self.assertAlmostEqual(data['loudness_lufs'], -23.01, delta=0.1)
+        self.assertAlmostEqual(data['true_peak_dbtp'], -20.0, delta=0.1)
+        self.assertAlmostEqual(data['gain_db'], 7.01, delta=0.1)
+
+
+@skipUnless(loudness.np is not None, 'numpy is not installed')
+class ChapterTests(APITestCase):
+    rate = 16000
+
+    def speech(self, rng, seconds):
+        np = loudness.np
+        frames = int(seconds * self.rate)
+        noise = np.convolve(rng.standard_normal(frames), np.ones(8) / 8, 'same') * 0.3
+        return noise * np.abs(np.sin(np.arange(frames) * (2 * np.pi * 3 / self.rate)))
+
+    def music(self, seconds):
+        t = loudness.np.arange(int(seconds * self.rate)) / self.rate
+        return 0.2 * (loudness.np.sin(2 * loudness.np.pi * 330 * t) + loudness.np.sin(2 * loudness.np.pi * 1760 * t))
+
+    def episode_audio(self):
+        """Speech, a 3 s pause at 120-123 s, speech, music from 200 to 260 s, speech"""
+        rng = loudness.np.random.default_rng(7)
+        return loudness.np.concatenate([
+            self.speech(rng, 120), loudness.np.zeros(3 * self.rate), self.speech(rng, 77),
+            self.music(60), self.speech(rng, 100),
+        ])
+
+    def test_boundaries_land_on_the_pause_and_the_music(self):
+        audio = self.episode_audio()
+        detector = chapters.Detector(self.rate)
+        for start in range(0, len(audio), 7 * self.rate + 123):
+            detector.feed(audio[start:start + 7 * self.rate + 123])
+        markers, seconds = detector.result()
+        self.assertAlmostEqual(seconds, 360.0)
+        self.assertEqual([kind for _, kind in markers], [chapters.START, chapters.SILENCE, chapters.CHANGE, chapters.CHANGE])
+        for (start, _), expected in zip(markers, [0, 121.5, 200, 260]):
+            self.assertAlmostEqual(start / 1000, expected, delta=1.5)
+        self.assertEqual(chapters.unpack(chapters.pack(markers)), markers)
+        self.assertEqual(len(chapters.pack(markers)), 5 * len(markers))
+        # Steady speech alone has no boundaries
+        detector = chapters.Detector(self.rate)
+        detector.feed(self.speech(loudness.np.random.default_rng(1), 300))
+        self.assertEqual(detector.result()[0], [(0, chapters.START)])
+
+    def test_catalog_run_saves_and_endpoint_serves_chapters(self):
+        _, _, shows = make_catalog(podcasts=1, episodes_per_podcast=2)
+        episode, other = Episode.objects.filter(podcast=shows[0]).order_by('pk')
+        self.assertEqual(self.client.get(f'/api/episodes/{episode.pk}/chapters/').status_code, 404)
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'episode.wav')
+            with wave.open(path, 'wb') as audio:
+                audio.setnchannels(1)
+                audio.setsampwidth(2)
+                audio.setframerate(self.rate)
+                audio.writeframes((self.episode_audio() * 2 ** 15).astype('<i2').tobytes())
+            items = [(episode.pk, path), (other.pk, os.path.join(directory, 'missing.wav'))]
+            with self.assertLogs('api.chapters', 'WARNING'):
+                totals = chapters.detect_catalog(items, processes=0)
+            self.assertEqual((totals['episodes'], totals['failed']), (1, 1))
+            self.assertAlmostEqual(totals['seconds'], 360.0)
+            # Running again replaces the row
+            chapters.detect_catalog(items[:1], processes=0)
+        self.assertEqual(Chapters.objects.count(), 1)
+
+        response = self.client.get(f'/api/episodes/{episode.pk}/chapters/')
+        self.assertEqual(response['Content-Type'], 'application/json+chapters')
+        document = json.loads(response.content)
+        self.assertEqual(document['version'], '1.2.0')
+        self.assertEqual([chapter['title'] for chapter in document['chapters']], ['Part 1', 'Part 2', 'Part 3', 'Part 4'])
+        self.assertEqual(document['chapters'][0]['startTime'], 0)
+        self.assertEqual(document['chapters'][-1]['endTime'], 360.0)
+
+        detailed = self.client.get(f'/api/episodes/{episode.pk}/chapters/', HTTP_ACCEPT='application/json').json()
+        self.assertEqual([chapter['kind'] for chapter in detailed['chapters']], ['start', 'silence', 'change', 'change'])
+        self.assertEqual(detailed['seconds'], 360.0)
+
+    def test_unexpected_errors_fail_only_their_episode(self):
+        _, _, shows = make_catalog(podcasts=1, episodes_per_podcast=2)
+        episode, other = Episode.objects.filter(podcast=shows[0]).order_by('pk')
+
+        def detect(source):
+            if source == 'bad.wav':
+                raise ValueError('bad header')
+            return [(0, chapters.START)], 60.0
+
+        with mock.patch('api.chapters.detect', side_effect=detect):
+            with self.assertLogs('api.chapters', 'WARNING') as logs:
+                totals = chapters.detect_catalog([(other.pk, 'bad.wav'), (episode.pk, 'ok.wav')], processes=0, batch_size=1)
+        self.assertEqual((totals['episodes'], totals['failed']), (1, 1))
+        self.assertIn('ValueError', logs.output[0])
+        self.assertEqual(list(Chapters.objects.values_list('episode_id', flat=True)), [episode.pk])
@@ -0,0 +1,236 @@
+"""
+Token-bucket throttles whose buckets live in a store shared by every worker.
+
+Each endpoint class (``scope``) keeps a bucket per user, or per client IP for
+anonymous requests. A bucket holds up to ``burst`` tokens and refills at the
+scope's rate; a request takes a token or is refused with the time until the
+next one, which DRF sends back as ``Retry-After``.
+"""
+import fcntl
+import hashlib
+import mmap
+import os
+import struct
+import threading
+import time
+from functools import lru_cache
+
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from django.core.signals import setting_changed
+from rest_framework.throttling import BaseThrottle
+
+from .metrics import THROTTLED
+
+
+DURATIONS = {'s': 1, 'm': 60, 'h': 3600, 'd': 86400}
+
+
+def parse_rate(rate):
+    """``'30/min'`` -> tokens refilled per second"""
+    count, period = rate.split('/')
+    return int(count) / DURATIONS[period[0]]
+
+
+def key_digest(key):
+    # Stable across processes, unlike hash()
+    return int.from_bytes(hashlib.blake2b(key.encode(), digest_size=8).digest(), 'little')
+
+
+class SharedMemoryBucketStore:
+    """
+    Fixed table of buckets in a memory-mapped file, shared by the workers on one host.
+
+    The table is split into sets of WAYS records. A key hashes to one set and
+    may take any record in it, and only that set is locked during a check, so
+    a check costs the same however many clients there are. A key that isn't
+    in its set takes the least recently used record. Keys that collide keep
+    their own levels until more than WAYS of them are active in one set at
+    once.
+    """
+
+    RECORD = struct.Struct('<Qdd')  # key digest, tokens, last refill
+    WAYS = 4
+
+    def __init__(self, path, slots=65536):
+        self.sets = max(1, slots // self.WAYS)
+        self.span = self.WAYS * self.RECORD.size
+        size = self.sets * self.span
+        self.fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o600)
+        if os.fstat(self.fd).st_size < size:
+            os.ftruncate(self.fd, size)
+        self.map = mmap.mmap(self.fd, size)
+        # Record locks are held per process, threads of one worker queue here first
+        self.lock = threading.Lock()
+
+    def consume(self, key, capacity, refill, now=None):
+        """Take a token from ``key``'s bucket; returns ``(allowed, seconds until the next token)``"""
+        # 0 marks a record never used
+        digest = key_digest(key) or 1
+        start = (digest % self.sets) * self.span
+        with self.lock:
+            fcntl.lockf(self.fd, fcntl.LOCK_EX, self.span, start)
+            try:
+                now = time.time() if now is None else now
+                records = [self.RECORD.unpack_from(self.map, start + way * self.RECORD.size) for way in range(self.WAYS)]
+                way = next((way for way, record in enumerate(records) if record[0] == digest), None)
+                if way is None:
+                    # Unused records have never been refilled, so they go first
+                    way = min(range(self.WAYS), key=lambda way: records[way][2])
+                    tokens, updated = capacity, now
+                else:
+                    _, tokens, updated = records[way]
+                tokens = min(capacity, tokens + max(0.0, now - updated) * refill)
+                allowed = tokens >= 1
+                if allowed:
+                    tokens -= 1
+                self.RECORD.pack_into(self.map, start + way * self.RECORD.size, digest, tokens, now)
+            finally:
+                fcntl.lockf(self.fd, fcntl.LOCK_UN, self.span, start)
+        return allowed, 0.0 if allowed else (1 - tokens) / refill
+
+    def close(self):
+        self.map.close()
+        os.close(self.fd)
+
+
+class RedisBucketStore:
+    """Buckets as Redis hashes, refilled and taken from in one Lua script using the server's clock"""
+
+    SCRIPT = """
+local capacity, refill = tonumber(ARGV[1]), tonumber(ARGV[2])
+local clock = redis.call('TIME')
+local now = tonumber(clock[1]) + tonumber(clock[2]) / 1000000
+local bucket = redis.call('HMGET', KEYS[1], 'tokens', 'updated')
+local tokens = tonumber(bucket[1]) or capacity
+local updated = tonumber(bucket[2]) or now
+tokens = math.min(capacity, tokens + math.max(0, now - updated) * refill)
+local allowed = 0
+if tokens >= 1 then
+    tokens = tokens - 1
+    allowed = 1
+end
+redis.call('HSET', KEYS[1], 'tokens', tostring(tokens), 'updated', tostring(now))
+redis.call('EXPIRE', KEYS[1], math.ceil(capacity / refill) + 1)
+return {allowed, tostring(tokens)}
+"""
+
+    def __init__(self, url, prefix='throttle:'):
+        try:
+            import redis
+        except ImportError:
+            raise ImproperlyConfigured('THROTTLE_REDIS_URL is set but the redis package is not installed')
+        self.prefix = prefix
+        self.client = redis.Redis.from_url(url)
+        self.script = self.client.register_script(self.SCRIPT)
+
+    def consume(self, key, capacity, refill, now=None):
+        allowed, tokens = self.script(keys=[self.prefix + key], args=[capacity, refill])
+        tokens = float(tokens)
+        return bool(allowed), 0.0 if allowed else (1 - tokens) / refill
+
+    def close(self):
+        self.client.close()
+
+
+@lru_cache(maxsize=None)
+def get_store():
+    config = settings.API_THROTTLING
+    if config['REDIS_URL']:
+        return RedisBucketStore(config['REDIS_URL'])
+    if not config['PATH']:
+        raise ImproperlyConfigured(
+            'Throttling is on but has nowhere to keep buckets: set THROTTLE_REDIS_URL, or API_THROTTLE_PATH '
+            'to a file only the API workers can write, or API_THROTTLE_ENABLED=false'
+        )
+    return SharedMemoryBucketStore(config['PATH'], config['SLOTS'])
+
+
+def reset_store(*, setting, **kwargs):
+    if setting == 'API_THROTTLING' and get_store.cache_info().currsize:
+        get_store().close()
+        get_store.cache_clear()
+
+
+setting_changed.connect(reset_store)
+
+
+class TokenBucketThrottle(BaseThrottle):
+    """Throttle against the ``settings.API_THROTTLING['BUCKETS'][scope]`` bucket"""
+
+    scope = None
+
+    def get_bucket_key(self, request):
+        user = request.user
+        if user and user.is_authenticated:
+            return f'{self.scope}:user:{user.pk}'
+        return f'{self.scope}:ip:{self.get_ident(request)}'
+
+    def allow_request(self, request, view):
+        config = settings.API_THROTTLING
+        if not config['ENABLED'] or self.scope not in config['BUCKETS']:
+            return True
+        rate, burst = config['BUCKETS'][self.scope]
+        allowed, self.retry_after = get_store().consume(self.get_bucket_key(request), burst, parse_rate(rate))
+        if not allowed:
+            THROTTLED.labels(self.scope).inc()
+        return allowed
+
+    def wait(self):
+        return self.retry_after
+
+
+class SearchThrottle(TokenBucketThrottle):
+    scope = 'search'
+
+
+class TrendingThrottle(TokenBucketThrottle):
+    scope = 'trending'
+
+
+class SuggestThrottle(TokenBucketThrottle):
+    scope = 'suggest'
+
+
+class HomeThrottle(TokenBucketThrottle):
+    scope = 'home'
+
+
+class OPMLImportThrottle(TokenBucketThrottle):
+    """Only imports; exporting is a single query"""
+
+    scope = 'opml'
+
+    def allow_request(self, request, view):
+        if request.method != 'POST':
+            return True
+        return super().allow_request(request, view)
+
+
+class SyncThrottle(TokenBucketThrottle):
+    scope = 'sync'
+
+
+class PlayThrottle(TokenBucketThrottle):
+    """Anonymous play reports, each one an analytics row and a count on creator stats"""
+
+    scope = 'plays'
+
+
+class RegisterThrottle(TokenBucketThrottle):
+    scope = 'register'
+
+
+class LoginThrottle(TokenBucketThrottle):
+    scope = 'login'
+
+
+class UploadThrottle(TokenBucketThrottle):
+    """Only creating or replacing podcasts and episodes, which is where files come in"""
+
+    scope = 'uploads'
+
+    def allow_request(self, request, view):
+        if getattr(view, 'action', None) not in ('create', 'update', 'partial_update'):
+            return True
+        return super().allow_request(request, view)
@@ -0,0 +1,75 @@
+"""
+Content addressing for uploaded audio.
+
+Upload handlers hash files chunk by chunk while the request body is read, so
+``Episode.save`` can tell a known file apart before sending a byte to storage.
+Identical audio is stored once; episodes sharing it point at the same name,
+and ``deletion.unreferenced`` only removes an object once no row points at it.
+"""
+import hashlib
+
+from django.core.files.uploadhandler import MemoryFileUploadHandler, TemporaryFileUploadHandler
+
+
+class HashingUploadMixin:
+    """Keep a running SHA-256 of the chunks this handler stores, exposed as ``file.content_hash``"""
+
+    def new_file(self, *args, **kwargs):
+        self.hasher = hashlib.sha256()
+        super().new_file(*args, **kwargs)
+
+    def receive_data_chunk(self, raw_data, start):
+        remaining = super().receive_data_chunk(raw_data, start)
+        if remaining is None:
+            # Consumed here rather than handed on to the next handler
+            self.hasher.update(raw_data)
+        return remaining
+
+    def file_complete(self, file_size):
+        file = super().file_complete(file_size)
+        if file is not None:
+            file.content_hash = self.hasher.hexdigest()
+        return file
+
+
+class HashingMemoryFileUploadHandler(HashingUploadMixin, MemoryFileUploadHandler):
+    pass
+
+
+class HashingTemporaryFileUploadHandler(HashingUploadMixin, TemporaryFileUploadHandler):
+    pass
+
+
+def hash_chunks(chunks):
+    """``(sha256 hex digest, size)`` of an iterable of byte chunks"""
+    hasher = hashlib.sha256()
+    size = 0
+    for chunk in chunks:
+        hasher.update(chunk)
+        size += len(chunk)
+    return hasher.hexdigest(), size
+
+
+def content_hash(file):
+    """Digest recorded by the upload handlers, or computed by streaming the file"""
+    digest = getattr(file, 'content_hash', None)
+    if digest:
+        return digest
+    digest, _ = hash_chunks(file.chunks())
+    file.seek(0)
+    return digest
+
+
+def stream_object(storage, name, chunk_size=64 * 1024):
+    """Yield a stored object's bytes without holding all of it in memory"""
+    import requests
+    from cloudinary_storage.storage import MediaCloudinaryStorage
+
+    if isinstance(storage, MediaCloudinaryStorage):
+        # The storage's own open() buffers the whole response
+        with requests.get(storage.url(name), stream=True, timeout=60) as response:
+            response.raise_for_status()
+            yield from response.iter_content(chunk_size)
+        return
+    with storage.open(name, 'rb') as fh:
+        yield from fh.chunks(chunk_size)
@@ -1,7 +1,7 @@
 from django.urls import path, include
 from rest_framework.routers import DefaultRouter
 from rest_framework_simplejwt.views import TokenRefreshView
-from . import views
+from . import events, views
 
 router = DefaultRouter()
 router.register(r'podcasts', views.PodcastViewSet)
@@ -17,9 +17,17 @@ urlpatterns = [
     path('categories/', views.CategoryListView.as_view(), name='category-list'),
     path('categories/<int:pk>/', views.CategoryDetailView.as_view(), name='category-detail'),
     path('subscriptions/', views.SubscriptionListView.as_view(), name='subscription-list'),
+    path('subscriptions/opml/', views.subscriptions_opml, name='subscription-opml'),
     path('search/', views.search, name='search'),
+    path('search/suggest/', views.search_suggest, name='search-suggest'),
     path('trending/', views.trending, name='trending'),
+    path('home/', views.home, name='home'),
+    path('sync/', views.sync, name='sync'),
     path('profile/', views.UserProfileView.as_view(), name='user-profile'),
     path('stats/', views.user_stats, name='user-stats'),
+    path('creator/stats/', views.creator_stats, name='creator-stats'),
+    path('export/', views.export_user_data, name='user-export'),
+    path('events/', events.event_stream, name='events'),
+    path('events/ticket/', views.event_ticket, name='event-ticket'),
 
 ]
\ No newline at end of file
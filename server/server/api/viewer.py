@@ -0,0 +1,100 @@
+"""
+How the signed-in viewer relates to the podcasts and episodes of a payload.
+
+Podcasts get ``is_subscribed``. Episodes get ``playlist_ids``, the viewer's
+playlists holding the episode, and ``resume_at``, the second the viewer's
+last play stopped at (null if never played or played through). The flags are
+added to payloads that are already rendered, with one query per flag for the
+whole page whichever path rendered it (serializer, ``values()`` fast path or
+hydrate cache), and only for signed-in viewers. Cached payloads stay shared
+and anonymous ones are untouched. A payload needs its ``id`` to get flags;
+``?fields=`` picks flags like any other field.
+"""
+from django.db.models import OuterRef, Subquery
+
+from .fieldsets import is_root_serializer, parse_field_list
+from .models import AnalyticsEvent, Episode, Playlist, Podcast, Subscription
+
+
+def podcast_flags(user, ids, names):
+    subscribed = set(
+        Subscription.all_objects.filter(user=user, podcast_id__in=ids).values_list('podcast_id', flat=True)
+    )
+    return {pk: {'is_subscribed': pk in subscribed} for pk in ids}
+
+
+def episode_flags(user, ids, names):
+    flags = {pk: {} for pk in ids}
+    if 'playlist_ids' in names:
+        for pk in ids:
+            flags[pk]['playlist_ids'] = []
+        memberships = (
+            Playlist.episodes.through.objects.filter(playlist__user=user, episode_id__in=ids)
+            .order_by('playlist_id').values_list('episode_id', 'playlist_id')
+        )
+        for episode_id, playlist_id in memberships:
+            flags[episode_id]['playlist_ids'].append(playlist_id)
+    if 'resume_at' in names:
+        last_play = AnalyticsEvent.objects.filter(
+            kind=AnalyticsEvent.PLAY, user=user, episode_id=OuterRef('pk'),
+        ).order_by('-created_at', '-pk')
+        plays = (
+            Episode.all_objects.filter(pk__in=ids)
+            .annotate(seconds=Subquery(last_play.values('seconds')[:1]),
+                      completed=Subquery(last_play.values('completed')[:1]))
+            .values_list('pk', 'seconds', 'completed')
+        )
+        for pk in ids:
+            flags[pk]['resume_at'] = None
+        for pk, seconds, completed in plays:
+            if seconds is not None and not completed:
+                flags[pk]['resume_at'] = seconds
+    return flags
+
+
+# model -> (flag names, flags for (user, ids, requested names))
+FLAGS = {
+    Podcast: (['is_subscribed'], podcast_flags),
+    Episode: (['playlist_ids', 'resume_at'], episode_flags),
+}
+
+
+def add_viewer_flags(items, model, request):
+    """Add the viewer's flags to rendered ``items`` in place"""
+    if request is None or model not in FLAGS or not request.user.is_authenticated:
+        return items
+    names, lookup = FLAGS[model]
+    requested = parse_field_list(request, 'fields')
+    if requested is not None:
+        names = [name for name in names if name in requested]
+    ids = list(dict.fromkeys(item['id'] for item in items if 'id' in item))
+    if not names or not ids:
+        return items
+    flags = lookup(request.user, ids, names)
+    for item in items:
+        if 'id' in item:
+            item.update(flags[item['id']])
+    return items
+
+
+class ViewerFlagsMixin:
+    """
+    Serializer mixin adding the flags to what it renders at the root.
+
+    ``context['viewer_flags'] = False`` leaves them out, for payloads that
+    are cached for everyone.
+    """
+
+    def add_viewer_flags(self, items):
+        if self.context.get('viewer_flags', True):
+            add_viewer_flags(items, self.Meta.model, self.context.get('request'))
+        return items
+
+    @property
+    def data(self):
+        data = super().data
+        # With many=True the list serializer adds them, for the whole page at once
+        if self.instance is not None and is_root_serializer(self):
+            self.add_viewer_flags([data])
+        return data
+
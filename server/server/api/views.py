@@ -1,6 +1,10 @@
+from django.conf import settings
 from django.shortcuts import render
+from django.http import HttpResponse, StreamingHttpResponse
 from rest_framework import generics, viewsets, status
-from rest_framework.decorators import action, api_view, permission_classes
+from rest_framework.decorators import action, api_view, parser_classes, permission_classes, throttle_classes
+from rest_framework.exceptions import ValidationError
+from rest_framework.parsers import MultiPartParser
 from rest_framework.response import Response
 from rest_framework.permissions import IsAuthenticated, IsAuthenticatedOrReadOnly, AllowAny
 from django.contrib.auth.models import User
@@ -9,7 +13,22 @@ from rest_framework_simplejwt.tokens import RefreshToken
 from rest_framework_simplejwt.views import TokenObtainPairView, TokenRefreshView
 from rest_framework_simplejwt.serializers import TokenObtainPairSerializer
 
-from .models import Category, Podcast, Episode, Playlist, Subscription
+from .models import AnalyticsEvent, Category, Chapters, Podcast, Episode, Playlist, Subscription
+from .analytics import dashboard, record, record_play, window_start
+from .chapters import chapter_list, podcasting_document
+from .deletion import schedule_purge
+from .events import issue_ticket
+from .exchange import export_records, ndjson_lines, user_querysets
+from .facets import facets as podcast_facets
+from .fieldsets import SparseFieldsetViewMixin
+from .home import compose, requested_sections
+from .opml import OUTCOMES, OPMLError, OPMLParser, export as export_opml, import_subscriptions, parse as parse_opml
+from .suggest import suggest
+from .sync import sync as sync_library
+from .hydrate import BatchRetrieveMixin
+from .metrics import SUBSCRIPTIONS, PLAYLIST_ADDS
+from .renderers import ChaptersRenderer, ORJSONRenderer
+from .throttling import HomeThrottle, LoginThrottle, OPMLImportThrottle, PlayThrottle, RegisterThrottle, SearchThrottle, SuggestThrottle, SyncThrottle, TrendingThrottle, UploadThrottle
 from .serializers import (
     CategorySerializer,
     UserSerializer,
@@ -20,7 +39,11 @@ from .serializers import (
     PlaylistSerializer,
     PlaylistCreateSerializer,
     SubscriptionSerializer,
-    UserRegistrationSerializer
+    UserRegistrationSerializer,
+    PlaySerializer,
+    CreatorStatsQuerySerializer,
+    FacetQuerySerializer,
+    SuggestQuerySerializer,
 )
 
 def get_tokens_for_user(user):
@@ -60,10 +83,12 @@ class CustomTokenObtainPairSerializer(TokenObtainPairSerializer):
 
 class CustomTokenObtainPairView(TokenObtainPairView):
     serializer_class = CustomTokenObtainPairSerializer
+    throttle_classes = [LoginThrottle]
 
 
 @api_view(['POST'])
 @permission_classes([AllowAny])
+@throttle_classes([RegisterThrottle])
 def register(request):
     serializer = UserRegistrationSerializer(data=request.data)
     if serializer.is_valid():
@@ -97,21 +122,22 @@ def logout(request):
                       status=status.HTTP_400_BAD_REQUEST)
 
 
-class CategoryListView(generics.ListCreateAPIView):
+class CategoryListView(SparseFieldsetViewMixin, generics.ListCreateAPIView):
     queryset = Category.objects.all()
     serializer_class = CategorySerializer
     permission_classes = [IsAuthenticatedOrReadOnly]
 
 
-class CategoryDetailView(generics.RetrieveUpdateDestroyAPIView):
+class CategoryDetailView(SparseFieldsetViewMixin, generics.RetrieveUpdateDestroyAPIView):
     queryset = Category.objects.all()
     serializer_class = CategorySerializer
     permission_classes = [IsAuthenticatedOrReadOnly]
 
 
-class PodcastViewSet(viewsets.ModelViewSet):
+class PodcastViewSet(BatchRetrieveMixin, SparseFieldsetViewMixin, viewsets.ModelViewSet):
     queryset = Podcast.objects.all().select_related('creator', 'category')
     permission_classes = [IsAuthenticatedOrReadOnly]
+    throttle_classes = [UploadThrottle]
     
     def get_serializer_class(self):
         if self.action == 'list':
@@ -121,6 +147,11 @@ class PodcastViewSet(viewsets.ModelViewSet):
     def perform_create(self, serializer):
         serializer.save(creator=self.request.user)
     
+    def perform_destroy(self, instance):
+        # Episodes, subscriptions and media are removed by a background purge
+        instance.mark_deleted()
+        schedule_purge()
+    
     def get_queryset(self):
         queryset = super().get_queryset()
         
@@ -138,6 +169,13 @@ class PodcastViewSet(viewsets.ModelViewSet):
         
         return queryset
     
+    @action(detail=False, methods=['get'], throttle_classes=[SearchThrottle])
+    def facets(self, request):
+        """Podcast counts by category and creator under the list's ``category``, ``creator`` and ``search`` filters"""
+        query = FacetQuerySerializer(data=request.query_params)
+        query.is_valid(raise_exception=True)
+        return Response(podcast_facets(query.validated_data))
+    
     @action(detail=False, methods=['get'], permission_classes=[IsAuthenticated])
     def my_podcasts(self, request):
         podcasts = self.get_queryset().filter(creator=request.user)
@@ -153,6 +191,8 @@ class PodcastViewSet(viewsets.ModelViewSet):
         )
         
         if created:
+            SUBSCRIPTIONS.labels('subscribe').inc()
+            record(AnalyticsEvent.SUBSCRIBE, podcast.pk, request.user)
             return Response({'message': 'Successfully subscribed to podcast'})
         else:
             return Response({'message': 'Already subscribed to this podcast'})
@@ -163,21 +203,28 @@ class PodcastViewSet(viewsets.ModelViewSet):
         try:
             subscription = Subscription.objects.get(user=request.user, podcast=podcast)
             subscription.delete()
+            SUBSCRIPTIONS.labels('unsubscribe').inc()
+            record(AnalyticsEvent.UNSUBSCRIBE, podcast.pk, request.user)
             return Response({'message': 'Successfully unsubscribed'})
         except Subscription.DoesNotExist:
             return Response({'message': 'Not subscribed to this podcast'}, 
                           status=status.HTTP_400_BAD_REQUEST)
 
 
-class EpisodeViewSet(viewsets.ModelViewSet):
+class EpisodeViewSet(BatchRetrieveMixin, SparseFieldsetViewMixin, viewsets.ModelViewSet):
     queryset = Episode.objects.all().select_related('podcast__creator')
     permission_classes = [IsAuthenticatedOrReadOnly]
+    throttle_classes = [UploadThrottle]
     
     def get_serializer_class(self):
         if self.action == 'list':
             return EpisodeListSerializer
         return EpisodeSerializer
     
+    def perform_destroy(self, instance):
+        instance.mark_deleted()
+        schedule_purge()
+    
     def get_queryset(self):
         queryset = super().get_queryset()
         
@@ -194,11 +241,36 @@ class EpisodeViewSet(viewsets.ModelViewSet):
     @action(detail=False, methods=['get'])
     def recent(self, request):
         episodes = self.get_queryset()[:10]
-        serializer = EpisodeListSerializer(episodes, many=True)
+        serializer = EpisodeListSerializer(episodes, many=True, context=self.get_serializer_context())
         return Response(serializer.data)
+    
+    @action(detail=True, methods=['post'], permission_classes=[AllowAny], throttle_classes=[PlayThrottle])
+    def play(self, request, pk=None):
+        episode = self.get_object()
+        serializer = PlaySerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        record_play(episode, request.user, serializer.validated_data['seconds'])
+        return Response({'message': 'Play recorded'}, status=status.HTTP_201_CREATED)
+
+    @action(detail=True, methods=['get'], renderer_classes=[ChaptersRenderer, ORJSONRenderer])
+    def chapters(self, request, pk=None):
+        """Podcasting 2.0 chapters by default; ``Accept: application/json`` adds how each boundary was found"""
+        episode = self.get_object()
+        try:
+            found = episode.chapters
+        except Chapters.DoesNotExist:
+            return Response({'error': 'Chapters not detected yet'}, status=status.HTTP_404_NOT_FOUND)
+        if request.accepted_renderer.format == 'chapters':
+            return Response(podcasting_document(found))
+        return Response({
+            'episode': episode.pk,
+            'seconds': found.seconds,
+            'analyzed_at': found.analyzed_at,
+            'chapters': chapter_list(found),
+        })
 
 
-class PlaylistViewSet(viewsets.ModelViewSet):
+class PlaylistViewSet(SparseFieldsetViewMixin, viewsets.ModelViewSet):
     permission_classes = [IsAuthenticated]
     
     def get_queryset(self):
@@ -224,6 +296,8 @@ class PlaylistViewSet(viewsets.ModelViewSet):
         try:
             episode = Episode.objects.get(id=episode_id)
             playlist.episodes.add(episode)
+            PLAYLIST_ADDS.inc()
+            record(AnalyticsEvent.PLAYLIST_ADD, episode.podcast_id, request.user, episode.pk)
             return Response({'message': 'Episode added to playlist'})
         except Episode.DoesNotExist:
             return Response({'error': 'Episode not found'}, 
@@ -247,7 +321,7 @@ class PlaylistViewSet(viewsets.ModelViewSet):
                           status=status.HTTP_404_NOT_FOUND)
 
 
-class SubscriptionListView(generics.ListAPIView):
+class SubscriptionListView(SparseFieldsetViewMixin, generics.ListAPIView):
     serializer_class = SubscriptionSerializer
     permission_classes = [IsAuthenticated]
     
@@ -255,8 +329,42 @@ class SubscriptionListView(generics.ListAPIView):
         return Subscription.objects.filter(user=self.request.user).select_related('podcast')
 
 
+@api_view(['GET', 'POST'])
+@permission_classes([IsAuthenticated])
+@parser_classes([MultiPartParser, OPMLParser])
+@throttle_classes([OPMLImportThrottle])
+def subscriptions_opml(request):
+    """
+    GET: the viewer's subscriptions as OPML. POST: subscribe to every feed of an
+    OPML document, sent as the body or as a ``file`` upload, see ``api.opml``.
+    """
+    if request.method == 'GET':
+        response = HttpResponse(export_opml(request), content_type='text/x-opml; charset=utf-8')
+        response['Content-Disposition'] = f'attachment; filename="{request.user.username}-subscriptions.opml"'
+        return response
+
+    upload = request.FILES.get('file')
+    if upload is not None:
+        data = upload.read(settings.API_OPML['MAX_BYTES'] + 1)
+    elif isinstance(request.data, bytes):
+        data = request.data
+    else:
+        raise ValidationError({'file': 'Send an OPML document as the request body or as "file".'})
+    try:
+        outlines = parse_opml(data)
+    except OPMLError as exc:
+        raise ValidationError({'opml': str(exc)})
+
+    results = import_subscriptions(request.user, outlines, request.get_host())
+    counts = dict.fromkeys(OUTCOMES, 0)
+    for result in results:
+        counts[result['status']] += 1
+    return Response({**counts, 'results': results})
+
+
 @api_view(['GET'])
 @permission_classes([AllowAny])
+@throttle_classes([SearchThrottle])
 def search(request):
     query = request.query_params.get('q', '')
     
@@ -264,25 +372,75 @@ def search(request):
         return Response({'error': 'Search query (q) parameter is required'}, 
                        status=status.HTTP_400_BAD_REQUEST)
     
+    # The request brings the viewer's flags along, as on the list routes
+    context = {'request': request}
     podcasts = Podcast.objects.filter(title__icontains=query)[:5]
-    podcast_data = PodcastListSerializer(podcasts, many=True).data
+    podcast_data = PodcastListSerializer(podcasts, many=True, context=context).data
     episodes = Episode.objects.filter(title__icontains=query)[:5]
-    episode_data = EpisodeListSerializer(episodes, many=True).data
+    episode_data = EpisodeListSerializer(episodes, many=True, context=context).data
     
-    return Response({
+    data = {
         'podcasts': podcast_data,
         'episodes': episode_data
-    })
+    }
+    if request.query_params.get('facets', '').lower() in ('1', 'true'):
+        filters = FacetQuerySerializer(data={'search': query})
+        filters.is_valid(raise_exception=True)
+        data['facets'] = podcast_facets(filters.validated_data)
+    return Response(data)
 
 
 @api_view(['GET'])
 @permission_classes([AllowAny])
+@throttle_classes([SuggestThrottle])
+def search_suggest(request):
+    query = SuggestQuerySerializer(data=request.query_params)
+    query.is_valid(raise_exception=True)
+    params = query.validated_data
+    return Response({'query': params['q'], 'results': suggest(params['q'], params['limit'])})
+
+
+@api_view(['GET'])
+@permission_classes([AllowAny])
+@throttle_classes([TrendingThrottle])
 def trending(request):
     podcasts = Podcast.objects.all().order_by('-created_at')[:10]
-    serializer = PodcastListSerializer(podcasts, many=True)
+    serializer = PodcastListSerializer(podcasts, many=True, context={'request': request})
     return Response(serializer.data)
 
 
+@api_view(['GET'])
+@permission_classes([AllowAny])
+@throttle_classes([HomeThrottle])
+def home(request):
+    """
+    Trending podcasts, recent episodes, categories and, when signed in, the
+    viewer's subscriptions and stats in one response. ``degraded`` names the
+    sections that came back stale or, for ``timeout``/``error``, empty.
+    """
+    sections, degraded = compose(request, requested_sections(request))
+    return Response({**sections, 'degraded': degraded})
+
+
+@api_view(['GET'])
+@permission_classes([IsAuthenticated])
+@throttle_classes([SyncThrottle])
+def sync(request):
+    """
+    What changed in the viewer's library since ``?token=``, see ``api.sync``.
+    Without a usable token the whole library comes back with ``reset`` set.
+    Send the returned token next time; ``more`` means call again right away.
+    """
+    return Response(sync_library(request.user, request.query_params.get('token')))
+
+
+@api_view(['POST'])
+@permission_classes([IsAuthenticated])
+def event_ticket(request):
+    """A single-use ticket for ``/api/events/?ticket=``, which EventSource can open without headers"""
+    return Response({'ticket': issue_ticket(request.user), 'expires_in': settings.API_EVENTS['TICKET_SECONDS']})
+
+
 class UserProfileView(generics.RetrieveUpdateAPIView):
     serializer_class = UserSerializer
     permission_classes = [IsAuthenticated]
@@ -305,3 +463,24 @@ def user_stats(request):
     return Response(stats)
 
 
+@api_view(['GET'])
+@permission_classes([IsAuthenticated])
+def creator_stats(request):
+    query = CreatorStatsQuerySerializer(data=request.query_params)
+    query.is_valid(raise_exception=True)
+    params = query.validated_data
+    
+    podcasts = Podcast.objects.filter(creator=request.user).order_by('pk')
+    if 'podcast' in params:
+        podcasts = podcasts.filter(pk=params['podcast'])
+    since = window_start(params['period'], params['days'])
+    return Response(dashboard(dict(podcasts.values_list('pk', 'title')), params['period'], since))
+
+
+@api_view(['GET'])
+@permission_classes([IsAuthenticated])
+def export_user_data(request):
+    records = export_records(user_querysets(request.user))
+    response = StreamingHttpResponse(ndjson_lines(records), content_type='application/x-ndjson')
+    response['Content-Disposition'] = f'attachment; filename="{request.user.username}-export.ndjson"'
+    return response
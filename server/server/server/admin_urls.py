@@ -0,0 +1,8 @@
+"""
+Admin URLs for the serverless profile, imported on the first /admin/ request.
+"""
+from django.contrib import admin
+
+admin.autodiscover()
+
+urlpatterns = admin.site.urls[0]
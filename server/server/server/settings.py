@@ -12,15 +12,20 @@ https://docs.djangoproject.com/en/5.2/ref/settings/
 
 from pathlib import Path
 import os
+import sys
+import tempfile
 import dj_database_url
 from dotenv import load_dotenv
-import cloudinary
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
 BASE_DIR = Path(__file__).resolve().parent.parent
 
 load_dotenv()
 
+# Serverless profile (Vercel sets VERCEL=1): the admin, the Cloudinary SDK and the
+# browsable API stay out of startup and load on first use, for shorter cold starts.
+SERVERLESS = os.getenv('SERVERLESS', os.getenv('VERCEL', '')).lower() in ('1', 'true')
+
 # Quick-start development settings - unsuitable for production
 # See https://docs.djangoproject.com/en/5.2/howto/deployment/checklist/
 
@@ -29,6 +34,7 @@ SECRET_KEY = os.getenv('SECRET_KEY', 'django-insecure-j#89=h2ww8&&kwvq=hnc&5ssso
 
 # SECURITY WARNING: don't run with debug turned on in production!
 DEBUG = os.getenv('DEBUG', 'False').lower() == 'true'
+TESTING = sys.argv[1:2] == ['test']
 
 ALLOWED_HOSTS = ['localhost', '127.0.0.1', '0.0.0.0', '.vercel.app']
 
@@ -55,7 +61,15 @@ INSTALLED_APPS = [
     'api',
 ]
 
+if SERVERLESS:
+    # No admin.autodiscover() at startup, server/urls.py runs it on the first /admin/ request
+    INSTALLED_APPS[INSTALLED_APPS.index('django.contrib.admin')] = 'django.contrib.admin.apps.SimpleAdminConfig'
+    # Only contributes template tags; the SDK itself is imported by the first storage call
+    INSTALLED_APPS.remove('cloudinary')
+
 MIDDLEWARE = [
+    'api.metrics.MetricsMiddleware',
+    'api.middleware.RequestTimingMiddleware',
     'corsheaders.middleware.CorsMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'whitenoise.middleware.WhiteNoiseMiddleware',
@@ -96,6 +110,23 @@ DATABASES = {
     )
 }
 
+if DATABASES['default'].get('ENGINE') == 'django.db.backends.sqlite3':
+    # Take the write lock when a transaction begins. A transaction that reads first
+    # fails outright when it can't upgrade its lock, e.g. two job workers claiming
+    # at once; waiting up front lets the busy timeout serialize them instead.
+    DATABASES['default'].setdefault('OPTIONS', {}).update({'transaction_mode': 'IMMEDIATE', 'timeout': 20})
+
+# Shared cache for per-object payloads. Defaults to per-process memory; point
+# CACHE_REDIS_URL at Redis so every worker sees the same entries.
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+        'LOCATION': os.getenv('CACHE_REDIS_URL'),
+    } if os.getenv('CACHE_REDIS_URL') else {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    },
+}
+
 # Password validation
 # https://docs.djangoproject.com/en/5.2/ref/settings/#auth-password-validators
 
@@ -137,13 +168,10 @@ STATICFILES_DIRS = [
 ]
 
 # Cloudinary Configuration
-# Make sure you have these in your .env file or environment variables
-cloudinary.config(
-    cloud_name=os.getenv('CLOUDINARY_CLOUD_NAME'),
-    api_key=os.getenv('CLOUDINARY_API_KEY'),
-    api_secret=os.getenv('CLOUDINARY_API_SECRET'),
-    secure=True  # Use https
-)
+# Make sure you have these in your .env file or environment variables. The SDK
+# reads CLOUDINARY_CLOUD_NAME/API_KEY/API_SECRET/SECURE itself when first imported,
+# so importing it here just to configure it would only slow startup down.
+os.environ.setdefault('CLOUDINARY_SECURE', 'true')  # Use https
 
 # Media files (User uploads)
 CLOUDINARY_STORAGE = {
@@ -178,6 +206,12 @@ else:
 FILE_UPLOAD_MAX_MEMORY_SIZE = 10 * 1024 * 1024  # 10MB 
 DATA_UPLOAD_MAX_MEMORY_SIZE = 10 * 1024 * 1024  # 10MB
 
+# Hash uploads as they arrive so known audio is not stored twice
+FILE_UPLOAD_HANDLERS = [
+    'api.uploads.HashingMemoryFileUploadHandler',
+    'api.uploads.HashingTemporaryFileUploadHandler',
+]
+
 # Maximum request size for all data combined
 DATA_UPLOAD_MAX_NUMBER_FIELDS = 1000
 
@@ -187,6 +221,9 @@ DATA_UPLOAD_MAX_NUMBER_FIELDS = 1000
 DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 
 REST_FRAMEWORK = {
+    'DEFAULT_RENDERER_CLASSES': [
+        'api.renderers.ORJSONRenderer',
+    ] + ([] if SERVERLESS else ['rest_framework.renderers.BrowsableAPIRenderer']),
     'DEFAULT_AUTHENTICATION_CLASSES': [
         'rest_framework_simplejwt.authentication.JWTAuthentication',
     ],
@@ -200,6 +237,177 @@ REST_FRAMEWORK = {
     ]
 }
 
+# Token-bucket throttles (api.throttling): scope -> (refill rate, burst). Buckets are
+# kept per user, or per IP for anonymous clients, in a memory-mapped file shared by
+# the workers on one host, or in Redis when THROTTLE_REDIS_URL is set. Outside
+# DEBUG and test runs the file has no default: anyone who can write it can reset
+# every bucket, so set API_THROTTLE_PATH somewhere only the API workers can write.
+API_THROTTLING = {
+    'ENABLED': os.getenv('API_THROTTLE_ENABLED', 'True').lower() == 'true',
+    'REDIS_URL': os.getenv('THROTTLE_REDIS_URL'),
+    'PATH': os.getenv('API_THROTTLE_PATH') or (
+        os.path.join(tempfile.gettempdir(), 'podcast-api-throttle') if DEBUG or TESTING else None
+    ),
+    'SLOTS': 65536,  # Buckets in the file, in sets of 4 a key may take any of
+    'BUCKETS': {
+        'search': ('60/min', 20),
+        'trending': ('120/min', 30),
+        'home': ('120/min', 30),
+        'suggest': ('600/min', 60),
+        'register': ('5/hour', 3),
+        'login': ('10/min', 5),
+        'uploads': ('30/hour', 5),
+        'opml': ('20/hour', 5),
+        'sync': ('120/min', 30),
+        'plays': ('120/hour', 20),  # A report per play start; skipping through a queue stays well under
+    },
+}
+
+# Batch lookups (/api/podcasts/batch/, /api/episodes/batch/)
+API_HYDRATE = {
+    'MAX_IDS': 200,
+    'CACHE_TIMEOUT': 300,  # Seconds; saves and deletes invalidate sooner, renames of related rows don't
+}
+
+# Composite home/discover payload (/api/home/): section -> (cache seconds, time budget
+# in ms). A section not built within its budget is served from its last cached copy,
+# or empty, and listed under "degraded"; the build still finishes and refills the cache.
+API_HOME = {
+    'WORKERS': 8,            # Threads building sections; 0 builds them in turn on the request thread, without budgets
+    'STALE_SECONDS': 3600,   # How long past its TTL a section may stand in for a slow build
+    'SECTIONS': {
+        'trending': (60, 300),
+        'recent_episodes': (30, 300),
+        'categories': (600, 300),
+        'subscriptions': (15, 300),
+        'stats': (60, 300),
+    },
+}
+
+# Podcast counts by category and creator (/api/podcasts/facets/, /api/search/?facets=true)
+API_FACETS = {
+    'CACHE_TIMEOUT': 300,     # Seconds per filter combination; podcast and category saves retire them sooner
+    'CREATORS': 20,           # Creators listed, by podcast count
+    'GENERATION_SECONDS': 2,  # How long a process reuses the generation it read; other hosts see saves this late
+    'WARM_DELAY': 10,         # Seconds from a podcast or category save to recounting the unfiltered case, with CACHE_REDIS_URL
+}
+
+# OPML import and export of subscriptions (/api/subscriptions/opml/, api.opml)
+API_OPML = {
+    'MAX_BYTES': 2 * 2**20,  # Largest document accepted; a thousand feeds is about 200 KiB
+    'MAX_OUTLINES': 5000,    # Most feeds per import
+}
+
+# Search-as-you-type (/api/search/suggest/, api.suggest). The index file is mapped by every
+# worker on the host; build it with "manage.py build_suggest_index" on each host, from cron
+# (hourly, say). Later changes are logged in the database and replayed by every worker.
+API_SUGGEST = {
+    'PATH': os.getenv('API_SUGGEST_PATH', os.path.join(tempfile.gettempdir(), 'podcast-api-suggest')),
+    'MAX_WORDS': 4,          # Word starts indexed per title, "the daily show" is found from "da" and "sh" too
+    'KEY_CHARS': 32,         # Characters indexed per key; longer queries are checked against the text
+    'SCAN_LIMIT': 64,        # Prefixes matching more keys than this get their best entries stored
+    'TOP': 20,               # Entries stored per such prefix
+    'MAX_LIMIT': 10,         # Most suggestions per request
+    'REBUILD_AFTER': 1000,   # Logged changes a worker replays before it queues a rebuild
+    'REFRESH_SECONDS': 1.0,  # How often a worker reads the change log, at most
+    'SETTLE_SECONDS': 30,    # Log rows this young are read again, a lower id may still be committing
+    'KEEP_HOURS': 48,        # Log rows kept for hosts yet to rebuild; run build_suggest_index on each host more often
+}
+
+# Server-Sent Events (/api/events/). Streams are only served by the ASGI app,
+# e.g. "uvicorn server.asgi:application"; the WSGI app answers 501. With
+# several workers set EVENTS_REDIS_URL so an event published in one worker
+# reaches streams held by the others.
+API_EVENTS = {
+    'REDIS_URL': os.getenv('EVENTS_REDIS_URL'),
+    'KEEPALIVE': 15,     # Seconds between comment lines on an idle stream
+    'QUEUE_SIZE': 100,   # Undelivered events kept per stream, oldest dropped first
+    'RETRY_MS': 5000,    # Reconnect delay suggested to EventSource
+    'TICKET_SECONDS': 30,  # Life of a ticket from /api/events/ticket/, used once to open a stream
+}
+
+# Creator analytics (/api/creator/stats/), built by "manage.py rollup_analytics"
+API_ANALYTICS = {
+    'BATCH_SIZE': 50_000,       # Event ids folded into the rollups per transaction
+    'SETTLE_SECONDS': 30,       # Newer events wait for a later run, lower ids may still be uncommitted
+    'COMPLETION_RATIO': 0.9,    # A play this far through the episode counts as listened through
+    'MAX_DAYS': {'hour': 7, 'day': 365},  # Longest window the dashboard serves per period
+}
+
+# Delta sync (/api/sync/); "manage.py compact_changes" trims the change log, run it daily
+API_SYNC = {
+    'LIMIT': 1000,              # Changes per response; "more" says another request follows
+    'SETTLE_SECONDS': 30,       # Tokens stop short of newer changes, lower ids may still be uncommitted
+    'RETENTION_DAYS': 30,       # Older tokens get a full snapshot; older changes are compacted away
+    'COMPACT_BATCH_SIZE': 50_000,
+}
+
+# Episode loudness (api.loudness), measured by the worker after upload; needs numpy and ffmpeg
+API_LOUDNESS = {
+    'TARGET_LUFS': -16.0,     # Where the recommended gain takes an episode, the usual podcast target
+    'PEAK_CEILING': -1.0,     # dBTP the gain keeps true peaks under
+    'BLOCK_SECONDS': 10,      # PCM decoded and measured per step
+    'FFMPEG': os.getenv('FFMPEG_BINARY', 'ffmpeg'),
+    'FFPROBE': os.getenv('FFPROBE_BINARY', 'ffprobe'),
+    'PROBE_TIMEOUT': 60,
+}
+
+# Chapter boundaries (api.chapters), found by "manage.py detect_chapters"
+API_CHAPTERS = {
+    'RATE': 16000,            # ffmpeg decodes to this, mono; speech, music and ads differ well below 8 kHz
+    'SILENCE_DB': 30,         # Frames this far under an episode's loud level are silent
+    'MIN_SILENCE': 0.6,       # Seconds of silence that make a gap a change can move into
+    'CHAPTER_SILENCE': 2.0,   # Seconds of silence that make a boundary on their own
+    'NOVELTY_SECONDS': 15,    # Audio compared on either side of a spectral change
+    'NOVELTY_Z': 8.0,         # Robust z-score a change needs; chance peaks in steady speech reach 5-8
+    'SNAP_SECONDS': 5,        # A change this close to a gap moves into it
+    'MIN_CHAPTER': 30,        # Shortest chapter, in seconds; an ad spot
+    'MAX_CHAPTERS': 60,
+}
+
+# Background jobs (api.jobs), run by "manage.py runworker --concurrency N"
+API_JOBS = {
+    'POLL_INTERVAL': 1.0,   # Seconds an idle worker waits before looking for jobs again
+    'BATCH_SIZE': 1,        # Jobs claimed per query; more saves round-trips on short jobs
+    'MAX_ATTEMPTS': 5,      # Default for tasks that don't set their own
+    'BACKOFF': 10,          # Seconds before the first retry, doubling after each failure
+    'BACKOFF_MAX': 3600,
+    'HEARTBEAT': 60,        # Seconds between refreshes of the locks on a worker's claimed jobs
+    'TIMEOUT': 900,         # No heartbeat for this long means the worker died; the job is requeued
+}
+
+# Above this many rows (planner estimate) admin changelists stop running exact COUNT(*)
+ADMIN_ESTIMATED_COUNT_THRESHOLD = 100_000
+
+# Request instrumentation (api.middleware.RequestTimingMiddleware)
+API_INSTRUMENTATION = {
+    'PROFILE_SAMPLE_RATE': float(os.getenv('API_PROFILE_SAMPLE_RATE', '0')),  # Fraction of requests run under cProfile
+    'SLOW_REQUEST_MS': float(os.getenv('API_SLOW_REQUEST_MS', '500')),         # Slower requests are logged as warnings and profiled
+    'PROFILE_DIR': os.getenv('API_PROFILE_DIR', BASE_DIR / 'profiles'),
+    'PROFILE_KEEP': 50,                                                        # Oldest dumps are rotated out
+    'DUPLICATE_QUERY_THRESHOLD': 5,                                            # Same SQL this often in one request flags an N+1
+}
+
+# Prometheus scrape endpoint (/metrics). Set PROMETHEUS_MULTIPROC_DIR when running
+# several worker processes so their samples are aggregated through mmap'd files.
+# Without METRICS_TOKEN only loopback clients may scrape; behind a reverse proxy on
+# the same host every request comes from loopback, so set a token there.
+METRICS_TOKEN = os.getenv('METRICS_TOKEN')  # When set, scrapes must send "Authorization: Bearer <token>"
+
+LOGGING = {
+    'version': 1,
+    'disable_existing_loggers': False,
+    'handlers': {
+        'console': {'class': 'logging.StreamHandler'},
+    },
+    'loggers': {
+        'api': {
+            'handlers': ['console'],
+            'level': os.getenv('API_LOG_LEVEL', 'WARNING'),
+        },
+    },
+}
+
 # JWT Settings
 from datetime import timedelta
 
@@ -15,13 +15,22 @@ Including another URLconf
     2. Add a URL to urlpatterns:  path('blog/', include('blog.urls'))
 """
 from django.contrib import admin
-from django.urls import path, include
+from django.urls import path, include, URLResolver
+from django.urls.resolvers import RoutePattern
 from django.conf import settings
 from django.conf.urls.static import static
+from api.metrics import metrics_view
+
+if settings.SERVERLESS:
+    # A resolver given a module path only imports it when first matched or reversed
+    admin_urls = URLResolver(RoutePattern('admin/'), 'server.admin_urls', app_name='admin', namespace='admin')
+else:
+    admin_urls = path('admin/', admin.site.urls)
 
 urlpatterns = [
-    path('admin/', admin.site.urls),
+    admin_urls,
     path('api/', include('api.urls')),
+    path('metrics', metrics_view, name='metrics'),
 ]
 
 # Serve media files during development